@@ -0,0 +1,106 @@
+"""
+Số liệu tổng hợp cho báo cáo kế toán (/accounting/profit/, /accounting/quanly_chiphi/tong_quan/).
+
+Tổng doanh thu, chi phí, lương và chi phí theo loại được tính trong Postgres bằng
+các hàm accounting_report_totals / expense_totals_by_lcp
+(xem create_accounting_report_functions.sql) nên kích thước response và thời gian
+xử lý không tăng theo số giao dịch. Danh sách dòng chi tiết chỉ trả về khi được
+yêu cầu và luôn được phân trang.
+"""
+from typing import Any, Dict, List, Optional
+
+from expense_rollup import month_range
+from supabase_query import PAGE_SIZE, fetch_all, get_client
+
+# Trang chi tiết lớn nhất: một request PostgREST
+MAX_PAGE_SIZE = PAGE_SIZE
+
+def _date_bounds(month: Optional[str]):
+    return month_range(month) if month else (None, None)
+
+def _apply_month(query, column: str, month: Optional[str]):
+    if not month:
+        return query
+    if column == 'ky_tinh_luong':
+        return query.eq(column, month)
+    start_date, end_date = month_range(month)
+    return query.gte(column, start_date).lt(column, end_date)
+
+def _scan(client, table: str, columns: str, column: str, month: Optional[str], roots_only: bool = False) -> List[Dict[str, Any]]:
+    """Đọc các cột cần thiết theo trang (chỉ dùng khi chưa cài hàm tổng hợp)"""
+    def query():
+        query = _apply_month(client.table(table).select(columns), column, month)
+        if roots_only:
+            query = query.is_('parent_id', 'null')
+        return query.order('id')
+    return fetch_all(query)
+
+def report_totals(month: Optional[str] = None, client=None) -> Dict[str, Any]:
+    """
+    Tổng doanh thu, chi phí gốc (không gồm lương) và lương.
+
+    Returns:
+        {total_revenue, revenue_count, total_expenses, expense_count,
+         total_payroll_expenses, payroll_count}; expense_count đếm cả chi phí con
+    """
+    client = get_client(client)
+    start_date, end_date = _date_bounds(month)
+    try:
+        rows = client.rpc('accounting_report_totals', {'p_start': start_date, 'p_end': end_date, 'p_month': month}).execute().data
+        row = rows[0] if rows else {}
+        return {
+            'total_revenue': float(row.get('total_revenue') or 0),
+            'revenue_count': int(row.get('revenue_count') or 0),
+            'total_expenses': float(row.get('total_expenses') or 0),
+            'expense_count': int(row.get('expense_count') or 0),
+            'total_payroll_expenses': float(row.get('total_payroll_expenses') or 0),
+            'payroll_count': int(row.get('payroll_count') or 0),
+        }
+    except Exception as e:
+        print(f"accounting_report_totals unavailable, falling back to column scans: {e}")
+
+    invoices = _scan(client, 'invoices_reality', 'id, total_amount', 'invoice_date', month)
+    expenses = _scan(client, 'quanly_chiphi', 'id, giathanh, parent_id', 'created_at', month)
+    payrolls = _scan(client, 'phieu_luong', 'id, luong_thuc_nhan', 'ky_tinh_luong', month)
+    return {
+        'total_revenue': sum(invoice.get('total_amount') or 0 for invoice in invoices),
+        'revenue_count': len(invoices),
+        'total_expenses': sum(expense.get('giathanh') or 0 for expense in expenses if not expense.get('parent_id')),
+        'expense_count': len(expenses),
+        'total_payroll_expenses': sum(payroll.get('luong_thuc_nhan') or 0 for payroll in payrolls),
+        'payroll_count': len(payrolls),
+    }
+
+def expense_totals_by_lcp(month: Optional[str] = None, client=None) -> Dict[Any, float]:
+    """Tổng giathanh chi phí gốc theo id_lcp (None = chưa phân loại)"""
+    client = get_client(client)
+    start_date, end_date = _date_bounds(month)
+    try:
+        rows = client.rpc('expense_totals_by_lcp', {'p_start': start_date, 'p_end': end_date}).execute().data
+        return {row.get('id_lcp'): float(row.get('total') or 0) for row in rows}
+    except Exception as e:
+        print(f"expense_totals_by_lcp unavailable, falling back to column scans: {e}")
+
+    totals: Dict[Any, float] = {}
+    for expense in _scan(client, 'quanly_chiphi', 'id, id_lcp, giathanh', 'created_at', month, roots_only=True):
+        totals[expense.get('id_lcp')] = totals.get(expense.get('id_lcp'), 0) + (expense.get('giathanh') or 0)
+    return totals
+
+def load_loaichiphi(ids, client=None) -> Dict[Any, Dict[str, Any]]:
+    """id -> dòng loaichiphi cho các loại chi phí được dùng"""
+    ids = [value for value in ids if value]
+    if not ids:
+        return {}
+    result = get_client(client).table('loaichiphi').select('id, tenchiphi, loaichiphi').in_('id', ids).execute()
+    return {item['id']: item for item in result.data}
+
+def normalize_page(page: int, page_size: int):
+    """Giới hạn tham số phân trang trong khoảng hợp lệ"""
+    return max(page, 1), min(max(page_size, 1), MAX_PAGE_SIZE)
+
+def fetch_page(table: str, month_column: str, month: Optional[str], page: int, page_size: int, columns: str = '*', client=None) -> List[Dict[str, Any]]:
+    """Một trang dòng chi tiết của bảng trong tháng, sắp xếp theo id"""
+    page, page_size = normalize_page(page, page_size)
+    offset = (page - 1) * page_size
+    query = _apply_month(get_client(client).table(table).select(columns), month_column, month)
+    return query.order('id').range(offset, offset + page_size - 1).execute().data
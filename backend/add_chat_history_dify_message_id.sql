@@ -0,0 +1,6 @@
+-- Khóa idempotent cho message đồng bộ từ Dify (xem dify_message_sync.py)
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS dify_message_id TEXT;
+
+-- Unique index đầy đủ (không partial) để upsert ON CONFLICT (dify_message_id) dùng được;
+-- các dòng không đến từ Dify để NULL và không bị ràng buộc
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_history_dify_message_id ON chat_history(dify_message_id);
@@ -0,0 +1,207 @@
+"""
+Xác thực JWT của Supabase ngay trong process thay vì gọi auth server mỗi request.
+
+Token ký HS256 được kiểm tra bằng SUPABASE_JWT_SECRET; token ký bất đối xứng
+(ES256/RS256) được kiểm tra bằng khóa công khai lấy từ JWKS của project và cache lại.
+Nếu không có cả hai thì mới hỏi supabase.auth.get_user như trước. Token đã xác thực
+được giữ trong một LRU ngắn hạn, role_id theo email được cache riêng; cả hai có thể
+xóa khi cần (revoke_user, RoleCache.forget) để thu hồi quyền ngay lập tức; mọi lệnh ghi
+vào bảng employees gọi invalidate_employees để thay đổi có hiệu lực ngay.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import jwt as pyjwt
+
+from supabase_query import get_client
+
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv('AUTH_TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '10000'))
+ROLE_CACHE_TTL_SECONDS = float(os.getenv('AUTH_ROLE_CACHE_TTL', '300'))
+ASYMMETRIC_ALGORITHMS = ['ES256', 'RS256']
+
+@dataclass
+class TokenUser:
+    """User lấy từ claims của token (cùng các thuộc tính hay dùng như user của supabase.auth)"""
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    app_metadata: Dict[str, Any] = field(default_factory=dict)
+    user_metadata: Dict[str, Any] = field(default_factory=dict)
+    issued_at: Optional[float] = None
+    expires_at: Optional[float] = None
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> 'TokenUser':
+        return cls(
+            id=claims.get('sub'),
+            email=claims.get('email'),
+            role=claims.get('role'),
+            app_metadata=claims.get('app_metadata') or {},
+            user_metadata=claims.get('user_metadata') or {},
+            issued_at=claims.get('iat'),
+            expires_at=claims.get('exp')
+        )
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+class TokenVerifier:
+    def __init__(self, jwt_secret: Optional[str] = None, jwks_url: Optional[str] = None, audience: str = 'authenticated',
+                 ttl_seconds: float = TOKEN_CACHE_TTL_SECONDS, max_entries: int = TOKEN_CACHE_SIZE,
+                 remote_verify: Optional[Callable[[str], Any]] = None, clock: Callable[[], float] = time.time):
+        self.jwt_secret = jwt_secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.remote_verify = remote_verify
+        self.clock = clock
+        self._jwks_client = None
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # user id / email -> thời điểm thu hồi: token phát hành trước đó bị từ chối
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'TokenVerifier':
+        supabase_url = os.getenv('SUPABASE_URL')
+        return cls(
+            jwt_secret=os.getenv('SUPABASE_JWT_SECRET') or None,
+            jwks_url=os.getenv('SUPABASE_JWKS_URL') or (f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json" if supabase_url else None),
+            remote_verify=lambda token: get_client().auth.get_user(token).user
+        )
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _get_jwks_client(self):
+        if self._jwks_client is None:
+            self._jwks_client = pyjwt.PyJWKClient(self.jwks_url, cache_keys=True, lifespan=3600)
+        return self._jwks_client
+
+    def _decode(self, token: str):
+        algorithm = pyjwt.get_unverified_header(token).get('alg')
+        if algorithm == 'HS256' and self.jwt_secret:
+            claims = pyjwt.decode(token, self.jwt_secret, algorithms=['HS256'], audience=self.audience)
+        elif algorithm in ASYMMETRIC_ALGORITHMS and self.jwks_url:
+            signing_key = self._get_jwks_client().get_signing_key_from_jwt(token)
+            claims = pyjwt.decode(token, signing_key.key, algorithms=ASYMMETRIC_ALGORITHMS, audience=self.audience)
+        elif self.remote_verify is not None:
+            # Chưa cấu hình khóa cho thuật toán này: hỏi auth server (vẫn được cache)
+            user = self.remote_verify(token)
+            if user is None:
+                raise pyjwt.InvalidTokenError("Token rejected by auth server")
+            claims = pyjwt.decode(token, options={'verify_signature': False, 'verify_aud': False})
+            return user, claims
+        else:
+            raise pyjwt.InvalidTokenError(f"No key configured for {algorithm} tokens")
+        return TokenUser.from_claims(claims), claims
+
+    def _is_revoked(self, user_id: Optional[str], email: Optional[str], issued_at: Optional[float]) -> bool:
+        for subject in (user_id, email):
+            revoked_at = self._revoked.get(subject) if subject else None
+            if revoked_at is not None and (issued_at is None or issued_at <= revoked_at):
+                return True
+        return False
+
+    def verify(self, token: str):
+        """User của token; jwt.InvalidTokenError nếu token sai, hết hạn hoặc đã bị thu hồi"""
+        key = self._cache_key(token)
+        now = self.clock()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                user, valid_until = cached
+                if now < valid_until:
+                    self._cache.move_to_end(key)
+                    return user
+                del self._cache[key]
+
+        user, claims = self._decode(token)
+        if self._is_revoked(str(claims.get('sub') or ''), claims.get('email'), claims.get('iat')):
+            raise pyjwt.InvalidTokenError("Token has been revoked")
+
+        valid_until = now + self.ttl_seconds
+        if claims.get('exp'):
+            valid_until = min(valid_until, float(claims['exp']))
+        with self._lock:
+            self._cache[key] = (user, valid_until)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return user
+
+    def revoke_token(self, token: str):
+        """Bỏ token khỏi cache (lần sau sẽ xác thực lại)"""
+        with self._lock:
+            self._cache.pop(self._cache_key(token), None)
+
+    def revoke_user(self, user_id: Optional[str] = None, email: Optional[str] = None):
+        """Từ chối mọi token đã phát hành cho user này tính tới thời điểm hiện tại"""
+        revoked_at = self.clock()
+        with self._lock:
+            for subject in (user_id, email):
+                if subject:
+                    self._revoked[str(subject)] = revoked_at
+            for key, (user, _) in list(self._cache.items()):
+                if (user_id and str(getattr(user, 'id', '')) == str(user_id)) or (email and getattr(user, 'email', None) == email):
+                    del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+class RoleCache:
+    """role_id của employees theo email, giữ trong ttl_seconds"""
+
+    def __init__(self, ttl_seconds: float = ROLE_CACHE_TTL_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_role_id(self, email: Optional[str], client=None) -> Optional[int]:
+        if not email:
+            return None
+        now = self.clock()
+        with self._lock:
+            cached = self._entries.get(email)
+            if cached is not None and now < cached[1]:
+                return cached[0]
+
+        result = get_client(client).table('employees').select('role_id').eq('email', email).execute()
+        role_id = result.data[0].get('role_id') if result.data else None
+        with self._lock:
+            self._entries[email] = (role_id, now + self.ttl_seconds)
+        return role_id
+
+    def forget(self, email: Optional[str]):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_verifier = TokenVerifier.from_env()
+role_cache = RoleCache()
+
+def invalidate_employees(emails: Iterable[Optional[str]], revoke: bool = False):
+    """
+    Bỏ role_id đã cache của các email vừa bị ghi trong bảng employees (cả email cũ lẫn mới).
+
+    Args:
+        emails: Email liên quan tới lệnh ghi (None được bỏ qua)
+        revoke: Từ chối luôn các token đã phát hành cho các email này (xóa / khóa nhân viên)
+    """
+    for email in {email for email in emails if email}:
+        role_cache.forget(email)
+        if revoke:
+            token_verifier.revoke_user(email=email)
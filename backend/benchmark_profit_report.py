@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark cho pipeline báo cáo lợi nhuận (generate_profit_excel, update_expense_ratios).
+
+Tạo dữ liệu giả 10.000 hóa đơn / 100.000 item (không cần database) rồi đo thời
+gian tạo sheet doanh thu chi tiết và kiểm tra tỷ lệ chi phí ở nhiều quy mô để
+thấy thời gian tăng tuyến tính theo số dòng.
+
+    python benchmark_profit_report.py
+    python benchmark_profit_report.py --invoices 2000 --items-per-invoice 10
+"""
+import argparse
+import io
+import os
+import time
+
+# update_expense_ratios khởi tạo Supabase client khi import; benchmark không truy vấn database
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_SERVICE_KEY', 'benchmark-key')
+
+from openpyxl import Workbook
+from openpyxl.styles import Border, Font, PatternFill, Side
+
+from generate_profit_excel import create_revenue_detail_sheet
+from update_expense_ratios import get_root_total
+
+def make_report_fixture(invoice_count=10000, items_per_invoice=10):
+    """Dữ liệu giống get_profit_data(): invoice_count hóa đơn, mỗi hóa đơn items_per_invoice item"""
+    revenue = [
+        {'id': invoice_id, 'invoice_date': '2025-09-10', 'customer_name': f'Khach hang {invoice_id}', 'total_amount': 1000}
+        for invoice_id in range(1, invoice_count + 1)
+    ]
+    invoice_items = [
+        {'id': item_id, 'invoice_id': item_id % invoice_count + 1, 'id_nhom': 1, 'id_kinh': 1, 'id_taynam': 1, 'id_bophan': 1,
+         'sanpham_id': 'SP1', 'ngang': 600, 'cao': 720, 'sau': 560, 'so_luong': 1, 'don_gia': 100, 'thanh_tien': 100}
+        for item_id in range(invoice_count * items_per_invoice)
+    ]
+    return {
+        'revenue': revenue,
+        'invoice_items': invoice_items,
+        'month': '2025-09',
+        'loainhom_map': {'1': 'Nhom'},
+        'loaikinh_map': {'1': 'Kinh'},
+        'loaitaynam_map': {'1': 'Tay nam'},
+        'bophan_map': {'1': 'Bo phan'},
+        'sanpham_map': {'1_1_1_1': 'Tu bep'},
+    }
+
+def make_expense_fixture(expense_count=100000, depth=5):
+    """Chi phí theo chuỗi cha-con sâu `depth` cấp"""
+    expenses = []
+    for expense_id in range(1, expense_count + 1):
+        parent_id = expense_id - 1 if (expense_id - 1) % depth else None
+        expenses.append({'id': expense_id, 'parent_id': parent_id, 'giathanh': 100, 'ti_le': 100})
+    return expenses
+
+def time_revenue_sheet(data):
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet("Doanh thu chi tiet")
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    started = time.perf_counter()
+    create_revenue_detail_sheet(sheet, data, Font(bold=True, color="FFFFFF"), PatternFill(fill_type="solid"), border)
+    elapsed = time.perf_counter() - started
+    # Đóng sheet write-only (không tính vào thời gian đo)
+    wb.save(io.BytesIO())
+    return elapsed
+
+def time_root_totals(expenses):
+    started = time.perf_counter()
+    expenses_by_id = {expense['id']: expense for expense in expenses}
+    for expense in expenses:
+        get_root_total(expense, expenses_by_id)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline bao cao loi nhuan')
+    parser.add_argument('--invoices', type=int, default=10000)
+    parser.add_argument('--items-per-invoice', type=int, default=10)
+    args = parser.parse_args()
+
+    print("Quy mo          | Sheet doanh thu | us/item | Ty le chi phi | us/chi phi")
+    for fraction in (0.1, 0.5, 1.0):
+        invoice_count = max(1, int(args.invoices * fraction))
+        data = make_report_fixture(invoice_count, args.items_per_invoice)
+        item_count = len(data['invoice_items'])
+        sheet_seconds = time_revenue_sheet(data)
+        ratio_seconds = time_root_totals(make_expense_fixture(item_count))
+        print(f"{invoice_count:>6} / {item_count:>7} | {sheet_seconds:>14.2f}s | {sheet_seconds / item_count * 1e6:>7.1f} "
+              f"| {ratio_seconds:>12.3f}s | {ratio_seconds / item_count * 1e6:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Cache trong tiến trình cho các bảng danh mục sản phẩm nhỏ
+(loainhom, loaikinh, loaitaynam, bophan, sanpham, phukienbep, loaiphukienbep).
+
+Mỗi bảng có TTL riêng và chỉ mục id -> dòng / id -> tên. Các endpoint CRUD gọi
+invalidate() sau khi ghi để lần đọc tiếp theo lấy dữ liệu mới từ database.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from supabase_query import fetch_all, get_client
+
+# TTL (giây) cho từng bảng danh mục
+CATALOG_TTLS = {
+    'loainhom': 600,
+    'loaikinh': 600,
+    'loaitaynam': 600,
+    'bophan': 600,
+    'loaiphukienbep': 600,
+    'sanpham': 300,
+    'phukienbep': 300,
+}
+
+# Cột tên hiển thị của từng bảng (dùng cho chỉ mục id -> tên)
+CATALOG_NAME_COLUMNS = {
+    'loainhom': 'tenloai',
+    'loaikinh': 'tenloai',
+    'loaitaynam': 'tenloai',
+    'bophan': 'tenloai',
+    'loaiphukienbep': 'tenloai',
+    'sanpham': 'tensp',
+    'phukienbep': 'tenphukien',
+}
+
+class _CacheEntry:
+    def __init__(self, rows: List[Dict[str, Any]], expires_at: float):
+        self.rows = rows
+        self.expires_at = expires_at
+        # Khóa chỉ mục luôn là str(id) vì cột id có thể là số hoặc chuỗi tùy bảng
+        self.by_id = {str(row.get('id')): row for row in rows}
+
+class CatalogCache:
+    """Cache danh mục với TTL theo bảng và bộ đếm hit/miss"""
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None, client=None, clock: Callable[[], float] = time.monotonic):
+        self.ttls = dict(ttls or CATALOG_TTLS)
+        self._client = client
+        self._clock = clock
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._table_locks = {table: threading.Lock() for table in self.ttls}
+        self._hits = {table: 0 for table in self.ttls}
+        self._misses = {table: 0 for table in self.ttls}
+        self._invalidations = {table: 0 for table in self.ttls}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def _check_table(self, table: str):
+        if table not in self.ttls:
+            raise KeyError(f"Table {table} is not a cached catalog table")
+
+    def _load_rows(self, table: str) -> List[Dict[str, Any]]:
+        client = self._get_client()
+        return fetch_all(lambda: client.table(table).select('*').order('id'))
+
+    def _get_entry(self, table: str) -> _CacheEntry:
+        self._check_table(table)
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry and entry.expires_at > self._clock():
+                self._hits[table] += 1
+                return entry
+
+        # Chỉ một request được nạp lại bảng, các request khác chờ kết quả
+        with self._table_locks[table]:
+            with self._lock:
+                entry = self._entries.get(table)
+                if entry and entry.expires_at > self._clock():
+                    self._hits[table] += 1
+                    return entry
+                self._misses[table] += 1
+                generation = self._generations.get(table, 0)
+
+            rows = self._load_rows(table)
+            entry = _CacheEntry(rows, self._clock() + self.ttls[table])
+
+            with self._lock:
+                # Nếu bảng bị invalidate trong lúc đang nạp thì không lưu dữ liệu có thể đã cũ
+                if self._generations.get(table, 0) == generation:
+                    self._entries[table] = entry
+            return entry
+
+    def get_rows(self, table: str) -> List[Dict[str, Any]]:
+        """Tất cả dòng của bảng (không được sửa trực tiếp các dict trả về)"""
+        return self._get_entry(table).rows
+
+    def get_index(self, table: str) -> Dict[str, Dict[str, Any]]:
+        """Chỉ mục str(id) -> dòng"""
+        return self._get_entry(table).by_id
+
+    def get(self, table: str, row_id: Any) -> Optional[Dict[str, Any]]:
+        """Lấy một dòng theo id, None nếu không có"""
+        if row_id is None or row_id == '':
+            return None
+        return self.get_index(table).get(str(row_id))
+
+    def get_name_map(self, table: str) -> Dict[str, Any]:
+        """Chỉ mục str(id) -> tên hiển thị"""
+        name_column = CATALOG_NAME_COLUMNS[table]
+        return {row_id: row.get(name_column) for row_id, row in self.get_index(table).items()}
+
+    def get_name(self, table: str, row_id: Any) -> Optional[Any]:
+        row = self.get(table, row_id)
+        return row.get(CATALOG_NAME_COLUMNS[table]) if row else None
+
+    def invalidate(self, *tables: str):
+        """Xóa cache của các bảng được chỉ định (không truyền gì = xóa tất cả)"""
+        targets = tables or tuple(self.ttls)
+        with self._lock:
+            for table in targets:
+                self._check_table(table)
+                self._entries.pop(table, None)
+                self._generations[table] = self._generations.get(table, 0) + 1
+                self._invalidations[table] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Bộ đếm hit/miss theo bảng"""
+        now = self._clock()
+        with self._lock:
+            tables = {}
+            for table in self.ttls:
+                entry = self._entries.get(table)
+                tables[table] = {
+                    'hits': self._hits[table],
+                    'misses': self._misses[table],
+                    'invalidations': self._invalidations[table],
+                    'cached_rows': len(entry.rows) if entry else 0,
+                    'ttl_remaining': max(0, round(entry.expires_at - now, 1)) if entry else 0,
+                }
+            return {
+                'hits': sum(self._hits.values()),
+                'misses': sum(self._misses.values()),
+                'tables': tables,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            for table in self.ttls:
+                self._hits[table] = 0
+                self._misses[table] = 0
+                self._invalidations[table] = 0
+
+# Instance dùng chung cho toàn bộ tiến trình API
+catalog_cache = CatalogCache()
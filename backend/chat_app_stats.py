@@ -0,0 +1,30 @@
+"""
+Số conversation khác nhau theo app (name_app) trong chat_history.
+
+Đọc bảng đếm app_conversation_stats do trigger trên chat_history cập nhật
+(xem create_app_conversation_stats.sql): mỗi app một dòng, không phụ thuộc độ lớn
+lịch sử chat. Nếu database chưa có bảng này thì đếm bằng cách quét chat_history theo trang.
+"""
+from typing import Any, Dict, List
+
+from supabase_query import get_client, iter_pages
+
+def _scan_conversation_counts(client) -> Dict[str, int]:
+    conversations: Dict[str, set] = {}
+    for page in iter_pages(lambda: client.table('chat_history').select('name_app, conversation_id').order('log_id')):
+        for record in page:
+            if record.get('name_app') and record.get('conversation_id'):
+                conversations.setdefault(record['name_app'], set()).add(record['conversation_id'])
+    return {name_app: len(conversation_ids) for name_app, conversation_ids in conversations.items()}
+
+def app_conversation_counts(client=None) -> List[Dict[str, Any]]:
+    """[{"name": name_app, "chat_count": số conversation khác nhau}]"""
+    client = get_client(client)
+    try:
+        result = client.table('app_conversation_stats').select('name_app, conversation_count').gt('conversation_count', 0).order('name_app').execute()
+        return [{"name": row['name_app'], "chat_count": row['conversation_count']} for row in result.data]
+    except Exception as e:
+        print(f"app_conversation_stats unavailable, falling back to chat_history scan: {e}")
+
+    counts = _scan_conversation_counts(client)
+    return [{"name": name_app, "chat_count": count} for name_app, count in sorted(counts.items())]
@@ -0,0 +1,84 @@
+"""
+Phân trang lịch sử chat bằng cursor (keyset) trên (created_at, log_id).
+
+Mỗi trang chỉ đọc `limit + 1` dòng ngay sau cursor của trang trước, nên trang sâu có
+chi phí như trang đầu (không dùng offset). Danh sách conversation được phép của user
+thường được đưa vào query dưới dạng in_ trên conversation_id thay vì lọc sau khi tải về.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from supabase_query import PAGE_SIZE, get_client
+
+DEFAULT_PAGE_SIZE = 100
+# Trang lớn nhất: một request PostgREST
+MAX_PAGE_SIZE = PAGE_SIZE
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Cursor trỏ tới dòng cuối cùng của trang hiện tại"""
+    payload = json.dumps([row.get('created_at'), row.get('log_id')], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Giải mã cursor; ValueError nếu cursor không hợp lệ"""
+    try:
+        created_at, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    # Hai giá trị được ghép vào chuỗi or_ của PostgREST nên phải đúng kiểu timestamp / số nguyên
+    if not isinstance(created_at, str) or isinstance(log_id, bool) or not isinstance(log_id, (int, str)):
+        raise ValueError("Invalid cursor")
+    try:
+        created_at = datetime.fromisoformat(created_at).isoformat()
+        log_id = int(log_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return created_at, log_id
+
+def normalize_limit(limit: int) -> int:
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+def _filtered(query, name_app: Optional[str], conversation_ids: Optional[List[str]]):
+    if name_app is not None:
+        query = query.eq('name_app', name_app)
+    if conversation_ids is not None:
+        query = query.in_('conversation_id', list(dict.fromkeys(conversation_ids)))
+    return query
+
+def count_chat_messages(name_app: Optional[str] = None, conversation_ids: Optional[List[str]] = None, client=None) -> int:
+    """Tổng số dòng chat_history theo cùng bộ lọc với fetch_chat_page (một request count='exact', không tải dữ liệu)"""
+    if conversation_ids is not None and not conversation_ids:
+        return 0
+    query = get_client(client).table('chat_history').select('log_id', count='exact', head=True)
+    return _filtered(query, name_app, conversation_ids).execute().count or 0
+
+def fetch_chat_page(columns: str = '*', cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                    name_app: Optional[str] = None, conversation_ids: Optional[List[str]] = None,
+                    client=None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Một trang chat_history mới nhất trước.
+
+    Args:
+        cursor: next_cursor của trang trước (None = trang đầu)
+        name_app: Chỉ lấy chat của app này
+        conversation_ids: Chỉ lấy các conversation này (allow-list của user); [] = không có gì
+
+    Returns:
+        (records, next_cursor); next_cursor = None khi đã hết dữ liệu
+    """
+    if conversation_ids is not None and not conversation_ids:
+        return [], None
+
+    limit = normalize_limit(limit)
+    query = _filtered(get_client(client).table('chat_history').select(columns), name_app, conversation_ids)
+    if cursor:
+        created_at, log_id = decode_cursor(cursor)
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",log_id.lt.{log_id})')
+
+    records = query.order('created_at', desc=True).order('log_id', desc=True).limit(limit + 1).execute().data or []
+    if len(records) > limit:
+        records = records[:limit]
+        return records, encode_cursor(records[-1])
+    return records, None
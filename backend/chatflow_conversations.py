@@ -0,0 +1,74 @@
+"""
+Xác định conversation_id của một user cho mọi chatflow khi đăng nhập.
+
+Session hiện có được đọc một lần cho cả user. Conversation gần nhất của user trên Dify
+không phụ thuộc chatflow (cùng API key, cùng tham số), nên Dify chỉ được hỏi một lần
+mỗi lần đăng nhập và kết quả được dùng cho mọi chatflow chưa có conversation_id. Kết
+quả được ghi vào user_chat_sessions bằng một lệnh upsert.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from db_executor import run_db
+from supabase_query import get_client
+
+def _load_sessions(client, user_id: int) -> Dict[int, Optional[str]]:
+    result = client.table('user_chat_sessions').select('chatflow_id, conversation_id').eq('user_id', user_id).execute()
+    return {row['chatflow_id']: row.get('conversation_id') for row in result.data}
+
+def _save_sessions(client, user_id: int, conversation_ids: Dict[int, str]):
+    now = datetime.now().isoformat()
+    rows = [{
+        'user_id': user_id,
+        'chatflow_id': chatflow_id,
+        'conversation_id': conversation_id,
+        'session_data': {"login_sync": True, "sync_time": now},
+        'last_accessed': now,
+        'updated_at': now
+    } for chatflow_id, conversation_id in conversation_ids.items()]
+    client.table('user_chat_sessions').upsert(rows, on_conflict='user_id,chatflow_id').execute()
+
+async def _lookup_conversation_id(dify, username: str) -> Optional[str]:
+    try:
+        # Conversation gần nhất của user trên Dify (giống DifyAPIService.get_or_create_conversation_id)
+        page = await dify.get_user_conversations(username, limit=1)
+    except Exception as e:
+        print(f"Error getting conversation_id for user {username}: {e}")
+        return None
+    for conversation in page.get('data') or []:
+        if conversation.get('id'):
+            return conversation['id']
+    return None
+
+async def resolve_conversation_ids(user: Dict[str, Any], chatflows: List[Dict[str, Any]], client=None, dify=None,
+                                   save: bool = True) -> Dict[str, str]:
+    """
+    conversation_id theo chatflow cho user.
+
+    Args:
+        user: Dòng employees (cần id, username)
+        chatflows: Các dòng chatflows (cần id)
+        save: Ghi kết quả vào user_chat_sessions (một lệnh upsert)
+
+    Returns:
+        {str(chatflow_id): conversation_id} cho các chatflow xác định được
+    """
+    client = get_client(client)
+    if dify is None:
+        from dify_client import get_dify_client
+        dify = get_dify_client()
+
+    existing = await run_db(_load_sessions, client, user['id'])
+    resolved = {chatflow['id']: existing[chatflow['id']] for chatflow in chatflows if existing.get(chatflow['id'])}
+
+    missing = [chatflow for chatflow in chatflows if chatflow['id'] not in resolved]
+    if missing:
+        # Một request Dify cho cả lần đăng nhập
+        conversation_id = await _lookup_conversation_id(dify, user['username'])
+        if conversation_id:
+            for chatflow in missing:
+                resolved[chatflow['id']] = conversation_id
+
+    if save and resolved:
+        await run_db(_save_sessions, client, user['id'], resolved)
+    return {str(chatflow_id): conversation_id for chatflow_id, conversation_id in resolved.items()}
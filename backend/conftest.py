@@ -0,0 +1,318 @@
+"""
+Fixture dùng chung cho các unit test không cần kết nối Supabase thật.
+"""
+import os
+import sys
+import re
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Mô phỏng tối thiểu query builder của supabase-py trên dữ liệu trong bộ nhớ"""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table_name = table
+        self.filters = []
+        self.columns = '*'
+        self.order_keys = []
+        self.range_bounds = None
+        self.action = 'select'
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.head = False
+
+    def select(self, columns='*', count=None, head=None):
+        self.columns = columns
+        self.head = bool(head)
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        # Như SQL: NULL không thỏa điều kiện <>
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) != value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    @staticmethod
+    def _split_top_level(filters):
+        clauses, depth, current, quoted = [], 0, '', False
+        for char in filters:
+            quoted ^= char == '"'
+            depth += char == '(' and not quoted
+            depth -= char == ')' and not quoted
+            if char == ',' and depth == 0 and not quoted:
+                clauses.append(current)
+                current = ''
+            else:
+                current += char
+        clauses.append(current)
+        return clauses
+
+    @classmethod
+    def _parse_condition(cls, clause):
+        """Điều kiện PostgREST: cot.in.(a,b) | cot.eq/lt/gt.v | and(...) | or(...)"""
+        for group, combine in (('and(', all), ('or(', any)):
+            if clause.startswith(group):
+                checks = [cls._parse_condition(part) for part in cls._split_top_level(clause[len(group):-1])]
+                return lambda row: combine(check(row) for check in checks)
+
+        column, operator, value = clause.split('.', 2)
+        if operator == 'in':
+            values = {item.strip('"') for item in value.strip('()').split(',')}
+            return lambda row: str(row.get(column)) in values
+
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            # Giá trị trong dấu nháy kép: \ bỏ ý nghĩa đặc biệt của ký tự kế tiếp (như PostgREST)
+            value = re.sub(r'\\(.)', r'\1', value[1:-1], flags=re.DOTALL)
+        if operator == 'ilike':
+            return lambda row: cls._ilike(row.get(column), value)
+        compare = {'eq': lambda a, b: a == b, 'lt': lambda a, b: a < b, 'gt': lambda a, b: a > b}[operator]
+
+        def check(row):
+            actual = row.get(column)
+            if actual is None:
+                return False
+            return compare(actual, type(actual)(value))
+        return check
+
+    @staticmethod
+    def _ilike(actual, pattern):
+        if actual is None:
+            return False
+        # Như LIKE của Postgres: \ là ký tự escape, ký tự đứng sau nó được so khớp nguyên văn
+        regex = ''.join(re.escape(token[1:]) if token.startswith('\\') else '.*' if token in '*%' else '.' if token == '_' else re.escape(token)
+                        for token in re.findall(r'\\.|.', pattern, flags=re.DOTALL))
+        return re.fullmatch(regex, str(actual), flags=re.IGNORECASE | re.DOTALL) is not None
+
+    def ilike(self, column, pattern):
+        self.filters.append(lambda row: self._ilike(row.get(column), pattern))
+        return self
+
+    def or_(self, filters):
+        checks = [self._parse_condition(clause) for clause in self._split_top_level(filters)]
+        self.filters.append(lambda row: any(check(row) for check in checks))
+        return self
+
+    def is_(self, column, value):
+        expected = None if value in ('null', None) else value
+        self.filters.append(lambda row: row.get(column) is expected)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) <= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_keys.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self.range_bounds = (0, size - 1)
+        return self
+
+    def range(self, start, end):
+        self.range_bounds = (start, end)
+        return self
+
+    def insert(self, payload):
+        self.action = 'insert'
+        self.payload = payload
+        return self
+
+    def upsert(self, payload, on_conflict=None, ignore_duplicates=False):
+        self.action = 'upsert'
+        self.payload = payload
+        self.on_conflict = on_conflict or 'id'
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload):
+        self.action = 'update'
+        self.payload = payload
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def _matches(self, row):
+        return all(check(row) for check in self.filters)
+
+    def _project(self, row):
+        if self.columns == '*':
+            return dict(row)
+        projected = {}
+        for column in self._split_top_level(self.columns):
+            column = column.strip()
+            if column == '*':
+                projected.update(row)
+            elif '(' in column:
+                projected.update(self._embed(row, column))
+            else:
+                projected[column] = row.get(column)
+        return projected
+
+    def _embed(self, row, column):
+        """
+        Resource nhúng kiểu PostgREST: bang(cot, ...) hoặc bang!goi_y(cot, ...) theo db.foreign_keys.
+
+        db.foreign_keys[(bang, bang_nhung)] là một quan hệ (cot_local, cot_remote) hoặc danh sách
+        (cot_local, cot_remote, ten_rang_buoc); gợi ý là tên cột local hoặc tên ràng buộc.
+        """
+        resource, columns = column[:-1].split('(', 1)
+        table, _, hint = resource.partition('!')
+        relations = self.db.foreign_keys.get((self.table_name, table), [])
+        if isinstance(relations, tuple):
+            relations = [relations]
+        if hint:
+            relations = [relation for relation in relations if hint in (relation[0], *relation[2:])]
+        if not relations:
+            raise Exception(f"Could not find a relationship between '{self.table_name}' and '{table}' in the schema cache")
+        if len(relations) > 1:
+            raise Exception(f"PGRST201: Could not embed because more than one relationship was found for '{self.table_name}' and '{table}'")
+        local_column, remote_column = relations[0][:2]
+        keys = [key.strip() for key in columns.split(',')]
+        target = next((other for other in self.db.tables.get(table, [])
+                       if row.get(local_column) is not None and other.get(remote_column) == row.get(local_column)), None)
+        return {table: {key: target.get(key) for key in keys} if target is not None else None}
+
+    def execute(self):
+        # Mỗi lệnh là nguyên tử như trên Postgres, kể cả khi gọi từ nhiều thread
+        with self.db.lock:
+            return self._execute()
+
+    def _execute(self):
+        self.db.calls.append((self.table_name, self.action))
+        rows = self.db.tables.setdefault(self.table_name, [])
+
+        if self.action == 'insert':
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            inserted = []
+            for row in payload:
+                row = dict(row)
+                if 'id' not in row:
+                    row['id'] = self.db.next_id(self.table_name)
+                rows.append(row)
+                inserted.append(dict(row))
+            return FakeResult(inserted)
+
+        if self.action == 'upsert':
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            keys = [k.strip() for k in self.on_conflict.split(',')]
+            written = []
+            for row in payload:
+                existing = next((r for r in rows if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None and self.ignore_duplicates:
+                    # ON CONFLICT DO NOTHING: PostgREST chỉ trả về các dòng được insert
+                    continue
+                if existing is not None:
+                    existing.update(row)
+                    written.append(dict(existing))
+                else:
+                    row = dict(row)
+                    if 'id' not in row:
+                        row['id'] = self.db.next_id(self.table_name)
+                    rows.append(row)
+                    written.append(dict(row))
+            return FakeResult(written)
+
+        matched = [row for row in rows if self._matches(row)]
+
+        if self.action == 'update':
+            for row in matched:
+                row.update(self.payload)
+            return FakeResult([dict(row) for row in matched])
+
+        if self.action == 'delete':
+            self.db.tables[self.table_name] = [row for row in rows if not self._matches(row)]
+            return FakeResult([dict(row) for row in matched])
+
+        # Sắp xếp ổn định theo khóa phụ trước, khóa chính sau
+        for column, desc in reversed(self.order_keys):
+            matched = sorted(matched, key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        # Như count='exact' của PostgREST: tổng số dòng khớp, không tính range/limit
+        count = len(matched)
+        if self.head:
+            return FakeResult([], count=count)
+        if self.range_bounds:
+            start, end = self.range_bounds
+            matched = matched[start:end + 1]
+        return FakeResult([self._project(row) for row in matched], count=count)
+
+
+class FakeSupabase:
+    """Client giả lập: lưu bảng trong dict và ghi lại mọi round trip"""
+
+    def __init__(self, tables=None):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.calls = []
+        self.lock = threading.RLock()
+        self._id_cache = {}
+        # Khóa ngoại cho select nhúng: (bảng, bảng nhúng) -> (cột của bảng, cột của bảng nhúng)
+        self.foreign_keys = {}
+        # Hàm RPC giả lập: tên -> callable(db, params) trả về danh sách dòng
+        self.rpc_functions = {}
+
+    def next_id(self, table):
+        # Gọi ngay trước khi thêm một dòng vào bảng; chỉ quét lại bảng khi nó bị sửa ở chỗ khác
+        rows = self.tables.get(table, [])
+        cached = self._id_cache.get(table)
+        if cached is not None and cached[0] == (id(rows), len(rows)):
+            current = cached[1]
+        else:
+            current = max((row['id'] for row in rows if isinstance(row.get('id'), int)), default=0)
+        self._id_cache[table] = ((id(rows), len(rows) + 1), current + 1)
+        return current + 1
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        if name not in self.rpc_functions:
+            raise Exception(f"Could not find the function public.{name}")
+        db = self
+
+        class _Rpc:
+            def execute(self):
+                db.calls.append((name, 'rpc'))
+                return FakeResult(db.rpc_functions[name](db, params or {}))
+        return _Rpc()
+
+    def calls_to(self, table):
+        return [call for call in self.calls if call[0] == table]
+
+
+@pytest.fixture
+def fake_supabase():
+    return FakeSupabase()
@@ -0,0 +1,42 @@
+-- Hàm tổng hợp cho /accounting/profit/ và /accounting/quanly_chiphi/tong_quan/ (xem accounting_report.py)
+-- p_start/p_end/p_month = NULL nghĩa là không lọc theo tháng
+
+-- Tổng doanh thu, chi phí gốc và lương
+CREATE OR REPLACE FUNCTION public.accounting_report_totals(p_start DATE, p_end DATE, p_month TEXT)
+RETURNS TABLE (
+    total_revenue NUMERIC,
+    revenue_count BIGINT,
+    total_expenses NUMERIC,
+    expense_count BIGINT,
+    total_payroll_expenses NUMERIC,
+    payroll_count BIGINT
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        (SELECT COALESCE(SUM(i.total_amount), 0) FROM public.invoices_reality i
+          WHERE (p_start IS NULL OR i.invoice_date >= p_start) AND (p_end IS NULL OR i.invoice_date < p_end)),
+        (SELECT COUNT(*) FROM public.invoices_reality i
+          WHERE (p_start IS NULL OR i.invoice_date >= p_start) AND (p_end IS NULL OR i.invoice_date < p_end)),
+        -- Chỉ tính chi phí gốc, giathanh của chi phí cha đã bao gồm chi phí con
+        (SELECT COALESCE(SUM(c.giathanh), 0) FROM public.quanly_chiphi c
+          WHERE c.parent_id IS NULL
+            AND (p_start IS NULL OR c.created_at >= p_start) AND (p_end IS NULL OR c.created_at < p_end)),
+        -- Số dòng chi phí (cả chi phí con) như trước đây
+        (SELECT COUNT(*) FROM public.quanly_chiphi c
+          WHERE (p_start IS NULL OR c.created_at >= p_start) AND (p_end IS NULL OR c.created_at < p_end)),
+        (SELECT COALESCE(SUM(p.luong_thuc_nhan), 0) FROM public.phieu_luong p
+          WHERE p_month IS NULL OR p.ky_tinh_luong = p_month),
+        (SELECT COUNT(*) FROM public.phieu_luong p
+          WHERE p_month IS NULL OR p.ky_tinh_luong = p_month);
+$$;
+
+-- Tổng chi phí gốc theo loại chi phí
+CREATE OR REPLACE FUNCTION public.expense_totals_by_lcp(p_start DATE, p_end DATE)
+RETURNS TABLE (id_lcp INTEGER, total NUMERIC, expense_count BIGINT)
+LANGUAGE sql STABLE AS $$
+    SELECT c.id_lcp, COALESCE(SUM(c.giathanh), 0), COUNT(*)
+    FROM public.quanly_chiphi c
+    WHERE c.parent_id IS NULL
+      AND (p_start IS NULL OR c.created_at >= p_start) AND (p_end IS NULL OR c.created_at < p_end)
+    GROUP BY c.id_lcp;
+$$;
@@ -0,0 +1,81 @@
+-- Số conversation khác nhau theo app cho /chat-history/apps và /chat-history/my-apps
+-- (xem chat_app_stats.py). Trigger trên chat_history giữ bảng đếm luôn đúng,
+-- nên endpoint chỉ đọc một dòng cho mỗi app thay vì quét toàn bộ lịch sử chat.
+
+-- Mỗi cặp (app, conversation) đã xuất hiện
+CREATE TABLE IF NOT EXISTS app_conversations (
+    name_app TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    PRIMARY KEY (name_app, conversation_id)
+);
+
+CREATE TABLE IF NOT EXISTS app_conversation_stats (
+    name_app TEXT PRIMARY KEY,
+    conversation_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Dùng khi xóa chat_history để kiểm tra conversation còn dòng nào không
+CREATE INDEX IF NOT EXISTS idx_chat_history_app_conversation ON chat_history(name_app, conversation_id);
+
+CREATE OR REPLACE FUNCTION public.track_app_conversation()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.name_app IS NULL OR NEW.conversation_id IS NULL THEN
+            RETURN NEW;
+        END IF;
+
+        INSERT INTO app_conversations (name_app, conversation_id)
+        VALUES (NEW.name_app, NEW.conversation_id)
+        ON CONFLICT DO NOTHING;
+        GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+        IF v_inserted > 0 THEN
+            INSERT INTO app_conversation_stats (name_app, conversation_count)
+            VALUES (NEW.name_app, 1)
+            ON CONFLICT (name_app) DO UPDATE
+            SET conversation_count = app_conversation_stats.conversation_count + 1, updated_at = NOW();
+        END IF;
+        RETURN NEW;
+    END IF;
+
+    -- DELETE: chỉ giảm khi conversation không còn dòng nào trong app
+    IF OLD.name_app IS NULL OR OLD.conversation_id IS NULL THEN
+        RETURN OLD;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM chat_history
+        WHERE name_app = OLD.name_app AND conversation_id = OLD.conversation_id
+    ) THEN
+        DELETE FROM app_conversations WHERE name_app = OLD.name_app AND conversation_id = OLD.conversation_id;
+        GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+        IF v_inserted > 0 THEN
+            UPDATE app_conversation_stats
+            SET conversation_count = GREATEST(conversation_count - 1, 0), updated_at = NOW()
+            WHERE name_app = OLD.name_app;
+        END IF;
+    END IF;
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_chat_history_app_conversation ON chat_history;
+CREATE TRIGGER trg_chat_history_app_conversation
+    AFTER INSERT OR DELETE ON chat_history
+    FOR EACH ROW EXECUTE FUNCTION public.track_app_conversation();
+
+-- Khởi tạo từ dữ liệu hiện có
+INSERT INTO app_conversations (name_app, conversation_id)
+SELECT DISTINCT name_app, conversation_id FROM chat_history
+WHERE name_app IS NOT NULL AND conversation_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO app_conversation_stats (name_app, conversation_count)
+SELECT name_app, COUNT(*) FROM app_conversations GROUP BY name_app
+ON CONFLICT (name_app) DO UPDATE SET conversation_count = EXCLUDED.conversation_count, updated_at = NOW();
@@ -0,0 +1,24 @@
+-- Tiến độ đồng bộ email chat_history -> user_chat (xem email_chat_sync.py)
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    last_log_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Tìm nhanh user_chat đã có theo conversation khi đối chiếu theo lô
+CREATE INDEX IF NOT EXISTS idx_user_chat_email_conversation ON public.user_chat(email, conversation_id);
+
+-- Báo cho service đồng bộ khi có dòng chat_history mới (LISTEN chat_history_inserted)
+CREATE OR REPLACE FUNCTION public.notify_chat_history_inserted()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('chat_history_inserted', NEW.log_id::text);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_chat_history_notify_inserted ON chat_history;
+CREATE TRIGGER trg_chat_history_notify_inserted
+    AFTER INSERT ON chat_history
+    FOR EACH ROW EXECUTE FUNCTION public.notify_chat_history_inserted();
@@ -0,0 +1,26 @@
+-- Tìm kiếm nhân viên theo tên/email bằng ilike '%từ khóa%' (xem employee_directory.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_employees_full_name_trgm ON employees USING gin (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_employees_email_trgm ON employees USING gin (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_employees_department_id ON employees(department_id);
+CREATE INDEX IF NOT EXISTS idx_employees_ma_nv ON employees(ma_nv);
+
+-- Khóa ngoại để PostgREST nhúng departments(...) trong select employees
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'public.employees'::regclass
+          AND contype = 'f'
+          AND conkey = ARRAY[(SELECT attnum FROM pg_attribute WHERE attrelid = 'public.employees'::regclass AND attname = 'department_id')]
+    ) THEN
+        ALTER TABLE employees
+            ADD CONSTRAINT fk_employees_department
+            FOREIGN KEY (department_id) REFERENCES departments(id) ON DELETE SET NULL NOT VALID;
+    END IF;
+END;
+$$;
+
+-- Cập nhật schema cache của PostgREST để nhận quan hệ mới
+NOTIFY pgrst, 'reload schema';
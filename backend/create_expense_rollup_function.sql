@@ -0,0 +1,17 @@
+-- Ghi giathanh của chi phí cha sau khi tính lại (xem expense_rollup.py)
+-- p_updates: [{"id": 1, "giathanh": 180}, ...]; chỉ cột giathanh được cập nhật
+CREATE OR REPLACE FUNCTION public.set_expense_giathanh(p_updates JSONB)
+RETURNS INTEGER
+LANGUAGE sql AS $$
+    WITH updated AS (
+        UPDATE public.quanly_chiphi c
+        SET giathanh = u.giathanh
+        FROM jsonb_to_recordset(p_updates) AS u(id INTEGER, giathanh NUMERIC)
+        WHERE c.id = u.id
+        RETURNING c.id
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$;
+
+-- Cập nhật schema cache của PostgREST để nhận hàm mới
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,40 @@
+-- Tạo hóa đơn (invoices_reality) hoặc báo giá (invoices_quote) cùng toàn bộ chi tiết
+-- trong một transaction (xem invoice_writer.py)
+-- p_kind: 'reality' | 'quote'; p_invoice: object hóa đơn; p_items: mảng item (không cần invoice_id)
+CREATE OR REPLACE FUNCTION public.create_invoice_with_items(p_kind TEXT, p_invoice JSONB, p_items JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_invoice_id INTEGER;
+BEGIN
+    IF p_kind = 'reality' THEN
+        INSERT INTO public.invoices_reality (customer_name, sales_employee_id, invoice_date, total_amount, id_congtrinh)
+        SELECT r.customer_name, r.sales_employee_id, r.invoice_date, r.total_amount, r.id_congtrinh
+        FROM jsonb_populate_record(NULL::public.invoices_reality, p_invoice) r
+        RETURNING id INTO v_invoice_id;
+
+        INSERT INTO public.invoice_items_reality (
+            invoice_id, loai_san_pham, id_loaiphukien, id_phukien, id_nhom, id_kinh, id_taynam, id_bophan,
+            sanpham_id, ngang, cao, sau, so_luong, don_gia, chiet_khau, thanh_tien)
+        SELECT v_invoice_id, r.loai_san_pham, r.id_loaiphukien, r.id_phukien, r.id_nhom, r.id_kinh, r.id_taynam, r.id_bophan,
+               r.sanpham_id, r.ngang, r.cao, r.sau, r.so_luong, r.don_gia, r.chiet_khau, r.thanh_tien
+        FROM jsonb_populate_recordset(NULL::public.invoice_items_reality, COALESCE(p_items, '[]'::jsonb)) r;
+    ELSIF p_kind = 'quote' THEN
+        INSERT INTO public.invoices_quote (sales_employee_id, invoice_date, total_amount, id_congtrinh)
+        SELECT r.sales_employee_id, r.invoice_date, r.total_amount, r.id_congtrinh
+        FROM jsonb_populate_record(NULL::public.invoices_quote, p_invoice) r
+        RETURNING id INTO v_invoice_id;
+
+        INSERT INTO public.invoice_items_quote (
+            invoice_id, loai_san_pham, id_loaiphukien, id_phukien, id_nhom, id_kinh, id_taynam, id_bophan,
+            sanpham_id, ngang, cao, sau, so_luong, don_gia, chiet_khau, thanh_tien)
+        SELECT v_invoice_id, r.loai_san_pham, r.id_loaiphukien, r.id_phukien, r.id_nhom, r.id_kinh, r.id_taynam, r.id_bophan,
+               r.sanpham_id, r.ngang, r.cao, r.sau, r.so_luong, r.don_gia, r.chiet_khau, r.thanh_tien
+        FROM jsonb_populate_recordset(NULL::public.invoice_items_quote, COALESCE(p_items, '[]'::jsonb)) r;
+    ELSE
+        RAISE EXCEPTION 'Unknown invoice kind: %', p_kind;
+    END IF;
+
+    RETURN v_invoice_id;
+END;
+$$;
@@ -0,0 +1,19 @@
+-- Kết quả gửi thông báo theo từng người nhận (ghi bởi notification_scheduler, xem email_delivery.py)
+create table public.notification_logs (
+  id serial not null,
+  notification_id integer not null,
+  recipient_email character varying(255) not null,
+  recipient_employee character varying(50) null,
+  status character varying(20) not null,
+  attempts integer not null default 1,
+  sent_at timestamp with time zone null,
+  error_message text null,
+  created_at timestamp with time zone null default now(),
+  constraint notification_logs_pkey primary key (id),
+  constraint notification_logs_notification_id_fkey foreign key (notification_id) references notifications (id) on delete cascade,
+  constraint notification_logs_status_check check (
+    ((status)::text = any ((array['sent'::character varying, 'failed'::character varying])::text[]))
+  )
+) TABLESPACE pg_default;
+
+create index if not exists idx_notification_logs_notification_id on public.notification_logs using btree (notification_id) TABLESPACE pg_default;
@@ -0,0 +1,52 @@
+-- Theo dõi các tháng cần tính lại báo cáo profits (xem profit_sync.py)
+CREATE TABLE IF NOT EXISTS public.profit_dirty_months (
+    report_month VARCHAR(7) PRIMARY KEY, -- YYYY-MM
+    marked_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Index cho các truy vấn theo tháng của hàm tổng hợp
+CREATE INDEX IF NOT EXISTS idx_invoices_reality_invoice_date ON public.invoices_reality(invoice_date);
+CREATE INDEX IF NOT EXISTS idx_quanly_chiphi_created_at ON public.quanly_chiphi(created_at);
+CREATE INDEX IF NOT EXISTS idx_phieu_luong_ky_tinh_luong ON public.phieu_luong(ky_tinh_luong);
+
+-- Tổng doanh thu, chi phí gốc và lương của nhiều tháng trong một lần gọi
+CREATE OR REPLACE FUNCTION public.profit_month_totals(p_months TEXT[])
+RETURNS TABLE (
+    report_month TEXT,
+    total_revenue NUMERIC,
+    invoice_count BIGINT,
+    total_expenses NUMERIC,
+    expense_count BIGINT,
+    total_payroll_expenses NUMERIC,
+    payroll_count BIGINT
+)
+LANGUAGE sql STABLE AS $$
+    WITH months AS (
+        SELECT m AS report_month,
+               to_date(m || '-01', 'YYYY-MM-DD') AS start_date,
+               (to_date(m || '-01', 'YYYY-MM-DD') + INTERVAL '1 month')::date AS end_date
+        FROM unnest(p_months) AS m
+    )
+    SELECT months.report_month,
+           COALESCE(inv.total, 0), COALESCE(inv.cnt, 0),
+           COALESCE(exp.total, 0), COALESCE(exp.cnt, 0),
+           COALESCE(pay.total, 0), COALESCE(pay.cnt, 0)
+    FROM months
+    LEFT JOIN LATERAL (
+        SELECT SUM(i.total_amount) AS total, COUNT(*) AS cnt
+        FROM public.invoices_reality i
+        WHERE i.invoice_date >= months.start_date AND i.invoice_date < months.end_date
+    ) inv ON TRUE
+    LEFT JOIN LATERAL (
+        -- Chỉ tính chi phí gốc, giathanh của chi phí cha đã bao gồm chi phí con
+        SELECT SUM(c.giathanh) AS total, COUNT(*) AS cnt
+        FROM public.quanly_chiphi c
+        WHERE c.parent_id IS NULL
+          AND c.created_at >= months.start_date AND c.created_at < months.end_date
+    ) exp ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(p.luong_thuc_nhan) AS total, COUNT(*) AS cnt
+        FROM public.phieu_luong p
+        WHERE p.ky_tinh_luong = months.report_month
+    ) pay ON TRUE;
+$$;
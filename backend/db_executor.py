@@ -0,0 +1,104 @@
+"""
+Thread pool có giới hạn để chạy code truy cập Supabase (client đồng bộ) ngoài event loop.
+
+Các handler `async def` gọi trực tiếp client đồng bộ sẽ chặn event loop của uvicorn,
+khiến một request chậm làm đứng mọi request khác. Bọc handler bằng @offload_db
+(hoặc gọi `await run_db(...)`) để phần truy vấn chạy trong pool này.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Số truy vấn database chạy đồng thời tối đa
+DB_THREADPOOL_SIZE = int(os.getenv('DB_THREADPOOL_SIZE', '16'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'submitted': 0,
+    'completed': 0,
+    'failed': 0,
+    'in_flight': 0,
+    'max_in_flight': 0,
+    'total_wait_ms': 0.0,
+    'max_wait_ms': 0.0,
+}
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Khởi tạo (một lần) và trả về thread pool dùng chung"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_THREADPOOL_SIZE, thread_name_prefix='db')
+    return _executor
+
+def _record_start(submitted_at: float):
+    wait_ms = (time.perf_counter() - submitted_at) * 1000
+    with _stats_lock:
+        _stats['in_flight'] += 1
+        _stats['max_in_flight'] = max(_stats['max_in_flight'], _stats['in_flight'])
+        _stats['total_wait_ms'] += wait_ms
+        _stats['max_wait_ms'] = max(_stats['max_wait_ms'], wait_ms)
+
+def _record_end(failed: bool):
+    with _stats_lock:
+        _stats['in_flight'] -= 1
+        _stats['completed'] += 1
+        if failed:
+            _stats['failed'] += 1
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Chạy hàm đồng bộ trong thread pool database và chờ kết quả mà không chặn event loop"""
+    submitted_at = time.perf_counter()
+    with _stats_lock:
+        _stats['submitted'] += 1
+
+    def call():
+        _record_start(submitted_at)
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _record_end(failed)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), call)
+
+def offload_db(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator biến một handler đồng bộ thành coroutine chạy trong thread pool database.
+
+    functools.wraps giữ nguyên chữ ký hàm nên FastAPI vẫn đọc được tham số
+    query/path/body như trước.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+def get_db_executor_stats() -> Dict[str, Any]:
+    """Thống kê thread pool (số request, đang chạy, thời gian chờ trong hàng đợi)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    started = stats['completed'] + stats['in_flight']
+    stats['avg_wait_ms'] = round(stats['total_wait_ms'] / started, 3) if started else 0.0
+    stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+    stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+    stats['pool_size'] = DB_THREADPOOL_SIZE
+    return stats
+
+def shutdown_db_executor(wait: bool = True):
+    """Đóng thread pool khi ứng dụng tắt"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
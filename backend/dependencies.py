@@ -2,6 +2,7 @@
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from supabase_client import supabase
+from auth_tokens import token_verifier, role_cache
 
 security = HTTPBearer()
 
@@ -11,9 +12,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """
     token = credentials.credentials
     try:
-        # Xác thực token với Supabase
-        user = supabase.auth.get_user(token)
-        return user.user
+        # Xác thực chữ ký token ngay tại chỗ (có cache), không gọi auth server
+        return token_verifier.verify(token)
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -24,9 +24,8 @@ async def get_current_user_optional(credentials: HTTPBearer = Depends(HTTPBearer
     if not credentials or not credentials.credentials:
         return None
     try:
-        # Xác thực token với Supabase
-        user = supabase.auth.get_user(credentials.credentials)
-        return user.user
+        # Xác thực chữ ký token ngay tại chỗ (có cache), không gọi auth server
+        return token_verifier.verify(credentials.credentials)
     except Exception as e:
         return None
 
@@ -35,17 +34,10 @@ async def get_current_admin_user(current_user = Depends(get_current_user)):
     Dependency để kiểm tra quyền admin.
     """
     try:
-        # Kiểm tra vai trò admin từ database users table
-        from supabase_client import supabase
-
-        # Tìm user trong bảng users theo email
-        result = supabase.table('employees').select('role_id, email').eq('email', current_user.email).execute()
-
-        if result.data and len(result.data) > 0:
-            user_data = result.data[0]
-            # role_id = 1 là Admin
-            if user_data['role_id'] == 1:
-                return current_user
+        # Kiểm tra vai trò admin từ bảng employees (role_id theo email được cache)
+        # role_id = 1 là Admin
+        if role_cache.get_role_id(current_user.email, supabase) == 1:
+            return current_user
 
         # Fallback: kiểm tra email trong danh sách admin
         admin_emails = ["admin@company.com", "admin@example.com"]
@@ -2,7 +2,6 @@
 import requests
 import os
 from typing import List, Dict, Optional
-from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,6 +11,9 @@ class DifyAPIService:
     def __init__(self):
         self.api_base_url = os.getenv('DIFY_API_BASE_URL', 'https://api.dify.ai/v1')
         self.api_key = os.getenv('DIFY_API_KEY', '')
+        # Dùng lại kết nối giữa các request; code async dùng dify_client.AsyncDifyClient
+        self.session = requests.Session()
+        self.timeout = (float(os.getenv('DIFY_CONNECT_TIMEOUT', '5')), float(os.getenv('DIFY_TIMEOUT', '30')))
 
     def get_conversation_messages(self, conversation_id: str, user: str, first_id: Optional[str] = None, limit: int = 20) -> Dict:
         """
@@ -34,7 +36,7 @@ class DifyAPIService:
             params['first_id'] = first_id
 
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -61,7 +63,7 @@ class DifyAPIService:
             params['first'] = first
 
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -91,52 +93,53 @@ class DifyAPIService:
 
         return None
 
-    def sync_messages_to_database(self, conversation_id: str, user_id: int, chatflow_name: str):
+    def sync_messages_to_database(self, conversation_id: str, user_id: int, chatflow_name: str, client=None) -> Optional[Dict]:
         """
         Sync messages from Dify to our database
+
+        Đọc mọi trang message của conversation, mỗi trang ghi bằng một lệnh upsert theo
+        dify_message_id nên chạy lại không tạo dòng trùng.
+        Returns: {"inserted", "skipped", "pages"} hoặc None nếu lỗi
         """
         try:
-            # Get user info for API call
-            from supabase_client import supabase
-            user_result = supabase.table('employees').select('username').eq('id', user_id).execute()
+            from dify_message_sync import message_rows, upsert_message_page
+            if client is None:
+                from supabase_client import supabase as client
+            user_result = client.table('employees').select('username').eq('id', user_id).execute()
 
             if not user_result.data:
                 print(f"User {user_id} not found")
-                return False
+                return None
 
             username = user_result.data[0]['username']
 
-            # Fetch messages from Dify
-            messages_data = self.get_conversation_messages(conversation_id, username)
+            totals = {'inserted': 0, 'skipped': 0, 'pages': 0}
+            first_id = None
+            while True:
+                messages_data = self.get_conversation_messages(conversation_id, username, first_id=first_id, limit=100)
 
-            if not messages_data or 'data' not in messages_data:
-                print("No messages data from Dify")
-                return False
+                if not messages_data or 'data' not in messages_data:
+                    if totals['pages'] == 0:
+                        print("No messages data from Dify")
+                        return None
+                    break
 
-            # Sync each message to our database
-            for message in messages_data['data']:
-                # Check if message already exists
-                existing = supabase.table('chat_history').select('id').eq('conversation_id', conversation_id).eq('created_at', message['created_at']).execute()
+                messages = messages_data['data']
+                page = upsert_message_page(message_rows(messages, conversation_id, user_id, chatflow_name), client)
+                totals['inserted'] += page['inserted']
+                totals['skipped'] += page['skipped']
+                totals['pages'] += 1
 
-                if not existing.data:
-                    # Create new chat history record
-                    chat_data = {
-                        'name_app': chatflow_name,
-                        'conversation_id': conversation_id,
-                        'user_id': user_id,
-                        'user_message': message.get('query', ''),
-                        'bot_response': message.get('answer', ''),
-                        'created_at': datetime.fromtimestamp(message['created_at']).isoformat()
-                    }
+                if not messages_data.get('has_more') or not messages:
+                    break
+                first_id = messages[0]['id']
 
-                    supabase.table('chat_history').insert(chat_data).execute()
-                    print(f"Synced message: {message['id']}")
-
-            return True
+            print(f"Synced conversation {conversation_id}: {totals['inserted']} inserted, {totals['skipped']} skipped")
+            return totals
 
         except Exception as e:
             print(f"Error syncing messages to database: {e}")
-            return False
+            return None
 
     def get_or_create_conversation_id(self, user_id: int, chatflow_id: int) -> Optional[str]:
         """
@@ -0,0 +1,182 @@
+"""
+Client bất đồng bộ cho Dify API dùng chung một pool kết nối httpx.
+
+Mọi request đều có timeout. Lỗi tạm thời (mất kết nối, timeout, HTTP 429/5xx) được
+thử lại với thời gian chờ tăng dần có jitter; khi Dify lỗi liên tiếp quá ngưỡng,
+circuit breaker chặn request trong một khoảng thời gian để không dồn thêm tải.
+iter_conversation_messages / iter_user_conversations đọc lần lượt mọi trang.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Dify giới hạn limit tối đa 100 mỗi trang
+MAX_PAGE_SIZE = 100
+
+class DifyAPIError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class DifyCircuitOpenError(DifyAPIError):
+    """Circuit breaker đang mở, request không được gửi tới Dify"""
+
+class CircuitBreaker:
+    """Mở sau failure_threshold lỗi liên tiếp, cho thử lại một request sau reset_timeout giây"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        return self.state != 'open'
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        # Thử lại ở trạng thái half_open thất bại thì mở lại ngay
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+class AsyncDifyClient:
+    def __init__(self, api_base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 timeout: Optional[float] = None, connect_timeout: Optional[float] = None,
+                 max_connections: Optional[int] = None, max_attempts: Optional[int] = None,
+                 backoff_seconds: float = 0.5, max_backoff_seconds: float = 8,
+                 breaker: Optional[CircuitBreaker] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_base_url = (api_base_url or os.getenv('DIFY_API_BASE_URL', 'https://api.dify.ai/v1')).rstrip('/')
+        self.api_key = api_key if api_key is not None else os.getenv('DIFY_API_KEY', '')
+        self.max_attempts = max_attempts or int(os.getenv('DIFY_MAX_ATTEMPTS', '3'))
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv('DIFY_BREAKER_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('DIFY_BREAKER_RESET_SECONDS', '30'))
+        )
+        timeout = timeout or float(os.getenv('DIFY_TIMEOUT', '30'))
+        connect_timeout = connect_timeout or float(os.getenv('DIFY_CONNECT_TIMEOUT', '5'))
+        max_connections = max_connections or int(os.getenv('DIFY_MAX_CONNECTIONS', '20'))
+        self._client = httpx.AsyncClient(
+            base_url=self.api_base_url,
+            headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport
+        )
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        # Full jitter: ngẫu nhiên trong [0, backoff * 2^(attempt-1)]
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_backoff_seconds))
+        return delay
+
+    async def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                      json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Gửi request tới Dify, trả về JSON; DifyAPIError nếu thất bại sau các lần thử"""
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow_request():
+                raise DifyCircuitOpenError(f"Dify circuit open, skipping {method} {path}")
+            response = None
+            try:
+                response = await self._client.request(method, path, params=params, json=json)
+            except httpx.TransportError as e:
+                error = DifyAPIError(f"Dify request {method} {path} failed: {e!r}")
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response.json()
+                error = DifyAPIError(f"Dify request {method} {path} returned {response.status_code}: {response.text[:200]}",
+                                     response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # Lỗi phía request (4xx): Dify vẫn hoạt động bình thường
+                    self.breaker.record_success()
+                    raise error
+
+            self.breaker.record_failure()
+            if attempt >= self.max_attempts:
+                raise error
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def get_conversation_messages(self, conversation_id: str, user: str, first_id: Optional[str] = None,
+                                        limit: int = 20) -> Dict[str, Any]:
+        params = {'conversation_id': conversation_id, 'user': user, 'limit': min(limit, MAX_PAGE_SIZE)}
+        if first_id:
+            params['first_id'] = first_id
+        return await self.request('GET', '/messages', params=params)
+
+    async def get_user_conversations(self, user: str, last_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        params = {'user': user, 'limit': min(limit, MAX_PAGE_SIZE)}
+        if last_id:
+            params['last_id'] = last_id
+        return await self.request('GET', '/conversations', params=params)
+
+    async def iter_message_pages(self, conversation_id: str, user: str,
+                                 page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[list]:
+        """Từng trang message, từ mới nhất về cũ nhất (first_id = message cũ nhất của trang trước)"""
+        first_id = None
+        while True:
+            page = await self.get_conversation_messages(conversation_id, user, first_id=first_id, limit=page_size)
+            messages = page.get('data') or []
+            if messages:
+                yield messages
+            if not page.get('has_more') or not messages:
+                return
+            first_id = messages[0]['id']
+
+    async def iter_conversation_messages(self, conversation_id: str, user: str,
+                                         page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+        async for messages in self.iter_message_pages(conversation_id, user, page_size):
+            for message in messages:
+                yield message
+
+    async def iter_user_conversations(self, user: str, page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+        """Mọi conversation của user, mới nhất trước (Dify phân trang conversation bằng last_id)"""
+        last_id = None
+        while True:
+            page = await self.get_user_conversations(user, last_id=last_id, limit=page_size)
+            conversations = page.get('data') or []
+            for conversation in conversations:
+                yield conversation
+            if not page.get('has_more') or not conversations:
+                return
+            last_id = conversations[-1]['id']
+
+    async def aclose(self):
+        await self._client.aclose()
+
+_dify_client: Optional[AsyncDifyClient] = None
+
+def get_dify_client() -> AsyncDifyClient:
+    """Client dùng chung cho cả app (pool kết nối gắn với event loop của server)"""
+    global _dify_client
+    if _dify_client is None:
+        _dify_client = AsyncDifyClient()
+    return _dify_client
+
+async def close_dify_client():
+    global _dify_client
+    if _dify_client is not None:
+        await _dify_client.aclose()
+        _dify_client = None
@@ -0,0 +1,53 @@
+"""
+Ghi message Dify vào chat_history theo kiểu idempotent.
+
+Mỗi dòng mang dify_message_id (unique, xem add_chat_history_dify_message_id.sql);
+mỗi trang message được ghi bằng một lệnh upsert ON CONFLICT DO NOTHING, nên chạy
+lại hoặc chạy song song cùng một conversation không tạo dòng trùng. PostgREST chỉ
+trả về các dòng thực sự được insert, phần còn lại của trang được tính là skipped.
+"""
+from datetime import datetime
+from typing import Any, Dict, List
+
+from db_executor import run_db
+from supabase_query import get_client
+
+CONFLICT_COLUMN = 'dify_message_id'
+
+def message_rows(messages: List[Dict[str, Any]], conversation_id: str, user_id: int, chatflow_name: str) -> List[Dict[str, Any]]:
+    """Chuyển message Dify ({id, query, answer, created_at}) thành dòng chat_history"""
+    rows = {}
+    for message in messages:
+        if not message.get('id'):
+            continue
+        rows[message['id']] = {
+            'dify_message_id': message['id'],
+            'name_app': chatflow_name,
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'input_text': message.get('query', ''),
+            'output_text': message.get('answer', ''),
+            'created_at': datetime.fromtimestamp(message['created_at']).isoformat()
+        }
+    return list(rows.values())
+
+def upsert_message_page(rows: List[Dict[str, Any]], client=None) -> Dict[str, int]:
+    """Một lệnh upsert cho cả trang; trả về {"inserted", "skipped"}"""
+    if not rows:
+        return {'inserted': 0, 'skipped': 0}
+    result = get_client(client).table('chat_history').upsert(rows, on_conflict=CONFLICT_COLUMN, ignore_duplicates=True).execute()
+    inserted = len(result.data or [])
+    return {'inserted': inserted, 'skipped': len(rows) - inserted}
+
+async def sync_conversation_messages(dify, conversation_id: str, user: str, user_id: int, chatflow_name: str,
+                                     client=None) -> Dict[str, int]:
+    """Đồng bộ mọi trang message của conversation qua AsyncDifyClient"""
+    client = get_client(client)
+    totals = {'inserted': 0, 'skipped': 0}
+    async for messages in dify.iter_message_pages(conversation_id, user):
+        rows = message_rows(messages, conversation_id, user_id, chatflow_name)
+        # Client Supabase là đồng bộ: ghi trong pool database để không chặn event loop
+        page = await run_db(upsert_message_page, rows, client)
+        totals['inserted'] += page['inserted']
+        totals['skipped'] += page['skipped']
+    return totals
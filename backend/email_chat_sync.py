@@ -0,0 +1,308 @@
+"""
+Đồng bộ email từ chat_history sang user_chat theo kiểu tăng dần.
+
+Tiến độ được lưu trong sync_state (log_id lớn nhất đã xử lý), nên mỗi lần chạy chỉ
+đọc các dòng chat_history mới. log_id được cấp khi insert chứ không phải khi commit,
+nên mỗi lần chạy còn đọc lại các dòng chưa gắn user_id trong SAFETY_WINDOW log_id ngay
+dưới high-water mark nhưng chỉ những dòng tạo trong LATE_COMMIT_SECONDS gần nhất (dòng
+commit trễ chỉ trễ vài giây, còn email không khớp nhân viên nào thì không bị đọc lại
+mãi); các dòng có email chưa khớp nhân viên nào (nhân viên được tạo sau) được quét lại
+định kỳ bằng reconcile_pending. Mỗi lô được đối chiếu gộp: một truy vấn employees
+cho tất cả email, một truy vấn user_chat cho các conversation, một lệnh insert cho
+các cặp (email, conversation_id) còn thiếu. EmailChatSyncService chạy đồng bộ khi
+Postgres gửi NOTIFY trên kênh chat_history_inserted (xem create_email_sync_state.sql);
+nếu không kết nối trực tiếp được database thì kiểm tra lại theo chu kỳ.
+"""
+import json
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from supabase_query import get_client
+
+SYNC_NAME = 'email_user_chat'
+NOTIFY_CHANNEL = 'chat_history_inserted'
+BATCH_SIZE = 500
+# Số log_id dưới high-water mark được đọc lại mỗi lần chạy (dòng commit trễ hơn log_id lớn hơn nó)
+SAFETY_WINDOW = 500
+# Chỉ đọc lại các dòng trong window được tạo trong khoảng thời gian này (giây)
+LATE_COMMIT_SECONDS = 120
+IN_QUERY_CHUNK_SIZE = 200
+CHAT_COLUMNS = 'log_id, email, input_text, conversation_id, name_app, user_id'
+
+def _chunks(values: List[Any], size: int = IN_QUERY_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def extract_email(record: Dict[str, Any]) -> Optional[str]:
+    """Email của dòng chat: cột email, hoặc {"Email": ...} trong input_text"""
+    email = record.get('email')
+    if not email and record.get('input_text'):
+        try:
+            email = json.loads(record['input_text']).get('Email')
+        except (ValueError, TypeError, AttributeError):
+            email = None
+    if isinstance(email, str) and email.strip():
+        return email.strip()
+    return None
+
+def get_high_water_mark(client=None) -> int:
+    result = get_client(client).table('sync_state').select('last_log_id').eq('name', SYNC_NAME).execute()
+    return int(result.data[0]['last_log_id'] or 0) if result.data else 0
+
+def save_high_water_mark(last_log_id: int, client=None):
+    get_client(client).table('sync_state').upsert({
+        'name': SYNC_NAME,
+        'last_log_id': last_log_id,
+        'updated_at': datetime.now().isoformat(),
+    }, on_conflict='name').execute()
+
+def fetch_new_records(after_log_id: int, limit: int = BATCH_SIZE, client=None) -> List[Dict[str, Any]]:
+    result = get_client(client).table('chat_history').select(CHAT_COLUMNS).gt('log_id', after_log_id).order('log_id').limit(limit).execute()
+    return result.data or []
+
+def fetch_window_records(last_log_id: int, window: int = SAFETY_WINDOW, now: Optional[datetime] = None,
+                         client=None) -> List[Dict[str, Any]]:
+    """Các dòng có email chưa gắn user_id, tạo trong LATE_COMMIT_SECONDS gần nhất, trong window log_id cuối cùng trước high-water mark"""
+    if last_log_id <= 0 or window <= 0:
+        return []
+    since = ((now or datetime.now()) - timedelta(seconds=LATE_COMMIT_SECONDS)).isoformat()
+    result = get_client(client).table('chat_history').select(CHAT_COLUMNS).is_('user_id', 'null').neq('email', '') \
+        .gt('log_id', max(0, last_log_id - window)).lte('log_id', last_log_id).gte('created_at', since) \
+        .order('log_id').limit(window).execute()
+    return result.data or []
+
+def _employees_by_email(client, emails: Iterable[str]) -> Dict[str, Any]:
+    employees = {}
+    for chunk in _chunks(sorted(set(emails))):
+        result = client.table('employees').select('id, email').in_('email', chunk).execute()
+        for employee in result.data:
+            employees.setdefault(employee['email'], employee['id'])
+    return employees
+
+def _existing_pairs(client, conversation_ids: Iterable[str]) -> set:
+    pairs = set()
+    for chunk in _chunks(sorted(set(conversation_ids))):
+        result = client.table('user_chat').select('email, conversation_id').in_('conversation_id', chunk).execute()
+        pairs.update((row.get('email'), row.get('conversation_id')) for row in result.data)
+    return pairs
+
+def reconcile_chat_records(records: List[Dict[str, Any]], client=None, set_user_id: bool = True) -> Dict[str, int]:
+    """
+    Gắn các dòng chat_history có email với nhân viên và tạo user_chat còn thiếu.
+
+    Args:
+        records: Dòng chat_history (cần log_id, email/input_text, conversation_id, name_app, user_id)
+        set_user_id: Cập nhật chat_history.user_id cho các dòng chưa có
+
+    Returns:
+        Thống kê: records, with_email, matched, unmatched_emails, user_chat_created, chat_history_updated
+    """
+    client = get_client(client)
+    candidates = []
+    for record in records:
+        email = extract_email(record)
+        if email and record.get('conversation_id'):
+            candidates.append((record, email))
+
+    stats = {'records': len(records), 'with_email': len(candidates), 'matched': 0,
+             'unmatched_emails': 0, 'user_chat_created': 0, 'chat_history_updated': 0}
+    if not candidates:
+        return stats
+
+    employees = _employees_by_email(client, (email for _, email in candidates))
+    stats['unmatched_emails'] = len({email for _, email in candidates if email not in employees})
+    matched = [(record, email, employees[email]) for record, email in candidates if email in employees]
+    stats['matched'] = len(matched)
+    if not matched:
+        return stats
+
+    existing = _existing_pairs(client, (record['conversation_id'] for record, _, _ in matched))
+    new_rows = {}
+    for record, email, user_id in matched:
+        pair = (email, record['conversation_id'])
+        if pair not in existing and pair not in new_rows:
+            new_rows[pair] = {
+                'email': email,
+                'user_id': user_id,
+                'conversation_id': record['conversation_id'],
+                'name_app': record.get('name_app'),
+                'app_id': record.get('name_app')  # Sử dụng name_app làm app_id
+            }
+    if new_rows:
+        client.table('user_chat').insert(list(new_rows.values())).execute()
+        stats['user_chat_created'] = len(new_rows)
+
+    if set_user_id:
+        # Một lệnh update cho mỗi nhân viên thay vì mỗi dòng
+        log_ids_by_user = defaultdict(list)
+        for record, _, user_id in matched:
+            if record.get('user_id') is None:
+                log_ids_by_user[user_id].append(record['log_id'])
+        for user_id, log_ids in log_ids_by_user.items():
+            for chunk in _chunks(log_ids):
+                client.table('chat_history').update({'user_id': user_id}).in_('log_id', chunk).execute()
+            stats['chat_history_updated'] += len(log_ids)
+
+    return stats
+
+def sync_new_records(client=None, batch_size: int = BATCH_SIZE, window: int = SAFETY_WINDOW,
+                     now: Optional[datetime] = None) -> Dict[str, int]:
+    """Xử lý mọi dòng chat_history sau high-water mark (và dòng commit trễ trong window), lưu tiến độ sau mỗi lô"""
+    client = get_client(client)
+    last_log_id = get_high_water_mark(client)
+    totals = defaultdict(int)
+    # Đối chiếu là idempotent (bỏ qua cặp user_chat đã có, chỉ cập nhật user_id còn NULL) nên đọc lại không sao
+    late_records = fetch_window_records(last_log_id, window, now, client)
+    if late_records:
+        for key, value in reconcile_chat_records(late_records, client).items():
+            totals[key] += value
+    while True:
+        records = fetch_new_records(last_log_id, batch_size, client)
+        if not records:
+            break
+        for key, value in reconcile_chat_records(records, client).items():
+            totals[key] += value
+        last_log_id = max(record['log_id'] for record in records)
+        save_high_water_mark(last_log_id, client)
+        if len(records) < batch_size:
+            break
+    totals['last_log_id'] = last_log_id
+    return dict(totals)
+
+def fetch_pending_records(since: Optional[str] = None, client=None) -> List[Dict[str, Any]]:
+    """Các dòng chat_history có email nhưng chưa gắn user_id (tùy chọn: từ thời điểm since), đọc theo trang"""
+    client = get_client(client)
+    records = []
+    last_log_id = 0
+    while True:
+        # neq('email', '') cũng loại các dòng email NULL
+        query = client.table('chat_history').select(CHAT_COLUMNS).is_('user_id', 'null').neq('email', '').gt('log_id', last_log_id)
+        if since:
+            query = query.gte('created_at', since)
+        page = query.order('log_id').limit(BATCH_SIZE).execute().data or []
+        records.extend(page)
+        if len(page) < BATCH_SIZE:
+            return records
+        last_log_id = page[-1]['log_id']
+
+def reconcile_pending(since: Optional[str] = None, client=None) -> Dict[str, Any]:
+    """Đối chiếu gộp mọi dòng đang chờ; trả về thống kê kèm thời gian từng bước (giây)"""
+    client = get_client(client)
+    started = time.perf_counter()
+    records = fetch_pending_records(since, client)
+    fetched = time.perf_counter()
+    stats: Dict[str, Any] = reconcile_chat_records(records, client)
+    finished = time.perf_counter()
+    stats['timings'] = {
+        'fetch_seconds': round(fetched - started, 3),
+        'reconcile_seconds': round(finished - fetched, 3),
+        'total_seconds': round(finished - started, 3),
+    }
+    return stats
+
+def _connect_listener():
+    """Kết nối psycopg2 trực tiếp để LISTEN; None nếu chưa cấu hình SUPABASE_DB_HOST"""
+    if not os.environ.get("SUPABASE_DB_HOST"):
+        return None
+    import psycopg2
+    from pg_pool import connection_params
+    # Kết nối riêng, không lấy từ pool: LISTEN giữ kết nối suốt thời gian service chạy
+    connection = psycopg2.connect(**connection_params())
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+    return connection
+
+class EmailChatSyncService:
+    """Chạy sync_new_records khi có dòng chat_history mới (NOTIFY) hoặc theo chu kỳ dự phòng"""
+
+    def __init__(self, client=None, poll_interval: float = 5, listen_timeout: float = 300,
+                 pending_interval: float = 3600, connect_listener=_connect_listener, clock=time.monotonic):
+        self.client = client
+        # Không có LISTEN: kiểm tra high-water mark mỗi poll_interval giây (một truy vấn theo khóa chính)
+        self.poll_interval = poll_interval
+        # Có LISTEN: vẫn chạy lại sau listen_timeout giây phòng khi lỡ NOTIFY
+        self.listen_timeout = listen_timeout
+        # Quét lại mọi dòng chưa gắn user_id mỗi pending_interval giây (email của nhân viên tạo sau)
+        self.pending_interval = pending_interval
+        self.connect_listener = connect_listener
+        self.clock = clock
+        self.last_stats: Dict[str, int] = {}
+        self.last_pending_stats: Dict[str, Any] = {}
+        self._next_pending_sweep = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self) -> Dict[str, int]:
+        client = get_client(self.client)
+        self.last_stats = sync_new_records(client)
+        if self.last_stats.get('user_chat_created'):
+            print(f"✅ Email sync: {self.last_stats}")
+        now = self.clock()
+        if self._next_pending_sweep is None or now >= self._next_pending_sweep:
+            self._next_pending_sweep = now + self.pending_interval
+            self.last_pending_stats = reconcile_pending(client=client)
+            if self.last_pending_stats.get('user_chat_created'):
+                print(f"✅ Email sync (pending sweep): {self.last_pending_stats}")
+        return self.last_stats
+
+    def _wait_for_changes(self, connection) -> None:
+        if connection is None:
+            self._stop.wait(self.poll_interval)
+            return
+        # Chờ NOTIFY (kiểm tra cờ dừng mỗi giây)
+        deadline = time.monotonic() + self.listen_timeout
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            if select.select([connection], [], [], 1.0)[0]:
+                connection.poll()
+                if connection.notifies:
+                    connection.notifies.clear()
+                    return
+
+    def _listen(self):
+        try:
+            return self.connect_listener()
+        except Exception as e:
+            print(f"⚠️  LISTEN {NOTIFY_CHANNEL} unavailable, checking every {self.poll_interval}s: {e}")
+            return None
+
+    def _run(self):
+        connection = self._listen()
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                self._wait_for_changes(connection)
+            except Exception as e:
+                print(f"❌ Email sync error: {e}")
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                self._stop.wait(5)
+                if connection is None:
+                    connection = self._listen()
+        if connection is not None:
+            connection.close()
+
+    def start(self):
+        if self.is_running:
+            print("Email sync service is already running")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print("✅ Email sync service started successfully!")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        print("🛑 Email sync service stopped")
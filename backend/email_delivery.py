@@ -0,0 +1,183 @@
+"""
+Gửi email thông báo qua pool kết nối SMTP dùng lại được.
+
+Mỗi người nhận có một envelope riêng; danh sách người nhận được chia cho các worker,
+mỗi worker giữ một kết nối SMTP mở trong suốt lượt gửi. Lỗi tạm thời (mất kết nối,
+mã 4xx) được thử lại với thời gian chờ tăng dần; lỗi vĩnh viễn (mã 5xx) ghi nhận
+ngay. Kết quả được trả về theo từng người nhận để lưu vào notification_logs.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DeliveryResult:
+    recipient_email: str
+    status: str  # 'sent' | 'failed'
+    attempts: int
+    error_message: Optional[str] = None
+    sent_at: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+class SMTPConnectionPool:
+    """Pool các kết nối SMTP đã đăng nhập, tạo khi cần và dùng lại giữa các lần gửi"""
+
+    def __init__(self, host: str, port: int, user: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = True, size: int = 4, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.user and self.password:
+            connection.login(self.user, self.password)
+        return connection
+
+    @staticmethod
+    def _is_alive(connection: smtplib.SMTP) -> bool:
+        try:
+            return connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_alive(connection):
+                    return connection
+                self._close(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection: smtplib.SMTP, broken: bool = False):
+        if broken:
+            self._close(connection)
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    @staticmethod
+    def _close(connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def close(self):
+        """Đóng mọi kết nối đang rảnh"""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # Mất kết nối, timeout, lỗi mạng
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+def _is_connection_error(error: Exception) -> bool:
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+def build_message(sender: str, recipient: str, subject: str, content: str, headers: Optional[Dict[str, str]] = None) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid()
+    for name, value in (headers or {}).items():
+        message[name] = value
+    message.set_content(content)
+    # Giống yagmail: bản HTML giữ xuống dòng của nội dung
+    message.add_alternative(content if '<' in content else content.replace('\n', '<br>\n'), subtype='html')
+    return message
+
+class EmailDeliveryQueue:
+    """Gửi một email tới nhiều người nhận song song qua SMTPConnectionPool"""
+
+    def __init__(self, pool: SMTPConnectionPool, sender: str, max_attempts: int = 3, backoff_seconds: float = 1.0):
+        self.pool = pool
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='smtp-delivery')
+
+    def _deliver_chunk(self, recipients: List[str], subject: str, content: str, headers: Optional[Dict[str, str]]) -> List[DeliveryResult]:
+        results = []
+        connection = None
+        try:
+            for recipient in recipients:
+                message = build_message(self.sender, recipient, subject, content, headers)
+                attempt = 0
+                while True:
+                    attempt += 1
+                    try:
+                        if connection is None:
+                            connection = self.pool.acquire()
+                        connection.send_message(message, from_addr=self.sender, to_addrs=[recipient])
+                        results.append(DeliveryResult(recipient, 'sent', attempt, sent_at=datetime.now().isoformat()))
+                        break
+                    except Exception as e:
+                        if connection is not None and _is_connection_error(e):
+                            self.pool.release(connection, broken=True)
+                            connection = None
+                        if attempt >= self.max_attempts or not _is_transient(e):
+                            logger.error(f"Failed to send email to {recipient}: {str(e)}")
+                            results.append(DeliveryResult(recipient, 'failed', attempt, error_message=str(e)))
+                            break
+                        time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+        finally:
+            if connection is not None:
+                self.pool.release(connection)
+        return results
+
+    def deliver(self, recipients: List[str], subject: str, content: str, headers: Optional[Dict[str, str]] = None) -> List[DeliveryResult]:
+        """Gửi tới từng người nhận, trả về kết quả theo thứ tự danh sách"""
+        recipients = list(dict.fromkeys(recipient for recipient in recipients if recipient))
+        if not recipients:
+            return []
+        # Mỗi worker nhận một phần danh sách và dùng một kết nối cho cả phần đó
+        chunk_count = min(self.pool.size, len(recipients))
+        chunks = [recipients[index::chunk_count] for index in range(chunk_count)]
+        futures = [self._executor.submit(self._deliver_chunk, chunk, subject, content, headers) for chunk in chunks]
+
+        by_recipient = {}
+        for future in futures:
+            for result in future.result():
+                by_recipient[result.recipient_email] = result
+        return [by_recipient[recipient] for recipient in recipients]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
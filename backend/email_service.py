@@ -1,11 +1,18 @@
-import yagmail
 import os
 from typing import List, Optional
 from datetime import datetime
 import logging
 
+from email_delivery import SMTPConnectionPool, EmailDeliveryQueue, DeliveryResult
+
 logger = logging.getLogger(__name__)
 
+PRIORITY_HEADERS = {
+    'high': '1',
+    'normal': '3',
+    'low': '5'
+}
+
 class EmailService:
     def __init__(self):
         # Email configuration - you can move these to environment variables
@@ -14,21 +21,51 @@ class EmailService:
         self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
         self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
 
-        # Initialize yagmail
+        # Pool kết nối SMTP (STARTTLS), kết nối được mở khi gửi lần đầu
         try:
-            self.yag = yagmail.SMTP(
-                user=self.sender_email,
-                password=self.sender_password,
+            self.pool = SMTPConnectionPool(
                 host=self.smtp_server,
                 port=self.smtp_port,
-                smtp_ssl=False,  # Disable SSL, use TLS instead
-                smtp_starttls=True,  # Enable STARTTLS
-                smtp_skip_login=False
+                user=self.sender_email,
+                password=self.sender_password,
+                starttls=os.getenv('SMTP_STARTTLS', 'true').lower() != 'false',
+                size=int(os.getenv('SMTP_POOL_SIZE', '4'))
+            )
+            self.delivery = EmailDeliveryQueue(
+                self.pool,
+                sender=self.sender_email,
+                max_attempts=int(os.getenv('SMTP_MAX_ATTEMPTS', '3'))
             )
             logger.info("Email service initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize email service: {str(e)}")
-            self.yag = None
+            self.delivery = None
+
+    def deliver(self, recipient_emails: List[str], subject: str, content: str, priority: str = "normal") -> List[DeliveryResult]:
+        """
+        Send notification email to each recipient separately
+
+        Returns:
+            List[DeliveryResult]: One delivery result per unique recipient
+        """
+        if not self.delivery:
+            logger.error("Email service not initialized")
+            return [DeliveryResult(email, 'failed', 0, error_message='Email service not initialized')
+                    for email in dict.fromkeys(recipient_emails)]
+
+        headers = {
+            'X-Priority': PRIORITY_HEADERS.get(priority.lower(), '3'),
+            'X-Mailer': 'Department Notification System'
+        }
+        results = self.delivery.deliver(recipient_emails, subject, content, headers)
+        sent_count = sum(1 for result in results if result.status == 'sent')
+        logger.info(f"Email sent successfully to {sent_count}/{len(results)} recipients")
+        return results
+
+    def close(self):
+        """Đóng worker gửi mail và các kết nối SMTP đang mở"""
+        if self.delivery:
+            self.delivery.shutdown()
 
     def send_notification_email(self, recipient_emails: List[str], subject: str, content: str, priority: str = "normal") -> bool:
         """
@@ -41,43 +78,14 @@ class EmailService:
             priority: Email priority (high, normal, low)
 
         Returns:
-            bool: True if sent successfully, False otherwise
+            bool: True if every recipient was sent successfully, False otherwise
         """
-        if not self.yag:
-            logger.error("Email service not initialized")
-            return False
-
         if not recipient_emails:
             logger.warning("No recipient emails provided")
             return False
 
-        try:
-            # Set email priority
-            priority_headers = {
-                'high': '1',
-                'normal': '3',
-                'low': '5'
-            }
-
-            headers = {
-                'X-Priority': priority_headers.get(priority.lower(), '3'),
-                'X-Mailer': 'Department Notification System'
-            }
-
-            # Send email
-            self.yag.send(
-                to=recipient_emails,
-                subject=subject,
-                contents=content,
-                headers=headers
-            )
-
-            logger.info(f"Email sent successfully to {len(recipient_emails)} recipients")
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to send email: {str(e)}")
-            return False
+        results = self.deliver(recipient_emails, subject, content, priority)
+        return bool(results) and all(result.status == 'sent' for result in results)
 
     def send_bulk_notification(self, notification_data: dict) -> dict:
         """
@@ -102,28 +110,32 @@ class EmailService:
                 'failed_count': 0
             }
 
-        # Send email
-        success = self.send_notification_email(
+        # Gửi riêng từng người nhận, một người lỗi không làm hỏng cả thông báo
+        results = self.deliver(
             recipient_emails=recipient_emails,
             subject=title,
             content=content,
             priority=priority
         )
+        sent_count = sum(1 for result in results if result.status == 'sent')
+        failed_count = len(results) - sent_count
 
-        if success:
+        if sent_count:
             return {
                 'success': True,
-                'message': f'Notification sent to {len(recipient_emails)} recipients',
-                'sent_count': len(recipient_emails),
-                'failed_count': 0,
-                'sent_at': datetime.now().isoformat()
+                'message': f'Notification sent to {sent_count} recipients' + (f', {failed_count} failed' if failed_count else ''),
+                'sent_count': sent_count,
+                'failed_count': failed_count,
+                'sent_at': datetime.now().isoformat(),
+                'results': [result.to_dict() for result in results]
             }
         else:
             return {
                 'success': False,
                 'message': 'Failed to send notification',
                 'sent_count': 0,
-                'failed_count': len(recipient_emails)
+                'failed_count': failed_count,
+                'results': [result.to_dict() for result in results]
             }
 
 # Global email service instance
@@ -0,0 +1,78 @@
+"""
+Danh bạ nhân viên: tìm kiếm và phân trang ngay trong Postgres.
+
+Từ khóa được so khớp bằng ilike trên full_name/email (có index trigram, xem
+create_employee_search_indexes.sql) và phòng ban được lấy cùng truy vấn bằng select
+nhúng departments!department_id(...), nên mỗi trang là một request duy nhất. Gợi ý
+!department_id là bắt buộc vì departments.manager_id -> employees.id cũng là một quan hệ
+giữa hai bảng. Nếu database chưa có khóa ngoại employees.department_id -> departments.id
+thì phòng ban của trang được đọc bằng một truy vấn in_ riêng.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from supabase_query import PAGE_SIZE, get_client
+
+DEPARTMENT_COLUMNS = 'id, name, description'
+EMBEDDED_COLUMNS = f'*, departments!department_id({DEPARTMENT_COLUMNS})'
+
+def search_filter(search: str) -> str:
+    """Điều kiện or_ của PostgREST: full_name hoặc email chứa từ khóa (không phân biệt hoa thường)"""
+    # %, _ và \ là ký tự đặc biệt của LIKE: escape để từ khóa được so khớp nguyên văn
+    term = search.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    # Đặt trong dấu nháy kép để dấu phẩy, dấu chấm, ngoặc trong từ khóa không phá cú pháp
+    term = term.replace('\\', '\\\\').replace('"', '\\"')
+    return f'full_name.ilike."*{term}*",email.ilike."*{term}*"'
+
+def _query(client, columns: str, search: Optional[str], department_id: Optional[int]):
+    query = client.table('employees').select(columns)
+    if department_id:
+        query = query.eq('department_id', department_id)
+    if search and search.strip():
+        query = query.or_(search_filter(search))
+    return query.order('ma_nv')
+
+def _fetch_range(client, search, department_id, start: int, end: int) -> List[Dict[str, Any]]:
+    try:
+        return _query(client, EMBEDDED_COLUMNS, search, department_id).range(start, end).execute().data or []
+    except Exception as e:
+        print(f"Embedded departments select unavailable, loading departments separately: {e}")
+
+    users = _query(client, '*', search, department_id).range(start, end).execute().data or []
+    department_ids = sorted({user['department_id'] for user in users if user.get('department_id')})
+    departments = {}
+    if department_ids:
+        result = client.table('departments').select(DEPARTMENT_COLUMNS).in_('id', department_ids).execute()
+        departments = {department['id']: department for department in result.data}
+    for user in users:
+        user['departments'] = departments.get(user.get('department_id'))
+    return users
+
+def list_employees(search: Optional[str] = None, department_id: Optional[int] = None, limit: Optional[int] = None,
+                   offset: int = 0, client=None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Nhân viên theo ma_nv, kèm thông tin phòng ban trong khóa "departments".
+
+    Args:
+        limit: Số dòng mỗi trang (tối đa 1000); None = trả về tất cả
+        offset: Vị trí bắt đầu (next_offset của trang trước)
+
+    Returns:
+        (users, next_offset); next_offset = None khi đã hết dữ liệu
+    """
+    client = get_client(client)
+    offset = max(offset, 0)
+    if limit is not None:
+        limit = min(max(limit, 1), PAGE_SIZE)
+        # Đọc thêm một dòng để biết còn trang sau hay không
+        users = _fetch_range(client, search, department_id, offset, offset + limit)
+        if len(users) > limit:
+            return users[:limit], offset + limit
+        return users, None
+
+    users = []
+    while True:
+        page = _fetch_range(client, search, department_id, offset, offset + PAGE_SIZE - 1)
+        users.extend(page)
+        if len(page) < PAGE_SIZE:
+            return users, None
+        offset += PAGE_SIZE
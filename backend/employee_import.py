@@ -0,0 +1,253 @@
+"""
+Nhập nhân viên hàng loạt từ file Excel/CSV.
+
+File CSV được đọc theo từng khối (IMPORT_CHUNK_SIZE dòng) nên bộ nhớ không tăng theo
+kích thước file. Mỗi khối được kiểm tra bằng các phép so khớp vector của pandas, mã
+nhân viên (ma_nv) còn thiếu được cấp theo dải liên tiếp từ số lớn nhất đã đọc một lần
+lúc bắt đầu, mật khẩu được băm bcrypt song song trong một thread pool dùng chung cho mọi
+request (bcrypt nhả GIL khi băm), và dữ liệu được insert theo lô. Lô nào bị database từ chối thì insert lại từng dòng để báo lỗi chính xác.
+"""
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import bcrypt
+import pandas as pd
+
+from auth_tokens import invalidate_employees
+from supabase_query import get_client, iter_pages
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+INSERT_BATCH_SIZE = 500
+IN_QUERY_CHUNK_SIZE = 200
+# Số thread băm mật khẩu; 0 = theo số CPU
+IMPORT_HASH_WORKERS = int(os.getenv('IMPORT_HASH_WORKERS', '0')) or os.cpu_count() or 1
+# Mặc định như bcrypt.gensalt(); chi phí băm quyết định thời gian nhập file lớn
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+FIRST_MA_NV = 1000
+
+REQUIRED_COLUMNS = ['email', 'password', 'full_name', 'luong_hop_dong', 'muc_luong_dong_bhxh']
+OPTIONAL_FIELDS = ['chuc_vu', 'phong_ban', 'so_nguoi_phu_thuoc', 'dien_thoai', 'dia_chi', 'ngay_vao_lam', 'department']
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+# Đọc dạng chuỗi để giữ nguyên mã (không thành 1005.0) và số 0 đầu số điện thoại
+TEXT_DTYPES = {'ma_nv': str, 'dien_thoai': str}
+
+def _chunks(values: List[Any], size: int):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_executor_lock = threading.Lock()
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    """Khởi tạo (một lần) và trả về thread pool băm mật khẩu dùng chung"""
+    global _hash_executor
+    if _hash_executor is None:
+        with _hash_executor_lock:
+            if _hash_executor is None:
+                _hash_executor = ThreadPoolExecutor(max_workers=IMPORT_HASH_WORKERS, thread_name_prefix='bcrypt')
+    return _hash_executor
+
+def shutdown_hash_executor():
+    """Đóng thread pool băm mật khẩu (gọi khi app tắt)"""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is not None:
+            _hash_executor.shutdown(wait=True)
+            _hash_executor = None
+
+def _hash_password(args: Tuple[str, int]) -> str:
+    password, rounds = args
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def read_frames(file, filename: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Các khối DataFrame của file; index giữ số thứ tự dòng dữ liệu trong file (từ 0)"""
+    if filename.endswith('.csv'):
+        yield from pd.read_csv(file, chunksize=chunk_size, dtype=TEXT_DTYPES)
+        return
+    # Excel không đọc theo khối được: đọc một lần rồi xử lý theo khối như CSV
+    frame = pd.read_excel(file, dtype=TEXT_DTYPES)
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start:start + chunk_size]
+
+def missing_columns(columns) -> List[str]:
+    names = {str(column).strip() for column in columns}
+    return [column for column in REQUIRED_COLUMNS if column not in names]
+
+def _text(frame: pd.DataFrame, column: str) -> pd.Series:
+    if column not in frame.columns:
+        return pd.Series(pd.NA, index=frame.index, dtype='string')
+    values = frame[column].astype('string').str.strip()
+    return values.mask(values == '')
+
+def validate_frame(frame: pd.DataFrame, seen_emails: set) -> Tuple[pd.DataFrame, Dict[int, List[str]]]:
+    """
+    Kiểm tra cả khối một lần.
+
+    Returns:
+        (các dòng hợp lệ đã chuẩn hóa, {index dòng: [lỗi]})
+    """
+    frame = frame.rename(columns=lambda column: str(column).strip())
+    clean = pd.DataFrame(index=frame.index)
+    for column in ['email', 'password', 'full_name', 'ma_nv'] + [field for field in OPTIONAL_FIELDS if field != 'so_nguoi_phu_thuoc']:
+        clean[column] = _text(frame, column)
+    for column in ['luong_hop_dong', 'muc_luong_dong_bhxh', 'so_nguoi_phu_thuoc']:
+        clean[column] = pd.to_numeric(frame[column], errors='coerce') if column in frame.columns else float('nan')
+
+    normalized_emails = clean['email'].str.lower()
+    checks = [
+        (clean['email'].isna(), "Thiếu email"),
+        (clean['email'].notna() & ~clean['email'].str.match(EMAIL_PATTERN, na=False), "Email không hợp lệ"),
+        (normalized_emails.notna() & (normalized_emails.duplicated() | normalized_emails.isin(seen_emails)), "Email bị trùng trong file"),
+        (clean['password'].isna(), "Thiếu mật khẩu"),
+        (clean['full_name'].isna(), "Thiếu họ tên"),
+        (clean['luong_hop_dong'].isna(), "luong_hop_dong không phải số"),
+        (clean['muc_luong_dong_bhxh'].isna(), "muc_luong_dong_bhxh không phải số"),
+        (_text(frame, 'so_nguoi_phu_thuoc').notna() & clean['so_nguoi_phu_thuoc'].isna(), "so_nguoi_phu_thuoc không phải số"),
+    ]
+    errors: Dict[int, List[str]] = {}
+    for mask, message in checks:
+        for index in mask[mask.fillna(False)].index:
+            errors.setdefault(index, []).append(message)
+
+    seen_emails.update(normalized_emails.dropna())
+    return clean.drop(index=list(errors)), errors
+
+def existing_emails(emails: List[str], client=None) -> set:
+    client = get_client(client)
+    found = set()
+    for chunk in _chunks(list(dict.fromkeys(emails)), IN_QUERY_CHUNK_SIZE):
+        result = client.table('employees').select('email').in_('email', chunk).execute()
+        found.update(row['email'] for row in result.data)
+    return found
+
+class MaNvAllocator:
+    """Cấp ma_nv dạng số tăng dần; số lớn nhất hiện có được đọc một lần"""
+
+    def __init__(self, client=None):
+        self.next_number = self._load_next_number(get_client(client))
+
+    @staticmethod
+    def _load_next_number(client) -> int:
+        highest = None
+        for page in iter_pages(lambda: client.table('employees').select('ma_nv').order('ma_nv')):
+            for row in page:
+                try:
+                    number = int(row['ma_nv'])
+                except (ValueError, TypeError):
+                    continue
+                highest = number if highest is None else max(highest, number)
+        return highest + 1 if highest is not None else FIRST_MA_NV
+
+    def reserve(self, provided: pd.Series):
+        """Không cấp trùng các ma_nv dạng số có sẵn trong file"""
+        numbers = pd.to_numeric(provided, errors='coerce').dropna()
+        if not numbers.empty:
+            self.next_number = max(self.next_number, int(numbers.max()) + 1)
+
+    def allocate(self, count: int) -> List[str]:
+        start = self.next_number
+        self.next_number += count
+        return [str(number) for number in range(start, start + count)]
+
+def build_rows(clean: pd.DataFrame, hashed_passwords: List[str]) -> List[Dict[str, Any]]:
+    rows = []
+    for record, hashed_password in zip(clean.to_dict('records'), hashed_passwords):
+        user_data = {
+            "email": record['email'],
+            "ho_ten": record['full_name'],  # Keep ho_ten for backward compatibility
+            "full_name": record['full_name'],
+            "role_id": 2,  # Default role
+            "is_active": True,
+            "ma_nv": record['ma_nv'],
+            "luong_hop_dong": float(record['luong_hop_dong']),
+            "muc_luong_dong_bhxh": float(record['muc_luong_dong_bhxh']),
+            "hashed_password": hashed_password
+        }
+        for field in OPTIONAL_FIELDS:
+            value = record.get(field)
+            if value is None or pd.isna(value):
+                continue
+            if field == 'so_nguoi_phu_thuoc':
+                user_data[field] = int(value)
+            elif field == 'department':
+                # Tên phòng ban được lưu vào phong_ban
+                user_data['phong_ban'] = value
+            else:
+                user_data[field] = value
+        rows.append(user_data)
+    return rows
+
+def insert_rows(rows: List[Dict[str, Any]], line_numbers: List[int], client=None) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Insert theo lô; lô lỗi được insert lại từng dòng. Trả về (đã tạo, lỗi)"""
+    client = get_client(client)
+    created, errors = [], []
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        lines = line_numbers[start:start + INSERT_BATCH_SIZE]
+        try:
+            client.table('employees').insert(batch).execute()
+            invalidate_employees(row['email'] for row in batch)
+            created.extend({"email": row['email'], "ma_nv": row['ma_nv']} for row in batch)
+            continue
+        except Exception as e:
+            print(f"Batch insert failed, retrying row by row: {e}")
+        for row, line in zip(batch, lines):
+            try:
+                result = client.table('employees').insert(row).execute()
+                if result.data:
+                    invalidate_employees([row['email']])
+                    created.append({"email": row['email'], "ma_nv": row['ma_nv']})
+                else:
+                    errors.append(f"Dòng {line}: Không thể tạo user {row['email']}")
+            except Exception as e:
+                errors.append(f"Dòng {line}: {str(e)}")
+    return created, errors
+
+def import_employees(frames, client=None, executor: Optional[Executor] = None, rounds: int = BCRYPT_ROUNDS) -> Dict[str, Any]:
+    """
+    Nhập các khối DataFrame (xem read_frames).
+
+    Args:
+        executor: Pool băm mật khẩu; mặc định thread pool dùng chung (get_hash_executor)
+        rounds: Số vòng bcrypt
+
+    Returns:
+        {"created_users": [{"email", "ma_nv"}], "errors": ["Dòng N: ..."]}
+    """
+    client = get_client(client)
+    executor = executor or get_hash_executor()
+
+    allocator = None
+    seen_emails: set = set()
+    created_users: List[Dict[str, str]] = []
+    errors: List[str] = []
+    for frame in frames:
+        clean, row_errors = validate_frame(frame, seen_emails)
+
+        taken = existing_emails(clean['email'].tolist(), client) if not clean.empty else set()
+        duplicate = clean['email'].isin(taken)
+        for index in clean.index[duplicate]:
+            row_errors.setdefault(index, []).append(f"Email {clean.at[index, 'email']} đã tồn tại")
+        clean = clean[~duplicate]
+        # Dòng dữ liệu thứ i (từ 0) nằm ở dòng i + 2 của file (sau dòng tiêu đề)
+        errors.extend(f"Dòng {index + 2}: {'; '.join(messages)}" for index, messages in sorted(row_errors.items()))
+        if clean.empty:
+            continue
+
+        if allocator is None:
+            allocator = MaNvAllocator(client)
+        allocator.reserve(clean['ma_nv'])
+        missing = clean['ma_nv'].isna()
+        if missing.any():
+            clean.loc[missing, 'ma_nv'] = allocator.allocate(int(missing.sum()))
+
+        passwords = clean['password'].tolist()
+        hashed = list(executor.map(_hash_password, [(password, rounds) for password in passwords],
+                                   chunksize=max(1, len(passwords) // 32)))
+        created, insert_errors = insert_rows(build_rows(clean.drop(columns='password'), hashed),
+                                             [index + 2 for index in clean.index], client)
+        created_users.extend(created)
+        errors.extend(insert_errors)
+    return {"created_users": created_users, "errors": errors}
@@ -0,0 +1,442 @@
+"""
+Cache snapshot cây chi phí (quanly_chiphi) theo tháng cho endpoint /quanly_chiphi/hierarchy/.
+
+Mỗi snapshot giữ chỉ mục id -> node, danh sách con theo parent_id và JSON đã tuần tự
+hóa sẵn của từng cây gốc, kèm ETag (sha256 của nội dung). Tổng được tính từ lá lên gốc
+bằng stack (không đệ quy) với cùng quy tắc như expense_rollup: giathanh của chi phí cha
+= tổng giathanh các con trực tiếp cùng tháng, total_amount = giathanh + total_amount
+của mọi con.
+
+Các endpoint CRUD gọi apply_upsert()/apply_delete() sau khi ghi: chỉ node thay đổi và
+các tổ tiên của nó được tính lại, chỉ cây gốc chứa chúng được tuần tự hóa lại. TTL là
+lưới an toàn cho dữ liệu bị sửa ngoài tiến trình API (script, worker khác).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from expense_rollup import expense_month, load_expenses, month_range
+from supabase_query import fetch_all, get_client
+
+HIERARCHY_CACHE_TTL = float(os.getenv('EXPENSE_HIERARCHY_CACHE_TTL', '300'))
+# Số snapshot (tháng) tối đa giữ trong bộ nhớ
+HIERARCHY_CACHE_SIZE = int(os.getenv('EXPENSE_HIERARCHY_CACHE_SIZE', '24'))
+CATEGORY_COLUMNS = 'id, tenchiphi, loaichiphi, giathanh'
+# Số id tối đa trong một bộ lọc in_
+IN_CHUNK_SIZE = 200
+
+_CLOSE = object()
+_COMMA = object()
+
+def _row_month(row: Dict[str, Any]) -> str:
+    return expense_month(row.get('created_at')) or ''
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match có chứa etag (hoặc là *)"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+class HierarchySnapshot:
+    """Cây chi phí của một tháng (month=None: mọi tháng); không thread-safe, được khóa bởi cache"""
+
+    def __init__(self, month: Optional[str], rows: Iterable[Dict[str, Any]], categories: Dict[Any, Optional[Dict[str, Any]]]):
+        self.month = month
+        self.categories = categories
+        self.nodes: Dict[Any, Dict[str, Any]] = {}
+        # parent_id -> id các con, giảm dần theo id (thứ tự của endpoint cũ)
+        self.children: Dict[Any, List[Any]] = defaultdict(list)
+        self.roots = set()
+        self._stored_giathanh: Dict[Any, Any] = {}
+        self._fragments: Dict[Any, str] = {}
+        self._dirty_roots = set()
+        self._body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+
+        for row in sorted(rows, key=lambda item: item['id'], reverse=True):
+            self._add_node(row)
+            parent_id = row.get('parent_id')
+            if parent_id is not None and parent_id != row['id']:
+                self.children[parent_id].append(row['id'])
+        self.roots = {node_id for node_id in self.nodes if self._is_root(node_id)}
+        self._compute_all()
+        self._dirty_roots = set(self.roots)
+
+    def includes(self, row: Dict[str, Any]) -> bool:
+        return self.month is None or expense_month(row.get('created_at')) == self.month
+
+    def _add_node(self, row: Dict[str, Any]):
+        node = dict(row)
+        category = self.categories.get(row.get('id_lcp')) if row.get('id_lcp') else None
+        node['loaichiphi'] = dict(category) if category else None
+        node['total_amount'] = 0
+        self.nodes[row['id']] = node
+        self._stored_giathanh[row['id']] = row.get('giathanh')
+
+    def _is_root(self, node_id) -> bool:
+        parent_id = self.nodes[node_id].get('parent_id')
+        return parent_id is None or parent_id == node_id or parent_id not in self.nodes
+
+    def _child_ids(self, node_id) -> List[Any]:
+        return [child_id for child_id in self.children.get(node_id, ()) if child_id in self.nodes]
+
+    def _recompute(self, node_id):
+        """Tính giathanh/total_amount của một node từ các con (đã được tính)"""
+        node = self.nodes[node_id]
+        child_ids = self._child_ids(node_id)
+        if child_ids:
+            node_month = _row_month(node)
+            node['giathanh'] = sum(
+                self.nodes[child_id]['giathanh'] or 0
+                for child_id in child_ids
+                if _row_month(self.nodes[child_id]) == node_month
+            )
+            # expense_rollup ghi cùng giá trị này vào database cho chi phí cha
+            self._stored_giathanh[node_id] = node['giathanh']
+        else:
+            node['giathanh'] = self._stored_giathanh[node_id]
+        node['total_amount'] = (node['giathanh'] or 0) + sum(self.nodes[child_id]['total_amount'] for child_id in child_ids)
+
+    def _compute_all(self):
+        visiting, done = set(), set()
+        for start_id in self.nodes:
+            if start_id in done:
+                continue
+            stack = [(start_id, False)]
+            while stack:
+                node_id, expanded = stack.pop()
+                if expanded:
+                    self._recompute(node_id)
+                    visiting.discard(node_id)
+                    done.add(node_id)
+                    continue
+                if node_id in done or node_id in visiting:
+                    continue
+                visiting.add(node_id)
+                stack.append((node_id, True))
+                for child_id in self._child_ids(node_id):
+                    if child_id not in done and child_id not in visiting:
+                        stack.append((child_id, False))
+
+    def _path(self, node_id) -> Tuple[List[Any], Optional[Any]]:
+        """(node và các tổ tiên từ dưới lên, id gốc); gốc là None nếu parent_id tạo chu trình"""
+        path, seen = [], set()
+        while node_id in self.nodes and node_id not in seen:
+            path.append(node_id)
+            seen.add(node_id)
+            if self._is_root(node_id):
+                return path, node_id
+            node_id = self.nodes[node_id]['parent_id']
+        return path, None
+
+    def _root_of(self, node_id):
+        return self._path(node_id)[1]
+
+    def _update_path(self, node_id):
+        path, root_id = self._path(node_id)
+        for path_id in path:
+            self._recompute(path_id)
+        if root_id is not None:
+            self._dirty_roots.add(root_id)
+
+    def _detach(self, node_id):
+        node = self.nodes.pop(node_id)
+        self._stored_giathanh.pop(node_id, None)
+        parent_id = node.get('parent_id')
+        siblings = self.children.get(parent_id)
+        if siblings and node_id in siblings:
+            siblings.remove(node_id)
+        # Như expense_rollup: chi phí cha mất con cuối cùng được đặt giathanh = 0
+        if parent_id in self.nodes and not self._child_ids(parent_id) and _row_month(self.nodes[parent_id]):
+            self._stored_giathanh[parent_id] = 0
+        self.roots.discard(node_id)
+        self._fragments.pop(node_id, None)
+        # Con của node bị xóa hiển thị như cây gốc (như khi cha không thuộc tháng)
+        for child_id in self._child_ids(node_id):
+            self.roots.add(child_id)
+            self._dirty_roots.add(child_id)
+        return node
+
+    def _attach(self, row: Dict[str, Any]):
+        node_id = row['id']
+        self._add_node(row)
+        parent_id = row.get('parent_id')
+        if parent_id is not None and parent_id != node_id:
+            siblings = self.children[parent_id]
+            siblings.append(node_id)
+            siblings.sort(reverse=True)
+        if self._is_root(node_id):
+            self.roots.add(node_id)
+        for child_id in self._child_ids(node_id):
+            self.roots.discard(child_id)
+            self._fragments.pop(child_id, None)
+
+    def upsert(self, row: Dict[str, Any]):
+        """Áp dụng một dòng vừa tạo/sửa: tính lại đường tổ tiên cũ và mới"""
+        node_id = row['id']
+        old_parent_id = None
+        if node_id in self.nodes:
+            old_root = self._root_of(node_id)
+            if old_root is not None:
+                self._dirty_roots.add(old_root)
+            old_parent_id = self.nodes[node_id].get('parent_id')
+            self._detach(node_id)
+        if self.includes(row):
+            self._attach(row)
+            self._update_path(node_id)
+        if old_parent_id is not None and old_parent_id in self.nodes:
+            self._update_path(old_parent_id)
+        self._body = None
+
+    def remove(self, node_ids: Iterable[Any]):
+        """Bỏ các dòng đã xóa và tính lại đường tổ tiên của chúng"""
+        parents = []
+        for node_id in node_ids:
+            if node_id not in self.nodes:
+                continue
+            old_root = self._root_of(node_id)
+            if old_root is not None:
+                self._dirty_roots.add(old_root)
+            parents.append(self._detach(node_id).get('parent_id'))
+        for parent_id in parents:
+            if parent_id in self.nodes:
+                self._update_path(parent_id)
+        self._body = None
+
+    def set_column(self, node_id, column: str, value: Any) -> bool:
+        """Đổi một cột không ảnh hưởng tới tổng (vd. ti_le); True nếu giá trị thay đổi"""
+        node = self.nodes.get(node_id)
+        if node is None or node.get(column) == value:
+            return False
+        node[column] = value
+        root_id = self._root_of(node_id)
+        if root_id is not None:
+            self._dirty_roots.add(root_id)
+        self._body = None
+        return True
+
+    def _serialize(self, root_id) -> str:
+        """JSON của một cây gốc, duyệt bằng stack nên không giới hạn độ sâu"""
+        parts = []
+        stack = [root_id]
+        while stack:
+            item = stack.pop()
+            if item is _CLOSE:
+                parts.append(']}')
+                continue
+            if item is _COMMA:
+                parts.append(',')
+                continue
+            head = json.dumps(self.nodes[item], ensure_ascii=False, separators=(',', ':'), default=str)
+            parts.append(head[:-1] + ',"children":[')
+            stack.append(_CLOSE)
+            child_ids = self._child_ids(item)
+            for index in range(len(child_ids) - 1, -1, -1):
+                stack.append(child_ids[index])
+                if index > 0:
+                    stack.append(_COMMA)
+        return ''.join(parts)
+
+    def render(self) -> Tuple[bytes, str]:
+        """(JSON {"hierarchy": [...]}, ETag); chỉ các cây gốc bị thay đổi được tuần tự hóa lại"""
+        if self._body is None or self._dirty_roots:
+            for root_id in self._dirty_roots:
+                if root_id in self.roots:
+                    self._fragments[root_id] = self._serialize(root_id)
+                else:
+                    self._fragments.pop(root_id, None)
+            self._dirty_roots.clear()
+            hierarchy = ','.join(self._fragments[root_id] for root_id in sorted(self.roots, reverse=True))
+            self._body = f'{{"hierarchy":[{hierarchy}]}}'.encode('utf-8')
+            self._etag = make_etag(self._body)
+        return self._body, self._etag
+
+    def tree(self) -> List[Dict[str, Any]]:
+        return json.loads(self.render()[0])['hierarchy']
+
+class ExpenseHierarchyCache:
+    """Snapshot cây chi phí theo tháng với TTL, cập nhật tăng dần sau mỗi lần ghi"""
+
+    def __init__(self, ttl: float = HIERARCHY_CACHE_TTL, max_snapshots: int = HIERARCHY_CACHE_SIZE, client=None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_snapshots = max_snapshots
+        self._client = client
+        self._clock = clock
+        # tháng (None = mọi tháng) -> (snapshot, hết hạn lúc)
+        self._snapshots: "OrderedDict[Optional[str], tuple]" = OrderedDict()
+        # id loaichiphi -> thông tin hiển thị (None nếu không tồn tại)
+        self._categories: Dict[Any, Optional[Dict[str, Any]]] = {}
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._build_locks: Dict[Optional[str], threading.Lock] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'patches': 0, 'invalidations': 0}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def _load_categories(self, ids: Iterable[Any]):
+        """Đọc các loaichiphi chưa có trong cache (chỉ những loại được dùng)"""
+        with self._lock:
+            missing = sorted({value for value in ids if value and value not in self._categories})
+        if not missing:
+            return
+        loaded = {}
+        for start in range(0, len(missing), IN_CHUNK_SIZE):
+            chunk = missing[start:start + IN_CHUNK_SIZE]
+            result = self._get_client().table('loaichiphi').select(CATEGORY_COLUMNS).in_('id', chunk).execute()
+            loaded.update({item['id']: item for item in result.data})
+        with self._lock:
+            for category_id in missing:
+                category = loaded.get(category_id)
+                self._categories[category_id] = {
+                    'id': category['id'],
+                    'tenchiphi': category.get('tenchiphi', ''),
+                    'loaichiphi': category.get('loaichiphi', ''),
+                    'giathanh': category.get('giathanh'),
+                } if category else None
+
+    def _build(self, month: Optional[str]) -> HierarchySnapshot:
+        if month:
+            month_range(month)  # ValueError nếu tháng sai định dạng
+        rows = load_expenses(month, self._get_client())
+        self._load_categories(row.get('id_lcp') for row in rows)
+        return HierarchySnapshot(month, rows, self._categories)
+
+    def _fresh(self, month: Optional[str]) -> Optional[HierarchySnapshot]:
+        entry = self._snapshots.get(month)
+        if entry and entry[1] > self._clock():
+            self._snapshots.move_to_end(month)
+            return entry[0]
+        return None
+
+    def get(self, month: Optional[str] = None) -> Tuple[bytes, str]:
+        """(JSON, ETag) của cây chi phí tháng `month` (YYYY-MM) hoặc mọi tháng"""
+        month = month or None
+        with self._lock:
+            snapshot = self._fresh(month)
+            if snapshot is not None:
+                self._stats['hits'] += 1
+                return snapshot.render()
+            build_lock = self._build_locks.setdefault(month, threading.Lock())
+
+        # Chỉ một request dựng snapshot của một tháng, các request khác chờ kết quả
+        with build_lock:
+            with self._lock:
+                snapshot = self._fresh(month)
+                if snapshot is not None:
+                    self._stats['hits'] += 1
+                    return snapshot.render()
+                self._stats['misses'] += 1
+                generation = self._generation
+
+            snapshot = self._build(month)
+
+            with self._lock:
+                # Có ghi/invalidate trong lúc đang đọc thì không lưu snapshot có thể đã cũ
+                if self._generation == generation:
+                    self._snapshots[month] = (snapshot, self._clock() + self.ttl)
+                    self._snapshots.move_to_end(month)
+                    while len(self._snapshots) > self.max_snapshots:
+                        self._snapshots.popitem(last=False)
+                return snapshot.render()
+
+    def apply_upsert(self, *rows: Dict[str, Any]):
+        """Cập nhật các snapshot sau khi tạo/sửa dòng quanly_chiphi (dòng đầy đủ trả về từ database)"""
+        rows = [row for row in rows if row and row.get('id') is not None]
+        if not rows:
+            return
+        try:
+            self._load_categories(row.get('id_lcp') for row in rows)
+        except Exception as e:
+            print(f"Could not load expense categories, dropping hierarchy cache: {e}")
+            self.invalidate()
+            return
+        with self._lock:
+            self._generation += 1
+            self._stats['patches'] += 1
+            for snapshot, _ in self._snapshots.values():
+                for row in rows:
+                    snapshot.upsert(row)
+
+    def apply_delete(self, ids: Iterable[Any]):
+        """Cập nhật các snapshot sau khi xóa dòng quanly_chiphi"""
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            self._generation += 1
+            self._stats['patches'] += 1
+            for snapshot, _ in self._snapshots.values():
+                snapshot.remove(ids)
+
+    def refresh_ratios(self, *months: Optional[str]):
+        """Đọc lại cột ti_le (do update_expense_ratios.py ghi) của các tháng và vá vào snapshot"""
+        for month in {month for month in months if month}:
+            try:
+                start_date, end_date = month_range(month)
+                client = self._get_client()
+                ratios = fetch_all(lambda: client.table('quanly_chiphi').select('id, ti_le')
+                                   .gte('created_at', start_date).lt('created_at', end_date).order('id'))
+            except Exception as e:
+                print(f"Could not refresh expense ratios for {month}, dropping cached hierarchy: {e}")
+                self.invalidate(month)
+                continue
+            with self._lock:
+                self._generation += 1
+                for key in (month, None):
+                    entry = self._snapshots.get(key)
+                    if entry:
+                        for row in ratios:
+                            entry[0].set_column(row['id'], 'ti_le', row.get('ti_le'))
+
+    def invalidate(self, *months: Optional[str]):
+        """Xóa snapshot của các tháng (kèm snapshot mọi tháng); không truyền gì = xóa tất cả và danh mục"""
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+            if not months:
+                self._snapshots.clear()
+                self._categories.clear()
+                return
+            for month in set(months) | {None}:
+                self._snapshots.pop(month, None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            return {
+                **self._stats,
+                'categories': len(self._categories),
+                'snapshots': {
+                    month or 'all': {
+                        'nodes': len(snapshot.nodes),
+                        'roots': len(snapshot.roots),
+                        'ttl_remaining': max(0, round(expires_at - now, 1)),
+                    }
+                    for month, (snapshot, expires_at) in self._snapshots.items()
+                },
+            }
+
+def hierarchy_response(month: Optional[str], if_none_match: Optional[str] = None, cache: Optional[ExpenseHierarchyCache] = None):
+    """Response JSON của cây chi phí; 304 nếu client đã có bản có cùng ETag"""
+    from fastapi import Response
+
+    body, etag = (cache or expense_hierarchy_cache).get(month)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+# Instance dùng chung cho toàn bộ tiến trình API
+expense_hierarchy_cache = ExpenseHierarchyCache()
@@ -0,0 +1,179 @@
+"""
+Tính lại giathanh của các chi phí cha trong quanly_chiphi theo tập dữ liệu.
+
+QUY TẮC: giathanh của chi phí cha = tổng giathanh các chi phí con trực tiếp
+TRONG CÙNG THÁNG với chi phí cha. Vì vậy chỉ cần dữ liệu của một tháng để tính
+mọi chi phí cha của tháng đó: đọc một lần, tính từ lá lên gốc trong bộ nhớ
+(không đệ quy) rồi chỉ ghi cột giathanh của các dòng thay đổi bằng hàm
+set_expense_giathanh (xem create_expense_rollup_function.sql). Không ghi lại cả dòng
+để không ghi đè thay đổi đồng thời ở các cột khác (mo_ta, parent_id, ti_le...).
+
+Được dùng chung bởi routers/accounting.py, routers/quote.py và update_expense_totals.py.
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from supabase_query import fetch_all, get_client
+
+# Số dòng tối đa trong một lệnh ghi
+WRITE_CHUNK_SIZE = 500
+# Cột cần để tính giathanh chi phí cha
+ROLLUP_COLUMNS = 'id, parent_id, giathanh, created_at'
+
+def expense_month(created_at: Any) -> Optional[str]:
+    """Lấy tháng YYYY-MM từ created_at (chuỗi hoặc datetime)"""
+    if not created_at:
+        return None
+    if isinstance(created_at, str):
+        return created_at[:7]
+    return created_at.strftime('%Y-%m')
+
+def month_range(month: str):
+    """Trả về (ngày đầu tháng, ngày đầu tháng sau) cho tháng YYYY-MM"""
+    start_date = f"{month}-01"
+    year, month_num = map(int, month.split('-'))
+    if month_num == 12:
+        end_date = f"{year + 1}-01-01"
+    else:
+        end_date = f"{year}-{month_num + 1:02d}-01"
+    return start_date, end_date
+
+def compute_parent_totals(rows: Iterable[Dict[str, Any]], parent_ids: Iterable[Any] = ()) -> Dict[Any, float]:
+    """
+    Tính giathanh mới cho mọi chi phí cha có trong `rows`.
+
+    `parent_ids` là các chi phí cha vừa mất con (xóa hoặc đổi cha): chúng luôn được
+    tính lại, bằng 0 nếu không còn con trực tiếp cùng tháng.
+
+    Duyệt hậu thứ tự bằng stack nên không bị giới hạn độ sâu đệ quy; chu trình
+    parent_id (dữ liệu lỗi) được bỏ qua thay vì lặp vô hạn.
+
+    Returns:
+        dict id -> tổng giathanh các con trực tiếp cùng tháng
+    """
+    by_id = {row['id']: row for row in rows}
+    children = defaultdict(list)
+    for row in by_id.values():
+        parent_id = row.get('parent_id')
+        if parent_id is not None and parent_id != row['id'] and parent_id in by_id:
+            children[parent_id].append(row['id'])
+    forced = {parent_id for parent_id in parent_ids if parent_id in by_id}
+
+    totals: Dict[Any, float] = {}
+    visiting, done = set(), set()
+
+    for root_id in by_id:
+        if root_id in done:
+            continue
+        stack = [(root_id, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if expanded:
+                visiting.discard(node_id)
+                done.add(node_id)
+                node_month = expense_month(by_id[node_id].get('created_at'))
+                if (children.get(node_id) or node_id in forced) and node_month:
+                    totals[node_id] = sum(
+                        totals.get(child_id, by_id[child_id].get('giathanh') or 0)
+                        for child_id in children[node_id]
+                        if expense_month(by_id[child_id].get('created_at')) == node_month
+                    )
+                continue
+            if node_id in done or node_id in visiting:
+                continue
+            visiting.add(node_id)
+            stack.append((node_id, True))
+            for child_id in children.get(node_id, []):
+                if child_id not in done and child_id not in visiting:
+                    stack.append((child_id, False))
+
+    return totals
+
+def changed_parent_rows(rows: List[Dict[str, Any]], totals: Optional[Dict[Any, float]] = None) -> List[Dict[str, Any]]:
+    """{id, giathanh mới} của các chi phí cha có giathanh khác với tổng tính được"""
+    if totals is None:
+        totals = compute_parent_totals(rows)
+    changed = []
+    for row in rows:
+        if row['id'] in totals and totals[row['id']] != (row.get('giathanh') or 0):
+            changed.append({'id': row['id'], 'giathanh': totals[row['id']]})
+    return changed
+
+def load_expenses(month: Optional[str] = None, client=None, columns: str = '*') -> List[Dict[str, Any]]:
+    """Đọc toàn bộ quanly_chiphi (hoặc của một tháng), phân trang theo id"""
+    client = get_client(client)
+
+    def query():
+        query = client.table('quanly_chiphi').select(columns)
+        if month:
+            start_date, end_date = month_range(month)
+            query = query.gte('created_at', start_date).lt('created_at', end_date)
+        return query.order('id')
+
+    return fetch_all(query)
+
+def write_changed_rows(changed: List[Dict[str, Any]], client=None):
+    """Chỉ ghi cột giathanh của các dòng {id, giathanh}; các cột khác giữ nguyên giá trị hiện có trong database"""
+    client = get_client(client)
+    try:
+        for start in range(0, len(changed), WRITE_CHUNK_SIZE):
+            client.rpc('set_expense_giathanh', {'p_updates': changed[start:start + WRITE_CHUNK_SIZE]}).execute()
+        return
+    except Exception as e:
+        print(f"set_expense_giathanh unavailable, updating giathanh grouped by value: {e}")
+
+    # Một lệnh update cho mỗi giá trị giathanh khác nhau (ghi lại cùng giá trị là vô hại)
+    ids_by_value = defaultdict(list)
+    for row in changed:
+        ids_by_value[row['giathanh']].append(row['id'])
+    for value, ids in ids_by_value.items():
+        for start in range(0, len(ids), WRITE_CHUNK_SIZE):
+            client.table('quanly_chiphi').update({'giathanh': value}).in_('id', ids[start:start + WRITE_CHUNK_SIZE]).execute()
+
+def rollup_expenses(month: Optional[str] = None, client=None, dry_run: bool = False, parent_ids: Iterable[Any] = ()) -> Dict[str, Any]:
+    """
+    Tính lại tất cả chi phí cha của một tháng (hoặc toàn bộ dữ liệu nếu month=None).
+    Các id trong `parent_ids` luôn được ghi lại kể cả khi không còn con (giathanh = 0).
+
+    Returns:
+        {"month", "expense_count", "parent_count", "updated_count", "changes": [{id, old, new}]}
+    """
+    rows = load_expenses(month, client, ROLLUP_COLUMNS)
+    totals = compute_parent_totals(rows, parent_ids)
+    changed = changed_parent_rows(rows, totals)
+    old_values = {row['id']: row.get('giathanh') for row in rows}
+
+    if changed and not dry_run:
+        write_changed_rows(changed, client)
+
+    return {
+        "month": month or "all",
+        "expense_count": len(rows),
+        "parent_count": len(totals),
+        "updated_count": len(changed),
+        "changes": [{"id": row['id'], "old": old_values[row['id']], "new": row['giathanh']} for row in changed],
+    }
+
+def rollup_parent_month(parent_id: int, client=None) -> Optional[Dict[str, Any]]:
+    """Tính lại các chi phí cha trong tháng của chi phí `parent_id` (thay cho update_parent_giathanh đệ quy)"""
+    client = get_client(client)
+    parent_result = client.table('quanly_chiphi').select('created_at').eq('id', parent_id).execute()
+    if not parent_result.data:
+        print(f"Parent expense {parent_id} not found")
+        return None
+
+    parent_month = expense_month(parent_result.data[0].get('created_at'))
+    if not parent_month:
+        print(f"Parent expense {parent_id} has no creation date")
+        return None
+
+    result = rollup_expenses(parent_month, client, parent_ids=[parent_id])
+    print(f"Rolled up parent expenses for month {parent_month}: {result['updated_count']} updated")
+    return result
+
+def update_parent_giathanh(parent_id: int):
+    """Cập nhật giathanh cho chi phí cha `parent_id` và các cấp trên (lỗi chỉ được log, không raise)"""
+    try:
+        rollup_parent_month(parent_id)
+    except Exception as e:
+        print(f"Error updating parent giathanh: {e}")
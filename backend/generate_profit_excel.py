@@ -7,156 +7,198 @@ Script de xuat bao cao loi nhuan ra file Excel voi 4 sheet:
 4. Sheet 4: Chi phi nhan su - chi tiet luong tung nhan vien
 
 Tat ca duoc xuat theo thoi gian da chon
+
+Module duoc API import truc tiep (write_profit_excel) va van chay duoc nhu script:
+    python generate_profit_excel.py --month 2025-09
 """
 
 import os
 import sys
 import argparse
+import tempfile
 from datetime import datetime
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
 # Them thu muc backend vao path de import cac module
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-
-# Import config
-try:
-    from supabase_client import supabase, SUPABASE_AVAILABLE
-    if not SUPABASE_AVAILABLE:
-        raise ImportError("Supabase not available")
-except ImportError:
-    # Fallback neu khong co supabase_client
-    from dotenv import load_dotenv
-    from supabase import create_client, Client
-
-    load_dotenv()
-    SUPABASE_URL = os.getenv('SUPABASE_URL')
-    SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_KEY') or os.getenv('SUPABASE_ANON_KEY')
-
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("Supabase credentials not found")
-
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-def get_profit_data(month=None):
-    """Lay du lieu loi nhuan tu database"""
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from catalog_cache import catalog_cache
+from expense_rollup import month_range
+from supabase_query import get_client, iter_pages
+
+EXCEL_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# File Excel nho hon nguong nay duoc giu trong bo nho, lon hon thi ghi ra file tam
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _iter_pages(query_factory):
+    """Doc tung trang theo id (query_factory tra ve query moi cho moi trang)"""
+    return iter_pages(lambda: query_factory().order('id'))
+
+def _fetch_all(query_factory):
+    """Doc tat ca dong theo trang"""
+    return [row for page in _iter_pages(query_factory) for row in page]
+
+def _fetch_in(client, table, column, values, columns='*'):
+    """Doc cac dong co `column` thuoc `values`, chia nho danh sach de URL khong qua dai"""
+    values = list(dict.fromkeys(value for value in values if value))
+    rows = []
+    for start in range(0, len(values), 200):
+        chunk = values[start:start + 200]
+        rows.extend(_fetch_all(lambda: client.table(table).select(columns).in_(column, chunk)))
+    return rows
+
+def _lookup_maps():
+    """Ten cac loai tu cache danh muc dung chung voi API"""
     try:
-        # Lay du lieu doanh thu
-        revenue_query = supabase.table('invoices_reality').select('*')
-        if month:
-            start_date = f"{month}-01"
-            year, month_num = map(int, month.split('-'))
-            if month_num == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month_num + 1:02d}-01"
-            revenue_query = revenue_query.gte('invoice_date', start_date).lt('invoice_date', end_date)
-
-        revenue_result = revenue_query.execute()
-        revenue_data = revenue_result.data
-
-        # Lay du lieu chi phi
-        expense_query = supabase.table('quanly_chiphi').select('*')
-        if month:
-            expense_query = expense_query.gte('created_at', start_date).lt('created_at', end_date)
-
-        expense_result = expense_query.execute()
-        expense_data = expense_result.data
-
-        # Lay thong tin loai chi phi
-        expense_category_ids = list(set(item.get('id_lcp') for item in expense_data if item.get('id_lcp')))
-        expense_categories = {}
-        if expense_category_ids:
+        sanpham_map = {}
+        for item in catalog_cache.get_rows('sanpham'):
+            key = f"{item['id_nhom']}_{item['id_kinh']}_{item['id_taynam']}_{item['id_bophan']}"
+            sanpham_map[key] = item['tensp']
+        return {
+            'loainhom_map': catalog_cache.get_name_map('loainhom'),
+            'loaikinh_map': catalog_cache.get_name_map('loaikinh'),
+            'loaitaynam_map': catalog_cache.get_name_map('loaitaynam'),
+            'bophan_map': catalog_cache.get_name_map('bophan'),
+            'sanpham_map': sanpham_map,
+        }
+    except Exception as e:
+        print(f"Error getting lookup data: {e}")
+        return {'loainhom_map': {}, 'loaikinh_map': {}, 'loaitaynam_map': {}, 'bophan_map': {}, 'sanpham_map': {}}
+
+def get_profit_data(month=None, client=None):
+    """
+    Nguon du lieu loi nhuan doc theo trang.
+
+    Hoa don, chi phi va phieu luong khong duoc nap het vao bo nho: cac khoa
+    revenue_pages / expense_pages / payroll_pages la ham tra ve generator, moi lan
+    mot trang (mot request PostgREST) kem du lieu tra cuu cua rieng trang do. Sheet
+    ghi xong trang nao thi trang do duoc giai phong.
+    """
+    client = get_client(client)
+    start_date, end_date = month_range(month) if month else (None, None)
+
+    def revenue_pages():
+        def revenue_query():
+            query = client.table('invoices_reality').select('*')
+            if month:
+                query = query.gte('invoice_date', start_date).lt('invoice_date', end_date)
+            return query
+        for invoices in _iter_pages(revenue_query):
+            # Chi tiet san pham cua cac hoa don trong trang
+            items = []
             try:
-                categories_result = supabase.table('loaichiphi').select('*').in_('id', expense_category_ids).execute()
-                expense_categories = {item['id']: item for item in categories_result.data}
+                items = _fetch_in(client, 'invoice_items_reality', 'invoice_id', (inv['id'] for inv in invoices))
             except Exception as e:
-                print(f"Error getting expense categories: {e}")
-
-        # Lay chi tiet san pham cho hoa don
-        invoice_ids = [inv['id'] for inv in revenue_data]
-        invoice_items = []
-        if invoice_ids:
+                print(f"Error getting invoice items: {e}")
+            yield invoices, items
+
+    # Loai chi phi it dong nen giu lai giua cac trang
+    expense_categories = {}
+
+    def expense_pages():
+        def expense_query():
+            query = client.table('quanly_chiphi').select('*')
+            if month:
+                query = query.gte('created_at', start_date).lt('created_at', end_date)
+            return query
+        for expenses in _iter_pages(expense_query):
+            missing = [item.get('id_lcp') for item in expenses if item.get('id_lcp') not in expense_categories]
             try:
-                items_result = supabase.table('invoice_items_reality').select('*').in_('invoice_id', invoice_ids).execute()
-                invoice_items = items_result.data
+                expense_categories.update({item['id']: item for item in _fetch_in(client, 'loaichiphi', 'id', missing)})
             except Exception as e:
-                print(f"Error getting invoice items: {e}")
-
-        # Lay thong tin lookup cho cac loai
-        try:
-            loainhom_result = supabase.table('loainhom').select('*').execute()
-            loainhom_map = {str(item['id']): item['tenloai'] for item in loainhom_result.data}
-
-            loaikinh_result = supabase.table('loaikinh').select('*').execute()
-            loaikinh_map = {str(item['id']): item['tenloai'] for item in loaikinh_result.data}
-
-            loaitaynam_result = supabase.table('loaitaynam').select('*').execute()
-            loaitaynam_map = {str(item['id']): item['tenloai'] for item in loaitaynam_result.data}
-
-            bophan_result = supabase.table('bophan').select('*').execute()
-            bophan_map = {str(item['id']): item['tenloai'] for item in bophan_result.data}
-
-            sanpham_result = supabase.table('sanpham').select('*').execute()
-            sanpham_map = {}
-            for item in sanpham_result.data:
-                key = f"{item['id_nhom']}_{item['id_kinh']}_{item['id_taynam']}_{item['id_bophan']}"
-                sanpham_map[key] = item['tensp']
-
-        except Exception as e:
-            print(f"Error getting lookup data: {e}")
-            loainhom_map = {}
-            loaikinh_map = {}
-            loaitaynam_map = {}
-            bophan_map = {}
-            sanpham_map = {}
-
-        # Lay du lieu chi phi nhan su (phieu luong)
-        payroll_query = supabase.table('phieu_luong').select('*')
-        if month:
-            payroll_query = payroll_query.eq('ky_tinh_luong', month)
-
-        payroll_result = payroll_query.execute()
-        payroll_data = payroll_result.data
-
-        # Lay thong tin nhan vien cho phieu luong
-        employee_ids = list(set(item.get('ma_nv') for item in payroll_data if item.get('ma_nv')))
-        employees = {}
-        if employee_ids:
+                print(f"Error getting expense categories: {e}")
+            yield expenses, expense_categories
+
+    def payroll_pages():
+        def payroll_query():
+            query = client.table('phieu_luong').select('*')
+            if month:
+                query = query.eq('ky_tinh_luong', month)
+            return query
+        for payroll in _iter_pages(payroll_query):
+            employees = {}
             try:
-                employees_result = supabase.table('employees').select('*').in_('ma_nv', employee_ids).execute()
-                employees = {emp['ma_nv']: emp for emp in employees_result.data}
+                employee_rows = _fetch_in(client, 'employees', 'ma_nv', (item.get('ma_nv') for item in payroll))
+                employees = {emp['ma_nv']: emp for emp in employee_rows}
             except Exception as e:
                 print(f"Error getting employee data: {e}")
+            yield payroll, employees
+
+    return {
+        'month': month,
+        'revenue_pages': revenue_pages,
+        'expense_pages': expense_pages,
+        'payroll_pages': payroll_pages,
+        **_lookup_maps(),
+    }
+
+def _pages(data, key, rows_key, lookup_key, default_lookup):
+    """Trang du lieu cua sheet: generator tu get_profit_data hoac mot trang tu danh sach co san"""
+    if key in data:
+        return data[key]()
+    return iter([(data.get(rows_key, []), data.get(lookup_key, default_lookup))])
+
+def group_rows(rows, key):
+    """Chi muc key -> danh sach dong, giu nguyen thu tu"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.get(key), []).append(row)
+    return groups
+
+# Dinh dang dung chung
+ALIGN_LEFT = Alignment(horizontal='left')
+ALIGN_RIGHT = Alignment(horizontal='right')
+ALIGN_CENTER = Alignment(horizontal='center')
+FONT_BOLD = Font(bold=True)
+FONT_TITLE = Font(bold=True, size=16)
+FONT_SUBTITLE = Font(bold=True, size=12)
+
+def _cell(sheet, value=None, font=None, fill=None, alignment=None, border=None, number_format=None):
+    """Tao o co dinh dang cho workbook write-only"""
+    cell = WriteOnlyCell(sheet, value=value)
+    if font:
+        cell.font = font
+    if fill:
+        cell.fill = fill
+    if alignment:
+        cell.alignment = alignment
+    if border:
+        cell.border = border
+    if number_format:
+        cell.number_format = number_format
+    return cell
 
-        return {
-            'revenue': revenue_data,
-            'expenses': expense_data,
-            'payroll': payroll_data,
-            'employees': employees,
-            'expense_categories': expense_categories,
-            'invoice_items': invoice_items,
-            'month': month,
-            'loainhom_map': loainhom_map,
-            'loaikinh_map': loaikinh_map,
-            'loaitaynam_map': loaitaynam_map,
-            'bophan_map': bophan_map,
-            'sanpham_map': sanpham_map
-        }
+def _set_column_widths(sheet, widths):
+    # O che do write-only, do rong cot phai duoc dat truoc khi ghi dong dau tien
+    for col, width in enumerate(widths, 1):
+        sheet.column_dimensions[get_column_letter(col)].width = width
 
-    except Exception as e:
-        print(f"Error getting data: {e}")
-        return None
+def _append_title(sheet, title, data):
+    sheet.append([_cell(sheet, title, font=FONT_TITLE)])
+    sheet.append([_cell(sheet, f"Thang: {data['month'] or 'Tat ca'}", font=FONT_SUBTITLE)])
+    sheet.append([])
 
-def create_excel_file(data, output_path):
-    """Tao file Excel voi 3 sheet"""
+def _append_header(sheet, headers, header_font, header_fill, border):
+    sheet.append([
+        _cell(sheet, header, font=header_font, fill=header_fill, alignment=ALIGN_CENTER, border=border)
+        for header in headers
+    ])
 
-    # Tao workbook
-    wb = Workbook()
+def build_profit_workbook(data):
+    """
+    Tao workbook write-only voi 4 sheet (khong giu doi tuong o trong bo nho).
+
+    Returns:
+        (workbook, tong hop so lieu); sheet tong hop duoc ghi sau cung tu cac tong
+        cong don trong luc ghi 3 sheet chi tiet
+    """
 
-    # Xoa sheet mac dinh
-    wb.remove(wb.active)
+    # Tao workbook
+    wb = Workbook(write_only=True)
 
     # Tao 4 sheet
     sheet1 = wb.create_sheet("Tong loi nhuan")
@@ -174,48 +216,81 @@ def create_excel_file(data, output_path):
         bottom=Side(style='thin')
     )
 
-    # ===== SHEET 1: TONG LOI NHUAN =====
-    create_profit_summary_sheet(sheet1, data, header_font, header_fill, border)
-
     # ===== SHEET 2: DOANH THU CHI TIET =====
-    create_revenue_detail_sheet(sheet2, data, header_font, header_fill, border)
+    totals = create_revenue_detail_sheet(sheet2, data, header_font, header_fill, border)
 
     # ===== SHEET 3: CHI PHI CHI TIET =====
-    create_expense_detail_sheet(sheet3, data, header_font, header_fill, border)
+    totals.update(create_expense_detail_sheet(sheet3, data, header_font, header_fill, border))
 
     # ===== SHEET 4: CHI PHI NHAN SU =====
-    create_payroll_detail_sheet(sheet4, data, header_font, header_fill, border)
+    totals.update(create_payroll_detail_sheet(sheet4, data, header_font, header_fill, border))
+
+    # ===== SHEET 1: TONG LOI NHUAN =====
+    # Moi sheet write-only ghi ra file rieng nen sheet dau co the ghi sau cung
+    create_profit_summary_sheet(sheet1, data, totals, header_font, header_fill, border)
 
-    # Luu file
+    return wb, totals
+
+def create_excel_file(data, output_path):
+    """Tao file Excel voi 4 sheet, tra ve tong hop so lieu"""
+    wb, totals = build_profit_workbook(data)
     wb.save(output_path)
-    return output_path
+    return totals
+
+def profit_excel_filename(month=None):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    month_str = month.replace('-', '') if month else 'all'
+    return f"bao_cao_loi_nhuan_{month_str}_{timestamp}.xlsx"
+
+def write_profit_excel(month=None, client=None):
+    """
+    Tao bao cao Excel trong tien trinh hien tai.
+
+    Returns:
+        (file object da tua ve dau, ten file); file nho nam trong bo nho, file lon
+        duoc ghi ra file tam va tu xoa khi dong
+    """
+    data = get_profit_data(month, client)
 
-def create_profit_summary_sheet(sheet, data, header_font, header_fill, border):
-    """Tao sheet tong loi nhuan"""
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        build_profit_workbook(data)[0].save(output)
+        output.seek(0)
+    except Exception:
+        output.close()
+        raise
+    return output, profit_excel_filename(month)
+
+def iter_file_chunks(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """Doc file theo tung khoi cho StreamingResponse va dong file khi doc xong"""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+def create_profit_summary_sheet(sheet, data, totals, header_font, header_fill, border):
+    """Tao sheet tong loi nhuan tu cac tong da cong don o 3 sheet chi tiet"""
+
+    # Dieu chinh do rong cot
+    _set_column_widths(sheet, [20, 20, 20])
 
     # Tieu de
-    sheet['A1'] = "BAO CAO TONG LOI NHUAN"
-    sheet['A1'].font = Font(bold=True, size=16)
-    sheet['A2'] = f"Thang: {data['month'] or 'Tat ca'}"
-    sheet['A2'].font = Font(bold=True, size=12)
+    _append_title(sheet, "BAO CAO TONG LOI NHUAN", data)
 
     # Tinh tong
-    total_revenue = sum(inv.get('total_amount', 0) for inv in data['revenue'])
-    total_expenses = sum(exp.get('giathanh', 0) for exp in data['expenses'])
-    total_payroll = sum(p.get('luong_thuc_nhan', 0) for p in data['payroll'])
+    total_revenue = totals['total_revenue']
+    total_expenses = totals['total_expenses']
+    total_payroll = totals['total_payroll']
     total_all_expenses = total_expenses + total_payroll
     total_profit = total_revenue - total_all_expenses
     profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
 
     # Header
-    headers = ['Chi tieu', 'So tien (VND)', 'Ty le (%)']
-    for col, header in enumerate(headers, 1):
-        cell = sheet.cell(row=4, column=col)
-        cell.value = header
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = border
+    _append_header(sheet, ['Chi tieu', 'So tien (VND)', 'Ty le (%)'], header_font, header_fill, border)
 
     # Du lieu
     summary_data = [
@@ -226,311 +301,256 @@ def create_profit_summary_sheet(sheet, data, header_font, header_fill, border):
         ['Hoat dong kinh doanh', total_profit, f"{profit_margin:.2f}"],
     ]
 
-    for row_idx, row_data in enumerate(summary_data, 5):
+    for row_data in summary_data:
+        row = []
         for col_idx, value in enumerate(row_data, 1):
-            cell = sheet.cell(row=row_idx, column=col_idx)
             if col_idx == 1:
-                cell.value = value
-                cell.alignment = Alignment(horizontal='left')
+                row.append(_cell(sheet, value, alignment=ALIGN_LEFT, border=border))
             else:
-                cell.value = value
-                cell.alignment = Alignment(horizontal='right')
-                if isinstance(value, (int, float)):
-                    cell.number_format = '#,##0'
-            cell.border = border
+                row.append(_cell(sheet, value, alignment=ALIGN_RIGHT, border=border,
+                                 number_format='#,##0' if isinstance(value, (int, float)) else None))
+        sheet.append(row)
 
     # Them thong tin thong ke
-    sheet['A10'] = "THONG KE CHI TIET"
-    sheet['A10'].font = Font(bold=True, size=12)
+    sheet.append([_cell(sheet, "THONG KE CHI TIET", font=FONT_SUBTITLE)])
 
     stats_data = [
-        ['So luong hoa don', len(data['revenue'])],
-        ['So luong chi phi van hanh', len(data['expenses'])],
-        ['So luong nhan vien co luong', len(data['payroll'])],
-        ['Trung binh luong/nhan vien', total_payroll / len(data['payroll']) if data['payroll'] else 0],
+        ['So luong hoa don', totals['invoice_count']],
+        ['So luong chi phi van hanh', totals['expense_count']],
+        ['So luong nhan vien co luong', totals['payroll_count']],
+        ['Trung binh luong/nhan vien', total_payroll / totals['payroll_count'] if totals['payroll_count'] else 0],
         ['Trang thai', 'HOAT DONG KINH DOANH TOT' if total_profit >= 0 else 'HOAT DONG KINH DOANH XAU'],
     ]
 
-    for row_idx, (label, value) in enumerate(stats_data, 11):
-        sheet.cell(row=row_idx, column=1).value = label
-        sheet.cell(row=row_idx, column=1).font = Font(bold=True)
-        sheet.cell(row=row_idx, column=1).border = border
-
-        cell = sheet.cell(row=row_idx, column=2)
-        cell.value = value
-        cell.border = border
-        if isinstance(value, (int, float)) and label != 'Trang thai':
-            cell.number_format = '#,##0'
-
-    # Dieu chinh do rong cot
-    for col in range(1, 4):
-        sheet.column_dimensions[get_column_letter(col)].width = 20
+    for label, value in stats_data:
+        sheet.append([
+            _cell(sheet, label, font=FONT_BOLD, border=border),
+            _cell(sheet, value, border=border,
+                  number_format='#,##0' if isinstance(value, (int, float)) and label != 'Trang thai' else None),
+        ])
 
 def create_revenue_detail_sheet(sheet, data, header_font, header_fill, border):
     """Tao sheet doanh thu chi tiet"""
 
+    # Dieu chinh do rong cot
+    _set_column_widths(sheet, [8, 15, 25, 30, 20, 20, 20, 15, 20, 12, 15, 15])
+
     # Tieu de
-    sheet['A1'] = "CHI TIET DOANH THU"
-    sheet['A1'].font = Font(bold=True, size=16)
-    sheet['A2'] = f"Thang: {data['month'] or 'Tat ca'}"
-    sheet['A2'].font = Font(bold=True, size=12)
+    _append_title(sheet, "CHI TIET DOANH THU", data)
 
     # Header
     headers = ['STT', 'Ngay hoa don', 'Khach hang', 'Ten san pham', 'Loai nhom', 'Loai kinh',
                'Loai tay nam', 'Bo phan', 'Kich thuoc', 'So luong', 'Don gia', 'Thanh tien']
-    for col, header in enumerate(headers, 1):
-        cell = sheet.cell(row=4, column=col)
-        cell.value = header
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = border
+    _append_header(sheet, headers, header_font, header_fill, border)
 
     # Du lieu
-    row_idx = 5
     stt = 1
+    total_revenue = 0
+    invoice_count = 0
 
-    for invoice in data['revenue']:
-        invoice_date = invoice.get('invoice_date', '')
-        if invoice_date:
-            try:
-                invoice_date = datetime.fromisoformat(invoice_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-            except:
-                invoice_date = invoice_date.split('T')[0] if 'T' in invoice_date else invoice_date
-
-        customer_name = invoice.get('customer_name', '')
-
-        # Lay items cua invoice nay
-        invoice_items = [item for item in data.get('invoice_items', []) if item.get('invoice_id') == invoice.get('id')]
-
-        if not invoice_items:
-            # Neu khong co items, tao dong trong
-            for col in range(1, len(headers) + 1):
-                cell = sheet.cell(row=row_idx, column=col)
-                cell.border = border
-            row_idx += 1
-            stt += 1
-            continue
-
-        for item_idx, item in enumerate(invoice_items):
-            # Lay ten tu lookup maps
-            ten_nhom = data['loainhom_map'].get(str(item.get('id_nhom', '')), item.get('id_nhom', ''))
-            ten_kinh = data['loaikinh_map'].get(str(item.get('id_kinh', '')), item.get('id_kinh', ''))
-            ten_taynam = data['loaitaynam_map'].get(str(item.get('id_taynam', '')), item.get('id_taynam', ''))
-            ten_bophan = data['bophan_map'].get(str(item.get('id_bophan', '')), item.get('id_bophan', ''))
-
-            # Lay ten san pham
-            sanpham_key = f"{item.get('id_nhom', '')}_{item.get('id_kinh', '')}_{item.get('id_taynam', '')}_{item.get('id_bophan', '')}"
-            tensp = data['sanpham_map'].get(sanpham_key, item.get('sanpham_id', ''))
+    for invoices, items in _pages(data, 'revenue_pages', 'revenue', 'invoice_items', []):
+        # Gom items theo hoa don mot lan moi trang (tranh quet lai toan bo items cho moi hoa don)
+        items_by_invoice = group_rows(items, 'invoice_id')
+        for invoice in invoices:
+            total_revenue += invoice.get('total_amount') or 0
+            invoice_count += 1
+            stt = _append_invoice_rows(sheet, data, invoice, items_by_invoice.get(invoice.get('id'), []), stt, headers, border)
 
-            row_data = [
-                stt if item_idx == 0 else '',
-                invoice_date if item_idx == 0 else '',
-                customer_name if item_idx == 0 else '',
-                tensp,
-                ten_nhom,
-                ten_kinh,
-                ten_taynam,
-                ten_bophan,
-                f"{item.get('ngang', 0)} x {item.get('cao', 0)} x {item.get('sau', 0)}",
-                item.get('so_luong', 0),
-                item.get('don_gia', 0),
-                item.get('thanh_tien', 0)
-            ]
+    # Tong ket
+    sheet.append([])
+    sheet.append([None] * 10 + [
+        _cell(sheet, "TONG DOANH THU:", font=FONT_BOLD),
+        _cell(sheet, total_revenue, font=FONT_BOLD, number_format='#,##0'),
+    ])
+    return {'total_revenue': total_revenue, 'invoice_count': invoice_count}
+
+def _append_invoice_rows(sheet, data, invoice, invoice_items, stt, headers, border):
+    """Ghi cac dong cua mot hoa don, tra ve STT tiep theo"""
+    invoice_date = invoice.get('invoice_date', '')
+    if invoice_date:
+        try:
+            invoice_date = datetime.fromisoformat(invoice_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+        except:
+            invoice_date = invoice_date.split('T')[0] if 'T' in invoice_date else invoice_date
 
-            for col_idx, value in enumerate(row_data, 1):
-                cell = sheet.cell(row=row_idx, column=col_idx)
-                cell.value = value
-                cell.border = border
+    customer_name = invoice.get('customer_name', '')
 
-                if col_idx in [10, 11, 12]:  # So luong, don gia, thanh tien
-                    cell.alignment = Alignment(horizontal='right')
-                    if isinstance(value, (int, float)):
-                        cell.number_format = '#,##0'
+    if not invoice_items:
+        # Neu khong co items, tao dong trong
+        sheet.append([_cell(sheet, border=border) for _ in headers])
+        return stt + 1
 
-            row_idx += 1
+    for item_idx, item in enumerate(invoice_items):
+        # Lay ten tu lookup maps
+        ten_nhom = data['loainhom_map'].get(str(item.get('id_nhom', '')), item.get('id_nhom', ''))
+        ten_kinh = data['loaikinh_map'].get(str(item.get('id_kinh', '')), item.get('id_kinh', ''))
+        ten_taynam = data['loaitaynam_map'].get(str(item.get('id_taynam', '')), item.get('id_taynam', ''))
+        ten_bophan = data['bophan_map'].get(str(item.get('id_bophan', '')), item.get('id_bophan', ''))
 
-        stt += 1
+        # Lay ten san pham
+        sanpham_key = f"{item.get('id_nhom', '')}_{item.get('id_kinh', '')}_{item.get('id_taynam', '')}_{item.get('id_bophan', '')}"
+        tensp = data['sanpham_map'].get(sanpham_key, item.get('sanpham_id', ''))
 
-    # Tong ket
-    total_row = row_idx + 1
-    sheet.cell(row=total_row, column=11).value = "TONG DOANH THU:"
-    sheet.cell(row=total_row, column=11).font = Font(bold=True)
-    sheet.cell(row=total_row, column=12).value = sum(inv.get('total_amount', 0) for inv in data['revenue'])
-    sheet.cell(row=total_row, column=12).font = Font(bold=True)
-    sheet.cell(row=total_row, column=12).number_format = '#,##0'
+        row_data = [
+            stt if item_idx == 0 else '',
+            invoice_date if item_idx == 0 else '',
+            customer_name if item_idx == 0 else '',
+            tensp,
+            ten_nhom,
+            ten_kinh,
+            ten_taynam,
+            ten_bophan,
+            f"{item.get('ngang', 0)} x {item.get('cao', 0)} x {item.get('sau', 0)}",
+            item.get('so_luong', 0),
+            item.get('don_gia', 0),
+            item.get('thanh_tien', 0)
+        ]
 
-    # Dieu chinh do rong cot
-    column_widths = [8, 15, 25, 30, 20, 20, 20, 15, 20, 12, 15, 15]
-    for col, width in enumerate(column_widths, 1):
-        sheet.column_dimensions[get_column_letter(col)].width = width
+        row = []
+        for col_idx, value in enumerate(row_data, 1):
+            if col_idx in [10, 11, 12]:  # So luong, don gia, thanh tien
+                row.append(_cell(sheet, value, border=border, alignment=ALIGN_RIGHT,
+                                 number_format='#,##0' if isinstance(value, (int, float)) else None))
+            else:
+                row.append(_cell(sheet, value, border=border))
+        sheet.append(row)
+
+    return stt + 1
 
 def create_expense_detail_sheet(sheet, data, header_font, header_fill, border):
     """Tao sheet chi phi chi tiet"""
 
+    # Dieu chinh do rong cot
+    _set_column_widths(sheet, [8, 15, 25, 40, 20, 15])
+
     # Tieu de
-    sheet['A1'] = "CHI TIET CHI PHI"
-    sheet['A1'].font = Font(bold=True, size=16)
-    sheet['A2'] = f"Thang: {data['month'] or 'Tat ca'}"
-    sheet['A2'].font = Font(bold=True, size=12)
+    _append_title(sheet, "CHI TIET CHI PHI", data)
 
     # Header
     headers = ['STT', 'Ngay chi phi', 'Loai chi phi', 'Mo ta', 'So tien (VND)', 'Ty le (%)']
-    for col, header in enumerate(headers, 1):
-        cell = sheet.cell(row=4, column=col)
-        cell.value = header
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = border
+    _append_header(sheet, headers, header_font, header_fill, border)
 
     # Du lieu
-    row_idx = 5
     total_expenses = 0
-
-    for idx, expense in enumerate(data['expenses'], 1):
-        expense_date = expense.get('created_at', '')
-        if expense_date:
-            try:
-                expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
-            except:
-                expense_date = expense_date.split('T')[0] if 'T' in expense_date else expense_date
-
-        category_name = 'N/A'
-        if expense.get('id_lcp') and expense.get('id_lcp') in data['expense_categories']:
-            category_name = data['expense_categories'][expense['id_lcp']].get('tenchiphi', 'N/A')
-
-        amount = expense.get('giathanh', 0)
-        total_expenses += amount
-        ratio = expense.get('ti_le', 0)
-
-        row_data = [
-            idx,
-            expense_date,
-            category_name,
-            expense.get('mo_ta', ''),
-            amount,
-            f"{ratio:.2f}" if ratio else '0.00'
-        ]
-
-        for col_idx, value in enumerate(row_data, 1):
-            cell = sheet.cell(row=row_idx, column=col_idx)
-            cell.value = value
-            cell.border = border
-
-            if col_idx in [5, 6]:  # So tien va ty le
-                cell.alignment = Alignment(horizontal='right')
-                if col_idx == 5 and isinstance(value, (int, float)):  # So tien
-                    cell.number_format = '#,##0'
-
-        row_idx += 1
+    idx = 0
+
+    for expenses, expense_categories in _pages(data, 'expense_pages', 'expenses', 'expense_categories', {}):
+        for expense in expenses:
+            idx += 1
+            expense_date = expense.get('created_at', '')
+            if expense_date:
+                try:
+                    expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+                except:
+                    expense_date = expense_date.split('T')[0] if 'T' in expense_date else expense_date
+
+            category_name = 'N/A'
+            if expense.get('id_lcp') and expense.get('id_lcp') in expense_categories:
+                category_name = expense_categories[expense['id_lcp']].get('tenchiphi', 'N/A')
+
+            amount = expense.get('giathanh') or 0
+            total_expenses += amount
+            ratio = expense.get('ti_le', 0)
+
+            sheet.append([
+                _cell(sheet, idx, border=border),
+                _cell(sheet, expense_date, border=border),
+                _cell(sheet, category_name, border=border),
+                _cell(sheet, expense.get('mo_ta', ''), border=border),
+                # So tien va ty le
+                _cell(sheet, amount, border=border, alignment=ALIGN_RIGHT,
+                      number_format='#,##0' if isinstance(amount, (int, float)) else None),
+                _cell(sheet, f"{ratio:.2f}" if ratio else '0.00', border=border, alignment=ALIGN_RIGHT),
+            ])
 
     # Tong ket
-    total_row = row_idx + 1
-    sheet.cell(row=total_row, column=5).value = "TONG CHI PHI:"
-    sheet.cell(row=total_row, column=5).font = Font(bold=True)
-    sheet.cell(row=total_row, column=6).value = total_expenses
-    sheet.cell(row=total_row, column=6).font = Font(bold=True)
-    sheet.cell(row=total_row, column=6).number_format = '#,##0'
-
-    # Dieu chinh do rong cot
-    column_widths = [8, 15, 25, 40, 20, 15]
-    for col, width in enumerate(column_widths, 1):
-        sheet.column_dimensions[get_column_letter(col)].width = width
+    sheet.append([])
+    sheet.append([None] * 4 + [
+        _cell(sheet, "TONG CHI PHI:", font=FONT_BOLD),
+        _cell(sheet, total_expenses, font=FONT_BOLD, number_format='#,##0'),
+    ])
+    return {'total_expenses': total_expenses, 'expense_count': idx}
 
 def create_payroll_detail_sheet(sheet, data, header_font, header_fill, border):
     """Tao sheet chi phi nhan su chi tiet"""
 
+    # Dieu chinh do rong cot
+    _set_column_widths(sheet, [8, 12, 25, 15, 18, 18, 18, 12])
+
     # Tieu de
-    sheet['A1'] = "CHI TIET CHI PHI NHAN SU"
-    sheet['A1'].font = Font(bold=True, size=16)
-    sheet['A2'] = f"Thang: {data['month'] or 'Tat ca'}"
-    sheet['A2'].font = Font(bold=True, size=12)
+    _append_title(sheet, "CHI TIET CHI PHI NHAN SU", data)
 
     # Header
     headers = ['STT', 'Ma NV', 'Ho ten', 'Ky tinh luong', 'Tong thu nhap', 'Tong khau tru', 'Luong thuc nhan', 'Trang thai']
-    for col, header in enumerate(headers, 1):
-        cell = sheet.cell(row=4, column=col)
-        cell.value = header
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        cell.border = border
+    _append_header(sheet, headers, header_font, header_fill, border)
 
     # Du lieu
-    row_idx = 5
     total_payroll = 0
+    idx = 0
+    max_salary = None
+    min_salary = None
+
+    for payroll_rows, employees in _pages(data, 'payroll_pages', 'payroll', 'employees', {}):
+        for payroll in payroll_rows:
+            idx += 1
+            ma_nv = payroll.get('ma_nv', '')
+            employee = employees.get(ma_nv, {})
+            ho_ten = employee.get('ho_ten', f'NV {ma_nv}')
+
+            ky_tinh_luong = payroll.get('ky_tinh_luong', '')
+            tong_thu_nhap = payroll.get('tong_thu_nhap', 0)
+            tong_khau_tru = payroll.get('tong_khau_tru', 0)
+            luong_thuc_nhan = payroll.get('luong_thuc_nhan') or 0
+            trang_thai = payroll.get('trang_thai', 'draft')
+
+            total_payroll += luong_thuc_nhan
+            max_salary = luong_thuc_nhan if max_salary is None else max(max_salary, luong_thuc_nhan)
+            min_salary = luong_thuc_nhan if min_salary is None else min(min_salary, luong_thuc_nhan)
 
-    for idx, payroll in enumerate(data['payroll'], 1):
-        ma_nv = payroll.get('ma_nv', '')
-        employee = data['employees'].get(ma_nv, {})
-        ho_ten = employee.get('ho_ten', f'NV {ma_nv}')
-
-        ky_tinh_luong = payroll.get('ky_tinh_luong', '')
-        tong_thu_nhap = payroll.get('tong_thu_nhap', 0)
-        tong_khau_tru = payroll.get('tong_khau_tru', 0)
-        luong_thuc_nhan = payroll.get('luong_thuc_nhan', 0)
-        trang_thai = payroll.get('trang_thai', 'draft')
-
-        total_payroll += luong_thuc_nhan
-
-        row_data = [
-            idx,
-            ma_nv,
-            ho_ten,
-            ky_tinh_luong,
-            tong_thu_nhap,
-            tong_khau_tru,
-            luong_thuc_nhan,
-            trang_thai
-        ]
-
-        for col_idx, value in enumerate(row_data, 1):
-            cell = sheet.cell(row=row_idx, column=col_idx)
-            cell.value = value
-            cell.border = border
-
-            if col_idx in [5, 6, 7]:  # Cac cot tien
-                cell.alignment = Alignment(horizontal='right')
-                if isinstance(value, (int, float)):
-                    cell.number_format = '#,##0'
+            row_data = [
+                idx,
+                ma_nv,
+                ho_ten,
+                ky_tinh_luong,
+                tong_thu_nhap,
+                tong_khau_tru,
+                luong_thuc_nhan,
+                trang_thai
+            ]
 
-        row_idx += 1
+            row = []
+            for col_idx, value in enumerate(row_data, 1):
+                if col_idx in [5, 6, 7]:  # Cac cot tien
+                    row.append(_cell(sheet, value, border=border, alignment=ALIGN_RIGHT,
+                                     number_format='#,##0' if isinstance(value, (int, float)) else None))
+                else:
+                    row.append(_cell(sheet, value, border=border))
+            sheet.append(row)
 
     # Tong ket
-    total_row = row_idx + 1
-    sheet.cell(row=total_row, column=6).value = "TONG CHI PHI NHAN SU:"
-    sheet.cell(row=total_row, column=6).font = Font(bold=True)
-    sheet.cell(row=total_row, column=7).value = total_payroll
-    sheet.cell(row=total_row, column=7).font = Font(bold=True)
-    sheet.cell(row=total_row, column=7).number_format = '#,##0'
+    sheet.append([])
+    sheet.append([None] * 5 + [
+        _cell(sheet, "TONG CHI PHI NHAN SU:", font=FONT_BOLD),
+        _cell(sheet, total_payroll, font=FONT_BOLD, number_format='#,##0'),
+    ])
 
     # Thong ke them
-    stats_row = total_row + 2
-    sheet.cell(row=stats_row, column=1).value = "THONG KE:"
-    sheet.cell(row=stats_row, column=1).font = Font(bold=True, size=12)
+    sheet.append([])
+    sheet.append([_cell(sheet, "THONG KE:", font=FONT_SUBTITLE)])
 
     stats_data = [
-        ['Tong so nhan vien co luong', len(data['payroll'])],
-        ['Luong trung binh', total_payroll / len(data['payroll']) if data['payroll'] else 0],
-        ['Luong cao nhat', max((p.get('luong_thuc_nhan', 0) for p in data['payroll']), default=0)],
-        ['Luong thap nhat', min((p.get('luong_thuc_nhan', 0) for p in data['payroll']), default=0)],
+        ['Tong so nhan vien co luong', idx],
+        ['Luong trung binh', total_payroll / idx if idx else 0],
+        ['Luong cao nhat', max_salary or 0],
+        ['Luong thap nhat', min_salary or 0],
     ]
 
-    for row_idx, (label, value) in enumerate(stats_data, stats_row + 1):
-        sheet.cell(row=row_idx, column=1).value = label
-        sheet.cell(row=row_idx, column=1).border = border
-
-        cell = sheet.cell(row=row_idx, column=2)
-        cell.value = value
-        cell.border = border
-        if isinstance(value, (int, float)):
-            cell.number_format = '#,##0'
-
-    # Dieu chinh do rong cot
-    column_widths = [8, 12, 25, 15, 18, 18, 18, 12]
-    for col, width in enumerate(column_widths, 1):
-        sheet.column_dimensions[get_column_letter(col)].width = width
+    for label, value in stats_data:
+        sheet.append([
+            _cell(sheet, label, border=border),
+            _cell(sheet, value, border=border, number_format='#,##0' if isinstance(value, (int, float)) else None),
+        ])
+    return {'total_payroll': total_payroll, 'payroll_count': idx}
 
 def main():
     parser = argparse.ArgumentParser(description='Xuat bao cao loi nhuan ra Excel')
@@ -539,28 +559,23 @@ def main():
 
     print("Bat dau xuat bao cao loi nhuan ra Excel...")
 
-    # Lay du lieu
+    # Nguon du lieu (doc theo trang khi ghi file)
     data = get_profit_data(args.month)
-    if not data:
-        print("Khong the lay du lieu")
-        sys.exit(1)
 
     # Tao ten file
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    month_str = args.month.replace('-', '') if args.month else 'all'
-    filename = f"bao_cao_loi_nhuan_{month_str}_{timestamp}.xlsx"
-    output_path = os.path.join(os.path.dirname(__file__), filename)
+    filename = profit_excel_filename(args.month)
+    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
     # Tao file Excel
     try:
-        create_excel_file(data, output_path)
+        totals = create_excel_file(data, output_path)
         print(f"SUCCESS: {filename}")
         print(f"File duoc luu tai: {output_path}")
 
         # Thong ke
-        total_revenue = sum(inv.get('total_amount', 0) for inv in data['revenue'])
-        total_expenses = sum(exp.get('giathanh', 0) for exp in data['expenses'])
-        total_payroll = sum(p.get('luong_thuc_nhan', 0) for p in data['payroll'])
+        total_revenue = totals['total_revenue']
+        total_expenses = totals['total_expenses']
+        total_payroll = totals['total_payroll']
         total_all_expenses = total_expenses + total_payroll
         total_profit = total_revenue - total_all_expenses
 
@@ -570,9 +585,9 @@ def main():
         print(f"   - Tong chi phi nhan su: {total_payroll:,.0f} VND")
         print(f"   - Tong chi phi: {total_all_expenses:,.0f} VND")
         print(f"   - Loi nhuan: {total_profit:,.0f} VND")
-        print(f"   - So hoa don: {len(data['revenue'])}")
-        print(f"   - So chi phi: {len(data['expenses'])}")
-        print(f"   - So nhan vien co luong: {len(data['payroll'])}")
+        print(f"   - So hoa don: {totals['invoice_count']}")
+        print(f"   - So chi phi: {totals['expense_count']}")
+        print(f"   - So nhan vien co luong: {totals['payroll_count']}")
 
     except Exception as e:
         print(f"Loi khi tao file Excel: {e}")
@@ -0,0 +1,144 @@
+"""
+Gắn thông tin chi tiết (công trình, sản phẩm, loại nhôm/kính/tay nắm/bộ phận,
+phụ kiện bếp) cho danh sách hóa đơn bằng truy vấn gộp.
+
+Thay vì truy vấn từng hóa đơn và từng item, module này gom tất cả ID của một
+trang hóa đơn rồi đọc items và công trình bằng một truy vấn in_() mỗi bảng;
+các bảng danh mục được đọc qua catalog_cache. Số round trip tới Supabase vì
+vậy không còn tăng theo số item.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+from supabase_client import supabase
+from supabase_query import fetch_all
+from catalog_cache import catalog_cache
+
+# Giới hạn số ID trong một truy vấn in_() để URL không quá dài
+IN_QUERY_CHUNK_SIZE = 200
+
+# Các cột tên loại được gắn vào sản phẩm / item: (cột id, bảng, khóa kết quả)
+CATALOG_NAME_FIELDS = [
+    ('id_nhom', 'loainhom', 'ten_nhom'),
+    ('id_kinh', 'loaikinh', 'ten_kinh'),
+    ('id_taynam', 'loaitaynam', 'ten_taynam'),
+    ('id_bophan', 'bophan', 'ten_bophan'),
+]
+
+def _unique_ids(values: Iterable[Any]) -> List[Any]:
+    """Loại bỏ giá trị rỗng và trùng lặp, giữ nguyên thứ tự"""
+    seen = set()
+    unique = []
+    for value in values:
+        if value and value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
+
+def fetch_rows_in(table: str, column: str, values: Iterable[Any], columns: str = '*') -> List[Dict[str, Any]]:
+    """Lấy tất cả dòng có `column` thuộc `values`, chia nhỏ danh sách ID và phân trang kết quả"""
+    ids = _unique_ids(values)
+    rows = []
+    for start in range(0, len(ids), IN_QUERY_CHUNK_SIZE):
+        chunk = ids[start:start + IN_QUERY_CHUNK_SIZE]
+        rows.extend(fetch_all(lambda: supabase.table(table).select(columns).in_(column, chunk).order('id')))
+    return rows
+
+def fetch_map_by_id(table: str, ids: Iterable[Any], columns: str = '*') -> Dict[Any, Dict[str, Any]]:
+    """Lấy các dòng theo danh sách ID và trả về dict id -> dòng"""
+    return {row['id']: row for row in fetch_rows_in(table, 'id', ids, columns)}
+
+def _fetch_map_safe(table: str, ids: Iterable[Any], columns: str = '*') -> Dict[Any, Dict[str, Any]]:
+    """Như fetch_map_by_id nhưng bỏ qua lỗi (giữ hành vi cũ: thiếu tên loại không làm hỏng cả request)"""
+    try:
+        return fetch_map_by_id(table, ids, columns)
+    except Exception as e:
+        print(f"Error fetching {table}: {e}")
+        return {}
+
+def _load_catalog_indexes() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Lấy chỉ mục id -> dòng của các bảng danh mục từ catalog_cache, bỏ qua bảng bị lỗi"""
+    indexes = {}
+    for table in ('sanpham', 'phukienbep', 'loaiphukienbep') + tuple(table for _, table, _ in CATALOG_NAME_FIELDS):
+        try:
+            indexes[table] = catalog_cache.get_index(table)
+        except Exception as e:
+            print(f"Error fetching {table}: {e}")
+            indexes[table] = {}
+    return indexes
+
+def _lookup(index: Dict[str, Dict[str, Any]], row_id: Any) -> Optional[Dict[str, Any]]:
+    return index.get(str(row_id)) if row_id else None
+
+def enrich_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gắn sanpham/phukien và tên loại cho danh sách item hóa đơn"""
+    indexes = _load_catalog_indexes()
+
+    items_with_details = []
+    for item in items:
+        item_with_details = dict(item)
+
+        product = _lookup(indexes['sanpham'], item.get('sanpham_id'))
+        if product:
+            product = dict(product)
+            for id_field, table, name_key in CATALOG_NAME_FIELDS:
+                catalog = _lookup(indexes[table], product.get(id_field))
+                if catalog:
+                    product[name_key] = catalog['tenloai']
+            item_with_details['sanpham'] = product
+
+        if item.get('id_phukien') and item.get('loai_san_pham') == 'phu_kien_bep':
+            phukien = _lookup(indexes['phukienbep'], item['id_phukien'])
+            if phukien:
+                phukien = dict(phukien)
+                loaiphukien = _lookup(indexes['loaiphukienbep'], phukien.get('id_loaiphukien'))
+                if loaiphukien:
+                    phukien['ten_loai_phukien'] = loaiphukien['tenloai']
+                item_with_details['phukien'] = phukien
+
+        # Nếu không có sản phẩm hoặc phụ kiện, lấy tên loại từ item trực tiếp
+        if not item_with_details.get('sanpham') and not item_with_details.get('phukien'):
+            for id_field, table, name_key in CATALOG_NAME_FIELDS:
+                catalog = _lookup(indexes[table], item.get(id_field))
+                if catalog:
+                    item_with_details[name_key] = catalog['tenloai']
+
+        items_with_details.append(item_with_details)
+
+    return items_with_details
+
+def enrich_invoices(invoices: List[Dict[str, Any]], items_table: str, include_cong_trinh: bool = False) -> List[Dict[str, Any]]:
+    """
+    Gắn items (và công trình nếu cần) cho một trang hóa đơn.
+
+    Args:
+        invoices: Danh sách hóa đơn đã lấy từ invoices_reality / invoices_quote
+        items_table: Bảng chi tiết tương ứng (invoice_items_reality / invoice_items_quote)
+        include_cong_trinh: Gắn thêm khóa 'cong_trinh' cho mỗi hóa đơn
+    """
+    if not invoices:
+        return []
+
+    items = fetch_rows_in(items_table, 'invoice_id', (invoice['id'] for invoice in invoices))
+    enriched_items = enrich_items(items)
+
+    items_by_invoice: Dict[Any, List[Dict[str, Any]]] = {}
+    for item in enriched_items:
+        items_by_invoice.setdefault(item.get('invoice_id'), []).append(item)
+
+    cong_trinh_map: Dict[Any, Dict[str, Any]] = {}
+    if include_cong_trinh:
+        cong_trinh_map = _fetch_map_safe('cong_trinh', (invoice.get('id_congtrinh') for invoice in invoices))
+
+    invoices_with_items = []
+    for invoice in invoices:
+        invoice_with_items = {
+            **invoice,
+            'items': items_by_invoice.get(invoice['id'], [])
+        }
+        if include_cong_trinh:
+            cong_trinh_info: Optional[Dict[str, Any]] = None
+            if invoice.get('id_congtrinh'):
+                cong_trinh_info = cong_trinh_map.get(invoice['id_congtrinh'])
+            invoice_with_items['cong_trinh'] = cong_trinh_info
+        invoices_with_items.append(invoice_with_items)
+
+    return invoices_with_items
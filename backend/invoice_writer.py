@@ -0,0 +1,95 @@
+"""
+Ghi hóa đơn (invoices_reality) và báo giá (invoices_quote) cùng các dòng chi tiết.
+
+Toàn bộ item được ghi trong một lần: ưu tiên hàm create_invoice_with_items (một
+transaction, xem create_invoice_with_items_function.sql); nếu database chưa có hàm
+này thì ghi hóa đơn rồi chèn tất cả item bằng một lệnh insert, và xóa hóa đơn
+nếu bước chèn item thất bại. Số round trip không còn tăng theo số item.
+"""
+from typing import Any, Dict, List, Optional
+
+from supabase_query import get_client
+
+# kind -> (bảng hóa đơn, bảng chi tiết)
+INVOICE_TABLES = {
+    'reality': ('invoices_reality', 'invoice_items_reality'),
+    'quote': ('invoices_quote', 'invoice_items_quote'),
+}
+
+def _is_missing_function(error: Exception) -> bool:
+    # PostgREST trả về PGRST202 khi hàm chưa được tạo trong database
+    return getattr(error, 'code', None) == 'PGRST202' or 'Could not find the function' in str(error)
+
+def build_item_row(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển một item từ request thành dòng chi tiết (chưa có invoice_id)"""
+    # Kiểm tra loại sản phẩm
+    loai_san_pham = item.get('loai_san_pham', 'tu_bep')
+
+    if loai_san_pham == 'phu_kien_bep':
+        # Phụ kiện bếp
+        return {
+            'loai_san_pham': 'phu_kien_bep',
+            'id_loaiphukien': item.get('id_loaiphukien'),
+            'id_phukien': item['id_phukien'],
+            'so_luong': item.get('so_luong', 1),
+            'don_gia': item['don_gia'],
+            'chiet_khau': item.get('chiet_khau', 0),
+            'thanh_tien': item['thanh_tien']
+        }
+
+    # Sản phẩm tủ bếp (như cũ)
+    return {
+        'loai_san_pham': 'tu_bep',
+        'id_nhom': item['id_nhom'],
+        'id_kinh': item['id_kinh'],
+        'id_taynam': item['id_taynam'],
+        'id_bophan': item['id_bophan'],
+        'sanpham_id': item['sanpham_id'],
+        'ngang': item['ngang'],
+        'cao': item['cao'],
+        'sau': item['sau'],
+        'so_luong': item['so_luong'],
+        'don_gia': item['don_gia'],
+        'chiet_khau': item.get('chiet_khau', 0),
+        'thanh_tien': item['thanh_tien']
+    }
+
+def create_invoice_with_items(kind: str, invoice_row: Dict[str, Any], items: Optional[List[Dict[str, Any]]], client=None) -> int:
+    """
+    Tạo hóa đơn/báo giá và toàn bộ item, trả về id hóa đơn.
+
+    Args:
+        kind: 'reality' hoặc 'quote'
+        invoice_row: Các cột của hóa đơn
+        items: Danh sách item từ request (invoice_data['items'])
+    """
+    invoice_table, items_table = INVOICE_TABLES[kind]
+    client = get_client(client)
+    # Kiểm tra dữ liệu item trước khi ghi bất cứ thứ gì
+    item_rows = [build_item_row(item) for item in items or []]
+
+    try:
+        result = client.rpc('create_invoice_with_items', {
+            'p_kind': kind,
+            'p_invoice': invoice_row,
+            'p_items': item_rows,
+        }).execute()
+        return result.data
+    except Exception as e:
+        # Chỉ chuyển sang cách ghi dự phòng khi hàm chưa tồn tại, tránh ghi trùng hóa đơn
+        if not _is_missing_function(e):
+            raise
+        print(f"create_invoice_with_items unavailable, falling back to batched inserts: {e}")
+
+    invoice_result = client.table(invoice_table).insert(invoice_row).execute()
+    invoice_id = invoice_result.data[0]['id']
+
+    if item_rows:
+        try:
+            client.table(items_table).insert([{'invoice_id': invoice_id, **row} for row in item_rows]).execute()
+        except Exception:
+            # Không để lại hóa đơn thiếu chi tiết
+            client.table(invoice_table).delete().eq('id', invoice_id).execute()
+            raise
+
+    return invoice_id
@@ -23,8 +23,13 @@ from routers.accounting import router as accounting_router
 from routers.payroll import router as payroll_router
 from routers.notifications import router as notifications_router
 from routers.quote import router as quote_router
+from db_executor import get_db_executor_stats, shutdown_db_executor
+from employee_import import shutdown_hash_executor
+from pg_pool import close_pg_pool, get_pg_pool, init_pg_pool
+from email_service import email_service
+from dify_client import close_dify_client
 # Removed: from email_sync_service import start_email_sync_service
-# Removed: from notification_scheduler import notification_scheduler
+from notification_scheduler import notification_scheduler
 
 # @asynccontextmanager
 # async def lifespan(app: FastAPI):
@@ -53,6 +58,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Cursor trang tiếp theo của lịch sử chat
 )
 
 # Thêm các router vào ứng dụng
@@ -72,21 +78,61 @@ app.include_router(payroll_router, prefix="/api/v1")
 app.include_router(notifications_router, prefix="/api/v1")
 app.include_router(quote_router, prefix="/api/v1")
 
-# Removed: Khởi động email sync service khi app start
-# @app.on_event("startup")
-# async def startup_event():
-#     """Khởi động notification scheduler khi app start"""
-#     notification_scheduler.start_scheduler()
+# Scheduler hẹn giờ chỉ đọc database khi khởi động, sau đó nhận thay đổi qua enqueue từ router
+@app.on_event("startup")
+def startup_event():
+    """Khởi động notification scheduler khi app start"""
+    notification_scheduler.start_scheduler()
 
-# @app.on_event("shutdown")
-# async def shutdown_event():
-#     """Dừng notification scheduler khi app shutdown"""
-#     notification_scheduler.stop_scheduler()
+@app.on_event("shutdown")
+def shutdown_event():
+    """Dừng notification scheduler khi app shutdown"""
+    notification_scheduler.stop_scheduler()
+
+@app.on_event("shutdown")
+def shutdown_db_pool():
+    """Đóng thread pool truy vấn database khi app tắt"""
+    shutdown_db_executor()
+
+@app.on_event("shutdown")
+def shutdown_hash_pool():
+    """Đóng thread pool băm mật khẩu của import nhân viên khi app tắt"""
+    shutdown_hash_executor()
+
+@app.on_event("startup")
+def startup_pg_pool():
+    """Tạo pool kết nối Postgres cho các route truy vấn trực tiếp"""
+    init_pg_pool()
+
+@app.on_event("shutdown")
+def shutdown_pg_pool():
+    """Đóng các kết nối Postgres trong pool khi app tắt"""
+    close_pg_pool()
+
+@app.on_event("shutdown")
+def shutdown_email_pool():
+    """Đóng các kết nối SMTP của email service khi app tắt"""
+    email_service.close()
+
+@app.on_event("shutdown")
+async def shutdown_dify_client():
+    """Đóng pool kết nối httpx tới Dify khi app tắt"""
+    await close_dify_client()
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the Admin API"}
 
+@app.get("/api/v1/db-executor/stats")
+def db_executor_stats():
+    """Thống kê thread pool truy vấn database"""
+    return get_db_executor_stats()
+
+@app.get("/api/v1/db-pool/stats")
+def db_pool_stats():
+    """Thống kê pool kết nối Postgres (thời gian chờ mượn kết nối, số kết nối)"""
+    return get_pg_pool().stats()
+
 @app.post("/api/v1/create-nhanvien-table")
 def create_nhanvien_table():
     """
@@ -1,6 +1,6 @@
 # models.py
 from pydantic import BaseModel, EmailStr
-from typing import Optional, Union
+from typing import Dict, List, Optional, Union
 
 # Model cho việc tạo người dùng mới
 class UserCreate(BaseModel):
@@ -296,6 +296,24 @@ class TinhLuongRequest(BaseModel):
     phu_cap_khac: float = 0
     thuong_kpi: float = 0
 
+# Model cho tính lương cả kỳ
+class TinhLuongBatchRequest(BaseModel):
+    ky_tinh_luong: str
+    ma_nv_list: Optional[List[Union[str, int]]] = None  # None = tất cả nhân viên có chấm công trong kỳ
+    phu_cap_khac: Dict[str, float] = {}  # ma_nv -> phụ cấp khác
+    thuong_kpi: Dict[str, float] = {}  # ma_nv -> thưởng KPI
+
+class TinhLuongBatchError(BaseModel):
+    ma_nv: Union[str, int]
+    error: str
+
+class TinhLuongBatchResponse(BaseModel):
+    ky_tinh_luong: str
+    total: int
+    success_count: int
+    payslips: List[PhieuLuongResponse]
+    errors: List[TinhLuongBatchError]
+
 # ===== NOTIFICATION MODELS =====
 
 # Model cho tạo thông báo mới
@@ -363,6 +381,7 @@ class NotificationLogResponse(BaseModel):
     recipient_email: str
     recipient_employee: Optional[str]
     status: str
+    attempts: Optional[int] = None
     sent_at: Optional[str]
     error_message: Optional[str]
     created_at: Optional[str]
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Xác định danh sách email nhận cho một thông báo.
+
+Nhân viên theo id, phòng ban và vai trò được lấy bằng một truy vấn employees duy
+nhất (điều kiện OR, đọc theo trang) thay vì một truy vấn cho mỗi id. Kết quả được
+cache theo thông báo để các lần gửi lại không phải mở rộng danh sách lần nữa; cache
+tự hết hiệu lực khi nhóm người nhận của thông báo thay đổi.
+"""
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from supabase_query import get_client, iter_pages
+
+logger = logging.getLogger(__name__)
+
+RECIPIENT_FIELDS = ('recipient_emails', 'recipient_employees', 'recipient_departments', 'recipient_roles', 'send_to_all')
+
+def _integer_id(value: Any) -> int:
+    """Id khóa ngoại dạng số nguyên (cả chuỗi số); ValueError nếu không phải"""
+    # Giá trị được ghép vào chuỗi or_ của PostgREST nên chỉ chấp nhận số nguyên
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"Invalid recipient id: {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid recipient id: {value!r}")
+
+def _in_clause(column: str, values: Iterable[Any]) -> Optional[str]:
+    values = list(dict.fromkeys(_integer_id(value) for value in values if value is not None))
+    if not values:
+        return None
+    return f"{column}.in.({','.join(str(value) for value in values)})"
+
+def audience_signature(notification: dict) -> Tuple:
+    """Khóa mô tả nhóm người nhận; đổi người nhận thì khóa đổi theo"""
+    signature = []
+    for field in RECIPIENT_FIELDS:
+        value = notification.get(field)
+        signature.append(tuple(sorted(str(item) for item in value)) if isinstance(value, list) else bool(value))
+    return tuple(signature)
+
+def _fetch_employee_emails(client, or_filter: Optional[str]) -> List[str]:
+    def query():
+        query = client.table('employees').select('id, email')
+        if or_filter:
+            query = query.or_(or_filter)
+        return query.order('id')
+
+    return [row['email'] for page in iter_pages(query) for row in page if row.get('email')]
+
+def _resolve(notification: dict, client=None) -> Tuple[List[str], bool]:
+    """Trả về (danh sách email, đã đọc đủ từ database hay chưa)"""
+    recipient_emails = dict.fromkeys(email for email in notification.get('recipient_emails') or [] if email)
+
+    if notification.get('send_to_all'):
+        or_filter = None
+    else:
+        try:
+            clauses = [
+                _in_clause('id', notification.get('recipient_employees') or []),
+                _in_clause('department_id', notification.get('recipient_departments') or []),
+                _in_clause('role_id', notification.get('recipient_roles') or []),
+            ]
+        except ValueError as e:
+            logger.error(f"Error getting employee emails: {str(e)}")
+            return list(recipient_emails), False
+        clauses = [clause for clause in clauses if clause]
+        if not clauses:
+            return list(recipient_emails), True
+        or_filter = ','.join(clauses)
+
+    try:
+        recipient_emails.update(dict.fromkeys(_fetch_employee_emails(get_client(client), or_filter)))
+    except Exception as e:
+        logger.error(f"Error getting employee emails: {str(e)}")
+        return list(recipient_emails), False
+
+    return list(recipient_emails), True
+
+def resolve_recipient_emails(notification: dict, client=None) -> List[str]:
+    """Email trực tiếp + email nhân viên theo id/phòng ban/vai trò (hoặc tất cả), không trùng lặp"""
+    return _resolve(notification, client)[0]
+
+class RecipientCache:
+    """Cache danh sách người nhận theo id thông báo"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: Dict[Any, Tuple[Tuple, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def get_recipient_emails(self, notification: dict, client=None) -> List[str]:
+        notification_id = notification.get('id')
+        signature = audience_signature(notification)
+        with self._lock:
+            cached = self._entries.get(notification_id)
+        if cached and cached[0] == signature:
+            return list(cached[1])
+
+        emails, complete = _resolve(notification, client)
+        # Không cache kết quả thiếu do lỗi truy vấn
+        if notification_id is not None and complete and emails:
+            with self._lock:
+                if len(self._entries) >= self.max_entries and notification_id not in self._entries:
+                    # Bỏ mục cũ nhất (dict giữ thứ tự thêm vào)
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[notification_id] = (signature, emails)
+        return list(emails)
+
+    def forget(self, notification_id):
+        """Xóa cache khi thông báo đã gửi xong"""
+        with self._lock:
+            self._entries.pop(notification_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,4 +1,5 @@
-import schedule
+import heapq
+import itertools
 import time
 import threading
 import logging
@@ -14,14 +15,39 @@ sys.path.insert(0, backend_dir)
 
 from supabase_client import supabase
 from email_service import email_service
+from notification_recipients import RecipientCache
 
 logger = logging.getLogger(__name__)
 
+def parse_scheduled_time(scheduled_time_str: str) -> datetime:
+    """Parse scheduled_send_at (stored as UTC) into an aware datetime"""
+    if scheduled_time_str.endswith('Z'):
+        scheduled_time_str = scheduled_time_str[:-1] + '+00:00'
+
+    scheduled_time_utc = datetime.fromisoformat(scheduled_time_str)
+    if scheduled_time_utc.tzinfo is None:
+        scheduled_time_utc = scheduled_time_utc.replace(tzinfo=timezone.utc)
+    return scheduled_time_utc
+
 class NotificationScheduler:
+    """
+    Gửi thông báo đúng thời điểm hẹn bằng một heap hẹn giờ (time.monotonic).
+
+    Thông báo sắp gửi được đọc một lần khi khởi động; sau đó router gọi enqueue()/cancel()
+    khi tạo, sửa hoặc xóa thông báo, nên khi rảnh scheduler không truy vấn database.
+    Luồng nền ngủ đến đúng thời điểm của thông báo gần nhất hoặc đến khi có enqueue mới.
+    """
+
     def __init__(self):
         self.is_running = False
         self.scheduler_thread = None
-        self.scheduled_jobs: Dict[int, schedule.Job] = {}
+        # Heap (thời điểm monotonic, thứ tự, notification_id); mục cũ bị bỏ qua khi lấy ra
+        self._heap: List[tuple] = []
+        self._due_at: Dict[int, float] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # Danh sách người nhận đã mở rộng, dùng lại khi gửi lại cùng thông báo
+        self.recipient_cache = RecipientCache()
 
     def start_scheduler(self):
         """Start the notification scheduler in a background thread"""
@@ -30,93 +56,101 @@ class NotificationScheduler:
             return
 
         self.is_running = True
+        self._load_upcoming_notifications()
         self.scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
         self.scheduler_thread.start()
         logger.info("Notification scheduler started")
 
     def stop_scheduler(self):
         """Stop the notification scheduler"""
-        self.is_running = False
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
         logger.info("Notification scheduler stopped")
 
+    def _load_upcoming_notifications(self):
+        """Load every published notification that has a send time (once, at startup)"""
+        try:
+            result = supabase.table('notifications').select('id, status, scheduled_send_at').eq('status', 'published').execute()
+            for notification in result.data or []:
+                self.enqueue(notification)
+        except Exception as e:
+            logger.error(f"Error loading scheduled notifications: {str(e)}")
+
+    def enqueue(self, notification: dict):
+        """Schedule (or reschedule) a notification; drafts, sent and unscheduled ones are removed"""
+        notification_id = notification['id']
+        if notification.get('status') != 'published' or not notification.get('scheduled_send_at'):
+            self.cancel(notification_id)
+            return
+
+        try:
+            scheduled_time_utc = parse_scheduled_time(notification['scheduled_send_at'])
+        except Exception as e:
+            logger.error(f"Error scheduling notification {notification_id}: {str(e)}")
+            return
+
+        # Calculate delay in seconds
+        delay_seconds = max(0, (scheduled_time_utc - datetime.now(timezone.utc)).total_seconds())
+        due_at = time.monotonic() + delay_seconds
+
+        with self._condition:
+            self._due_at[notification_id] = due_at
+            heapq.heappush(self._heap, (due_at, next(self._sequence), notification_id))
+            self._condition.notify()
+        logger.info(f"Scheduled notification {notification_id} in {delay_seconds:.1f}s")
+
+    def cancel(self, notification_id: int):
+        """Remove a notification from the schedule"""
+        with self._condition:
+            if self._due_at.pop(notification_id, None) is not None:
+                self._condition.notify()
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._due_at)
+
+    def _next_due_notification(self) -> Optional[int]:
+        """Block until a notification is due (returns its id) or the scheduler stops (returns None)"""
+        with self._condition:
+            while self.is_running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due_at, _, notification_id = self._heap[0]
+                if self._due_at.get(notification_id) != due_at:
+                    # Đã bị hủy hoặc đổi giờ
+                    heapq.heappop(self._heap)
+                    continue
+
+                remaining = due_at - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+
+                heapq.heappop(self._heap)
+                del self._due_at[notification_id]
+                return notification_id
+        return None
+
     def _run_scheduler(self):
         """Main scheduler loop"""
         logger.info("Scheduler loop started")
 
         while self.is_running:
+            notification_id = self._next_due_notification()
+            if notification_id is None:
+                break
             try:
-                # Check for new scheduled notifications every minute
-                self._check_scheduled_notifications()
-
-                # Run pending scheduled jobs
-                schedule.run_pending()
-
-                # Sleep for 60 seconds
-                time.sleep(60)
-
+                self._send_scheduled_notification(notification_id)
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {str(e)}")
-                time.sleep(60)  # Wait before retrying
 
         logger.info("Scheduler loop ended")
 
-    def _check_scheduled_notifications(self):
-        """Check for notifications that need to be scheduled"""
-        try:
-            # Get notifications that are published but not yet sent and have a scheduled time
-            now_utc = datetime.now(timezone.utc)
-            current_time_utc = now_utc.isoformat()
-
-            result = supabase.table('notifications').select('*').eq('status', 'published').lt('scheduled_send_at', current_time_utc).execute()
-
-            if result.data:
-                for notification in result.data:
-                    self._schedule_notification(notification)
-
-        except Exception as e:
-            logger.error(f"Error checking scheduled notifications: {str(e)}")
-            # Don't crash the scheduler, just log the error and continue
-
-    def _schedule_notification(self, notification: dict):
-        """Schedule a notification for sending"""
-        try:
-            notification_id = notification['id']
-            scheduled_time_str = notification['scheduled_send_at']
-
-            # Parse the scheduled time (stored as UTC)
-            if scheduled_time_str.endswith('Z'):
-                scheduled_time_str = scheduled_time_str[:-1] + '+00:00'
-
-            scheduled_time_utc = datetime.fromisoformat(scheduled_time_str)
-            if scheduled_time_utc.tzinfo is None:
-                scheduled_time_utc = scheduled_time_utc.replace(tzinfo=timezone.utc)
-
-            # Get current UTC time
-            now_utc = datetime.now(timezone.utc)
-
-            # Calculate delay in seconds
-            delay_seconds = max(0, (scheduled_time_utc - now_utc).total_seconds())
-
-            if delay_seconds > 0:
-                # Schedule the job using local time for the schedule library
-                # Since user says Vietnam local time doesn't add hours, convert UTC to local time
-                scheduled_time_local = scheduled_time_utc.replace(tzinfo=None)  # Remove timezone info, treat as local
-                job = schedule.every().day.at(scheduled_time_local.strftime("%H:%M")).do(
-                    self._send_scheduled_notification,
-                    notification_id=notification_id
-                )
-
-                self.scheduled_jobs[notification_id] = job
-                logger.info(f"Scheduled notification {notification_id} for {scheduled_time_local} (local time)")
-            else:
-                # Send immediately if the scheduled time has passed
-                self._send_scheduled_notification(notification_id)
-
-        except Exception as e:
-            logger.error(f"Error scheduling notification {notification['id']}: {str(e)}")
-
     def _send_scheduled_notification(self, notification_id: int):
         """Send a scheduled notification"""
         try:
@@ -133,6 +167,11 @@ class NotificationScheduler:
                 logger.warning(f"Notification {notification_id} status is not 'published'")
                 return
 
+            # Giờ gửi đã bị dời mà chưa enqueue lại: hẹn lại thay vì gửi sớm
+            if notification.get('scheduled_send_at') and parse_scheduled_time(notification['scheduled_send_at']) > datetime.now(timezone.utc) + timedelta(seconds=1):
+                self.enqueue(notification)
+                return
+
             # Get recipient emails
             recipient_emails = self._get_recipient_emails(notification)
 
@@ -164,82 +203,40 @@ class NotificationScheduler:
             }
 
             supabase.table('notifications').update(update_data).eq('id', notification_id).execute()
+            if result['success']:
+                self.recipient_cache.forget(notification_id)
 
             # Log the result
-            log_data = {
-                'notification_id': notification_id,
-                'action': 'scheduled_send',
-                'status': 'success' if result['success'] else 'failed',
-                'details': result,
-                'created_at': datetime.now().isoformat()
-            }
-
-            # TODO: Save to notification_logs table if it exists
-            logger.info(f"Scheduled notification {notification_id} sent: {result}")
-
-            # Remove from scheduled jobs
-            if notification_id in self.scheduled_jobs:
-                schedule.cancel_job(self.scheduled_jobs[notification_id])
-                del self.scheduled_jobs[notification_id]
+            self._save_delivery_logs(notification_id, result)
+            logger.info(f"Scheduled notification {notification_id} sent: {result['message']}")
 
         except Exception as e:
             logger.error(f"Error sending scheduled notification {notification_id}: {str(e)}")
 
+    def _save_delivery_logs(self, notification_id: int, result: dict):
+        """Save per-recipient delivery results to notification_logs (one insert)"""
+        rows = [{
+            'notification_id': notification_id,
+            'recipient_email': delivery['recipient_email'],
+            'status': delivery['status'],
+            'attempts': delivery['attempts'],
+            'sent_at': delivery['sent_at'],
+            'error_message': delivery['error_message']
+        } for delivery in result.get('results', [])]
+        if not rows:
+            return
+        try:
+            supabase.table('notification_logs').insert(rows).execute()
+        except Exception as e:
+            logger.error(f"Error saving notification logs for {notification_id}: {str(e)}")
+
     def _get_recipient_emails(self, notification: dict) -> List[str]:
         """Get all recipient email addresses for a notification"""
-        recipient_emails = set()
-
         try:
-            # Direct email recipients
-            if notification.get('recipient_emails'):
-                recipient_emails.update(notification['recipient_emails'])
-
-            # Employee recipients
-            if notification.get('recipient_employees'):
-                try:
-                    for emp_id in notification['recipient_employees']:
-                        emp_result = supabase.table('employees').select('email').eq('id', emp_id).execute()
-                        if emp_result.data and emp_result.data[0].get('email'):
-                            recipient_emails.add(emp_result.data[0]['email'])
-                except Exception as e:
-                    logger.error(f"Error getting employee emails: {str(e)}")
-
-            # Department recipients
-            if notification.get('recipient_departments'):
-                try:
-                    for dept_id in notification['recipient_departments']:
-                        emp_result = supabase.table('employees').select('email').eq('department_id', dept_id).execute()
-                        for emp in emp_result.data or []:
-                            if emp.get('email'):
-                                recipient_emails.add(emp['email'])
-                except Exception as e:
-                    logger.error(f"Error getting department emails: {str(e)}")
-
-            # Role recipients
-            if notification.get('recipient_roles'):
-                try:
-                    for role_id in notification['recipient_roles']:
-                        emp_result = supabase.table('employees').select('email').eq('role_id', role_id).execute()
-                        for emp in emp_result.data or []:
-                            if emp.get('email'):
-                                recipient_emails.add(emp['email'])
-                except Exception as e:
-                    logger.error(f"Error getting role emails: {str(e)}")
-
-            # Send to all
-            if notification.get('send_to_all'):
-                try:
-                    emp_result = supabase.table('employees').select('email').execute()
-                    for emp in emp_result.data or []:
-                        if emp.get('email'):
-                            recipient_emails.add(emp['email'])
-                except Exception as e:
-                    logger.error(f"Error getting all employee emails: {str(e)}")
-
+            return self.recipient_cache.get_recipient_emails(notification, client=supabase)
         except Exception as e:
             logger.error(f"Error getting recipient emails: {str(e)}")
-
-        return list(recipient_emails)
+            return []
 
     def send_notification_now(self, notification_id: int) -> dict:
         """Manually send a notification immediately"""
@@ -276,6 +273,10 @@ class NotificationScheduler:
             }
 
             supabase.table('notifications').update(update_data).eq('id', notification_id).execute()
+            if result['success']:
+                self.recipient_cache.forget(notification_id)
+                self.cancel(notification_id)
+            self._save_delivery_logs(notification_id, result)
 
             return result
 
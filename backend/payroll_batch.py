@@ -0,0 +1,118 @@
+"""
+Tính lương cho cả một kỳ (ky_tinh_luong) trong một lần.
+
+Đọc toàn bộ chấm công, lương sản phẩm và thông tin nhân viên của kỳ bằng các truy
+vấn gộp, tính từng phiếu lương bằng payroll_service.tinh_luong (cùng công thức với
+endpoint /payroll/tinh-luong) rồi ghi tất cả vào phieu_luong bằng một lệnh upsert.
+Lỗi của từng nhân viên được trả về riêng, không làm hỏng cả kỳ.
+"""
+import json
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from payroll_models import NhanVien, BangChamCong, LuongSanPham
+from payroll_service import tinh_luong, load_config
+from supabase_query import fetch_all, get_client
+
+IN_QUERY_CHUNK_SIZE = 200
+
+EMPLOYEE_COLUMNS = 'ma_nv, ho_ten, chuc_vu, phong_ban, luong_hop_dong, muc_luong_dong_bhxh, so_nguoi_phu_thuoc'
+CHAM_CONG_COLUMNS = 'id, ma_nv, ky_tinh_luong, ngay_cong_chuan, ngay_cong_thuc_te, gio_ot_ngay_thuong, gio_ot_cuoi_tuan, gio_ot_le_tet'
+LUONG_SAN_PHAM_COLUMNS = 'id, ma_nv, ky_tinh_luong, san_pham_id, so_luong, don_gia, ty_le'
+
+def _fetch_period_rows(client, table: str, columns: str, ky_tinh_luong: str) -> List[Dict[str, Any]]:
+    return fetch_all(lambda: client.table(table).select(columns).eq('ky_tinh_luong', ky_tinh_luong).order('id'))
+
+def _fetch_employees(client, ma_nv_values: Iterable[Any]) -> List[Dict[str, Any]]:
+    values = list(dict.fromkeys(ma_nv_values))
+    rows = []
+    for start in range(0, len(values), IN_QUERY_CHUNK_SIZE):
+        result = client.table('employees').select(EMPLOYEE_COLUMNS).in_('ma_nv', values[start:start + IN_QUERY_CHUNK_SIZE]).execute()
+        rows.extend(result.data)
+    return rows
+
+def _normalize_ma_nv(ma_nv: str):
+    # Giống normalize_ma_nv trong routers/payroll.py
+    return int(ma_nv) if ma_nv.isdigit() else ma_nv
+
+def _model_fields(row: Dict[str, Any], model) -> Dict[str, Any]:
+    return {field: row.get(field) for field in model.__dataclass_fields__}
+
+def tinh_luong_ky(ky_tinh_luong: str, ma_nv_list: Optional[List[Any]] = None,
+                  phu_cap_khac: Optional[Dict[str, float]] = None, thuong_kpi: Optional[Dict[str, float]] = None,
+                  config: Optional[Dict[str, Any]] = None, client=None) -> Dict[str, Any]:
+    """
+    Tính và lưu phiếu lương cho các nhân viên của một kỳ.
+
+    Args:
+        ky_tinh_luong: Kỳ lương (YYYY-MM)
+        ma_nv_list: Nhân viên cần tính; None = tất cả nhân viên có chấm công trong kỳ
+        phu_cap_khac / thuong_kpi: ma_nv -> số tiền
+
+    Returns:
+        {"payslips": [(PhieuLuong, dòng phieu_luong đã lưu)], "errors": [{"ma_nv", "error"}]}
+    """
+    client = get_client(client)
+    config = config or load_config()
+    phu_cap_khac = {str(key): value for key, value in (phu_cap_khac or {}).items()}
+    thuong_kpi = {str(key): value for key, value in (thuong_kpi or {}).items()}
+
+    # Mã NV có thể là số hoặc chuỗi tùy bảng, luôn so khớp theo str(ma_nv)
+    cham_cong_by_nv = {str(row['ma_nv']): row for row in _fetch_period_rows(client, 'bang_cham_cong', CHAM_CONG_COLUMNS, ky_tinh_luong)}
+    san_pham_by_nv = defaultdict(list)
+    for row in _fetch_period_rows(client, 'luong_san_pham', LUONG_SAN_PHAM_COLUMNS, ky_tinh_luong):
+        san_pham_by_nv[str(row['ma_nv'])].append(row)
+
+    if ma_nv_list is None:
+        targets = list(cham_cong_by_nv)
+        lookup_values = [row['ma_nv'] for row in cham_cong_by_nv.values()]
+    else:
+        targets = list(dict.fromkeys(str(ma_nv) for ma_nv in ma_nv_list))
+        lookup_values = [cham_cong_by_nv[ma_nv]['ma_nv'] if ma_nv in cham_cong_by_nv else _normalize_ma_nv(ma_nv) for ma_nv in targets]
+    employees_by_nv = {str(row['ma_nv']): row for row in _fetch_employees(client, lookup_values)}
+
+    computed, errors = [], []
+    for ma_nv in targets:
+        employee = employees_by_nv.get(ma_nv)
+        if not employee:
+            errors.append({"ma_nv": ma_nv, "error": "Nhân viên không tồn tại"})
+            continue
+        cham_cong = cham_cong_by_nv.get(ma_nv)
+        if not cham_cong:
+            errors.append({"ma_nv": ma_nv, "error": "Không có dữ liệu chấm công cho kỳ này"})
+            continue
+        try:
+            phieu_luong = tinh_luong(
+                NhanVien(**_model_fields(employee, NhanVien)),
+                BangChamCong(**_model_fields(cham_cong, BangChamCong)),
+                [LuongSanPham(**_model_fields(row, LuongSanPham)) for row in san_pham_by_nv.get(ma_nv, [])],
+                config,
+                phu_cap_khac.get(ma_nv, 0),
+                thuong_kpi.get(ma_nv, 0)
+            )
+            computed.append(phieu_luong)
+        except Exception as e:
+            errors.append({"ma_nv": ma_nv, "error": f"Lỗi tính lương: {str(e)}"})
+
+    if not computed:
+        return {"payslips": [], "errors": errors}
+
+    upsert_rows = [{
+        "ma_nv": phieu_luong.ma_nv,
+        "ky_tinh_luong": phieu_luong.ky_tinh_luong,
+        "tong_thu_nhap": phieu_luong.tong_thu_nhap,
+        "tong_khau_tru": phieu_luong.tong_khau_tru,
+        "luong_thuc_nhan": phieu_luong.luong_thuc_nhan,
+        "chi_tiet_thu_nhap": json.dumps(phieu_luong.chi_tiet_thu_nhap),
+        "chi_tiet_khau_tru": json.dumps(phieu_luong.chi_tiet_khau_tru)
+    } for phieu_luong in computed]
+
+    try:
+        result = client.table('phieu_luong').upsert(upsert_rows, on_conflict='ma_nv,ky_tinh_luong').execute()
+    except Exception as e:
+        errors.extend({"ma_nv": str(phieu_luong.ma_nv), "error": f"Lỗi lưu phiếu lương: {str(e)}"} for phieu_luong in computed)
+        return {"payslips": [], "errors": errors}
+
+    saved_by_nv = {str(row.get('ma_nv')): row for row in result.data or []}
+    payslips = [(phieu_luong, saved_by_nv.get(str(phieu_luong.ma_nv), {})) for phieu_luong in computed]
+    return {"payslips": payslips, "errors": errors}
@@ -0,0 +1,202 @@
+"""
+Pool kết nối psycopg2 dùng chung cho các route truy vấn Postgres trực tiếp.
+
+Kết nối được tạo khi cần (tối đa DB_POOL_SIZE) và dùng lại giữa các request thay vì
+mở kết nối mới (TCP, TLS, xác thực) mỗi lần. Kết nối rảnh lâu hơn
+DB_POOL_HEALTH_CHECK_SECONDS được kiểm tra bằng SELECT 1 trước khi cho mượn; kết nối
+hỏng bị bỏ đi. Thời gian chờ mượn kết nối được thống kê để theo dõi pool có đủ lớn.
+"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.getenv('DB_POOL_HEALTH_CHECK_SECONDS', '30'))
+# Ngưỡng (ms) của histogram thời gian chờ mượn kết nối
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000]
+
+class PoolTimeout(Exception):
+    """Không mượn được kết nối trong thời gian cho phép"""
+
+def connection_params() -> Dict[str, Any]:
+    """Tham số kết nối Postgres từ biến môi trường SUPABASE_DB_*"""
+    return {
+        'host': os.environ.get("SUPABASE_DB_HOST"),
+        'database': os.environ.get("SUPABASE_DB_NAME", "postgres"),
+        'user': os.environ.get("SUPABASE_DB_USER"),
+        'password': os.environ.get("SUPABASE_DB_PASSWORD"),
+        'port': os.environ.get("SUPABASE_DB_PORT", "5432")
+    }
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(**connection_params())
+
+class PostgresPool:
+    def __init__(self, connect: Callable[[], Any] = _connect, size: int = DB_POOL_SIZE,
+                 acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT, health_check_seconds: float = DB_POOL_HEALTH_CHECK_SECONDS):
+        self.connect = connect
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_seconds = health_check_seconds
+        # (kết nối, thời điểm trả về pool)
+        self._idle: "queue.LifoQueue[tuple]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'in_use': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+        self._wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def _record(self, **changes):
+        with self._stats_lock:
+            for key, value in changes.items():
+                self._stats[key] += value
+
+    def _record_wait(self, wait_ms: float):
+        bucket = next((index for index, limit in enumerate(WAIT_BUCKETS_MS) if wait_ms <= limit), len(WAIT_BUCKETS_MS))
+        with self._stats_lock:
+            self._stats['acquired'] += 1
+            self._stats['in_use'] += 1
+            self._stats['total_wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+            self._wait_histogram[bucket] += 1
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, connection):
+        self._record(discarded=1)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Mượn một kết nối; PoolTimeout nếu pool đầy quá timeout giây"""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.acquire_timeout if timeout is None else timeout):
+            self._record(timeouts=1)
+            raise PoolTimeout(f"No database connection available after {time.perf_counter() - started:.1f}s (pool size {self.size})")
+        try:
+            connection = None
+            while connection is None:
+                try:
+                    candidate, released_at = self._idle.get_nowait()
+                except queue.Empty:
+                    connection = self.connect()
+                    self._record(created=1)
+                    break
+                stale = time.monotonic() - released_at >= self.health_check_seconds
+                if candidate.closed or (stale and not self._is_alive(candidate)):
+                    self._close(candidate)
+                    continue
+                connection = candidate
+        except Exception:
+            self._slots.release()
+            raise
+        self._record_wait((time.perf_counter() - started) * 1000)
+        return connection
+
+    def release(self, connection, broken: bool = False):
+        """Trả kết nối về pool; giao dịch còn dở được rollback"""
+        try:
+            if not broken and not connection.closed:
+                try:
+                    connection.rollback()
+                except Exception:
+                    broken = True
+            if broken or connection.closed:
+                self._close(connection)
+            else:
+                self._idle.put((connection, time.monotonic()))
+        finally:
+            self._record(in_use=-1)
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        connection = self.acquire(timeout)
+        broken = False
+        try:
+            yield connection
+        except Exception:
+            broken = bool(connection.closed)
+            raise
+        finally:
+            self.release(connection, broken=broken)
+
+    def warm_up(self, count: int = 1):
+        """Mở trước một số kết nối (khi app khởi động)"""
+        connections = [self.acquire() for _ in range(min(count, self.size))]
+        for connection in connections:
+            self.release(connection)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            histogram = list(self._wait_histogram)
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['acquired'], 3) if stats['acquired'] else 0.0
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        stats['idle'] = self._idle.qsize()
+        stats['pool_size'] = self.size
+        stats['wait_ms_histogram'] = {f"<={limit}": count for limit, count in zip(WAIT_BUCKETS_MS, histogram)}
+        stats['wait_ms_histogram'][f">{WAIT_BUCKETS_MS[-1]}"] = histogram[-1]
+        return stats
+
+    def close(self):
+        """Đóng mọi kết nối đang rảnh"""
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+_pool: Optional[PostgresPool] = None
+_pool_lock = threading.Lock()
+
+def get_pg_pool() -> PostgresPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PostgresPool()
+    return _pool
+
+def init_pg_pool():
+    """Tạo pool khi app khởi động; mở sẵn một kết nối nếu đã cấu hình SUPABASE_DB_HOST"""
+    pool = get_pg_pool()
+    if os.environ.get("SUPABASE_DB_HOST"):
+        try:
+            pool.warm_up()
+        except Exception as e:
+            print(f"⚠️  Could not open database pool connection: {e}")
+    return pool
+
+def close_pg_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
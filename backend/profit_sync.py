@@ -0,0 +1,196 @@
+"""
+Đồng bộ bảng profits theo kiểu tăng dần (chỉ tính lại các tháng "bẩn").
+
+Mỗi lần ghi hóa đơn (invoices_reality), chi phí (quanly_chiphi) hoặc phiếu lương
+(phieu_luong) gọi mark_months_dirty() với tháng bị ảnh hưởng. Lần đồng bộ sau chỉ
+tính lại các tháng này bằng hàm tổng hợp profit_month_totals (một RPC cho tất cả
+các tháng, xem create_profit_dirty_months.sql) nên chi phí tỉ lệ với lượng thay
+đổi chứ không với toàn bộ lịch sử.
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from expense_rollup import expense_month, month_range
+from supabase_query import fetch_all, get_client
+
+DIRTY_TABLE = 'profit_dirty_months'
+
+# Tháng chưa ghi được vào DIRTY_TABLE (ví dụ bảng chưa được tạo); vẫn được đồng bộ ở lần sau
+_pending_months = set()
+_pending_lock = threading.Lock()
+
+def _valid_months(months: Iterable[Any]) -> List[str]:
+    result = set()
+    for value in months:
+        month = expense_month(value)
+        if month and len(month) == 7:
+            result.add(month)
+    return sorted(result)
+
+def mark_months_dirty(*months: Any, client=None):
+    """
+    Đánh dấu các tháng (YYYY-MM, ngày hoặc datetime) cần tính lại báo cáo.
+
+    Lỗi chỉ được log: việc ghi hóa đơn/chi phí/lương không được thất bại vì báo cáo.
+    """
+    months = _valid_months(months)
+    if not months:
+        return
+    marked_at = datetime.now(timezone.utc).isoformat()
+    try:
+        get_client(client).table(DIRTY_TABLE).upsert(
+            [{'report_month': month, 'marked_at': marked_at} for month in months],
+            on_conflict='report_month'
+        ).execute()
+    except Exception as e:
+        print(f"Warning: Could not mark profit months dirty {months}: {e}")
+        with _pending_lock:
+            _pending_months.update(months)
+
+def get_dirty_months(client=None) -> List[str]:
+    """Danh sách tháng đang chờ tính lại"""
+    months = set()
+    rows = get_client(client).table(DIRTY_TABLE).select('report_month').execute().data
+    months.update(row['report_month'] for row in rows if row.get('report_month'))
+    with _pending_lock:
+        months.update(_pending_months)
+    return sorted(months)
+
+def _clear_dirty_months(months: List[str], started_at: str, client):
+    """Bỏ đánh dấu các tháng đã đồng bộ, giữ lại tháng bị đánh dấu lại trong lúc đồng bộ"""
+    if not months:
+        return
+    client.table(DIRTY_TABLE).delete().in_('report_month', months).lte('marked_at', started_at).execute()
+    with _pending_lock:
+        _pending_months.difference_update(months)
+
+def _paged_select(client, table: str, columns: str, apply_filters) -> List[Dict[str, Any]]:
+    return fetch_all(lambda: apply_filters(client.table(table).select(columns)).order('id'))
+
+def _scan_month_totals(month: str, client) -> Dict[str, Any]:
+    """Tính tổng của một tháng khi không có hàm profit_month_totals (chỉ đọc các cột cần thiết)"""
+    start_date, end_date = month_range(month)
+    invoices = _paged_select(client, 'invoices_reality', 'id, total_amount',
+                             lambda q: q.gte('invoice_date', start_date).lt('invoice_date', end_date))
+    expenses = _paged_select(client, 'quanly_chiphi', 'id, giathanh, parent_id',
+                             lambda q: q.gte('created_at', start_date).lt('created_at', end_date).is_('parent_id', 'null'))
+    payrolls = _paged_select(client, 'phieu_luong', 'id, luong_thuc_nhan',
+                             lambda q: q.eq('ky_tinh_luong', month))
+    return {
+        'report_month': month,
+        'total_revenue': sum(invoice.get('total_amount') or 0 for invoice in invoices),
+        'invoice_count': len(invoices),
+        # Chỉ tính chi phí gốc, giathanh của chi phí cha đã bao gồm chi phí con
+        'total_expenses': sum(expense.get('giathanh') or 0 for expense in expenses),
+        'expense_count': len(expenses),
+        'total_payroll_expenses': sum(payroll.get('luong_thuc_nhan') or 0 for payroll in payrolls),
+        'payroll_count': len(payrolls),
+    }
+
+def compute_month_totals(months: Iterable[str], client=None) -> Dict[str, Dict[str, Any]]:
+    """
+    Doanh thu, chi phí gốc và lương của từng tháng.
+
+    Returns:
+        dict tháng -> {total_revenue, invoice_count, total_expenses, expense_count,
+                       total_payroll_expenses, payroll_count}
+    """
+    client = get_client(client)
+    months = _valid_months(months)
+    if not months:
+        return {}
+    try:
+        rows = client.rpc('profit_month_totals', {'p_months': months}).execute().data
+        return {row['report_month']: row for row in rows}
+    except Exception as e:
+        print(f"profit_month_totals unavailable, falling back to per-month scans: {e}")
+        return {month: _scan_month_totals(month, client) for month in months}
+
+def get_product_count() -> int:
+    """Số sản phẩm (không phụ thuộc tháng, lấy từ catalog_cache)"""
+    from catalog_cache import catalog_cache
+    return len(catalog_cache.get_rows('sanpham'))
+
+def build_profit_row(month: str, totals: Dict[str, Any], product_count: int) -> Dict[str, Any]:
+    """Dòng profits từ kết quả compute_month_totals"""
+    total_revenue = float(totals.get('total_revenue') or 0)
+    total_payroll_expenses = float(totals.get('total_payroll_expenses') or 0)
+    # Tổng chi phí = chi phí từ quanly_chiphi + chi phí nhân sự
+    total_expenses = float(totals.get('total_expenses') or 0) + total_payroll_expenses
+    total_profit = total_revenue - total_expenses
+    profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
+    return {
+        'report_month': month,
+        'total_revenue': total_revenue,
+        'total_expenses': total_expenses,
+        'total_payroll_expenses': total_payroll_expenses,
+        'total_profit': total_profit,
+        'profit_margin': profit_margin,
+        'invoice_count': int(totals.get('invoice_count') or 0),
+        'expense_count': int(totals.get('expense_count') or 0),
+        'payroll_count': int(totals.get('payroll_count') or 0),
+        'product_count': product_count,
+        'updated_at': 'now()'
+    }
+
+def sync_months(months: Iterable[str], client=None, product_count: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Tính lại và ghi báo cáo profits cho các tháng được chỉ định.
+
+    Returns:
+        {"synced_months", "rows": {tháng: dòng profits}, "errors"}
+    """
+    client = get_client(client)
+    months = _valid_months(months)
+    if not months:
+        return {"synced_months": [], "rows": {}, "errors": []}
+
+    if product_count is None:
+        product_count = get_product_count()
+    totals_by_month = compute_month_totals(months, client)
+    existing = client.table('profits').select('report_month').in_('report_month', months).execute()
+    existing_months = {row['report_month'] for row in existing.data}
+
+    synced, rows, errors, new_rows = [], {}, [], []
+    for month in months:
+        row = build_profit_row(month, totals_by_month.get(month, {}), product_count)
+        try:
+            if month in existing_months:
+                update_data = {key: value for key, value in row.items() if key != 'report_month'}
+                result = client.table('profits').update(update_data).eq('report_month', month).execute()
+                rows[month] = result.data[0] if result.data else row
+                synced.append(month)
+            else:
+                new_rows.append(row)
+        except Exception as e:
+            errors.append(f"Error syncing {month}: {str(e)}")
+
+    if new_rows:
+        try:
+            result = client.table('profits').insert(new_rows).execute()
+            for row in result.data:
+                rows[row['report_month']] = row
+            synced.extend(row['report_month'] for row in new_rows)
+        except Exception as e:
+            errors.extend(f"Error syncing {row['report_month']}: {str(e)}" for row in new_rows)
+
+    return {"synced_months": sorted(synced), "rows": rows, "errors": errors}
+
+def sync_dirty_months(client=None) -> Dict[str, Any]:
+    """Đồng bộ các tháng đã bị đánh dấu và bỏ đánh dấu những tháng thành công"""
+    client = get_client(client)
+    started_at = datetime.now(timezone.utc).isoformat()
+    months = get_dirty_months(client)
+    result = sync_months(months, client)
+    _clear_dirty_months(result['synced_months'], started_at, client)
+    return result
+
+def discover_months(client=None) -> List[str]:
+    """Tất cả các tháng có hóa đơn, chi phí hoặc phiếu lương (dùng cho lần đồng bộ toàn bộ)"""
+    client = get_client(client)
+    months = set()
+    for table, column in (('invoices_reality', 'invoice_date'), ('quanly_chiphi', 'created_at'), ('phieu_luong', 'ky_tinh_luong')):
+        rows = _paged_select(client, table, f'id, {column}', lambda q: q)
+        months.update(row.get(column) for row in rows)
+    return _valid_months(months)
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from supabase_client import supabase
 from typing import List
 from datetime import datetime
@@ -10,127 +11,87 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 # Import budget calculation functions
 from calculate_project_budget import calculate_project_budget_plan, update_project_budget_on_invoice_change, update_project_budget_on_expense_change
+from invoice_enrichment import enrich_invoices
+from catalog_cache import catalog_cache
+from db_executor import offload_db
+from expense_rollup import update_parent_giathanh, rollup_expenses
+from expense_hierarchy import expense_hierarchy_cache, hierarchy_response
+from accounting_report import report_totals, expense_totals_by_lcp, load_loaichiphi, normalize_page, fetch_page
+from generate_profit_excel import write_profit_excel, iter_file_chunks, EXCEL_MEDIA_TYPE
+from invoice_writer import create_invoice_with_items
+from profit_sync import mark_months_dirty, compute_month_totals, build_profit_row, get_product_count, sync_months, sync_dirty_months, discover_months
 
 router = APIRouter(prefix="/accounting")
 
-def update_parent_giathanh(parent_id: int):
-    """Update the giathanh of a parent expense based on its direct children IN THE SAME MONTH"""
-    try:
-        # Get parent expense info to determine the month
-        parent_result = supabase.table('quanly_chiphi').select('created_at').eq('id', parent_id).execute()
-        if not parent_result.data:
-            print(f"Parent expense {parent_id} not found")
-            return
-
-        parent_data = parent_result.data[0]
-        parent_created_at = parent_data.get('created_at')
-
-        if not parent_created_at:
-            print(f"Parent expense {parent_id} has no creation date")
-            return
-
-        # Extract month from parent creation date
-        if isinstance(parent_created_at, str):
-            parent_month = parent_created_at[:7]  # YYYY-MM
-        else:
-            parent_month = parent_created_at.strftime('%Y-%m')
-
-        # Get all direct children
-        children_result = supabase.table('quanly_chiphi').select('giathanh, created_at').eq('parent_id', parent_id).execute()
-
-        # Filter children from the same month
-        same_month_children = []
-        for child in children_result.data:
-            child_created_at = child.get('created_at')
-            if child_created_at:
-                if isinstance(child_created_at, str):
-                    child_month = child_created_at[:7]  # YYYY-MM
-                else:
-                    child_month = child_created_at.strftime('%Y-%m')
-
-                if child_month == parent_month:
-                    same_month_children.append(child)
-
-        # Calculate total from same-month children
-        total_children = sum(child['giathanh'] or 0 for child in same_month_children)
-
-        # Update parent giathanh
-        supabase.table('quanly_chiphi').update({
-            'giathanh': total_children
-        }).eq('id', parent_id).execute()
-
-        print(f"Updated parent expense {parent_id} (month {parent_month}): {total_children}")
-
-        # Recursively update grandparent if exists
-        parent_result = supabase.table('quanly_chiphi').select('parent_id').eq('id', parent_id).execute()
-        if parent_result.data and parent_result.data[0].get('parent_id'):
-            update_parent_giathanh(parent_result.data[0]['parent_id'])
-
-    except Exception as e:
-        print(f"Error updating parent giathanh: {e}")
-
 @router.get("/loainhom/")
-async def get_loainhom():
+@offload_db
+def get_loainhom():
     """Lấy danh sách loại nhôm"""
     try:
-        result = supabase.table('loainhom').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loainhom')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loainhom: {str(e)}")
 
 @router.post("/loainhom/")
-async def create_loainhom(loainhom_data: dict):
+@offload_db
+def create_loainhom(loainhom_data: dict):
     """Tạo loại nhôm mới"""
     try:
         result = supabase.table('loainhom').insert({
             'tenloai': loainhom_data['tenloai'],
             'mo_ta': loainhom_data.get('mo_ta', '')
         }).execute()
+        catalog_cache.invalidate('loainhom')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating loainhom: {str(e)}")
 
 @router.put("/loainhom/{loai_id}")
-async def update_loainhom(loai_id: int, loainhom_data: dict):
+@offload_db
+def update_loainhom(loai_id: int, loainhom_data: dict):
     """Cập nhật loại nhôm"""
     try:
         result = supabase.table('loainhom').update({
             'tenloai': loainhom_data['tenloai'],
             'mo_ta': loainhom_data.get('mo_ta', '')
         }).eq('id', loai_id).execute()
+        catalog_cache.invalidate('loainhom')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating loainhom: {str(e)}")
 
 @router.delete("/loainhom/{loai_id}")
-async def delete_loainhom(loai_id: int):
+@offload_db
+def delete_loainhom(loai_id: int):
     """Xóa loại nhôm"""
     try:
         result = supabase.table('loainhom').delete().eq('id', loai_id).execute()
+        catalog_cache.invalidate('loainhom')
         return {"message": "Loại nhôm đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting loainhom: {str(e)}")
 
 @router.get("/loaiphukienbep/")
-async def get_loaiphukienbep():
+@offload_db
+def get_loaiphukienbep():
     """Lấy danh sách loại phụ kiện bếp"""
     try:
-        result = supabase.table('loaiphukienbep').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaiphukienbep')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaiphukienbep: {str(e)}")
 
 @router.get("/phukienbep/")
-async def get_phukienbep():
+@offload_db
+def get_phukienbep():
     """Lấy danh sách phụ kiện bếp"""
     try:
-        result = supabase.table('phukienbep').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('phukienbep')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching phukienbep: {str(e)}")
 
 @router.post("/phukienbep/")
-async def create_phukienbep(phukien_data: dict):
+@offload_db
+def create_phukienbep(phukien_data: dict):
     """Tạo phụ kiện bếp mới"""
     try:
         result = supabase.table('phukienbep').insert({
@@ -148,12 +109,14 @@ async def create_phukienbep(phukien_data: dict):
             'bao_hanh': phukien_data.get('bao_hanh', ''),
             'xuat_xu': phukien_data.get('xuat_xu', '')
         }).execute()
+        catalog_cache.invalidate('phukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating phukienbep: {str(e)}")
 
 @router.put("/phukienbep/{phukien_id}")
-async def update_phukienbep(phukien_id: int, phukien_data: dict):
+@offload_db
+def update_phukienbep(phukien_id: int, phukien_data: dict):
     """Cập nhật phụ kiện bếp"""
     try:
         result = supabase.table('phukienbep').update({
@@ -172,90 +135,100 @@ async def update_phukienbep(phukien_id: int, phukien_data: dict):
             'xuat_xu': phukien_data.get('xuat_xu', ''),
             'updated_at': 'now()'
         }).eq('id', phukien_id).execute()
+        catalog_cache.invalidate('phukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating phukienbep: {str(e)}")
 
 @router.delete("/phukienbep/{phukien_id}")
-async def delete_phukienbep(phukien_id: int):
+@offload_db
+def delete_phukienbep(phukien_id: int):
     """Xóa phụ kiện bếp"""
     try:
         result = supabase.table('phukienbep').delete().eq('id', phukien_id).execute()
+        catalog_cache.invalidate('phukienbep')
         return {"message": "Phụ kiện bếp đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting phukienbep: {str(e)}")
 
 @router.post("/loaiphukienbep/")
-async def create_loaiphukienbep(loaiphukien_data: dict):
+@offload_db
+def create_loaiphukienbep(loaiphukien_data: dict):
     """Tạo loại phụ kiện bếp mới"""
     try:
         result = supabase.table('loaiphukienbep').insert({
             'tenloai': loaiphukien_data['tenloai'],
             'mo_ta': loaiphukien_data.get('mo_ta', '')
         }).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating loaiphukienbep: {str(e)}")
 
 @router.put("/loaiphukienbep/{loai_id}")
-async def update_loaiphukienbep(loai_id: int, loaiphukien_data: dict):
+@offload_db
+def update_loaiphukienbep(loai_id: int, loaiphukien_data: dict):
     """Cập nhật loại phụ kiện bếp"""
     try:
         result = supabase.table('loaiphukienbep').update({
             'tenloai': loaiphukien_data['tenloai'],
             'mo_ta': loaiphukien_data.get('mo_ta', '')
         }).eq('id', loai_id).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating loaiphukienbep: {str(e)}")
 
 @router.delete("/loaiphukienbep/{loai_id}")
-async def delete_loaiphukienbep(loai_id: int):
+@offload_db
+def delete_loaiphukienbep(loai_id: int):
     """Xóa loại phụ kiện bếp"""
     try:
         result = supabase.table('loaiphukienbep').delete().eq('id', loai_id).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return {"message": "Loại phụ kiện bếp đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting loaiphukienbep: {str(e)}")
 
 @router.get("/loaikinh/")
-async def get_loaikinh():
+@offload_db
+def get_loaikinh():
     """Lấy danh sách loại kính"""
     try:
-        result = supabase.table('loaikinh').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaikinh')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaikinh: {str(e)}")
 
 @router.get("/loaitaynam/")
-async def get_loaitaynam():
+@offload_db
+def get_loaitaynam():
     """Lấy danh sách loại tay nắm"""
     try:
-        result = supabase.table('loaitaynam').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaitaynam')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaitaynam: {str(e)}")
 
 @router.get("/bophan/")
-async def get_bophan():
+@offload_db
+def get_bophan():
     """Lấy danh sách bộ phận"""
     try:
-        result = supabase.table('bophan').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('bophan')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching bophan: {str(e)}")
 
 @router.get("/sanpham/")
-async def get_sanpham():
+@offload_db
+def get_sanpham():
     """Lấy danh sách sản phẩm"""
     try:
-        result = supabase.table('sanpham').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('sanpham')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sanpham: {str(e)}")
 
 @router.get("/chitietsanpham/")
-async def get_chitietsanpham():
+@offload_db
+def get_chitietsanpham():
     """Lấy danh sách chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').select('*').execute()
@@ -263,8 +236,28 @@ async def get_chitietsanpham():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching chitietsanpham: {str(e)}")
 
+@router.get("/catalog_cache/stats/")
+@offload_db
+def get_catalog_cache_stats():
+    """Thống kê hit/miss của cache danh mục sản phẩm"""
+    return catalog_cache.stats()
+
+@router.post("/catalog_cache/invalidate/")
+@offload_db
+def invalidate_catalog_cache(table: str = None):
+    """Xóa cache danh mục (một bảng hoặc tất cả)"""
+    try:
+        if table:
+            catalog_cache.invalidate(table)
+        else:
+            catalog_cache.invalidate()
+        return {"message": "Catalog cache invalidated", "table": table or "all"}
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/sanpham/")
-async def create_sanpham(product_data: dict):
+@offload_db
+def create_sanpham(product_data: dict):
     """Tạo sản phẩm mới"""
     try:
         result = supabase.table('sanpham').insert({
@@ -274,12 +267,14 @@ async def create_sanpham(product_data: dict):
             'id_taynam': product_data.get('id_taynam'),
             'id_bophan': product_data.get('id_bophan')
         }).execute()
+        catalog_cache.invalidate('sanpham')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating sanpham: {str(e)}")
 
 @router.put("/sanpham/{product_id}")
-async def update_sanpham(product_id: int, product_data: dict):
+@offload_db
+def update_sanpham(product_id: int, product_data: dict):
     """Cập nhật sản phẩm"""
     try:
         result = supabase.table('sanpham').update({
@@ -289,24 +284,28 @@ async def update_sanpham(product_id: int, product_data: dict):
             'id_taynam': product_data.get('id_taynam'),
             'id_bophan': product_data.get('id_bophan')
         }).eq('id', product_id).execute()
+        catalog_cache.invalidate('sanpham')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating sanpham: {str(e)}")
 
 @router.delete("/sanpham/{product_id}")
-async def delete_sanpham(product_id: int):
+@offload_db
+def delete_sanpham(product_id: int):
     """Xóa sản phẩm"""
     try:
         # First delete related product details
         supabase.table('chitietsanpham').delete().eq('id_sanpham', product_id).execute()
         # Then delete the product
         result = supabase.table('sanpham').delete().eq('id', product_id).execute()
+        catalog_cache.invalidate('sanpham')
         return {"message": "Product deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting sanpham: {str(e)}")
 
 @router.post("/chitietsanpham/")
-async def create_chitietsanpham(detail_data: dict):
+@offload_db
+def create_chitietsanpham(detail_data: dict):
     """Tạo chi tiết sản phẩm mới"""
     try:
         result = supabase.table('chitietsanpham').insert({
@@ -321,7 +320,8 @@ async def create_chitietsanpham(detail_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating chitietsanpham: {str(e)}")
 
 @router.put("/chitietsanpham/{detail_id}")
-async def update_chitietsanpham(detail_id: int, detail_data: dict):
+@offload_db
+def update_chitietsanpham(detail_id: int, detail_data: dict):
     """Cập nhật chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').update({
@@ -336,7 +336,8 @@ async def update_chitietsanpham(detail_id: int, detail_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating chitietsanpham: {str(e)}")
 
 @router.delete("/chitietsanpham/{detail_id}")
-async def delete_chitietsanpham(detail_id: int):
+@offload_db
+def delete_chitietsanpham(detail_id: int):
     """Xóa chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').delete().eq('id', detail_id).execute()
@@ -345,7 +346,8 @@ async def delete_chitietsanpham(detail_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting chitietsanpham: {str(e)}")
 
 @router.post("/invoices/")
-async def create_invoice(invoice_data: dict):
+@offload_db
+def create_invoice(invoice_data: dict):
     """Tạo hóa đơn mới"""
     try:
         # Tạo công trình trước nếu có thông tin công trình
@@ -376,52 +378,15 @@ async def create_invoice(invoice_data: dict):
             }).execute()
             cong_trinh_id = cong_trinh_result.data[0]['id']
 
-        # Tạo hóa đơn chính
-        invoice_result = supabase.table('invoices_reality').insert({
+        # Tạo hóa đơn chính và toàn bộ chi tiết trong một lần ghi
+        invoice_id = create_invoice_with_items('reality', {
             'customer_name': invoice_data['customer_name'],
             'sales_employee_id': invoice_data.get('sales_employee_id'),
             'invoice_date': invoice_data['invoice_date'],
             'total_amount': invoice_data['total_amount'],
             'id_congtrinh': cong_trinh_id
-        }).execute()
-
-        invoice_id = invoice_result.data[0]['id']
-
-        # Thêm chi tiết hóa đơn
-        for item in invoice_data['items']:
-            # Kiểm tra loại sản phẩm
-            loai_san_pham = item.get('loai_san_pham', 'tu_bep')
-
-            if loai_san_pham == 'phu_kien_bep':
-                # Thêm phụ kiện bếp vào hóa đơn
-                supabase.table('invoice_items_reality').insert({
-                    'invoice_id': invoice_id,
-                    'loai_san_pham': 'phu_kien_bep',
-                    'id_loaiphukien': item.get('id_loaiphukien'),
-                    'id_phukien': item['id_phukien'],
-                    'so_luong': item.get('so_luong', 1),
-                    'don_gia': item['don_gia'],
-                    'chiet_khau': item.get('chiet_khau', 0),
-                    'thanh_tien': item['thanh_tien']
-                }).execute()
-            else:
-                # Thêm sản phẩm tủ bếp vào hóa đơn (như cũ)
-                supabase.table('invoice_items_reality').insert({
-                    'invoice_id': invoice_id,
-                    'loai_san_pham': 'tu_bep',
-                    'id_nhom': item['id_nhom'],
-                    'id_kinh': item['id_kinh'],
-                    'id_taynam': item['id_taynam'],
-                    'id_bophan': item['id_bophan'],
-                    'sanpham_id': item['sanpham_id'],
-                    'ngang': item['ngang'],
-                    'cao': item['cao'],
-                    'sau': item['sau'],
-                    'so_luong': item['so_luong'],
-                    'don_gia': item['don_gia'],
-                    'chiet_khau': item.get('chiet_khau', 0),
-                    'thanh_tien': item['thanh_tien']
-                }).execute()
+        }, invoice_data['items'])
+        mark_months_dirty(invoice_data['invoice_date'])
 
         # Tự động tạo hoa hồng cho nhân viên bán hàng
         if invoice_data.get('sales_employee_id'):
@@ -451,7 +416,8 @@ async def create_invoice(invoice_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating invoice: {str(e)}")
 
 @router.get("/invoices/")
-async def get_invoices(month: str = None):
+@offload_db
+def get_invoices(month: str = None):
     """Lấy danh sách hóa đơn, có thể lọc theo tháng"""
     try:
         query = supabase.table('invoices_reality').select('*')
@@ -470,167 +436,16 @@ async def get_invoices(month: str = None):
 
         result = query.order('invoice_date', desc=True).execute()
 
-        # Lấy chi tiết cho mỗi hóa đơn
-        invoices_with_items = []
-        for invoice in result.data:
-            # Lấy thông tin công trình nếu có
-            cong_trinh_info = None
-            if invoice.get('id_congtrinh'):
-                try:
-                    cong_trinh_result = supabase.table('cong_trinh').select('*').eq('id', invoice['id_congtrinh']).execute()
-                    if cong_trinh_result.data:
-                        cong_trinh_info = cong_trinh_result.data[0]
-                except Exception as e:
-                    print(f"Error fetching cong_trinh for invoice {invoice['id']}: {e}")
-
-            # Lấy items của invoice này
-            items_result = supabase.table('invoice_items_reality').select('*').eq('invoice_id', invoice['id']).execute()
-
-            # Lấy thông tin chi tiết cho mỗi item
-            items_with_details = []
-            for item in items_result.data:
-                item_with_details = dict(item)
-
-                # Lấy thông tin sản phẩm
-                if item.get('sanpham_id'):
-                    try:
-                        product_id = item['sanpham_id']
-                        if product_id:
-                            product_result = supabase.table('sanpham').select('*').eq('id', product_id).execute()
-                            if product_result.data:
-                                product = product_result.data[0]
-
-                                # Lấy tên loại nhôm
-                                if product.get('id_nhom'):
-                                    try:
-                                        nhom_id = product['id_nhom']
-                                        if nhom_id:
-                                            nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                            if nhom_result.data:
-                                                product['ten_nhom'] = nhom_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại kính
-                                if product.get('id_kinh'):
-                                    try:
-                                        kinh_id = product['id_kinh']
-                                        if kinh_id:
-                                            kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                            if kinh_result.data:
-                                                product['ten_kinh'] = kinh_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại tay nắm
-                                if product.get('id_taynam'):
-                                    try:
-                                        taynam_id = product['id_taynam']
-                                        if taynam_id:
-                                            taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                                            if taynam_result.data:
-                                                product['ten_taynam'] = taynam_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên bộ phận
-                                if product.get('id_bophan'):
-                                    try:
-                                        bophan_id = product['id_bophan']
-                                        if bophan_id:
-                                            bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                            if bophan_result.data:
-                                                product['ten_bophan'] = bophan_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['sanpham'] = product
-                    except (ValueError, TypeError):
-                        pass
-
-                # Xử lý phụ kiện bếp nếu có
-                if item.get('id_phukien') and item.get('loai_san_pham') == 'phu_kien_bep':
-                    try:
-                        phukien_id = item['id_phukien']
-                        if phukien_id:
-                            phukien_result = supabase.table('phukienbep').select('*').eq('id', phukien_id).execute()
-                            if phukien_result.data:
-                                phukien = phukien_result.data[0]
-
-                                # Lấy tên loại phụ kiện bếp
-                                if phukien.get('id_loaiphukien'):
-                                    try:
-                                        loaiphukien_result = supabase.table('loaiphukienbep').select('tenloai').eq('id', phukien['id_loaiphukien']).execute()
-                                        if loaiphukien_result.data:
-                                            phukien['ten_loai_phukien'] = loaiphukien_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['phukien'] = phukien
-                    except (ValueError, TypeError):
-                        pass
-
-                # Nếu không có sanpham_id hoặc không tìm thấy sản phẩm, lấy thông tin từ item trực tiếp
-                if not item_with_details.get('sanpham') and not item_with_details.get('phukien'):
-                    # Lấy tên loại nhôm từ item
-                    if item.get('id_nhom'):
-                        try:
-                            nhom_id = item['id_nhom']
-                            if nhom_id:
-                                nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                if nhom_result.data:
-                                    item_with_details['ten_nhom'] = nhom_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại kính từ item
-                    if item.get('id_kinh'):
-                        try:
-                            kinh_id = item['id_kinh']
-                            if kinh_id:
-                                kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                if kinh_result.data:
-                                    item_with_details['ten_kinh'] = kinh_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại tay nắm từ item
-                    if item.get('id_taynam'):
-                        try:
-                            taynam_id = item['id_taynam']
-                            if taynam_id:
-                                taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                                if taynam_result.data:
-                                    item_with_details['ten_taynam'] = taynam_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên bộ phận từ item
-                    if item.get('id_bophan'):
-                        try:
-                            bophan_id = item['id_bophan']
-                            if bophan_id:
-                                bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                if bophan_result.data:
-                                    item_with_details['ten_bophan'] = bophan_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                items_with_details.append(item_with_details)
-
-            invoice_with_items = {
-                **invoice,
-                'items': items_with_details,
-                'cong_trinh': cong_trinh_info
-            }
-            invoices_with_items.append(invoice_with_items)
+        # Lấy công trình và chi tiết cho cả trang hóa đơn bằng truy vấn gộp
+        invoices_with_items = enrich_invoices(result.data, 'invoice_items_reality', include_cong_trinh=True)
 
         return {"invoices": invoices_with_items}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching invoices: {str(e)}")
 
 @router.get("/loaichiphi/")
-async def get_loaichiphi():
+@offload_db
+def get_loaichiphi():
     """Lấy danh sách loại chi phí"""
     try:
         result = supabase.table('loaichiphi').select('*').execute()
@@ -649,7 +464,8 @@ async def get_loaichiphi():
         raise HTTPException(status_code=500, detail=f"Error fetching loaichiphi: {str(e)}")
 
 @router.post("/loaichiphi/")
-async def create_loaichiphi(loaichiphi_data: dict):
+@offload_db
+def create_loaichiphi(loaichiphi_data: dict):
     """Tạo loại chi phí mới"""
     try:
         result = supabase.table('loaichiphi').insert({
@@ -669,7 +485,8 @@ async def create_loaichiphi(loaichiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating loaichiphi: {str(e)}")
 
 @router.put("/loaichiphi/{loaichiphi_id}")
-async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
+@offload_db
+def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
     """Cập nhật loại chi phí"""
     try:
         result = supabase.table('loaichiphi').update({
@@ -677,6 +494,7 @@ async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
             'tenchiphi': loaichiphi_data['tenchiphi'],  # Map tenchiphi -> tenchiphi
             'giathanh': loaichiphi_data.get('giathanh')  # Add giathanh field
         }).eq('id', loaichiphi_id).execute()
+        expense_hierarchy_cache.invalidate()
         # Transform response to match expected format
         item = result.data[0]
         return {
@@ -689,7 +507,8 @@ async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating loaichiphi: {str(e)}")
 
 @router.delete("/loaichiphi/{loaichiphi_id}")
-async def delete_loaichiphi(loaichiphi_id: int):
+@offload_db
+def delete_loaichiphi(loaichiphi_id: int):
     """Xóa loại chi phí"""
     try:
         # Kiểm tra xem có chi phí nào đang sử dụng loại này không
@@ -698,6 +517,7 @@ async def delete_loaichiphi(loaichiphi_id: int):
             raise HTTPException(status_code=400, detail="Không thể xóa loại chi phí đang được sử dụng")
 
         result = supabase.table('loaichiphi').delete().eq('id', loaichiphi_id).execute()
+        expense_hierarchy_cache.invalidate()
         return {"message": "Loại chi phí đã được xóa thành công"}
     except HTTPException:
         raise
@@ -705,7 +525,8 @@ async def delete_loaichiphi(loaichiphi_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting loaichiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/")
-async def get_quanly_chiphi(month: str = None):
+@offload_db
+def get_quanly_chiphi(month: str = None):
     """Lấy danh sách chi phí, có thể lọc theo tháng"""
     try:
         # Get quanly_chiphi data first with basic columns
@@ -756,85 +577,23 @@ async def get_quanly_chiphi(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching quanly_chiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/hierarchy/")
-async def get_quanly_chiphi_hierarchy(month: str = None):
-    """Lấy danh sách chi phí theo cấu trúc cây phân cấp"""
+@offload_db
+def get_quanly_chiphi_hierarchy(request: Request, month: str = None):
+    """Lấy danh sách chi phí theo cấu trúc cây phân cấp (snapshot có ETag, 304 nếu client đã có bản mới nhất)"""
     try:
-        # Get all expenses with their category info
-        query = supabase.table('quanly_chiphi').select('*')
-
-        if month:
-            start_date = f"{month}-01"
-            year, month_num = map(int, month.split('-'))
-            if month_num == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month_num + 1:02d}-01"
-            query = query.gte('created_at', start_date).lt('created_at', end_date)
-
-        result = query.order('id', desc=True).execute()
-
-        # Get all categories for mapping
-        categories_result = supabase.table('loaichiphi').select('*').execute()
-        categories_map = {cat['id']: cat for cat in categories_result.data}
-
-        # Build hierarchy
-        expenses_map = {}
-        root_expenses = []
-
-        # First pass: create expense objects with category info
-        for item in result.data:
-            expense = dict(item)
-            if item.get('id_lcp') and item['id_lcp'] in categories_map:
-                expense['loaichiphi'] = {
-                    'id': categories_map[item['id_lcp']]['id'],
-                    'tenchiphi': categories_map[item['id_lcp']].get('tenchiphi', ''),
-                    'loaichiphi': categories_map[item['id_lcp']].get('loaichiphi', ''),
-                    'giathanh': categories_map[item['id_lcp']].get('giathanh')
-                }
-            else:
-                expense['loaichiphi'] = None
-
-            expense['children'] = []
-            expenses_map[item['id']] = expense
-
-        # Second pass: build hierarchy
-        for expense in expenses_map.values():
-            parent_id = expense.get('parent_id')
-            if parent_id and parent_id in expenses_map:
-                expenses_map[parent_id]['children'].append(expense)
-            else:
-                root_expenses.append(expense)
-
-        # Calculate totals for each level
-        def calculate_totals(expense):
-            # For parent expenses, giathanh should be sum of direct children IN THE SAME MONTH
-            if expense['children']:
-                # Filter children from the same month as parent
-                parent_month = expense.get('created_at', '')[:7] if expense.get('created_at') else ''
-                same_month_children = []
-                for child in expense['children']:
-                    child_month = child.get('created_at', '')[:7] if child.get('created_at') else ''
-                    if child_month == parent_month:
-                        same_month_children.append(child)
-
-                total_direct_children = sum(child['giathanh'] or 0 for child in same_month_children)
-                expense['giathanh'] = total_direct_children
-            # total_amount is the sum of all descendants (for display purposes)
-            total = expense['giathanh'] or 0
-            for child in expense['children']:
-                total += calculate_totals(child)
-            expense['total_amount'] = total
-            return total
-
-        for expense in root_expenses:
-            calculate_totals(expense)
-
-        return {"hierarchy": root_expenses}
+        return hierarchy_response(month, request.headers.get('if-none-match'))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching expense hierarchy: {str(e)}")
 
+@router.get("/quanly_chiphi/hierarchy/stats/")
+@offload_db
+def get_expense_hierarchy_cache_stats():
+    """Thống kê cache cây chi phí (hit/miss, số snapshot theo tháng)"""
+    return expense_hierarchy_cache.stats()
+
 @router.post("/quanly_chiphi/")
-async def create_quanly_chiphi(chiphi_data: dict):
+@offload_db
+def create_quanly_chiphi(chiphi_data: dict):
     """Tạo chi phí mới"""
     try:
         # Validate parent_id to prevent circular references
@@ -877,6 +636,8 @@ async def create_quanly_chiphi(chiphi_data: dict):
         # Update parent giathanh if this is a child expense
         if parent_id:
             update_parent_giathanh(parent_id)
+        mark_months_dirty(result.data[0].get('created_at') if result.data else None)
+        expense_hierarchy_cache.apply_upsert(*result.data)
 
         # Update ratios for the month
         try:
@@ -904,6 +665,7 @@ async def create_quanly_chiphi(chiphi_data: dict):
             )
             if result.returncode != 0:
                 print(f"Warning: Failed to update ratios: {result.stderr}")
+            expense_hierarchy_cache.refresh_ratios(expense_month)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
 
@@ -916,12 +678,14 @@ async def create_quanly_chiphi(chiphi_data: dict):
         return {"message": "Expense creation attempted", "error": str(e)}
 
 @router.put("/quanly_chiphi/{chiphi_id}")
-async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
+@offload_db
+def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
     """Cập nhật chi phí"""
     try:
         # Get current expense to check if parent changed
-        current_expense = supabase.table('quanly_chiphi').select('parent_id').eq('id', chiphi_id).execute()
+        current_expense = supabase.table('quanly_chiphi').select('parent_id, created_at').eq('id', chiphi_id).execute()
         old_parent_id = current_expense.data[0]['parent_id'] if current_expense.data else None
+        old_created_at = current_expense.data[0].get('created_at') if current_expense.data else None
 
         # Validate parent_id to prevent circular references
         parent_id = chiphi_data.get('parent_id')
@@ -961,6 +725,8 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
             update_parent_giathanh(parent_id)
         if old_parent_id and old_parent_id != parent_id:
             update_parent_giathanh(old_parent_id)
+        mark_months_dirty(old_created_at, result.data[0].get('created_at') if result.data else None)
+        expense_hierarchy_cache.apply_upsert(*result.data)
 
         # Update ratios for the affected months
         try:
@@ -992,6 +758,7 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
                 )
                 if subprocess_result.returncode != 0:
                     print(f"Warning: Failed to update ratios for month {month}: {subprocess_result.stderr}")
+            expense_hierarchy_cache.refresh_ratios(*months_to_update)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
 
@@ -1002,13 +769,16 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating quanly_chiphi: {str(e)}")
 
 @router.delete("/quanly_chiphi/{chiphi_id}")
-async def delete_quanly_chiphi(chiphi_id: int):
+@offload_db
+def delete_quanly_chiphi(chiphi_id: int):
     """Xóa chi phí và tất cả chi phí con"""
     try:
         # Get parent_id before deletion
-        expense_result = supabase.table('quanly_chiphi').select('parent_id').eq('id', chiphi_id).execute()
+        expense_result = supabase.table('quanly_chiphi').select('parent_id, created_at').eq('id', chiphi_id).execute()
         parent_id = expense_result.data[0]['parent_id'] if expense_result.data else None
 
+        deleted_ids = []
+
         # Function to recursively delete expense and its children
         def delete_expense_recursive(expense_id):
             # Find all children
@@ -1018,6 +788,7 @@ async def delete_quanly_chiphi(chiphi_id: int):
             
             # Delete the expense itself
             supabase.table('quanly_chiphi').delete().eq('id', expense_id).execute()
+            deleted_ids.append(expense_id)
 
         # Start recursive deletion
         delete_expense_recursive(chiphi_id)
@@ -1025,6 +796,9 @@ async def delete_quanly_chiphi(chiphi_id: int):
         # Update parent giathanh after deletion
         if parent_id:
             update_parent_giathanh(parent_id)
+        if expense_result.data:
+            mark_months_dirty(expense_result.data[0].get('created_at'))
+        expense_hierarchy_cache.apply_delete(deleted_ids)
 
         # Update ratios for the affected month
         try:
@@ -1050,6 +824,7 @@ async def delete_quanly_chiphi(chiphi_id: int):
                     )
                     if result.returncode != 0:
                         print(f"Warning: Failed to update ratios for month {expense_month}: {result.stderr}")
+                    expense_hierarchy_cache.refresh_ratios(expense_month)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
         
@@ -1058,55 +833,30 @@ async def delete_quanly_chiphi(chiphi_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting quanly_chiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/tong_quan/")
-async def get_chiphi_tong_quan(month: str = None):
-    """Lấy tổng quan chi phí theo tháng"""
+@offload_db
+def get_chiphi_tong_quan(month: str = None, include_rows: bool = False, page: int = 1, page_size: int = 100):
+    """
+    Lấy tổng quan chi phí theo tháng
+
+    Tổng và phân loại được tính trong database; monthly_data chỉ có dữ liệu khi
+    include_rows=true và được phân trang theo page/page_size.
+    """
     try:
-        # Get quanly_chiphi data first
-        query = supabase.table('quanly_chiphi').select('*')
-
-        if month:
-            # Lọc theo tháng (định dạng YYYY-MM)
-            start_date = f"{month}-01"
-            # Tính ngày cuối tháng
-            year, month_num = map(int, month.split('-'))
-            if month_num == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month_num + 1:02d}-01"
-
-            query = query.gte('created_at', start_date).lt('created_at', end_date)
+        totals = report_totals(month)
+        totals_by_lcp = expense_totals_by_lcp(month)
 
-        result = query.execute()
-
-        # Fetch loaichiphi data for all items
         loaichiphi_map = {}
-        if result.data:
-            # Get unique loaichiphi IDs
-            loaichiphi_ids = list(set(item.get('id_lcp') for item in result.data if item.get('id_lcp')))
-            if loaichiphi_ids:
-                try:
-                    loaichiphi_result = supabase.table('loaichiphi').select('*').in_('id', loaichiphi_ids).execute()
-                    loaichiphi_map = {item['id']: item for item in loaichiphi_result.data}
-                except Exception as e:
-                    print(f"Error fetching loaichiphi data: {e}")
-
-        # Tính tổng chi phí (chỉ chi phí cha)
-        total_expenses = sum(item['giathanh'] for item in result.data if not item.get('parent_id'))
+        try:
+            loaichiphi_map = load_loaichiphi(totals_by_lcp.keys())
+        except Exception as e:
+            print(f"Error fetching loaichiphi data: {e}")
 
-        # Nhóm theo loại chi phí
+        # Nhóm theo loại chi phí (chỉ chi phí cha)
         expense_by_category = {}
         expense_by_type = {'cố định': 0, 'biến phí': 0}
 
-        for item in result.data:
-            # Skip child expenses for category/type calculations
-            if item.get('parent_id'):
-                continue
-
-            # Get loaichiphi data from map
-            loaichiphi_data = None
-            if item.get('id_lcp') and item['id_lcp'] in loaichiphi_map:
-                loaichiphi_data = loaichiphi_map[item['id_lcp']]
-
+        for id_lcp, total in totals_by_lcp.items():
+            loaichiphi_data = loaichiphi_map.get(id_lcp)
             if loaichiphi_data:
                 category_name = loaichiphi_data.get('tenchiphi', 'Chưa phân loại')  # Map tenchiphi -> category name
                 type_name = loaichiphi_data.get('loaichiphi', 'Chưa phân loại')  # Map loaichiphi -> type name
@@ -1114,59 +864,41 @@ async def get_chiphi_tong_quan(month: str = None):
                 category_name = 'Chưa phân loại'
                 type_name = 'Chưa phân loại'
 
-            if category_name not in expense_by_category:
-                expense_by_category[category_name] = 0
-            expense_by_category[category_name] += item['giathanh']
-
+            expense_by_category[category_name] = expense_by_category.get(category_name, 0) + total
             if type_name in expense_by_type:
-                expense_by_type[type_name] += item['giathanh']
+                expense_by_type[type_name] += total
 
-        return {
-            "total_expenses": total_expenses,
-            "expense_count": len(result.data),
+        response = {
+            "total_expenses": totals['total_expenses'],
+            "expense_count": totals['expense_count'],
             "expense_by_category": expense_by_category,
             "expense_by_type": expense_by_type,
-            "monthly_data": result.data
+            "monthly_data": []
         }
+        if include_rows:
+            page, page_size = normalize_page(page, page_size)
+            response["monthly_data"] = fetch_page('quanly_chiphi', 'created_at', month, page, page_size)
+            response["pagination"] = {"page": page, "page_size": page_size, "total": totals['expense_count']}
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching expense overview: {str(e)}")
 
 @router.get("/profit/")
-async def get_profit_report(month: str = None):
-    """Lấy báo cáo hoạt động kinh doanh tổng hợp"""
+@offload_db
+def get_profit_report(month: str = None, include_rows: bool = False, page: int = 1, page_size: int = 100):
+    """
+    Lấy báo cáo hoạt động kinh doanh tổng hợp
+
+    Tổng và phân loại được tính trong database; details.revenue / expenses /
+    payroll_expenses chỉ có dữ liệu khi include_rows=true và được phân trang.
+    """
     try:
-        # Lấy dữ liệu doanh thu
-        revenue_query = supabase.table('invoices_reality').select('*')
-        if month:
-            start_date = f"{month}-01"
-            year, month_num = map(int, month.split('-'))
-            if month_num == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month_num + 1:02d}-01"
-            revenue_query = revenue_query.gte('invoice_date', start_date).lt('invoice_date', end_date)
-
-        revenue_result = revenue_query.execute()
-        total_revenue = sum(invoice['total_amount'] or 0 for invoice in revenue_result.data)
-
-        # Lấy dữ liệu chi phí
-        expense_query = supabase.table('quanly_chiphi').select('*')
-        if month:
-            expense_query = expense_query.gte('created_at', start_date).lt('created_at', end_date)
-
-        expense_result = expense_query.execute()
-        total_expenses = sum(expense['giathanh'] or 0 for expense in expense_result.data if not expense.get('parent_id'))
-
-        # Lấy dữ liệu chi phí nhân sự (lương)
-        payroll_query = supabase.table('phieu_luong').select('luong_thuc_nhan')
-        if month:
-            payroll_query = payroll_query.eq('ky_tinh_luong', month)
-
-        payroll_result = payroll_query.execute()
-        total_payroll_expenses = sum(payroll['luong_thuc_nhan'] or 0 for payroll in payroll_result.data)
+        totals = report_totals(month)
+        total_revenue = totals['total_revenue']
+        total_payroll_expenses = totals['total_payroll_expenses']
 
         # Tổng chi phí = chi phí từ quanly_chiphi + chi phí nhân sự
-        total_expenses += total_payroll_expenses
+        total_expenses = totals['total_expenses'] + total_payroll_expenses
 
         # Tính lợi nhuận
         total_profit = total_revenue - total_expenses
@@ -1179,38 +911,46 @@ async def get_profit_report(month: str = None):
         expense_by_category = {}
         expense_by_type = {'định phí': 0, 'biến phí': 0}
 
-        # Lấy thông tin loại chi phí
-        if expense_result.data:
-            loaichiphi_ids = list(set(item.get('id_lcp') for item in expense_result.data if item.get('id_lcp')))
-            if loaichiphi_ids:
-                try:
-                    loaichiphi_result = supabase.table('loaichiphi').select('*').in_('id', loaichiphi_ids).execute()
-                    loaichiphi_map = {item['id']: item for item in loaichiphi_result.data}
-
-                    for expense in expense_result.data:
-                        # Skip child expenses for category/type calculations
-                        if expense.get('parent_id'):
-                            continue
-
-                        loaichiphi_data = loaichiphi_map.get(expense.get('id_lcp'))
-                        if loaichiphi_data:
-                            category_name = loaichiphi_data.get('tenchiphi', 'Chưa phân loại')
-                            type_name = loaichiphi_data.get('loaichiphi', 'Chưa phân loại')
-
-                            if category_name not in expense_by_category:
-                                expense_by_category[category_name] = 0
-                            expense_by_category[category_name] += expense['giathanh'] or 0
-
-                            if type_name in expense_by_type:
-                                expense_by_type[type_name] += expense['giathanh'] or 0
-                except Exception as e:
-                    print(f"Error fetching loaichiphi data: {e}")
+        totals_by_lcp = expense_totals_by_lcp(month)
+        try:
+            loaichiphi_map = load_loaichiphi(totals_by_lcp.keys())
+            for id_lcp, total in totals_by_lcp.items():
+                loaichiphi_data = loaichiphi_map.get(id_lcp)
+                if loaichiphi_data:
+                    category_name = loaichiphi_data.get('tenchiphi', 'Chưa phân loại')
+                    type_name = loaichiphi_data.get('loaichiphi', 'Chưa phân loại')
+
+                    expense_by_category[category_name] = expense_by_category.get(category_name, 0) + total
+                    if type_name in expense_by_type:
+                        expense_by_type[type_name] += total
+        except Exception as e:
+            print(f"Error fetching loaichiphi data: {e}")
 
         # Thêm chi phí nhân sự vào phân tích chi phí
         if total_payroll_expenses > 0:
             expense_by_category['Chi phí nhân sự'] = total_payroll_expenses
             expense_by_type['định phí'] += total_payroll_expenses  # Giả sử lương là chi phí định phí
 
+        details = {
+            "revenue": [],
+            "expenses": [],
+            "payroll_expenses": [],
+            "expense_by_category": expense_by_category,
+            "expense_by_type": expense_by_type
+        }
+        if include_rows:
+            page, page_size = normalize_page(page, page_size)
+            details["revenue"] = fetch_page('invoices_reality', 'invoice_date', month, page, page_size)
+            details["expenses"] = fetch_page('quanly_chiphi', 'created_at', month, page, page_size)
+            details["payroll_expenses"] = fetch_page('phieu_luong', 'ky_tinh_luong', month, page, page_size, columns='id, luong_thuc_nhan')
+            details["pagination"] = {
+                "page": page,
+                "page_size": page_size,
+                "revenue_total": totals['revenue_count'],
+                "expense_total": totals['expense_count'],
+                "payroll_total": totals['payroll_count']
+            }
+
         return {
             "period": month or "all",
             "summary": {
@@ -1219,24 +959,19 @@ async def get_profit_report(month: str = None):
                 "total_payroll_expenses": total_payroll_expenses,
                 "total_profit": total_profit,
                 "profit_margin": profit_margin,
-                "revenue_count": len(revenue_result.data),
-                "expense_count": len(expense_result.data),
-                "payroll_count": len(payroll_result.data)
-            },
-            "details": {
-                "revenue": revenue_result.data,
-                "expenses": expense_result.data,
-                "payroll_expenses": payroll_result.data,
-                "expense_by_category": expense_by_category,
-                "expense_by_type": expense_by_type
+                "revenue_count": totals['revenue_count'],
+                "expense_count": totals['expense_count'],
+                "payroll_count": totals['payroll_count']
             },
+            "details": details,
             "status": "profit" if total_profit >= 0 else "loss"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching profit report: {str(e)}")
 
 @router.get("/profits/")
-async def get_profit_reports(month: str = None):
+@offload_db
+def get_profit_reports(month: str = None):
     """Lấy danh sách báo cáo hoạt động kinh doanh (sort bằng Python thay vì database index)"""
     try:
         query = supabase.table('profits').select('*')
@@ -1259,7 +994,8 @@ async def get_profit_reports(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching profit reports: {str(e)}")
 
 @router.post("/profits/")
-async def create_profit_report(report_data: dict):
+@offload_db
+def create_profit_report(report_data: dict):
     """Tạo báo cáo hoạt động kinh doanh mới"""
     try:
         result = supabase.table('profits').insert({
@@ -1280,7 +1016,8 @@ async def create_profit_report(report_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating profit report: {str(e)}")
 
 @router.put("/profits/{report_id}")
-async def update_profit_report(report_id: int, report_data: dict):
+@offload_db
+def update_profit_report(report_id: int, report_data: dict):
     """Cập nhật báo cáo hoạt động kinh doanh"""
     try:
         result = supabase.table('profits').update({
@@ -1300,7 +1037,8 @@ async def update_profit_report(report_id: int, report_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating profit report: {str(e)}")
 
 @router.delete("/profits/{report_id}")
-async def delete_profit_report(report_id: int):
+@offload_db
+def delete_profit_report(report_id: int):
     """Xóa báo cáo hoạt động kinh doanh"""
     try:
         result = supabase.table('profits').delete().eq('id', report_id).execute()
@@ -1309,7 +1047,8 @@ async def delete_profit_report(report_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting profit report: {str(e)}")
 
 @router.post("/profits/generate/{month}")
-async def generate_profit_report(month: str):
+@offload_db
+def generate_profit_report(month: str):
     """Tự động tạo báo cáo hoạt động kinh doanh cho tháng cụ thể"""
     try:
         # Kiểm tra xem đã có báo cáo cho tháng này chưa
@@ -1317,50 +1056,12 @@ async def generate_profit_report(month: str):
         if existing.data:
             raise HTTPException(status_code=400, detail=f"Profit report for {month} already exists")
 
-        # Lấy dữ liệu doanh thu
-        start_date = f"{month}-01"
-        year, month_num = map(int, month.split('-'))
-        if month_num == 12:
-            end_date = f"{year + 1}-01-01"
-        else:
-            end_date = f"{year}-{month_num + 1:02d}-01"
-
-        revenue_result = supabase.table('invoices_reality').select('*').gte('invoice_date', start_date).lt('invoice_date', end_date).execute()
-        total_revenue = sum(invoice['total_amount'] or 0 for invoice in revenue_result.data)
-
-        # Lấy dữ liệu chi phí
-        expense_result = supabase.table('quanly_chiphi').select('*').gte('created_at', start_date).lt('created_at', end_date).execute()
-        total_expenses = sum(expense['giathanh'] or 0 for expense in expense_result.data if not expense.get('parent_id'))
-
-        # Lấy dữ liệu chi phí nhân sự (lương)
-        payroll_result = supabase.table('phieu_luong').select('luong_thuc_nhan').eq('ky_tinh_luong', month).execute()
-        total_payroll_expenses = sum(payroll['luong_thuc_nhan'] or 0 for payroll in payroll_result.data)
-
-        # Tổng chi phí = chi phí từ quanly_chiphi + chi phí nhân sự
-        total_expenses += total_payroll_expenses
-
-        # Lấy số lượng sản phẩm
-        product_result = supabase.table('sanpham').select('id', count='exact').execute()
-        product_count = product_result.count or 0
-
-        # Tính lợi nhuận
-        total_profit = total_revenue - total_expenses
-        profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
+        # Tính tổng doanh thu, chi phí và lương của tháng
+        totals = compute_month_totals([month]).get(month, {})
+        product_count = get_product_count()
 
         # Tạo báo cáo
-        result = supabase.table('profits').insert({
-            'report_month': month,
-            'total_revenue': total_revenue,
-            'total_expenses': total_expenses,
-            'total_payroll_expenses': total_payroll_expenses,
-            'total_profit': total_profit,
-            'profit_margin': profit_margin,
-            'invoice_count': len(revenue_result.data),
-            'expense_count': len([e for e in expense_result.data if not e.get('parent_id')]),  # Only count parent expenses
-            'payroll_count': len(payroll_result.data),
-            'product_count': product_count,
-            'updated_at': 'now()'
-        }).execute()
+        result = supabase.table('profits').insert(build_profit_row(month, totals, product_count)).execute()
 
         return result.data[0]
     except HTTPException:
@@ -1369,262 +1070,60 @@ async def generate_profit_report(month: str):
         raise HTTPException(status_code=500, detail=f"Error generating profit report: {str(e)}")
 
 @router.put("/profits/sync/{month}")
-async def sync_profit_report(month: str):
+@offload_db
+def sync_profit_report(month: str):
     """Đồng bộ lại báo cáo hoạt động kinh doanh cho tháng cụ thể"""
     try:
-        # Lấy dữ liệu doanh thu
-        start_date = f"{month}-01"
-        year, month_num = map(int, month.split('-'))
-        if month_num == 12:
-            end_date = f"{year + 1}-01-01"
-        else:
-            end_date = f"{year}-{month_num + 1:02d}-01"
-
-        revenue_result = supabase.table('invoices_reality').select('*').gte('invoice_date', start_date).lt('invoice_date', end_date).execute()
-        total_revenue = sum(invoice['total_amount'] or 0 for invoice in revenue_result.data)
-
-        # Lấy dữ liệu chi phí
-        expense_result = supabase.table('quanly_chiphi').select('*').gte('created_at', start_date).lt('created_at', end_date).execute()
-        total_expenses = sum(expense['giathanh'] or 0 for expense in expense_result.data if not expense.get('parent_id'))
-
-        # Lấy dữ liệu chi phí nhân sự (lương)
-        payroll_result = supabase.table('phieu_luong').select('luong_thuc_nhan').eq('ky_tinh_luong', month).execute()
-        total_payroll_expenses = sum(payroll['luong_thuc_nhan'] or 0 for payroll in payroll_result.data)
-
-        # Tổng chi phí = chi phí từ quanly_chiphi + chi phí nhân sự
-        total_expenses += total_payroll_expenses
-
-        # Lấy số lượng sản phẩm
-        product_result = supabase.table('sanpham').select('id', count='exact').execute()
-        product_count = product_result.count or 0
-
-        # Tính lợi nhuận
-        total_profit = total_revenue - total_expenses
-        profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
-
-        # Cập nhật hoặc tạo mới
-        existing = supabase.table('profits').select('*').eq('report_month', month).execute()
-        if existing.data:
-            # Cập nhật
-            result = supabase.table('profits').update({
-                'total_revenue': total_revenue,
-                'total_expenses': total_expenses,
-                'total_payroll_expenses': total_payroll_expenses,
-                'total_profit': total_profit,
-                'profit_margin': profit_margin,
-                'invoice_count': len(revenue_result.data),
-                'expense_count': len([e for e in expense_result.data if not e.get('parent_id')]),  # Only count parent expenses
-                'payroll_count': len(payroll_result.data),
-                'product_count': product_count,
-                'updated_at': 'now()'
-            }).eq('report_month', month).execute()
-        else:
-            # Tạo mới
-            result = supabase.table('profits').insert({
-                'report_month': month,
-                'total_revenue': total_revenue,
-                'total_expenses': total_expenses,
-                'total_payroll_expenses': total_payroll_expenses,
-                'total_profit': total_profit,
-                'profit_margin': profit_margin,
-                'invoice_count': len(revenue_result.data),
-                'expense_count': len([e for e in expense_result.data if not e.get('parent_id')]),  # Only count parent expenses
-                'payroll_count': len(payroll_result.data),
-                'product_count': product_count,
-                'updated_at': 'now()'
-            }).execute()
-
-        return result.data[0]
+        result = sync_months([month])
+        if result['errors'] or month not in result['rows']:
+            raise Exception('; '.join(result['errors']) or f"No profit row written for {month}")
+        return result['rows'][month]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error syncing profit report: {str(e)}")
 
 @router.post("/profits/sync_all/")
-async def sync_all_profit_reports():
-    """Đồng bộ lại tất cả báo cáo hoạt động kinh doanh"""
+@offload_db
+def sync_all_profit_reports(full: bool = False):
+    """
+    Đồng bộ báo cáo hoạt động kinh doanh của các tháng có thay đổi.
+
+    Mặc định chỉ tính lại các tháng bị đánh dấu khi ghi hóa đơn/chi phí/lương;
+    full=true quét lại tất cả các tháng có dữ liệu (dùng cho lần đầu hoặc sửa dữ liệu).
+    """
     try:
-        synced_months = []
-        errors = []
-
-        # Lấy tất cả các tháng có dữ liệu từ invoices
-        revenue_result = supabase.table('invoices_reality').select('invoice_date').execute()
-        
-        # Trích xuất các tháng duy nhất
-        months = set()
-        for invoice in revenue_result.data:
-            if invoice.get('invoice_date'):
-                # Xử lý cả string và datetime
-                if isinstance(invoice['invoice_date'], str):
-                    month = invoice['invoice_date'][:7]  # YYYY-MM
-                else:
-                    month = invoice['invoice_date'].strftime('%Y-%m')
-                months.add(month)
-
-        # Lấy các tháng có dữ liệu từ quanly_chiphi
-        expense_result = supabase.table('quanly_chiphi').select('created_at').execute()
-        for expense in expense_result.data:
-            if expense.get('created_at'):
-                if isinstance(expense['created_at'], str):
-                    month = expense['created_at'][:7]
-                else:
-                    month = expense['created_at'].strftime('%Y-%m')
-                months.add(month)
-
-        # Lấy các tháng có dữ liệu từ phieu_luong
-        payroll_result = supabase.table('phieu_luong').select('ky_tinh_luong').execute()
-        for payroll in payroll_result.data:
-            if payroll.get('ky_tinh_luong'):
-                months.add(payroll['ky_tinh_luong'])
-
-        # Đồng bộ từng tháng
-        for month in sorted(months):
-            try:
-                # Lấy dữ liệu doanh thu
-                start_date = f"{month}-01"
-                year, month_num = map(int, month.split('-'))
-                if month_num == 12:
-                    end_date = f"{year + 1}-01-01"
-                else:
-                    end_date = f"{year}-{month_num + 1:02d}-01"
-
-                revenue_result = supabase.table('invoices_reality').select('*').gte('invoice_date', start_date).lt('invoice_date', end_date).execute()
-                total_revenue = sum(invoice['total_amount'] or 0 for invoice in revenue_result.data)
-
-                # Lấy dữ liệu chi phí
-                expense_result = supabase.table('quanly_chiphi').select('*').gte('created_at', start_date).lt('created_at', end_date).execute()
-                total_expenses = sum(expense['giathanh'] or 0 for expense in expense_result.data if not expense.get('parent_id'))
-
-                # Lấy dữ liệu chi phí nhân sự (lương)
-                payroll_result = supabase.table('phieu_luong').select('luong_thuc_nhan').eq('ky_tinh_luong', month).execute()
-                total_payroll_expenses = sum(payroll['luong_thuc_nhan'] or 0 for payroll in payroll_result.data)
-
-                # Tổng chi phí = chi phí từ quanly_chiphi + chi phí nhân sự
-                total_expenses += total_payroll_expenses
-
-                # Lấy số lượng sản phẩm
-                product_result = supabase.table('sanpham').select('id', count='exact').execute()
-                product_count = product_result.count or 0
-
-                # Tính lợi nhuận
-                total_profit = total_revenue - total_expenses
-                profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
-
-                # Cập nhật hoặc tạo mới
-                existing = supabase.table('profits').select('*').eq('report_month', month).execute()
-                if existing.data:
-                    # Cập nhật
-                    supabase.table('profits').update({
-                        'total_revenue': total_revenue,
-                        'total_expenses': total_expenses,
-                        'total_payroll_expenses': total_payroll_expenses,
-                        'total_profit': total_profit,
-                        'profit_margin': profit_margin,
-                        'invoice_count': len(revenue_result.data),
-                        'expense_count': len([e for e in expense_result.data if not e.get('parent_id')]),
-                        'payroll_count': len(payroll_result.data),
-                        'product_count': product_count,
-                        'updated_at': 'now()'
-                    }).eq('report_month', month).execute()
-                else:
-                    # Tạo mới
-                    supabase.table('profits').insert({
-                        'report_month': month,
-                        'total_revenue': total_revenue,
-                        'total_expenses': total_expenses,
-                        'total_payroll_expenses': total_payroll_expenses,
-                        'total_profit': total_profit,
-                        'profit_margin': profit_margin,
-                        'invoice_count': len(revenue_result.data),
-                        'expense_count': len([e for e in expense_result.data if not e.get('parent_id')]),
-                        'payroll_count': len(payroll_result.data),
-                        'product_count': product_count,
-                        'updated_at': 'now()'
-                    }).execute()
-
-                synced_months.append(month)
-
-            except Exception as e:
-                errors.append(f"Error syncing {month}: {str(e)}")
+        if full:
+            mark_months_dirty(*discover_months())
+        result = sync_dirty_months()
+        synced_months = result['synced_months']
 
         return {
             "message": f"Đã đồng bộ {len(synced_months)} tháng thành công",
             "months_processed": len(synced_months),
             "synced_months": synced_months,
-            "errors": errors
+            "errors": result['errors']
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error syncing all profit reports: {str(e)}")
 
 @router.get("/export_profit_excel/")
-async def export_profit_excel(month: str = None):
-    """Xuất báo cáo hoạt động kinh doanh ra file Excel"""
+@offload_db
+def export_profit_excel(month: str = None):
+    """Xuất báo cáo hoạt động kinh doanh ra file Excel (tạo trong tiến trình, trả về dạng stream)"""
     try:
-        import subprocess
-        import os
-        import time
-        import json
-        from fastapi.responses import FileResponse
-
-        # Đường dẫn đến script Python
-        script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "generate_profit_excel.py")
-
-        # Sử dụng Python system executable
-        python_exe = "python"
-
-        # Chạy script với timeout để tránh treo
-        if month:
-            cmd = [python_exe, script_path, "--month", month]
-        else:
-            cmd = [python_exe, script_path]
-
-        print(f"Running command: {' '.join(cmd)}")
-
-        # Chạy với timeout 60 giây
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=60,
-            cwd=os.path.dirname(script_path)
+        output, filename = write_profit_excel(month)
+        return StreamingResponse(
+            iter_file_chunks(output),
+            media_type=EXCEL_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
-
-        print(f"Return code: {result.returncode}")
-        print(f"Stdout: {result.stdout}")
-        if result.stderr:
-            print(f"Stderr: {result.stderr}")
-
-        if result.returncode == 0:
-            # Parse output để lấy thông tin file
-            output_lines = result.stdout.strip().split('\n')
-            filename = None
-            filepath = None
-
-            for line in output_lines:
-                if 'SUCCESS:' in line:
-                    filename = line.split('SUCCESS:')[1].strip()
-                elif 'File duoc luu tai:' in line:
-                    filepath = line.split('File duoc luu tai:')[1].strip()
-
-            if filename and filepath and os.path.exists(filepath):
-                # Trả về file Excel trực tiếp để download
-                return FileResponse(
-                    path=filepath,
-                    filename=filename,
-                    media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-            else:
-                raise HTTPException(status_code=500, detail=f"Khong tim thay file Excel da tao")
-        else:
-            raise HTTPException(status_code=500, detail=f"Loi khi xuat Excel: {result.stderr}")
-
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=500, detail="Qua thoi gian cho xuat Excel")
     except Exception as e:
         print(f"Exception in export_profit_excel: {e}")
         raise HTTPException(status_code=500, detail=f"Loi xuat Excel: {str(e)}")
 
 @router.post("/quanly_chiphi/update_ratios/")
-async def update_expense_ratios(month: str = None):
+@offload_db
+def update_expense_ratios(month: str = None):
     """Cập nhật tỷ lệ phần trăm cho tất cả chi phí trong tháng được chỉ định"""
     try:
         import subprocess
@@ -1647,6 +1146,10 @@ async def update_expense_ratios(month: str = None):
         )
 
         if result.returncode == 0:
+            if month:
+                expense_hierarchy_cache.refresh_ratios(month)
+            else:
+                expense_hierarchy_cache.invalidate()
             return {
                 "success": True,
                 "message": "Đã cập nhật tỷ lệ chi phí thành công",
@@ -1665,39 +1168,37 @@ async def update_expense_ratios(month: str = None):
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật tỷ lệ chi phí: {str(e)}")
 
 @router.get("/quanly_chiphi/verify_totals/")
-async def verify_expense_totals():
+@offload_db
+def verify_expense_totals(month: str = None):
     """Kiểm tra tính chính xác của các tổng chi phí"""
     try:
-        import subprocess
-        import os
-
-        # Đường dẫn đến script (ở thư mục backend, không phải routers)
-        script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "update_expense_totals.py")
-
-        # Chạy script với --verify
-        result = subprocess.run(
-            ["python", script_path, "--verify"],
-            capture_output=True,
-            text=True,
-            timeout=30,
-            cwd=os.path.dirname(script_path)
-        )
+        # Tính lại trong bộ nhớ, không ghi database
+        result = rollup_expenses(month, dry_run=True)
+
+        output_lines = [
+            f"VAN DE: Chi phi cha ID {change['id']} - Tong con: {change['new']}, Gia tri cha: {change['old'] or 0}"
+            for change in result['changes']
+        ]
+        if result['updated_count'] == 0:
+            output_lines.append("Tat ca chi phi cha deu chinh xac!")
+        else:
+            output_lines.append(f"Tim thay {result['updated_count']} van de can sua.")
 
         return {
-            "success": result.returncode == 0,
-            "output": result.stdout,
-            "errors": result.stderr if result.returncode != 0 else None
+            "success": result['updated_count'] == 0,
+            "output": "\n".join(output_lines),
+            "errors": None,
+            "issues": result['changes']
         }
 
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=500, detail="Quá thời gian chờ kiểm tra")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi kiểm tra tỷ lệ tổng chi phí: {str(e)}")
 
 # ==================== CHIPHI_QUOTE ENDPOINTS ====================
 
 @router.get("/chiphi_quote/")
-async def get_chiphi_quote():
+@offload_db
+def get_chiphi_quote():
     """Lấy danh sách tất cả chi phí báo giá"""
     try:
         result = supabase.table('chiphi_quote').select('*').execute()
@@ -1706,7 +1207,8 @@ async def get_chiphi_quote():
         raise HTTPException(status_code=500, detail=f"Error fetching chiphi_quote: {str(e)}")
 
 @router.get("/chiphi_quote/project/{project_id}")
-async def get_chiphi_quote_by_project(project_id: int):
+@offload_db
+def get_chiphi_quote_by_project(project_id: int):
     """Lấy danh sách chi phí báo giá theo công trình với thông tin loại chi phí"""
     try:
         # Get chiphi_quote data
@@ -1769,7 +1271,8 @@ async def get_chiphi_quote_by_project(project_id: int):
         raise HTTPException(status_code=500, detail=f"Error fetching chiphi_quote by project: {str(e)}")
 
 @router.post("/chiphi_quote/")
-async def create_chiphi_quote(expense_data: dict):
+@offload_db
+def create_chiphi_quote(expense_data: dict):
     """Tạo chi phí báo giá mới"""
     try:
         # Prepare data for insertion
@@ -1800,7 +1303,8 @@ async def create_chiphi_quote(expense_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating chiphi_quote: {str(e)}")
 
 @router.put("/chiphi_quote/{expense_id}")
-async def update_chiphi_quote(expense_id: int, expense_data: dict):
+@offload_db
+def update_chiphi_quote(expense_id: int, expense_data: dict):
     """Cập nhật chi phí báo giá"""
     try:
         # Prepare data for update
@@ -1839,7 +1343,8 @@ async def update_chiphi_quote(expense_id: int, expense_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating chiphi_quote: {str(e)}")
 
 @router.delete("/chiphi_quote/{expense_id}")
-async def delete_chiphi_quote(expense_id: int):
+@offload_db
+def delete_chiphi_quote(expense_id: int):
     """Xóa chi phí báo giá"""
     try:
         # Lấy thông tin expense trước khi xóa để cập nhật ngân sách kế hoạch
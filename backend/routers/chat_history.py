@@ -1,21 +1,22 @@
 # routers/chat_history.py
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from pydantic import BaseModel
 from supabase_client import supabase
+from auth_tokens import role_cache
 from models import ChatHistoryCreate, ChatHistoryResponse
 from dependencies import get_current_admin_user, get_current_user_optional
+from chat_app_stats import app_conversation_counts
+from chat_history_pages import count_chat_messages, fetch_chat_page, DEFAULT_PAGE_SIZE
+from email_chat_sync import sync_new_records, reconcile_chat_records, reconcile_pending
+from typing import Optional
 
 def _is_admin_user(current_user):
     """Kiểm tra xem user hiện tại có phải admin không"""
     if not current_user:
         return False
     try:
-        # Kiểm tra vai trò admin từ database users table
-        result = supabase.table('employees').select('role_id').eq('email', current_user.email).execute()
-        if result.data and len(result.data) > 0:
-            user_data = result.data[0]
-            return user_data['role_id'] == 1
-        return False
+        # Kiểm tra vai trò admin từ bảng employees (role_id theo email được cache)
+        return role_cache.get_role_id(current_user.email, supabase) == 1
     except:
         return False
 
@@ -29,25 +30,25 @@ def _get_user_chat_conversations(user_email):
     except:
         return []
 
-def _filter_chat_history_by_user_chat(chat_records, user_conversations):
-    """Filter chat history records dựa trên user_chat data"""
-    if not user_conversations:
-        return []
-    
-    # Tạo set của (conversation_id, name_app) để filter nhanh
-    allowed_conversations = set()
-    for conv in user_conversations:
-        allowed_conversations.add((conv['conversation_id'], conv['name_app']))
-    
-    # Filter records
-    filtered_records = []
-    for record in chat_records:
-        conv_id = record.get('conversation_id')
-        name_app = record.get('name_app')
-        if (conv_id, name_app) in allowed_conversations:
-            filtered_records.append(record)
-    
-    return filtered_records
+def _allowed_conversation_ids(current_user, is_admin):
+    """None = không giới hạn (admin/anonymous); ngược lại là các conversation_id của user trong user_chat"""
+    if is_admin or not current_user:
+        return None
+    return [conv['conversation_id'] for conv in _get_user_chat_conversations(current_user.email) if conv.get('conversation_id')]
+
+def _fetch_page_with_users(response, cursor, limit, **filters):
+    """Một trang chat_history kèm thông tin employees; đặt X-Next-Cursor khi còn trang sau"""
+    try:
+        records, next_cursor = fetch_chat_page('*, employees!fk_user(username, full_name)', cursor, limit, client=supabase, **filters)
+    except ValueError:
+        raise
+    except Exception:
+        # Nếu join thất bại, query không join
+        records, next_cursor = fetch_chat_page('*', cursor, limit, client=supabase, **filters)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return records
+
 from datetime import datetime
 
 def _auto_sync_email_to_user_chat(record):
@@ -56,53 +57,21 @@ def _auto_sync_email_to_user_chat(record):
     Chỉ tạo user_chat record nếu cột email có dữ liệu hợp lệ
     """
     try:
-        conversation_id = record.get('conversation_id')
-        if not conversation_id:
+        if not record.get('conversation_id'):
             print(f"Skip sync: No conversation_id for record {record.get('log_id')}")
             return
 
         # Chỉ kiểm tra cột email
         email = record.get('email')
-
-        # Kiểm tra điều kiện: chỉ sync nếu có email hợp lệ trong cột email
         if not email or email.strip() == '':
             print(f"Skip sync: No valid email in email column for record {record.get('log_id')}")
             return
 
-        print(f"Processing sync for email: {email}, conversation: {conversation_id}")
-
-        # Tìm user theo email
-        user_result = supabase.table('employees').select('*').eq('email', email).execute()
-
-        if not user_result.data or len(user_result.data) == 0:
+        stats = reconcile_chat_records([record], supabase)
+        if stats['user_chat_created']:
+            print(f"Created user_chat record for email {email}, conversation {record.get('conversation_id')}")
+        elif not stats['matched']:
             print(f"Skip sync: No user found for email {email}")
-            return
-
-        user = user_result.data[0]
-        user_id = user['id']
-        print(f"Found user {user_id} for email {email}")
-
-        # Cập nhật chat_history với user_id
-        supabase.table('chat_history').update({
-            'user_id': user_id
-        }).eq('log_id', record['log_id']).execute()
-        print(f"Updated chat_history record {record['log_id']} with user_id {user_id}")
-
-        # Tạo user_chat record nếu chưa tồn tại
-        existing_user_chat = supabase.table('user_chat').select('*').eq('email', email).eq('conversation_id', conversation_id).execute()
-
-        if not existing_user_chat.data or len(existing_user_chat.data) == 0:
-            user_chat_data = {
-                'email': email,
-                'user_id': user_id,
-                'conversation_id': conversation_id,
-                'name_app': record.get('name_app'),
-                'app_id': record.get('name_app')
-            }
-            supabase.table('user_chat').insert(user_chat_data).execute()
-            print(f"Created user_chat record for email {email}, user {user_id}")
-        else:
-            print(f"User_chat record already exists for email {email}, conversation {conversation_id}")
 
     except Exception as e:
         print(f"Auto sync error for record {record.get('log_id')}: {str(e)}")
@@ -140,40 +109,8 @@ def get_unique_app_names():
     Trả về số lượng conversation duy nhất đã diễn ra với mỗi app
     """
     try:
-        # Lấy danh sách name_app và conversation_id duy nhất
-        result = supabase.table('chat_history').select('name_app, conversation_id').execute()
-
-        # Kiểm tra cấu trúc dữ liệu trả về
-
-        # Xử lý dữ liệu dựa trên cấu trúc thực tế
-        if isinstance(result.data, list) and len(result.data) > 0:
-            # Nếu là list trực tiếp
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            # Nếu có nested data
-            records = result.data.data
-        else:
-            records = []
-
-        # Đếm số lượng conversation duy nhất cho mỗi app
-        app_conversation_counts = {}
-        for record in records:
-            if isinstance(record, dict) and 'name_app' in record and 'conversation_id' in record:
-                app_name = record['name_app']
-                conversation_id = record['conversation_id']
-                
-                if app_name not in app_conversation_counts:
-                    app_conversation_counts[app_name] = set()
-                
-                app_conversation_counts[app_name].add(conversation_id)        # Chuyển thành format dễ sử dụng
-        apps = []
-        for app_name, conversation_ids in app_conversation_counts.items():
-            apps.append({
-                "name": app_name,
-                "chat_count": len(conversation_ids)  # Số lượng conversation duy nhất
-            })
-
-        return apps
+        # Số conversation duy nhất của mỗi app lấy từ bảng đếm, không quét chat_history
+        return app_conversation_counts(supabase)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -191,34 +128,7 @@ def get_my_apps(current_user = Depends(get_current_user_optional)):
         
         if is_admin:
             # Admin xem tất cả apps
-            result = supabase.table('chat_history').select('name_app, conversation_id').execute()
-            
-            # Xử lý dữ liệu
-            if isinstance(result.data, list) and len(result.data) > 0:
-                records = result.data
-            elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-                records = result.data.data
-            else:
-                records = []
-            
-            # Đếm số lượng conversation duy nhất cho mỗi app
-            app_conversation_counts = {}
-            for record in records:
-                if isinstance(record, dict) and 'name_app' in record and 'conversation_id' in record:
-                    app_name = record['name_app']
-                    conversation_id = record['conversation_id']
-                    
-                    if app_name not in app_conversation_counts:
-                        app_conversation_counts[app_name] = set()
-                    
-                    app_conversation_counts[app_name].add(conversation_id)
-            
-            apps = []
-            for app_name, conversation_ids in app_conversation_counts.items():
-                apps.append({
-                    "name": app_name,
-                    "chat_count": len(conversation_ids)
-                })
+            apps = app_conversation_counts(supabase)
         else:
             # User thường: chỉ xem apps của mình từ user_chat
             user_conversations = _get_user_chat_conversations(current_user.email)
@@ -247,12 +157,14 @@ def get_my_apps(current_user = Depends(get_current_user_optional)):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-def get_chat_history_by_app(name_app: str, current_user = Depends(get_current_user_optional)):
+@router.get("/app/{name_app}")
+def get_chat_history_by_app(name_app: str, response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user = Depends(get_current_user_optional)):
     """
-    Lấy lịch sử chat của một app cụ thể, sắp xếp theo thời gian
+    Lấy lịch sử chat của một app cụ thể, sắp xếp theo thời gian (mới nhất trước)
     - User thường: chỉ xem chat của mình từ user_chat
     - Admin: xem tất cả chat của app
     - Anonymous: xem tất cả chat của app (tạm thời cho test)
+    Phân trang bằng cursor: truyền header X-Next-Cursor của trang trước vào tham số cursor
     """
     try:
         from urllib.parse import unquote
@@ -264,91 +176,49 @@ def get_chat_history_by_app(name_app: str, current_user = Depends(get_current_us
         # Kiểm tra quyền admin
         is_admin = _is_admin_user(current_user) if current_user else False
 
+        matched_app = html_decoded_name_app
         if is_admin:
-            # Admin xem tất cả chat của app
-            try:
-                # Lấy tất cả tên app có sẵn
-                all_apps_result = supabase.table('chat_history').select('name_app').execute()
-                available_apps = []
-                if hasattr(all_apps_result.data, 'data'):
-                    available_apps = list(set([record['name_app'] for record in all_apps_result.data.data if 'name_app' in record]))
-                else:
-                    available_apps = list(set([record['name_app'] for record in all_apps_result.data if 'name_app' in record]))
-
-                # Tìm app name chính xác nhất
-                matched_app = None
-                for app in available_apps:
-                    if app == html_decoded_name_app:
-                        matched_app = app
-                        break
-                    elif html.unescape(app) == html_decoded_name_app:
-                        matched_app = app
-                        break
-                    elif html_decoded_name_app.lower() in app.lower() or app.lower() in html_decoded_name_app.lower():
-                        matched_app = app
-                        break
-
-                if matched_app:
-                    result = supabase.table('chat_history').select('''
-                        *,
-                        employees!fk_user(username, full_name)
-                    ''').eq('name_app', matched_app).order('created_at', desc=True).execute()
-                else:
-                    result = {"data": []}
-            except:
-                # Nếu join thất bại, query không join
-                result = supabase.table('chat_history').select('*').eq('name_app', html_decoded_name_app).order('created_at', desc=True).execute()
-        else:
-            # User thường hoặc anonymous: xem tất cả chat của app (tạm thời cho test)
-            result = supabase.table('chat_history').select('*').eq('name_app', html_decoded_name_app).order('created_at', desc=True).execute()
-
-        # Xử lý cấu trúc dữ liệu
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-
-        return records
+            # Tìm app name chính xác nhất trong danh sách app (bảng đếm, không quét chat_history)
+            available_apps = [app['name'] for app in app_conversation_counts(supabase)]
+            matched_app = None
+            for app in available_apps:
+                if app == html_decoded_name_app:
+                    matched_app = app
+                    break
+                elif html.unescape(app) == html_decoded_name_app:
+                    matched_app = app
+                    break
+                elif html_decoded_name_app.lower() in app.lower() or app.lower() in html_decoded_name_app.lower():
+                    matched_app = app
+                    break
+
+            if not matched_app:
+                return []
+
+        return _fetch_page_with_users(response, cursor, limit, name_app=matched_app,
+                                      conversation_ids=_allowed_conversation_ids(current_user, is_admin))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/")
-def get_all_chat_history(limit: int = 100, current_user = Depends(get_current_user_optional)):
+def get_all_chat_history(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, current_user = Depends(get_current_user_optional)):
     """
-    Lấy tất cả lịch sử chat, giới hạn số lượng
+    Lấy lịch sử chat theo trang (mới nhất trước)
     - User thường: chỉ xem chat của mình từ user_chat
     - Admin: xem tất cả chat
     - Anonymous: xem tất cả chat (tạm thời cho test)
+    Phân trang bằng cursor: truyền header X-Next-Cursor của trang trước vào tham số cursor
     """
     try:
         # Kiểm tra quyền admin
         is_admin = _is_admin_user(current_user) if current_user else False
 
-        if is_admin:
-            # Admin xem tất cả
-            try:
-                result = supabase.table('chat_history').select('''
-                    *,
-                    employees!fk_user(username, full_name)
-                ''').order('created_at', desc=True).limit(limit).execute()
-            except:
-                # Nếu join thất bại, query không join
-                result = supabase.table('chat_history').select('*').order('created_at', desc=True).limit(limit).execute()
-        else:
-            # User thường hoặc anonymous: xem tất cả chat (tạm thời cho test)
-            result = supabase.table('chat_history').select('*').order('created_at', desc=True).limit(limit).execute()
-
-        # Xử lý cấu trúc dữ liệu
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-
-        return records
+        return _fetch_page_with_users(response, cursor, limit,
+                                      conversation_ids=_allowed_conversation_ids(current_user, is_admin))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -462,12 +332,15 @@ def parse_email_from_chat_history(conversation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/user/{user_id}")
-def get_user_chat_history(user_id: int, limit: int = 50, current_user = Depends(get_current_user_optional)):
+def get_user_chat_history(user_id: int, limit: int = 50, cursor: Optional[str] = None, current_user = Depends(get_current_user_optional)):
     """
-    Lấy lịch sử chat của một user cụ thể
+    Lấy lịch sử chat của một user cụ thể, từng trang `limit` tin nhắn (trang sau: cursor = next_cursor)
     - User thường: chỉ xem chat của mình
     - Admin: có thể xem chat của user khác
     - Anonymous: có thể xem chat của user được chỉ định (tạm thời cho test)
+
+    total_messages / conversation_count là tổng của user (không phụ thuộc trang);
+    page_message_count / page_conversation_count chỉ đếm trong trang hiện tại
     """
     try:
         # Kiểm tra quyền admin
@@ -503,25 +376,17 @@ def get_user_chat_history(user_id: int, limit: int = 50, current_user = Depends(
                 "total_messages": 0,
                 "conversations": {},
                 "conversation_count": 0,
+                "page_message_count": 0,
+                "page_conversation_count": 0,
+                "next_cursor": None,
                 "message": "No chat history found in user_chat table"
             }
 
         # Lấy conversation_ids
-        conversation_ids = [conv['conversation_id'] for conv in user_conversations]
-
-        # Lấy chat history cho các conversation này
-        result = supabase.table('chat_history').select('*').in_('conversation_id', conversation_ids).order('created_at', desc=True).limit(limit).execute()
-
-        # Xử lý cấu trúc dữ liệu
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
+        conversation_ids = list(dict.fromkeys(conv['conversation_id'] for conv in user_conversations if conv.get('conversation_id')))
 
-        # Filter theo user_chat data để đảm bảo chỉ lấy đúng conversations
-        records = _filter_chat_history_by_user_chat(records, user_conversations)
+        # Lấy một trang chat history cho các conversation này (lọc ngay trong query)
+        records, next_cursor = fetch_chat_page('*', cursor, limit, conversation_ids=conversation_ids, client=supabase)
 
         # Group by conversation
         conversations = {}
@@ -533,13 +398,18 @@ def get_user_chat_history(user_id: int, limit: int = 50, current_user = Depends(
 
         return {
             "user": user,
-            "total_messages": len(records),
+            "total_messages": count_chat_messages(conversation_ids=conversation_ids, client=supabase),
             "conversations": conversations,
-            "conversation_count": len(conversations)
+            "conversation_count": len(conversation_ids),
+            "page_message_count": len(records),
+            "page_conversation_count": len(conversations),
+            "next_cursor": next_cursor
         }
 
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -555,79 +425,17 @@ def sync_email_to_user_chat():
     Sync chat history data to user chat table based on email parsing
     """
     try:
-        # Lấy tất cả chat history records chưa có user_id
-        result = supabase.table('chat_history').select('*').execute()
-        
-        # Filter records chưa có user_id trong Python
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-            
-        # Filter records chưa có user_id
-        records = [r for r in records if r.get('user_id') is None]
+        # Đối chiếu gộp tất cả records có email mà chưa có user_id
+        stats = reconcile_pending(client=supabase)
 
-        synced_count = 0
-        skipped_count = 0
-        
-        for record in records:
-            conversation_id = record.get('conversation_id')
-            if not conversation_id:
-                continue
-                
-            # Chỉ lấy email từ cột email
-            email = record.get('email')
-            
-            if not email or email.strip() == '':
-                continue
-                
-            # Tìm user theo email
-            user_result = supabase.table('employees').select('*').eq('email', email).execute()
-            
-            if not user_result.data or len(user_result.data) == 0:
-                skipped_count += 1
-                continue
-                
-            user = user_result.data[0]
-            user_id = user['id']
-            
-            # Cập nhật chat_history với user_id
-            supabase.table('chat_history').update({
-                'user_id': user_id
-            }).eq('log_id', record['log_id']).execute()
-            
-            # Tạo hoặc cập nhật user chat record
-            existing_user_chat = supabase.table('user_chat').select('*').eq('email', email).eq('conversation_id', conversation_id).execute()
-            
-            if existing_user_chat.data and len(existing_user_chat.data) > 0:
-                # Cập nhật record hiện có
-                supabase.table('user_chat').update({
-                    'user_id': user_id,
-                    'name_app': record.get('name_app'),
-                    'app_id': record.get('name_app')  # Sử dụng name_app làm app_id
-                }).eq('email', email).eq('conversation_id', conversation_id).execute()
-            else:
-                # Tạo record mới
-                user_chat_data = {
-                    'email': email,
-                    'user_id': user_id,
-                    'conversation_id': conversation_id,
-                    'name_app': record.get('name_app'),
-                    'app_id': record.get('name_app')  # Sử dụng name_app làm app_id
-                }
-                supabase.table('user_chat').insert(user_chat_data).execute()
-            
-            synced_count += 1
-        
         return {
             "message": f"Sync completed successfully",
-            "synced_records": synced_count,
-            "skipped_records": skipped_count,
-            "total_processed": len(records)
+            "synced_records": stats['user_chat_created'],
+            "skipped_records": stats['with_email'] - stats['matched'],
+            "total_processed": stats['records'],
+            "timings": stats['timings']
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -640,69 +448,17 @@ def check_and_sync_email():
         # Lấy chat_history records trong 24 giờ qua chưa có user_id
         from datetime import datetime, timedelta
         yesterday = (datetime.now() - timedelta(days=1)).isoformat()
-        
-        result = supabase.table('chat_history').select('*').gte('created_at', yesterday).execute()
-        
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-            
-        # Filter records chưa có user_id
-        records = [r for r in records if r.get('user_id') is None]
-        
-        synced_count = 0
-        skipped_count = 0
-        
-        for record in records:
-            conversation_id = record.get('conversation_id')
-            if not conversation_id:
-                continue
-                
-            # Chỉ lấy email từ cột email
-            email = record.get('email')
-            
-            if not email or email.strip() == '':
-                continue
-                
-            # Tìm user theo email
-            user_result = supabase.table('employees').select('*').eq('email', email).execute()
-            
-            if not user_result.data or len(user_result.data) == 0:
-                skipped_count += 1
-                continue
-                
-            user = user_result.data[0]
-            user_id = user['id']
-            
-            # Cập nhật chat_history với user_id
-            supabase.table('chat_history').update({
-                'user_id': user_id
-            }).eq('log_id', record['log_id']).execute()
-            
-            # Tạo user_chat record nếu chưa tồn tại
-            existing_user_chat = supabase.table('user_chat').select('*').eq('email', email).eq('conversation_id', conversation_id).execute()
-            
-            if not existing_user_chat.data or len(existing_user_chat.data) == 0:
-                user_chat_data = {
-                    'email': email,
-                    'user_id': user_id,
-                    'conversation_id': conversation_id,
-                    'name_app': record.get('name_app'),
-                    'app_id': record.get('name_app')
-                }
-                supabase.table('user_chat').insert(user_chat_data).execute()
-                synced_count += 1
-        
+
+        stats = reconcile_pending(since=yesterday, client=supabase)
+
         return {
             "message": f"Checked and synced recent chat history",
-            "synced_records": synced_count,
-            "skipped_records": skipped_count,
-            "total_checked": len(records)
+            "synced_records": stats['user_chat_created'],
+            "skipped_records": stats['with_email'] - stats['matched'],
+            "total_checked": stats['records'],
+            "timings": stats['timings']
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -712,66 +468,18 @@ def sync_all_pending_emails():
     Sync tất cả chat_history records chưa có user_id (không giới hạn thời gian)
     """
     try:
-        # Lấy tất cả chat_history records chưa có user_id
-        result = supabase.table('chat_history').select('*').execute()
-        
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-        
-        # Filter records chưa có user_id trong Python
-        records = [r for r in records if r.get('user_id') is None]
-        
-        for record in records:
-            conversation_id = record.get('conversation_id')
-            if not conversation_id:
-                continue
-                
-            # Chỉ lấy email từ cột email
-            email = record.get('email')
-            
-            if not email or email.strip() == '':
-                continue
-                
-            # Tìm user theo email
-            user_result = supabase.table('employees').select('*').eq('email', email).execute()
-            
-            if not user_result.data or len(user_result.data) == 0:
-                skipped_count += 1
-                continue
-                
-            user = user_result.data[0]
-            user_id = user['id']
-            
-            # Cập nhật chat_history với user_id
-            supabase.table('chat_history').update({
-                'user_id': user_id
-            }).eq('log_id', record['log_id']).execute()
-            
-            # Tạo user_chat record nếu chưa tồn tại
-            existing_user_chat = supabase.table('user_chat').select('*').eq('email', email).eq('conversation_id', conversation_id).execute()
-            
-            if not existing_user_chat.data or len(existing_user_chat.data) == 0:
-                user_chat_data = {
-                    'email': email,
-                    'user_id': user_id,
-                    'conversation_id': conversation_id,
-                    'name_app': record.get('name_app'),
-                    'app_id': record.get('name_app')
-                }
-                supabase.table('user_chat').insert(user_chat_data).execute()
-                synced_count += 1
-        
+        # Một truy vấn employees cho mọi email, một truy vấn user_chat, một lệnh insert
+        stats = reconcile_pending(client=supabase)
+
         return {
             "message": f"Synced all pending chat history records",
-            "synced_records": synced_count,
-            "skipped_records": skipped_count,
-            "total_processed": len(records)
+            "synced_records": stats['user_chat_created'],
+            "skipped_records": stats['with_email'] - stats['matched'],
+            "total_processed": stats['records'],
+            "updated_chat_history": stats['chat_history_updated'],
+            "timings": stats['timings']
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -784,103 +492,37 @@ def detect_new_emails():
         # Lấy chat_history records trong 1 giờ qua có email nhưng chưa có user_id
         from datetime import datetime, timedelta
         one_hour_ago = (datetime.now() - timedelta(hours=1)).isoformat()
-        
-        # Sử dụng query đơn giản hơn
-        result = supabase.table('chat_history').select('*').gte('created_at', one_hour_ago).execute()
-        
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-            
-        # Filter records có email nhưng chưa có user_id
-        records = [r for r in records if r.get('email') and r.get('email').strip() and r.get('user_id') is None]
-        
-        synced_count = 0
-        skipped_count = 0
-        
-        for record in records:
-            conversation_id = record.get('conversation_id')
-            if not conversation_id:
-                continue
-                
-            email = record.get('email').strip()
-            
-            # Tìm user theo email
-            user_result = supabase.table('employees').select('*').eq('email', email).execute()
-            
-            if not user_result.data or len(user_result.data) == 0:
-                skipped_count += 1
-                continue
-                
-            user = user_result.data[0]
-            user_id = user['id']
-            
-            # Cập nhật chat_history với user_id
-            supabase.table('chat_history').update({
-                'user_id': user_id
-            }).eq('log_id', record['log_id']).execute()
-            
-            # Tạo user_chat record nếu chưa tồn tại
-            existing_user_chat = supabase.table('user_chat').select('*').eq('email', email).eq('conversation_id', conversation_id).execute()
-            
-            if not existing_user_chat.data or len(existing_user_chat.data) == 0:
-                user_chat_data = {
-                    'email': email,
-                    'user_id': user_id,
-                    'conversation_id': conversation_id,
-                    'name_app': record.get('name_app'),
-                    'app_id': record.get('name_app')
-                }
-                supabase.table('user_chat').insert(user_chat_data).execute()
-                synced_count += 1
-        
+
+        stats = reconcile_pending(since=one_hour_ago, client=supabase)
+
         return {
             "message": f"Detected and synced new email records",
-            "synced_records": synced_count,
-            "skipped_records": skipped_count,
-            "total_detected": len(records)
+            "synced_records": stats['user_chat_created'],
+            "skipped_records": stats['with_email'] - stats['matched'],
+            "total_detected": stats['records'],
+            "timings": stats['timings']
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/trigger-auto-sync")
 def trigger_auto_sync():
     """
-    Trigger tự động sync cho tất cả records mới có email
+    Trigger sync cho các chat_history records mới kể từ lần sync trước (high-water mark).
+    Các record cũ chưa có user_id được quét lại bằng /sync-all-pending hoặc chu kỳ của email sync service
     """
     try:
-        # Lấy tất cả chat_history records
-        result = supabase.table('chat_history').select('*').execute()
-        
-        if isinstance(result.data, list) and len(result.data) > 0:
-            records = result.data
-        elif hasattr(result.data, 'data') and isinstance(result.data.data, list):
-            records = result.data.data
-        else:
-            records = []
-            
-        # Filter records có email nhưng chưa có user_id
-        records_to_sync = [r for r in records if r.get('email') and r.get('email').strip() and r.get('user_id') is None]
-        
-        synced_count = 0
-        skipped_count = 0
-        
-        for record in records_to_sync:
-            # Gọi hàm auto sync
-            _auto_sync_email_to_user_chat(record)
-            synced_count += 1
-        
+        stats = sync_new_records(supabase)
+
         return {
-            "message": f"Auto sync triggered for {len(records_to_sync)} records",
-            "synced_records": synced_count,
-            "skipped_records": skipped_count,
-            "total_processed": len(records_to_sync)
+            "message": f"Auto sync processed {stats.get('records', 0)} new records",
+            "synced_records": stats.get('user_chat_created', 0),
+            "skipped_records": stats.get('with_email', 0) - stats.get('matched', 0),
+            "total_processed": stats.get('records', 0),
+            "last_log_id": stats.get('last_log_id')
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
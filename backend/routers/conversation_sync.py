@@ -6,6 +6,8 @@ from typing import Optional
 import jwt as pyjwt
 import os
 from dotenv import load_dotenv
+from chatflow_conversations import resolve_conversation_ids
+from db_executor import run_db
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -76,7 +78,7 @@ async def get_current_user(request: Request) -> SyncTokenData:
     return user_data
 
 @router.post("/login", response_model=TokenResponse)
-def login_and_sync_conversations(login_data: LoginRequest):
+async def login_and_sync_conversations(login_data: LoginRequest):
     """
     Đăng nhập và đồng bộ conversation_ids từ Dify
     """
@@ -86,7 +88,7 @@ def login_and_sync_conversations(login_data: LoginRequest):
         from supabase_client import supabase
 
         # Tìm user theo username
-        user_result = supabase.table('employees').select('id, username, email').eq('username', login_data.username).execute()
+        user_result = await run_db(lambda: supabase.table('employees').select('id, username, email').eq('username', login_data.username).execute())
 
         if not user_result.data:
             raise HTTPException(status_code=401, detail="Invalid username or password")
@@ -94,40 +96,9 @@ def login_and_sync_conversations(login_data: LoginRequest):
         user = user_result.data[0]
         user_id = user['id']
 
-        # Đồng bộ conversation_ids từ Dify
-        from dify_api_service import dify_service
-
-        # Lấy tất cả chatflows
-        chatflows_result = supabase.table('chatflows').select('id, name').execute()
-
-        conversation_ids = {}
-
-        if chatflows_result.data:
-            for chatflow in chatflows_result.data:
-                chatflow_id = chatflow['id']
-                conversation_id = dify_service.get_or_create_conversation_id(user_id, chatflow_id)
-
-                if conversation_id:
-                    conversation_ids[str(chatflow_id)] = conversation_id
-
-                    # Cập nhật database
-                    from routers.user_chat_sessions_direct import create_or_update_session_direct
-                    from pydantic import BaseModel
-
-                    class SessionCreate(BaseModel):
-                        user_id: int
-                        chatflow_id: int
-                        conversation_id: Optional[str] = None
-                        session_data: Optional[dict] = None
-
-                    session_data = SessionCreate(
-                        user_id=user_id,
-                        chatflow_id=chatflow_id,
-                        conversation_id=conversation_id,
-                        session_data={"login_sync": True, "sync_time": datetime.now().isoformat()}
-                    )
-
-                    create_or_update_session_direct(session_data)
+        # Lấy tất cả chatflows, rồi xác định conversation_id cho các chatflow song song
+        chatflows_result = await run_db(lambda: supabase.table('chatflows').select('id, name').execute())
+        conversation_ids = await resolve_conversation_ids(user, chatflows_result.data or [], client=supabase)
 
         # Tạo JWT token với conversation_ids
         token_data = {
@@ -158,7 +129,7 @@ def get_current_user_info(current_user: SyncTokenData = Depends(get_current_user
     return current_user
 
 @router.post("/refresh-conversations")
-def refresh_conversation_ids(current_user: SyncTokenData = Depends(get_current_user)):
+async def refresh_conversation_ids(current_user: SyncTokenData = Depends(get_current_user)):
     """
     Làm mới conversation_ids trong token
     """
@@ -166,20 +137,14 @@ def refresh_conversation_ids(current_user: SyncTokenData = Depends(get_current_u
         user_id = current_user.user_id
 
         # Đồng bộ lại từ Dify
-        from dify_api_service import dify_service
         from supabase_client import supabase
 
-        chatflows_result = supabase.table('chatflows').select('id, name').execute()
-
-        conversation_ids = {}
-
-        if chatflows_result.data:
-            for chatflow in chatflows_result.data:
-                chatflow_id = chatflow['id']
-                conversation_id = dify_service.get_or_create_conversation_id(user_id, chatflow_id)
+        user_result = await run_db(lambda: supabase.table('employees').select('id, username').eq('id', user_id).execute())
+        if not user_result.data:
+            raise HTTPException(status_code=404, detail="User not found")
 
-                if conversation_id:
-                    conversation_ids[str(chatflow_id)] = conversation_id
+        chatflows_result = await run_db(lambda: supabase.table('chatflows').select('id, name').execute())
+        conversation_ids = await resolve_conversation_ids(user_result.data[0], chatflows_result.data or [], client=supabase, save=False)
 
         # Tạo token mới
         token_data = {
@@ -195,6 +160,8 @@ def refresh_conversation_ids(current_user: SyncTokenData = Depends(get_current_u
             "conversation_ids": conversation_ids
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error refreshing conversations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,6 +3,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from supabase_client import supabase
 from models import DepartmentCreate, DepartmentUpdate, DepartmentMemberCreate
 from dependencies import get_current_admin_user
+from auth_tokens import invalidate_employees
 
 router = APIRouter(
     prefix="/departments",
@@ -155,6 +156,7 @@ def assign_user_to_department(user_id: int, department_id: int = None):
 
         if not data[1]:
             raise HTTPException(status_code=404, detail="User not found")
+        invalidate_employees(row.get('email') for row in data[1])
 
         return data[1][0]
     except HTTPException:
@@ -15,6 +15,7 @@ from models import (
 from supabase_client import supabase
 from email_service import email_service
 from notification_scheduler import notification_scheduler
+from db_executor import offload_db
 from datetime import datetime, timezone
 import pytz
 import logging
@@ -61,7 +62,8 @@ def utc_to_local(utc_datetime_str: str) -> str:
 router = APIRouter()
 
 @router.post("/notifications/", response_model=NotificationResponse)
-async def create_notification(notification: NotificationCreate):
+@offload_db
+def create_notification(notification: NotificationCreate):
     """Tạo thông báo mới"""
     try:
         # Determine initial status
@@ -89,6 +91,8 @@ async def create_notification(notification: NotificationCreate):
 
         if result.data:
             created_notification = result.data[0]
+            if scheduled_at:
+                notification_scheduler.enqueue(created_notification)
 
             # Convert scheduled_send_at from UTC to local time for display
             if created_notification.get('scheduled_send_at'):
@@ -114,7 +118,8 @@ async def create_notification(notification: NotificationCreate):
         raise HTTPException(status_code=500, detail=f"Lỗi tạo thông báo: {str(e)}")
 
 @router.get("/notifications/", response_model=List[NotificationResponse])
-async def get_notifications(status: Optional[str] = None, limit: int = 50, offset: int = 0):
+@offload_db
+def get_notifications(status: Optional[str] = None, limit: int = 50, offset: int = 0):
     """Lấy danh sách thông báo"""
     try:
         query = supabase.table('notifications').select('*').order('created_at', desc=True).range(offset, offset + limit - 1)
@@ -136,7 +141,8 @@ async def get_notifications(status: Optional[str] = None, limit: int = 50, offse
         raise HTTPException(status_code=500, detail=f"Lỗi lấy danh sách thông báo: {str(e)}")
 
 @router.get("/notifications/{notification_id}", response_model=NotificationResponse)
-async def get_notification(notification_id: int):
+@offload_db
+def get_notification(notification_id: int):
     """Lấy thông tin chi tiết thông báo"""
     try:
         result = supabase.table('notifications').select('*').eq('id', notification_id).execute()
@@ -155,7 +161,8 @@ async def get_notification(notification_id: int):
         raise HTTPException(status_code=500, detail=f"Lỗi lấy thông tin thông báo: {str(e)}")
 
 @router.put("/notifications/{notification_id}", response_model=NotificationResponse)
-async def update_notification(notification_id: int, notification: NotificationUpdate):
+@offload_db
+def update_notification(notification_id: int, notification: NotificationUpdate):
     """Cập nhật thông báo"""
     try:
         # Lấy thông báo hiện tại
@@ -193,6 +200,8 @@ async def update_notification(notification_id: int, notification: NotificationUp
         if update_data:
             result = supabase.table('notifications').update(update_data).eq('id', notification_id).execute()
             updated_notification = result.data[0] if result.data else current_result.data[0]
+            # Hẹn lại theo giờ/trạng thái mới (hoặc bỏ hẹn)
+            notification_scheduler.enqueue(updated_notification)
 
             # Convert scheduled_send_at from UTC to local time for display
             if updated_notification.get('scheduled_send_at'):
@@ -209,7 +218,8 @@ async def update_notification(notification_id: int, notification: NotificationUp
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật thông báo: {str(e)}")
 
 @router.delete("/notifications/{notification_id}")
-async def delete_notification(notification_id: int):
+@offload_db
+def delete_notification(notification_id: int):
     """Xóa thông báo"""
     try:
         result = supabase.table('notifications').delete().eq('id', notification_id).execute()
@@ -217,12 +227,14 @@ async def delete_notification(notification_id: int):
         if not result.data:
             raise HTTPException(status_code=404, detail="Không tìm thấy thông báo")
 
+        notification_scheduler.cancel(notification_id)
         return {"message": "Đã xóa thông báo thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xóa thông báo: {str(e)}")
 
 @router.post("/notifications/{notification_id}/send")
-async def send_notification(notification_id: int):
+@offload_db
+def send_notification(notification_id: int):
     """Gửi thông báo ngay lập tức"""
     try:
         # Lấy thông báo
@@ -254,7 +266,8 @@ async def send_notification(notification_id: int):
         raise HTTPException(status_code=500, detail=f"Lỗi gửi thông báo: {str(e)}")
 
 @router.get("/notifications/{notification_id}/logs", response_model=List[NotificationLogResponse])
-async def get_notification_logs(notification_id: int):
+@offload_db
+def get_notification_logs(notification_id: int):
     """Lấy lịch sử gửi thông báo"""
     try:
         # Kiểm tra thông báo tồn tại
@@ -262,8 +275,9 @@ async def get_notification_logs(notification_id: int):
         if not notification_result.data:
             raise HTTPException(status_code=404, detail="Không tìm thấy thông báo")
 
-        # TODO: Implement notification logs table and logic
-        # For now, return empty list
-        return []
+        logs_result = supabase.table('notification_logs').select('*').eq('notification_id', notification_id).order('id').execute()
+        return [NotificationLogResponse(**log) for log in logs_result.data]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy lịch sử gửi: {str(e)}")
\ No newline at end of file
@@ -4,6 +4,9 @@ from models import *
 from payroll_service import tinh_luong, load_config
 from payroll_models import NhanVien as PayrollNhanVien, BangChamCong as PayrollBangChamCong, LuongSanPham as PayrollLuongSanPham
 from typing import List, Optional
+from profit_sync import mark_months_dirty
+from auth_tokens import invalidate_employees
+from payroll_batch import tinh_luong_ky
 import json
 
 router = APIRouter(prefix="/payroll", tags=["payroll"])
@@ -33,6 +36,7 @@ def create_nhan_vien(nhan_vien: NhanVienCreate):
         # Insert vào database
         data = nhan_vien.dict()
         result = supabase.table('employees').insert(data).execute()
+        invalidate_employees(row.get('email') for row in result.data)
 
         return NhanVienResponse(**result.data[0])
     except Exception as e:
@@ -85,7 +89,7 @@ def update_nhan_vien(ma_nv: str, update_data: NhanVienUpdate):
 
     try:
         # Kiểm tra tồn tại
-        existing = supabase.table('employees').select('ma_nv').eq('ma_nv', normalize_ma_nv(ma_nv)).execute()
+        existing = supabase.table('employees').select('ma_nv, email').eq('ma_nv', normalize_ma_nv(ma_nv)).execute()
         if not existing.data:
             raise HTTPException(status_code=404, detail="Nhân viên không tồn tại")
 
@@ -93,6 +97,9 @@ def update_nhan_vien(ma_nv: str, update_data: NhanVienUpdate):
         update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
         if update_dict:
             result = supabase.table('employees').update(update_dict).eq('ma_nv', normalize_ma_nv(ma_nv)).execute()
+            # Email cũ và mới; khóa nhân viên thì thu hồi luôn token đã cấp
+            invalidate_employees([row.get('email') for row in existing.data + result.data],
+                                 revoke=update_dict.get('is_active') is False)
             return NhanVienResponse(**result.data[0])
         else:
             return get_nhan_vien(ma_nv)
@@ -109,6 +116,7 @@ def delete_nhan_vien(ma_nv: str):
 
         if not result.data:
             raise HTTPException(status_code=404, detail="Nhân viên không tồn tại")
+        invalidate_employees((row.get('email') for row in result.data), revoke=True)
 
         return {"message": "Đã xóa nhân viên thành công"}
     except Exception as e:
@@ -383,6 +391,7 @@ def tinh_luong_endpoint(request: TinhLuongRequest):
         }
 
         result = supabase.table('phieu_luong').upsert(upsert_data, on_conflict='ma_nv,ky_tinh_luong').execute()
+        mark_months_dirty(phieu_luong.ky_tinh_luong)
 
         # Return response từ object phieu_luong đã tính toán
         return PhieuLuongResponse(
@@ -405,6 +414,47 @@ def tinh_luong_endpoint(request: TinhLuongRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi tính lương: {str(e)}")
 
+@router.post("/tinh-luong-ky", response_model=TinhLuongBatchResponse)
+def tinh_luong_ky_endpoint(request: TinhLuongBatchRequest):
+    """Tính lương cho tất cả (hoặc danh sách) nhân viên trong kỳ, lỗi từng nhân viên trả về trong errors"""
+    if not SUPABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database service unavailable")
+
+    try:
+        result = tinh_luong_ky(request.ky_tinh_luong, request.ma_nv_list, request.phu_cap_khac, request.thuong_kpi, client=supabase)
+        if result["payslips"]:
+            mark_months_dirty(request.ky_tinh_luong)
+
+        payslips = [
+            PhieuLuongResponse(
+                id=saved.get('id'),
+                ma_nv=phieu_luong.ma_nv,
+                ky_tinh_luong=phieu_luong.ky_tinh_luong,
+                tong_thu_nhap=phieu_luong.tong_thu_nhap,
+                tong_khau_tru=phieu_luong.tong_khau_tru,
+                luong_thuc_nhan=phieu_luong.luong_thuc_nhan,
+                chi_tiet_thu_nhap=phieu_luong.chi_tiet_thu_nhap,
+                chi_tiet_khau_tru=phieu_luong.chi_tiet_khau_tru,
+                trang_thai=saved.get('trang_thai'),
+                ngay_tao=saved.get('ngay_tao'),
+                ngay_duyet=saved.get('ngay_duyet'),
+                nguoi_duyet=saved.get('nguoi_duyet')
+            )
+            for phieu_luong, saved in result["payslips"]
+        ]
+        errors = [TinhLuongBatchError(**error) for error in result["errors"]]
+
+        return TinhLuongBatchResponse(
+            ky_tinh_luong=request.ky_tinh_luong,
+            total=len(payslips) + len(errors),
+            success_count=len(payslips),
+            payslips=payslips,
+            errors=errors
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi tính lương: {str(e)}")
+
 @router.get("/phieu-luong", response_model=List[PhieuLuongResponse])
 def get_phieu_luong_list(
     ma_nv: Optional[str] = None,
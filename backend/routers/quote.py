@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
 from supabase_client import supabase
 import os
 import sys
@@ -8,129 +8,87 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 # Import budget calculation functions
 from calculate_project_budget import calculate_project_budget_plan, update_project_budget_on_invoice_change, update_project_budget_on_expense_change
+from invoice_enrichment import enrich_invoices
+from catalog_cache import catalog_cache
+from db_executor import offload_db
+from expense_rollup import update_parent_giathanh
+from expense_hierarchy import expense_hierarchy_cache, hierarchy_response
+from profit_sync import mark_months_dirty
+from invoice_writer import create_invoice_with_items
 from typing import List
 from datetime import datetime
 
 router = APIRouter(prefix="/quote")
 
-def update_parent_giathanh(parent_id: int):
-    """Update the giathanh of a parent expense based on its direct children IN THE SAME MONTH"""
-    try:
-        # Get parent expense info to determine the month
-        parent_result = supabase.table('quanly_chiphi').select('created_at').eq('id', parent_id).execute()
-        if not parent_result.data:
-            print(f"Parent expense {parent_id} not found")
-            return
-
-        parent_data = parent_result.data[0]
-        parent_created_at = parent_data.get('created_at')
-
-        if not parent_created_at:
-            print(f"Parent expense {parent_id} has no creation date")
-            return
-
-        # Extract month from parent creation date
-        if isinstance(parent_created_at, str):
-            parent_month = parent_created_at[:7]  # YYYY-MM
-        else:
-            parent_month = parent_created_at.strftime('%Y-%m')
-
-        # Get all direct children
-        children_result = supabase.table('quanly_chiphi').select('giathanh, created_at').eq('parent_id', parent_id).execute()
-
-        # Filter children from the same month
-        same_month_children = []
-        for child in children_result.data:
-            child_created_at = child.get('created_at')
-            if child_created_at:
-                if isinstance(child_created_at, str):
-                    child_month = child_created_at[:7]  # YYYY-MM
-                else:
-                    child_month = child_created_at.strftime('%Y-%m')
-
-                if child_month == parent_month:
-                    same_month_children.append(child)
-
-        # Calculate total from same-month children
-        total_children = sum(child['giathanh'] or 0 for child in same_month_children)
-
-        # Update parent giathanh
-        supabase.table('quanly_chiphi').update({
-            'giathanh': total_children
-        }).eq('id', parent_id).execute()
-
-        print(f"Updated parent expense {parent_id} (month {parent_month}): {total_children}")
-
-        # Recursively update grandparent if exists
-        parent_result = supabase.table('quanly_chiphi').select('parent_id').eq('id', parent_id).execute()
-        if parent_result.data and parent_result.data[0].get('parent_id'):
-            update_parent_giathanh(parent_result.data[0]['parent_id'])
-
-    except Exception as e:
-        print(f"Error updating parent giathanh: {e}")
-
 @router.get("/loainhom/")
-async def get_loainhom():
+@offload_db
+def get_loainhom():
     """Lấy danh sách loại nhôm"""
     try:
-        result = supabase.table('loainhom').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loainhom')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loainhom: {str(e)}")
 
 @router.post("/loainhom/")
-async def create_loainhom(loainhom_data: dict):
+@offload_db
+def create_loainhom(loainhom_data: dict):
     """Tạo loại nhôm mới"""
     try:
         result = supabase.table('loainhom').insert({
             'tenloai': loainhom_data['tenloai'],
             'mo_ta': loainhom_data.get('mo_ta', '')
         }).execute()
+        catalog_cache.invalidate('loainhom')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating loainhom: {str(e)}")
 
 @router.put("/loainhom/{loai_id}")
-async def update_loainhom(loai_id: int, loainhom_data: dict):
+@offload_db
+def update_loainhom(loai_id: int, loainhom_data: dict):
     """Cập nhật loại nhôm"""
     try:
         result = supabase.table('loainhom').update({
             'tenloai': loainhom_data['tenloai'],
             'mo_ta': loainhom_data.get('mo_ta', '')
         }).eq('id', loai_id).execute()
+        catalog_cache.invalidate('loainhom')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating loainhom: {str(e)}")
 
 @router.delete("/loainhom/{loai_id}")
-async def delete_loainhom(loai_id: int):
+@offload_db
+def delete_loainhom(loai_id: int):
     """Xóa loại nhôm"""
     try:
         result = supabase.table('loainhom').delete().eq('id', loai_id).execute()
+        catalog_cache.invalidate('loainhom')
         return {"message": "Loại nhôm đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting loainhom: {str(e)}")
 
 @router.get("/loaiphukienbep/")
-async def get_loaiphukienbep():
+@offload_db
+def get_loaiphukienbep():
     """Lấy danh sách loại phụ kiện bếp"""
     try:
-        result = supabase.table('loaiphukienbep').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaiphukienbep')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaiphukienbep: {str(e)}")
 
 @router.get("/phukienbep/")
-async def get_phukienbep():
+@offload_db
+def get_phukienbep():
     """Lấy danh sách phụ kiện bếp"""
     try:
-        result = supabase.table('phukienbep').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('phukienbep')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching phukienbep: {str(e)}")
 
 @router.post("/phukienbep/")
-async def create_phukienbep(phukien_data: dict):
+@offload_db
+def create_phukienbep(phukien_data: dict):
     """Tạo phụ kiện bếp mới"""
     try:
         result = supabase.table('phukienbep').insert({
@@ -148,12 +106,14 @@ async def create_phukienbep(phukien_data: dict):
             'bao_hanh': phukien_data.get('bao_hanh', ''),
             'xuat_xu': phukien_data.get('xuat_xu', '')
         }).execute()
+        catalog_cache.invalidate('phukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating phukienbep: {str(e)}")
 
 @router.put("/phukienbep/{phukien_id}")
-async def update_phukienbep(phukien_id: int, phukien_data: dict):
+@offload_db
+def update_phukienbep(phukien_id: int, phukien_data: dict):
     """Cập nhật phụ kiện bếp"""
     try:
         result = supabase.table('phukienbep').update({
@@ -172,90 +132,100 @@ async def update_phukienbep(phukien_id: int, phukien_data: dict):
             'xuat_xu': phukien_data.get('xuat_xu', ''),
             'updated_at': 'now()'
         }).eq('id', phukien_id).execute()
+        catalog_cache.invalidate('phukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating phukienbep: {str(e)}")
 
 @router.delete("/phukienbep/{phukien_id}")
-async def delete_phukienbep(phukien_id: int):
+@offload_db
+def delete_phukienbep(phukien_id: int):
     """Xóa phụ kiện bếp"""
     try:
         result = supabase.table('phukienbep').delete().eq('id', phukien_id).execute()
+        catalog_cache.invalidate('phukienbep')
         return {"message": "Phụ kiện bếp đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting phukienbep: {str(e)}")
 
 @router.post("/loaiphukienbep/")
-async def create_loaiphukienbep(loaiphukien_data: dict):
+@offload_db
+def create_loaiphukienbep(loaiphukien_data: dict):
     """Tạo loại phụ kiện bếp mới"""
     try:
         result = supabase.table('loaiphukienbep').insert({
             'tenloai': loaiphukien_data['tenloai'],
             'mo_ta': loaiphukien_data.get('mo_ta', '')
         }).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating loaiphukienbep: {str(e)}")
 
 @router.put("/loaiphukienbep/{loai_id}")
-async def update_loaiphukienbep(loai_id: int, loaiphukien_data: dict):
+@offload_db
+def update_loaiphukienbep(loai_id: int, loaiphukien_data: dict):
     """Cập nhật loại phụ kiện bếp"""
     try:
         result = supabase.table('loaiphukienbep').update({
             'tenloai': loaiphukien_data['tenloai'],
             'mo_ta': loaiphukien_data.get('mo_ta', '')
         }).eq('id', loai_id).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating loaiphukienbep: {str(e)}")
 
 @router.delete("/loaiphukienbep/{loai_id}")
-async def delete_loaiphukienbep(loai_id: int):
+@offload_db
+def delete_loaiphukienbep(loai_id: int):
     """Xóa loại phụ kiện bếp"""
     try:
         result = supabase.table('loaiphukienbep').delete().eq('id', loai_id).execute()
+        catalog_cache.invalidate('loaiphukienbep')
         return {"message": "Loại phụ kiện bếp đã được xóa thành công"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting loaiphukienbep: {str(e)}")
 
 @router.get("/loaikinh/")
-async def get_loaikinh():
+@offload_db
+def get_loaikinh():
     """Lấy danh sách loại kính"""
     try:
-        result = supabase.table('loaikinh').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaikinh')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaikinh: {str(e)}")
 
 @router.get("/loaitaynam/")
-async def get_loaitaynam():
+@offload_db
+def get_loaitaynam():
     """Lấy danh sách loại tay nắm"""
     try:
-        result = supabase.table('loaitaynam').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('loaitaynam')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching loaitaynam: {str(e)}")
 
 @router.get("/bophan/")
-async def get_bophan():
+@offload_db
+def get_bophan():
     """Lấy danh sách bộ phận"""
     try:
-        result = supabase.table('bophan').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('bophan')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching bophan: {str(e)}")
 
 @router.get("/sanpham/")
-async def get_sanpham():
+@offload_db
+def get_sanpham():
     """Lấy danh sách sản phẩm"""
     try:
-        result = supabase.table('sanpham').select('*').execute()
-        return result.data
+        return catalog_cache.get_rows('sanpham')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sanpham: {str(e)}")
 
 @router.get("/chitietsanpham/")
-async def get_chitietsanpham():
+@offload_db
+def get_chitietsanpham():
     """Lấy danh sách chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').select('*').execute()
@@ -264,7 +234,8 @@ async def get_chitietsanpham():
         raise HTTPException(status_code=500, detail=f"Error fetching chitietsanpham: {str(e)}")
 
 @router.post("/sanpham/")
-async def create_sanpham(product_data: dict):
+@offload_db
+def create_sanpham(product_data: dict):
     """Tạo sản phẩm mới"""
     try:
         result = supabase.table('sanpham').insert({
@@ -274,12 +245,14 @@ async def create_sanpham(product_data: dict):
             'id_taynam': product_data.get('id_taynam'),
             'id_bophan': product_data.get('id_bophan')
         }).execute()
+        catalog_cache.invalidate('sanpham')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating sanpham: {str(e)}")
 
 @router.put("/sanpham/{product_id}")
-async def update_sanpham(product_id: int, product_data: dict):
+@offload_db
+def update_sanpham(product_id: int, product_data: dict):
     """Cập nhật sản phẩm"""
     try:
         result = supabase.table('sanpham').update({
@@ -289,24 +262,28 @@ async def update_sanpham(product_id: int, product_data: dict):
             'id_taynam': product_data.get('id_taynam'),
             'id_bophan': product_data.get('id_bophan')
         }).eq('id', product_id).execute()
+        catalog_cache.invalidate('sanpham')
         return result.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating sanpham: {str(e)}")
 
 @router.delete("/sanpham/{product_id}")
-async def delete_sanpham(product_id: int):
+@offload_db
+def delete_sanpham(product_id: int):
     """Xóa sản phẩm"""
     try:
         # First delete related product details
         supabase.table('chitietsanpham').delete().eq('id_sanpham', product_id).execute()
         # Then delete the product
         result = supabase.table('sanpham').delete().eq('id', product_id).execute()
+        catalog_cache.invalidate('sanpham')
         return {"message": "Product deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting sanpham: {str(e)}")
 
 @router.post("/chitietsanpham/")
-async def create_chitietsanpham(detail_data: dict):
+@offload_db
+def create_chitietsanpham(detail_data: dict):
     """Tạo chi tiết sản phẩm mới"""
     try:
         result = supabase.table('chitietsanpham').insert({
@@ -321,7 +298,8 @@ async def create_chitietsanpham(detail_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating chitietsanpham: {str(e)}")
 
 @router.put("/chitietsanpham/{detail_id}")
-async def update_chitietsanpham(detail_id: int, detail_data: dict):
+@offload_db
+def update_chitietsanpham(detail_id: int, detail_data: dict):
     """Cập nhật chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').update({
@@ -336,7 +314,8 @@ async def update_chitietsanpham(detail_id: int, detail_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating chitietsanpham: {str(e)}")
 
 @router.delete("/chitietsanpham/{detail_id}")
-async def delete_chitietsanpham(detail_id: int):
+@offload_db
+def delete_chitietsanpham(detail_id: int):
     """Xóa chi tiết sản phẩm"""
     try:
         result = supabase.table('chitietsanpham').delete().eq('id', detail_id).execute()
@@ -344,55 +323,26 @@ async def delete_chitietsanpham(detail_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting chitietsanpham: {str(e)}")
 
+def _update_project_budget(invoice_data: dict):
+    """Cập nhật ngân sách kế hoạch của công trình (chạy nền sau response; lỗi chỉ được log)"""
+    try:
+        update_project_budget_on_invoice_change(invoice_data)
+        print(f"Updated ngan_sach_ke_hoach for cong_trinh {invoice_data['id_congtrinh']}")
+    except Exception as e:
+        print(f"Error updating ngan_sach_ke_hoach for cong_trinh: {e}")
+
 @router.post("/invoices_quote/")
-async def create_invoice_quote(invoice_data: dict):
+@offload_db
+def create_invoice_quote(invoice_data: dict, background_tasks: BackgroundTasks):
     """Tạo hóa đơn báo giá mới"""
     try:
-        # Tạo hóa đơn chính (báo giá)
-        invoice_result = supabase.table('invoices_quote').insert({
+        # Tạo hóa đơn chính (báo giá) và toàn bộ chi tiết trong một lần ghi
+        invoice_id = create_invoice_with_items('quote', {
             'sales_employee_id': invoice_data.get('sales_employee_id'),
             'invoice_date': invoice_data['invoice_date'],
             'total_amount': invoice_data['total_amount'],
             'id_congtrinh': invoice_data.get('id_congtrinh')  # Only store project ID
-        }).execute()
-
-        invoice_id = invoice_result.data[0]['id']
-
-        # Thêm chi tiết hóa đơn
-        for item in invoice_data['items']:
-            # Kiểm tra loại sản phẩm
-            loai_san_pham = item.get('loai_san_pham', 'tu_bep')
-
-            if loai_san_pham == 'phu_kien_bep':
-                # Thêm phụ kiện bếp vào hóa đơn
-                supabase.table('invoice_items_quote').insert({
-                    'invoice_id': invoice_id,
-                    'loai_san_pham': 'phu_kien_bep',
-                    'id_loaiphukien': item.get('id_loaiphukien'),
-                    'id_phukien': item['id_phukien'],
-                    'so_luong': item.get('so_luong', 1),
-                    'don_gia': item['don_gia'],
-                    'chiet_khau': item.get('chiet_khau', 0),
-                    'thanh_tien': item['thanh_tien']
-                }).execute()
-            else:
-                # Thêm sản phẩm tủ bếp vào hóa đơn (như cũ)
-                supabase.table('invoice_items_quote').insert({
-                    'invoice_id': invoice_id,
-                    'loai_san_pham': 'tu_bep',
-                    'id_nhom': item['id_nhom'],
-                    'id_kinh': item['id_kinh'],
-                    'id_taynam': item['id_taynam'],
-                    'id_bophan': item['id_bophan'],
-                    'sanpham_id': item['sanpham_id'],
-                    'ngang': item['ngang'],
-                    'cao': item['cao'],
-                    'sau': item['sau'],
-                    'so_luong': item['so_luong'],
-                    'don_gia': item['don_gia'],
-                    'chiet_khau': item.get('chiet_khau', 0),
-                    'thanh_tien': item['thanh_tien']
-                }).execute()
+        }, invoice_data['items'])
 
         # Tự động tạo hoa hồng cho nhân viên bán hàng (optional for quotes)
         if invoice_data.get('sales_employee_id'):
@@ -417,20 +367,17 @@ async def create_invoice_quote(invoice_data: dict):
                 'ty_le': commission_percentage
             }).execute()
 
-        # Cập nhật ngân sách kế hoạch cho công trình nếu có id_congtrinh
+        # Cập nhật ngân sách kế hoạch cho công trình sau khi trả response (không chặn request)
         if invoice_data.get('id_congtrinh'):
-            try:
-                update_project_budget_on_invoice_change(invoice_data)
-                print(f"Updated ngan_sach_ke_hoach for cong_trinh {invoice_data['id_congtrinh']}")
-            except Exception as e:
-                print(f"Error updating ngan_sach_ke_hoach for cong_trinh: {e}")
+            background_tasks.add_task(_update_project_budget, invoice_data)
 
         return {"message": "Quote created successfully", "invoice_id": invoice_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating quote: {str(e)}")
 
 @router.get("/invoices_quote/")
-async def get_invoices_quote(month: str = None, user_id: str = None):
+@offload_db
+def get_invoices_quote(month: str = None, user_id: str = None):
     """Lấy danh sách báo giá, có thể lọc theo tháng và nhân viên kinh doanh"""
     try:
         query = supabase.table('invoices_quote').select('*')
@@ -463,311 +410,31 @@ async def get_invoices_quote(month: str = None, user_id: str = None):
 
         result = query.order('invoice_date', desc=True).execute()
 
-        # Lấy chi tiết cho mỗi báo giá
-        quotes_with_items = []
-        for invoice in result.data:
-            # Lấy items của quote này
-            items_result = supabase.table('invoice_items_quote').select('*').eq('invoice_id', invoice['id']).execute()
-
-            # Lấy thông tin chi tiết cho mỗi item
-            items_with_details = []
-            for item in items_result.data:
-                item_with_details = dict(item)
-
-                # Lấy thông tin sản phẩm
-                if item.get('sanpham_id'):
-                    try:
-                        product_id = item['sanpham_id']
-                        if product_id:
-                            product_result = supabase.table('sanpham').select('*').eq('id', product_id).execute()
-                            if product_result.data:
-                                product = product_result.data[0]
-
-                                # Lấy tên loại nhôm
-                                if product.get('id_nhom'):
-                                    try:
-                                        nhom_id = product['id_nhom']
-                                        if nhom_id:
-                                            nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                            if nhom_result.data:
-                                                product['ten_nhom'] = nhom_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại kính
-                                if product.get('id_kinh'):
-                                    try:
-                                        kinh_id = product['id_kinh']
-                                        if kinh_id:
-                                            kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                            if kinh_result.data:
-                                                product['ten_kinh'] = kinh_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại tay nắm
-                                if product.get('id_taynam'):
-                                    try:
-                                        taynam_id = product['id_taynam']
-                                        if taynam_id:
-                                            taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                                            if taynam_result.data:
-                                                product['ten_taynam'] = taynam_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên bộ phận
-                                if product.get('id_bophan'):
-                                    try:
-                                        bophan_id = product['id_bophan']
-                                        if bophan_id:
-                                            bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                            if bophan_result.data:
-                                                product['ten_bophan'] = bophan_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['sanpham'] = product
-                    except (ValueError, TypeError):
-                        pass
-
-                # Xử lý phụ kiện bếp nếu có
-                if item.get('id_phukien') and item.get('loai_san_pham') == 'phu_kien_bep':
-                    try:
-                        phukien_id = item['id_phukien']
-                        if phukien_id:
-                            phukien_result = supabase.table('phukienbep').select('*').eq('id', phukien_id).execute()
-                            if phukien_result.data:
-                                phukien = phukien_result.data[0]
-
-                                # Lấy tên loại phụ kiện bếp
-                                if phukien.get('id_loaiphukien'):
-                                    try:
-                                        loaiphukien_result = supabase.table('loaiphukienbep').select('tenloai').eq('id', phukien['id_loaiphukien']).execute()
-                                        if loaiphukien_result.data:
-                                            phukien['ten_loai_phukien'] = loaiphukien_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['phukien'] = phukien
-                    except (ValueError, TypeError):
-                        pass
-
-                # Nếu không có sanpham_id hoặc không tìm thấy sản phẩm, lấy thông tin từ item trực tiếp
-                if not item_with_details.get('sanpham') and not item_with_details.get('phukien'):
-                    # Lấy tên loại nhôm từ item
-                    if item.get('id_nhom'):
-                        try:
-                            nhom_id = item['id_nhom']
-                            if nhom_id:
-                                nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                if nhom_result.data:
-                                    item_with_details['ten_nhom'] = nhom_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại kính từ item
-                    if item.get('id_kinh'):
-                        try:
-                            kinh_id = item['id_kinh']
-                            if kinh_id:
-                                kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                if kinh_result.data:
-                                    item_with_details['ten_kinh'] = kinh_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại tay nắm từ item
-                    if item.get('id_taynam'):
-                        try:
-                            taynam_id = item['id_taynam']
-                            if taynam_id:
-                                taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                            if taynam_result.data:
-                                item_with_details['ten_taynam'] = taynam_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên bộ phận từ item
-                    if item.get('id_bophan'):
-                        try:
-                            bophan_id = item['id_bophan']
-                            if bophan_id:
-                                bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                if bophan_result.data:
-                                    item_with_details['ten_bophan'] = bophan_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                items_with_details.append(item_with_details)
-
-            quote_with_items = {
-                **invoice,
-                'items': items_with_details
-            }
-            quotes_with_items.append(quote_with_items)
+        # Lấy chi tiết cho cả trang báo giá bằng truy vấn gộp
+        quotes_with_items = enrich_invoices(result.data, 'invoice_items_quote')
 
         return {"quotes": quotes_with_items}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching quotes: {str(e)}")
 
 @router.get("/invoices_quote/project/{project_id}")
-async def get_quotes_by_project(project_id: int):
+@offload_db
+def get_quotes_by_project(project_id: int):
     """Lấy danh sách đơn hàng báo giá theo công trình"""
     try:
         # Lấy tất cả quotes có id_congtrinh tương ứng
         result = supabase.table('invoices_quote').select('*').eq('id_congtrinh', project_id).order('invoice_date', desc=True).execute()
 
-        # Lấy chi tiết cho mỗi báo giá
-        quotes_with_items = []
-        for invoice in result.data:
-            # Lấy items của quote này
-            items_result = supabase.table('invoice_items_quote').select('*').eq('invoice_id', invoice['id']).execute()
-
-            # Lấy thông tin chi tiết cho mỗi item
-            items_with_details = []
-            for item in items_result.data:
-                item_with_details = dict(item)
-
-                # Lấy thông tin sản phẩm
-                if item.get('sanpham_id'):
-                    try:
-                        product_id = item['sanpham_id']
-                        if product_id:
-                            product_result = supabase.table('sanpham').select('*').eq('id', product_id).execute()
-                            if product_result.data:
-                                product = product_result.data[0]
-
-                                # Lấy tên loại nhôm
-                                if product.get('id_nhom'):
-                                    try:
-                                        nhom_id = product['id_nhom']
-                                        if nhom_id:
-                                            nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                            if nhom_result.data:
-                                                product['ten_nhom'] = nhom_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại kính
-                                if product.get('id_kinh'):
-                                    try:
-                                        kinh_id = product['id_kinh']
-                                        if kinh_id:
-                                            kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                            if kinh_result.data:
-                                                product['ten_kinh'] = kinh_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên loại tay nắm
-                                if product.get('id_taynam'):
-                                    try:
-                                        taynam_id = product['id_taynam']
-                                        if taynam_id:
-                                            taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                                            if taynam_result.data:
-                                                product['ten_taynam'] = taynam_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                # Lấy tên bộ phận
-                                if product.get('id_bophan'):
-                                    try:
-                                        bophan_id = product['id_bophan']
-                                        if bophan_id:
-                                            bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                            if bophan_result.data:
-                                                product['ten_bophan'] = bophan_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['sanpham'] = product
-                    except (ValueError, TypeError):
-                        pass
-
-                # Xử lý phụ kiện bếp nếu có
-                if item.get('id_phukien') and item.get('loai_san_pham') == 'phu_kien_bep':
-                    try:
-                        phukien_id = item['id_phukien']
-                        if phukien_id:
-                            phukien_result = supabase.table('phukienbep').select('*').eq('id', phukien_id).execute()
-                            if phukien_result.data:
-                                phukien = phukien_result.data[0]
-
-                                # Lấy tên loại phụ kiện bếp
-                                if phukien.get('id_loaiphukien'):
-                                    try:
-                                        loaiphukien_result = supabase.table('loaiphukienbep').select('tenloai').eq('id', phukien['id_loaiphukien']).execute()
-                                        if loaiphukien_result.data:
-                                            phukien['ten_loai_phukien'] = loaiphukien_result.data[0]['tenloai']
-                                    except:
-                                        pass
-
-                                item_with_details['phukien'] = phukien
-                    except (ValueError, TypeError):
-                        pass
-
-                # Nếu không có sanpham_id hoặc không tìm thấy sản phẩm, lấy thông tin từ item trực tiếp
-                if not item_with_details.get('sanpham') and not item_with_details.get('phukien'):
-                    # Lấy tên loại nhôm từ item
-                    if item.get('id_nhom'):
-                        try:
-                            nhom_id = item['id_nhom']
-                            if nhom_id:
-                                nhom_result = supabase.table('loainhom').select('tenloai').eq('id', nhom_id).execute()
-                                if nhom_result.data:
-                                    item_with_details['ten_nhom'] = nhom_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại kính từ item
-                    if item.get('id_kinh'):
-                        try:
-                            kinh_id = item['id_kinh']
-                            if kinh_id:
-                                kinh_result = supabase.table('loaikinh').select('tenloai').eq('id', kinh_id).execute()
-                                if kinh_result.data:
-                                    item_with_details['ten_kinh'] = kinh_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên loại tay nắm từ item
-                    if item.get('id_taynam'):
-                        try:
-                            taynam_id = item['id_taynam']
-                            if taynam_id:
-                                taynam_result = supabase.table('loaitaynam').select('tenloai').eq('id', taynam_id).execute()
-                                if taynam_result.data:
-                                    item_with_details['ten_taynam'] = taynam_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                    # Lấy tên bộ phận từ item
-                    if item.get('id_bophan'):
-                        try:
-                            bophan_id = item['id_bophan']
-                            if bophan_id:
-                                bophan_result = supabase.table('bophan').select('tenloai').eq('id', bophan_id).execute()
-                                if bophan_result.data:
-                                    item_with_details['ten_bophan'] = bophan_result.data[0]['tenloai']
-                        except:
-                            pass
-
-                items_with_details.append(item_with_details)
-
-            quote_with_items = {
-                **invoice,
-                'items': items_with_details
-            }
-            quotes_with_items.append(quote_with_items)
+        # Lấy chi tiết cho cả trang báo giá bằng truy vấn gộp
+        quotes_with_items = enrich_invoices(result.data, 'invoice_items_quote')
 
         return {"quotes": quotes_with_items}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching quotes by project: {str(e)}")
 
 @router.get("/loaichiphi/")
-async def get_loaichiphi():
+@offload_db
+def get_loaichiphi():
     """Lấy danh sách loại chi phí"""
     try:
         result = supabase.table('loaichiphi').select('*').execute()
@@ -786,7 +453,8 @@ async def get_loaichiphi():
         raise HTTPException(status_code=500, detail=f"Error fetching loaichiphi: {str(e)}")
 
 @router.post("/loaichiphi/")
-async def create_loaichiphi(loaichiphi_data: dict):
+@offload_db
+def create_loaichiphi(loaichiphi_data: dict):
     """Tạo loại chi phí mới"""
     try:
         result = supabase.table('loaichiphi').insert({
@@ -806,7 +474,8 @@ async def create_loaichiphi(loaichiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating loaichiphi: {str(e)}")
 
 @router.put("/loaichiphi/{loaichiphi_id}")
-async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
+@offload_db
+def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
     """Cập nhật loại chi phí"""
     try:
         result = supabase.table('loaichiphi').update({
@@ -814,6 +483,7 @@ async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
             'tenchiphi': loaichiphi_data['tenchiphi'],  # Map tenchiphi -> tenchiphi
             'giathanh': loaichiphi_data.get('giathanh')  # Add giathanh field
         }).eq('id', loaichiphi_id).execute()
+        expense_hierarchy_cache.invalidate()
         # Transform response to match expected format
         item = result.data[0]
         return {
@@ -826,7 +496,8 @@ async def update_loaichiphi(loaichiphi_id: int, loaichiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating loaichiphi: {str(e)}")
 
 @router.delete("/loaichiphi/{loaichiphi_id}")
-async def delete_loaichiphi(loaichiphi_id: int):
+@offload_db
+def delete_loaichiphi(loaichiphi_id: int):
     """Xóa loại chi phí"""
     try:
         # Kiểm tra xem có chi phí nào đang sử dụng loại này không
@@ -835,6 +506,7 @@ async def delete_loaichiphi(loaichiphi_id: int):
             raise HTTPException(status_code=400, detail="Không thể xóa loại chi phí đang được sử dụng")
 
         result = supabase.table('loaichiphi').delete().eq('id', loaichiphi_id).execute()
+        expense_hierarchy_cache.invalidate()
         return {"message": "Loại chi phí đã được xóa thành công"}
     except HTTPException:
         raise
@@ -842,7 +514,8 @@ async def delete_loaichiphi(loaichiphi_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting loaichiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/")
-async def get_quanly_chiphi(month: str = None):
+@offload_db
+def get_quanly_chiphi(month: str = None):
     """Lấy danh sách chi phí, có thể lọc theo tháng"""
     try:
         # Get quanly_chiphi data first with basic columns
@@ -893,85 +566,17 @@ async def get_quanly_chiphi(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching quanly_chiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/hierarchy/")
-async def get_quanly_chiphi_hierarchy(month: str = None):
-    """Lấy danh sách chi phí theo cấu trúc cây phân cấp"""
+@offload_db
+def get_quanly_chiphi_hierarchy(request: Request, month: str = None):
+    """Lấy danh sách chi phí theo cấu trúc cây phân cấp (snapshot có ETag, 304 nếu client đã có bản mới nhất)"""
     try:
-        # Get all expenses with their category info
-        query = supabase.table('quanly_chiphi').select('*')
-
-        if month:
-            start_date = f"{month}-01"
-            year, month_num = map(int, month.split('-'))
-            if month_num == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month_num + 1:02d}-01"
-            query = query.gte('created_at', start_date).lt('created_at', end_date)
-
-        result = query.order('id', desc=True).execute()
-
-        # Get all categories for mapping
-        categories_result = supabase.table('loaichiphi').select('*').execute()
-        categories_map = {cat['id']: cat for cat in categories_result.data}
-
-        # Build hierarchy
-        expenses_map = {}
-        root_expenses = []
-
-        # First pass: create expense objects with category info
-        for item in result.data:
-            expense = dict(item)
-            if item.get('id_lcp') and item['id_lcp'] in categories_map:
-                expense['loaichiphi'] = {
-                    'id': categories_map[item['id_lcp']]['id'],
-                    'tenchiphi': categories_map[item['id_lcp']].get('tenchiphi', ''),
-                    'loaichiphi': categories_map[item['id_lcp']].get('loaichiphi', ''),
-                    'giathanh': categories_map[item['id_lcp']].get('giathanh')
-                }
-            else:
-                expense['loaichiphi'] = None
-
-            expense['children'] = []
-            expenses_map[item['id']] = expense
-
-        # Second pass: build hierarchy
-        for expense in expenses_map.values():
-            parent_id = expense.get('parent_id')
-            if parent_id and parent_id in expenses_map:
-                expenses_map[parent_id]['children'].append(expense)
-            else:
-                root_expenses.append(expense)
-
-        # Calculate totals for each level
-        def calculate_totals(expense):
-            # For parent expenses, giathanh should be sum of direct children IN THE SAME MONTH
-            if expense['children']:
-                # Filter children from the same month as parent
-                parent_month = expense.get('created_at', '')[:7] if expense.get('created_at') else ''
-                same_month_children = []
-                for child in expense['children']:
-                    child_month = child.get('created_at', '')[:7] if child.get('created_at') else ''
-                    if child_month == parent_month:
-                        same_month_children.append(child)
-
-                total_direct_children = sum(child['giathanh'] or 0 for child in same_month_children)
-                expense['giathanh'] = total_direct_children
-            # total_amount is the sum of all descendants (for display purposes)
-            total = expense['giathanh'] or 0
-            for child in expense['children']:
-                total += calculate_totals(child)
-            expense['total_amount'] = total
-            return total
-
-        for expense in root_expenses:
-            calculate_totals(expense)
-
-        return {"hierarchy": root_expenses}
+        return hierarchy_response(month, request.headers.get('if-none-match'))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching expense hierarchy: {str(e)}")
 
 @router.post("/quanly_chiphi/")
-async def create_quanly_chiphi(chiphi_data: dict):
+@offload_db
+def create_quanly_chiphi(chiphi_data: dict):
     """Tạo chi phí mới"""
     try:
         # Validate parent_id to prevent circular references
@@ -1014,6 +619,8 @@ async def create_quanly_chiphi(chiphi_data: dict):
         # Update parent giathanh if this is a child expense
         if parent_id:
             update_parent_giathanh(parent_id)
+        mark_months_dirty(result.data[0].get('created_at') if result.data else None)
+        expense_hierarchy_cache.apply_upsert(*result.data)
 
         # Update ratios for the month
         try:
@@ -1041,6 +648,7 @@ async def create_quanly_chiphi(chiphi_data: dict):
             )
             if result.returncode != 0:
                 print(f"Warning: Failed to update ratios: {result.stderr}")
+            expense_hierarchy_cache.refresh_ratios(expense_month)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
 
@@ -1053,12 +661,14 @@ async def create_quanly_chiphi(chiphi_data: dict):
         return {"message": "Expense creation attempted", "error": str(e)}
 
 @router.put("/quanly_chiphi/{chiphi_id}")
-async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
+@offload_db
+def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
     """Cập nhật chi phí"""
     try:
         # Get current expense to check if parent changed
-        current_expense = supabase.table('quanly_chiphi').select('parent_id').eq('id', chiphi_id).execute()
+        current_expense = supabase.table('quanly_chiphi').select('parent_id, created_at').eq('id', chiphi_id).execute()
         old_parent_id = current_expense.data[0]['parent_id'] if current_expense.data else None
+        old_created_at = current_expense.data[0].get('created_at') if current_expense.data else None
 
         # Validate parent_id to prevent circular references
         parent_id = chiphi_data.get('parent_id')
@@ -1098,6 +708,8 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
             update_parent_giathanh(parent_id)
         if old_parent_id and old_parent_id != parent_id:
             update_parent_giathanh(old_parent_id)
+        mark_months_dirty(old_created_at, result.data[0].get('created_at') if result.data else None)
+        expense_hierarchy_cache.apply_upsert(*result.data)
 
         # Update ratios for the affected months
         try:
@@ -1129,6 +741,7 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
                 )
                 if subprocess_result.returncode != 0:
                     print(f"Warning: Failed to update ratios for month {month}: {subprocess_result.stderr}")
+            expense_hierarchy_cache.refresh_ratios(*months_to_update)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
 
@@ -1139,13 +752,16 @@ async def update_quanly_chiphi(chiphi_id: int, chiphi_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating quanly_chiphi: {str(e)}")
 
 @router.delete("/quanly_chiphi/{chiphi_id}")
-async def delete_quanly_chiphi(chiphi_id: int):
+@offload_db
+def delete_quanly_chiphi(chiphi_id: int):
     """Xóa chi phí và tất cả chi phí con"""
     try:
         # Get parent_id before deletion
-        expense_result = supabase.table('quanly_chiphi').select('parent_id').eq('id', chiphi_id).execute()
+        expense_result = supabase.table('quanly_chiphi').select('parent_id, created_at').eq('id', chiphi_id).execute()
         parent_id = expense_result.data[0]['parent_id'] if expense_result.data else None
 
+        deleted_ids = []
+
         # Function to recursively delete expense and its children
         def delete_expense_recursive(expense_id):
             # Find all children
@@ -1155,6 +771,7 @@ async def delete_quanly_chiphi(chiphi_id: int):
 
             # Delete the expense itself
             supabase.table('quanly_chiphi').delete().eq('id', expense_id).execute()
+            deleted_ids.append(expense_id)
 
         # Start recursive deletion
         delete_expense_recursive(chiphi_id)
@@ -1162,6 +779,9 @@ async def delete_quanly_chiphi(chiphi_id: int):
         # Update parent giathanh after deletion
         if parent_id:
             update_parent_giathanh(parent_id)
+        if expense_result.data:
+            mark_months_dirty(expense_result.data[0].get('created_at'))
+        expense_hierarchy_cache.apply_delete(deleted_ids)
 
         # Update ratios for the affected month
         try:
@@ -1187,6 +807,7 @@ async def delete_quanly_chiphi(chiphi_id: int):
                     )
                     if result.returncode != 0:
                         print(f"Warning: Failed to update ratios for month {expense_month}: {result.stderr}")
+                    expense_hierarchy_cache.refresh_ratios(expense_month)
         except Exception as e:
             print(f"Warning: Error updating ratios: {e}")
 
@@ -1195,7 +816,8 @@ async def delete_quanly_chiphi(chiphi_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting quanly_chiphi: {str(e)}")
 
 @router.get("/quanly_chiphi/tong_quan/")
-async def get_chiphi_tong_quan(month: str = None):
+@offload_db
+def get_chiphi_tong_quan(month: str = None):
     """Lấy tổng quan chi phí theo tháng"""
     try:
         # Get quanly_chiphi data first
@@ -1269,7 +891,8 @@ async def get_chiphi_tong_quan(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching expense overview: {str(e)}")
 
 @router.get("/profit/")
-async def get_profit_report(month: str = None):
+@offload_db
+def get_profit_report(month: str = None):
     """Lấy báo cáo hoạt động kinh doanh tổng hợp"""
     try:
         # Lấy dữ liệu doanh thu từ quotes
@@ -1373,7 +996,8 @@ async def get_profit_report(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching profit report: {str(e)}")
 
 @router.get("/profits/")
-async def get_profit_reports(month: str = None):
+@offload_db
+def get_profit_reports(month: str = None):
     """Lấy danh sách báo cáo hoạt động kinh doanh (sort bằng Python thay vì database index)"""
     try:
         query = supabase.table('profits').select('*')
@@ -1396,7 +1020,8 @@ async def get_profit_reports(month: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching profit reports: {str(e)}")
 
 @router.post("/profits/")
-async def create_profit_report(report_data: dict):
+@offload_db
+def create_profit_report(report_data: dict):
     """Tạo báo cáo hoạt động kinh doanh mới"""
     try:
         result = supabase.table('profits').insert({
@@ -1417,7 +1042,8 @@ async def create_profit_report(report_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating profit report: {str(e)}")
 
 @router.put("/profits/{report_id}")
-async def update_profit_report(report_id: int, report_data: dict):
+@offload_db
+def update_profit_report(report_id: int, report_data: dict):
     """Cập nhật báo cáo hoạt động kinh doanh"""
     try:
         result = supabase.table('profits').update({
@@ -1437,7 +1063,8 @@ async def update_profit_report(report_id: int, report_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating profit report: {str(e)}")
 
 @router.delete("/profits/{report_id}")
-async def delete_profit_report(report_id: int):
+@offload_db
+def delete_profit_report(report_id: int):
     """Xóa báo cáo hoạt động kinh doanh"""
     try:
         result = supabase.table('profits').delete().eq('id', report_id).execute()
@@ -1446,7 +1073,8 @@ async def delete_profit_report(report_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting profit report: {str(e)}")
 
 @router.post("/profits/generate/{month}")
-async def generate_profit_report(month: str):
+@offload_db
+def generate_profit_report(month: str):
     """Tự động tạo báo cáo hoạt động kinh doanh cho tháng cụ thể"""
     try:
         # Kiểm tra xem đã có báo cáo cho tháng này chưa
@@ -1506,7 +1134,8 @@ async def generate_profit_report(month: str):
         raise HTTPException(status_code=500, detail=f"Error generating profit report: {str(e)}")
 
 @router.put("/profits/sync/{month}")
-async def sync_profit_report(month: str):
+@offload_db
+def sync_profit_report(month: str):
     """Đồng bộ lại báo cáo hoạt động kinh doanh cho tháng cụ thể"""
     try:
         # Lấy dữ liệu doanh thu từ quotes
@@ -1576,7 +1205,8 @@ async def sync_profit_report(month: str):
         raise HTTPException(status_code=500, detail=f"Error syncing profit report: {str(e)}")
 
 @router.post("/profits/sync_all/")
-async def sync_all_profit_reports():
+@offload_db
+def sync_all_profit_reports():
     """Đồng bộ lại tất cả báo cáo hoạt động kinh doanh"""
     try:
         synced_months = []
@@ -1693,7 +1323,8 @@ async def sync_all_profit_reports():
         raise HTTPException(status_code=500, detail=f"Error syncing all profit reports: {str(e)}")
 
 @router.post("/quanly_chiphi/update_ratios/")
-async def update_expense_ratios(month: str = None):
+@offload_db
+def update_expense_ratios(month: str = None):
     """Cập nhật tỷ lệ phần trăm cho tất cả chi phí trong tháng được chỉ định"""
     try:
         import subprocess
@@ -1716,6 +1347,10 @@ async def update_expense_ratios(month: str = None):
         )
 
         if result.returncode == 0:
+            if month:
+                expense_hierarchy_cache.refresh_ratios(month)
+            else:
+                expense_hierarchy_cache.invalidate()
             return {
                 "success": True,
                 "message": "Đã cập nhật tỷ lệ chi phí thành công",
@@ -1734,7 +1369,8 @@ async def update_expense_ratios(month: str = None):
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật tỷ lệ chi phí: {str(e)}")
 
 @router.get("/cong_trinh/")
-async def get_cong_trinh(user_id: str = None):
+@offload_db
+def get_cong_trinh(user_id: str = None):
     """Lấy danh sách công trình"""
     try:
         query = supabase.table('cong_trinh').select('*')
@@ -1750,7 +1386,8 @@ async def get_cong_trinh(user_id: str = None):
         raise HTTPException(status_code=500, detail=f"Error fetching cong_trinh: {str(e)}")
 
 @router.post("/cong_trinh/")
-async def create_cong_trinh(cong_trinh_data: dict):
+@offload_db
+def create_cong_trinh(cong_trinh_data: dict):
     """Tạo công trình mới"""
     try:
         # Validate that the employee exists
@@ -1775,7 +1412,8 @@ async def create_cong_trinh(cong_trinh_data: dict):
         raise HTTPException(status_code=500, detail=f"Error creating cong_trinh: {str(e)}")
 
 @router.put("/cong_trinh/{cong_trinh_id}")
-async def update_cong_trinh(cong_trinh_id: int, cong_trinh_data: dict):
+@offload_db
+def update_cong_trinh(cong_trinh_id: int, cong_trinh_data: dict):
     """Cập nhật công trình"""
     try:
         # Validate that the employee exists
@@ -1800,7 +1438,8 @@ async def update_cong_trinh(cong_trinh_id: int, cong_trinh_data: dict):
         raise HTTPException(status_code=500, detail=f"Error updating cong_trinh: {str(e)}")
 
 @router.delete("/cong_trinh/{cong_trinh_id}")
-async def delete_cong_trinh(cong_trinh_id: int):
+@offload_db
+def delete_cong_trinh(cong_trinh_id: int):
     """Xóa công trình"""
     try:
         result = supabase.table('cong_trinh').delete().eq('id', cong_trinh_id).execute()
@@ -1809,7 +1448,8 @@ async def delete_cong_trinh(cong_trinh_id: int):
         raise HTTPException(status_code=500, detail=f"Error deleting cong_trinh: {str(e)}")
 
 @router.get("/cong_trinh/{cong_trinh_id}")
-async def get_cong_trinh_by_id(cong_trinh_id: int):
+@offload_db
+def get_cong_trinh_by_id(cong_trinh_id: int):
     """Lấy thông tin công trình theo ID"""
     try:
         result = supabase.table('cong_trinh').select('*').eq('id', cong_trinh_id).execute()
@@ -1820,7 +1460,8 @@ async def get_cong_trinh_by_id(cong_trinh_id: int):
         raise HTTPException(status_code=500, detail=f"Error fetching cong_trinh: {str(e)}")
 
 @router.get("/chiphi_quote/project/{project_id}")
-async def get_chiphi_quote_by_project(project_id: int):
+@offload_db
+def get_chiphi_quote_by_project(project_id: int):
     """Lấy danh sách chi phí báo giá theo công trình"""
     try:
         result = supabase.table('chiphi_quote').select('*').eq('id_congtrinh', project_id).execute()
@@ -1829,7 +1470,8 @@ async def get_chiphi_quote_by_project(project_id: int):
         raise HTTPException(status_code=500, detail=f"Error fetching chiphi_quote by project: {str(e)}")
 
 @router.get("/dashboard/products_count/{month}")
-async def get_products_count_for_month(month: str, user_id: str = None):
+@offload_db
+def get_products_count_for_month(month: str, user_id: str = None):
     """Lấy tổng số sản phẩm trong invoices_quote cho các công trình trong tháng hiện tại"""
     try:
         # Lấy danh sách công trình trong tháng hiện tại
@@ -4,9 +4,9 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime
 import json
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from pg_pool import get_pg_pool
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -39,20 +39,17 @@ class UserChatSessionResponse(BaseModel):
     updated_at: str
 
 def get_db_connection():
-    """Get direct database connection"""
+    """Mượn kết nối từ pool dùng chung (trả lại bằng release_db_connection)"""
     try:
-        conn = psycopg2.connect(
-            host=os.environ.get("SUPABASE_DB_HOST"),
-            database=os.environ.get("SUPABASE_DB_NAME", "postgres"),
-            user=os.environ.get("SUPABASE_DB_USER"),
-            password=os.environ.get("SUPABASE_DB_PASSWORD"),
-            port=os.environ.get("SUPABASE_DB_PORT", "5432")
-        )
-        return conn
+        return get_pg_pool().acquire()
     except Exception as e:
         print(f"Database connection error: {e}")
         raise HTTPException(status_code=500, detail="Database connection failed")
 
+def release_db_connection(conn):
+    """Trả kết nối về pool; giao dịch chưa commit được rollback"""
+    get_pg_pool().release(conn)
+
 @router.post("/", response_model=UserChatSessionResponse)
 def create_or_update_session_direct(session: UserChatSessionCreate):
     """
@@ -145,7 +142,7 @@ def create_or_update_session_direct(session: UserChatSessionCreate):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @router.get("/user/{user_id}/chatflow/{chatflow_id}", response_model=UserChatSessionResponse)
 def get_user_chatflow_session_direct(user_id: int, chatflow_id: int):
@@ -231,7 +228,7 @@ def get_user_chatflow_session_direct(user_id: int, chatflow_id: int):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @router.get("/user/{user_id}", response_model=list[UserChatSessionResponse])
 def get_user_sessions_direct(user_id: int):
@@ -266,7 +263,7 @@ def get_user_sessions_direct(user_id: int):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @router.put("/user/{user_id}/chatflow/{chatflow_id}")
 def update_session_direct(user_id: int, chatflow_id: int, update_data: UserChatSessionUpdate):
@@ -337,7 +334,7 @@ def update_session_direct(user_id: int, chatflow_id: int, update_data: UserChatS
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @router.delete("/user/{user_id}/chatflow/{chatflow_id}")
 def delete_session_direct(user_id: int, chatflow_id: int):
@@ -372,7 +369,7 @@ def delete_session_direct(user_id: int, chatflow_id: int):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @router.post("/sync-conversation/{user_id}/{chatflow_id}")
 def sync_conversation_id(user_id: int, chatflow_id: int):
@@ -3,12 +3,16 @@ from fastapi import APIRouter, HTTPException, Depends
 from supabase_client import supabase, SUPABASE_AVAILABLE
 from models import UserCreate, ActivityLogCreate
 from dependencies import get_current_admin_user
+from auth_tokens import invalidate_employees
+from employee_import import import_employees, missing_columns, read_frames
+from employee_directory import list_employees
 from pydantic import BaseModel, EmailStr
 import hashlib
 import bcrypt
 from fastapi import UploadFile, File
 import pandas as pd
 import io
+import itertools
 import random
 import string
 import time
@@ -242,6 +246,7 @@ def create_new_user(user: UserCreate):
         print(f"Password hashed for {user.email}: {hashed_password[:20]}...")  # Debug log (chỉ hiển thị 20 ký tự đầu)
 
         user_result = supabase.table('employees').insert(user_data).execute()
+        invalidate_employees(row.get('email') for row in user_result.data)
         print(f"User created in database: {user_result.data}")
 
         return {
@@ -255,58 +260,15 @@ def create_new_user(user: UserCreate):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/")
-def list_all_users(department_id: int = None, search: str = None):
+def list_all_users(department_id: int = None, search: str = None, limit: Optional[int] = None, offset: int = 0):
     """
-    Lấy danh sách tất cả nhân viên từ bảng users, có thể filter theo department và search theo tên hoặc email
+    Lấy danh sách nhân viên, có thể filter theo department và search theo tên hoặc email.
+    Tìm kiếm và phân trang chạy trong database; truyền limit/offset để lấy từng trang
+    (next_offset = None khi hết dữ liệu), không truyền limit để lấy tất cả.
     """
     try:
-        # Lấy danh sách users với filter từ database
-        users_query = supabase.table('employees').select('*').order('ma_nv')
-
-        # Áp dụng department filter
-        if department_id:
-            users_query = users_query.eq('department_id', department_id)
-
-        # Áp dụng search filter
-        if search and search.strip():
-            search_term = search.strip()
-            # Lấy tất cả users và filter trong Python để tránh vấn đề với Supabase client
-            all_users_query = supabase.table('employees').select('*').order('ma_nv')
-            if department_id:
-                all_users_query = all_users_query.eq('department_id', department_id)
-            all_users_result = all_users_query.execute()
-
-            # Filter trong Python
-            filtered_users = []
-            if all_users_result.data:
-                for user in all_users_result.data:
-                    if (search_term.lower() in (user.get('full_name') or '').lower() or
-                        search_term.lower() in (user.get('email') or '').lower()):
-                        filtered_users.append(user)
-
-            users_result = type('Result', (), {'data': filtered_users})()
-        else:
-            # Query bình thường nếu không có search
-            users_result = users_query.execute()
-
-        # Lấy danh sách departments để map
-        dept_result = supabase.table('departments').select('id, name, description').execute()
-        dept_map = {dept['id']: dept for dept in dept_result.data}
-
-        # Transform dữ liệu để thêm thông tin department
-        users = []
-        for user in users_result.data:
-            user_dict = dict(user)
-            dept_id = user_dict.get('department_id')
-
-            if dept_id and dept_id in dept_map:
-                user_dict['departments'] = dept_map[dept_id]
-            else:
-                user_dict['departments'] = None
-
-            users.append(user_dict)
-
-        return {"users": users}
+        users, next_offset = list_employees(search, department_id, limit, offset, supabase)
+        return {"users": users, "next_offset": next_offset}
     except Exception as e:
         print(f"Error fetching users: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -351,7 +313,11 @@ def update_user(user_id: str, user_data: dict):
             update_data['ngay_vao_lam'] = user_data['ngay_vao_lam']
 
         if update_data:
+            # Quyền admin được cache theo email: cần cả email cũ để bỏ cache khi đổi email
+            previous = supabase.table('employees').select('email').eq('ma_nv', user_id).execute() if 'email' in update_data else None
             result = supabase.table('employees').update(update_data).eq('ma_nv', user_id).execute()
+            invalidate_employees([row.get('email') for row in (previous.data if previous else []) + result.data],
+                                 revoke=update_data.get('is_active') is False)
             return {"message": "User updated successfully", "user": result.data}
         else:
             raise HTTPException(status_code=400, detail="No valid fields to update")
@@ -367,6 +333,8 @@ def delete_user(user_id: str):
     try:
         # Xóa user khỏi bảng employees
         result = supabase.table('employees').delete().eq('ma_nv', user_id).execute()
+        # Thu hồi các token đã cấp cho nhân viên bị xóa
+        invalidate_employees((employee.get('email') for employee in result.data or []), revoke=True)
         return {"message": "User deleted successfully"}
     except Exception as e:
         print(f"Error deleting user: {str(e)}")
@@ -542,6 +510,7 @@ def verify_code_and_reset_password(request: VerifyCodeRequest):
 
         if not result.data:
             raise HTTPException(status_code=404, detail="Không thể cập nhật mật khẩu")
+        invalidate_employees([request.email])
 
         # Remove used code
         del verification_codes[request.email]
@@ -559,6 +528,7 @@ def bulk_upload_users(file: UploadFile = File(...)):
     """
     Upload file Excel để tạo nhiều nhân viên cùng lúc.
     Username sẽ được tự động tạo từ ma_nv hoặc full_name nếu không được cung cấp.
+    File được kiểm tra, băm mật khẩu và insert theo khối (xem employee_import.py).
     """
     try:
         if not SUPABASE_AVAILABLE or supabase is None:
@@ -568,103 +538,25 @@ def bulk_upload_users(file: UploadFile = File(...)):
         if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
             raise HTTPException(status_code=400, detail="Chỉ chấp nhận file Excel (.xlsx, .xls) hoặc CSV (.csv)")
 
-        # Đọc file
+        # Đọc khối đầu tiên để kiểm tra file và các cột bắt buộc (ma_nv không còn bắt buộc)
         try:
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file.file)
-            else:
-                df = pd.read_excel(file.file)
+            frames = read_frames(file.file, file.filename)
+            first_frame = next(frames, None)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Không thể đọc file: {str(e)}")
 
-        # Kiểm tra các cột bắt buộc (ma_nv không còn bắt buộc)
-        required_columns = ['email', 'password', 'full_name', 'luong_hop_dong', 'muc_luong_dong_bhxh']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise HTTPException(status_code=400, detail=f"Thiếu các cột bắt buộc: {', '.join(missing_columns)}")
+        missing = missing_columns(first_frame.columns if first_frame is not None else [])
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Thiếu các cột bắt buộc: {', '.join(missing)}")
 
-        created_users = []
-        errors = []
-
-        # Xử lý từng dòng
-        for index, row in df.iterrows():
-            try:
-                # Tự động tạo ma_nv nếu không được cung cấp
-                if 'ma_nv' in row and pd.notna(row['ma_nv']) and str(row['ma_nv']).strip():
-                    ma_nv = str(row['ma_nv']).strip()
-                else:
-                    # Tự động tạo ma_nv với format số nguyên tăng dần
-                    # Tìm số thứ tự cao nhất hiện tại
-                    try:
-                        existing_ma_nv = supabase.table('employees').select('ma_nv').execute()
-                        existing_numbers = []
-                        if existing_ma_nv.data:
-                            for emp in existing_ma_nv.data:
-                                if emp['ma_nv'] is not None:
-                                    try:
-                                        # Convert to int if it's string, or use as is if already int
-                                        num = int(emp['ma_nv'])
-                                        existing_numbers.append(num)
-                                    except (ValueError, TypeError):
-                                        continue
-                        
-                        # Tìm số thứ tự tiếp theo (bắt đầu từ 1000 nếu chưa có)
-                        next_number = max(existing_numbers) + 1 if existing_numbers else 1000
-                        ma_nv = str(next_number)  # Lưu dưới dạng string để tương thích
-                    except Exception as e:
-                        print(f"Error generating ma_nv: {e}")
-                        # Fallback: tạo số ngẫu nhiên
-                        import random
-                        ma_nv = str(random.randint(1000, 9999))
-
-                # Chuẩn bị dữ liệu
-                user_data = {
-                    "email": str(row['email']).strip(),
-                    "ho_ten": str(row['full_name']).strip(),  # Keep ho_ten for backward compatibility
-                    "full_name": str(row['full_name']).strip(),  # Also save to full_name
-                    "role_id": 2,  # Default role
-                    "is_active": True,
-                    "ma_nv": ma_nv,
-                    "luong_hop_dong": float(row['luong_hop_dong']),
-                    "muc_luong_dong_bhxh": float(row['muc_luong_dong_bhxh'])
-                }
-
-                # Các trường tùy chọn
-                optional_fields = ['chuc_vu', 'phong_ban', 'so_nguoi_phu_thuoc', 'dien_thoai', 'dia_chi', 'ngay_vao_lam', 'department']
-                for field in optional_fields:
-                    if field in row and pd.notna(row[field]) and str(row[field]).strip():
-                        if field == 'so_nguoi_phu_thuoc':
-                            user_data[field] = int(float(row[field]))
-                        elif field == 'department':
-                            # Map department name to department_id if needed
-                            # For now, store as phong_ban
-                            user_data['phong_ban'] = str(row[field]).strip()
-                        else:
-                            user_data[field] = str(row[field]).strip()
-
-                # Hash password
-                hashed_password = bcrypt.hashpw(str(row['password']).encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-                user_data["hashed_password"] = hashed_password
-
-                # Thêm vào database
-                result = supabase.table('employees').insert(user_data).execute()
-
-                if result.data:
-                    created_users.append({
-                        "email": user_data["email"],
-                        "ma_nv": user_data["ma_nv"]
-                    })
-                else:
-                    errors.append(f"Dòng {index + 2}: Không thể tạo user {user_data['email']}")
-
-            except Exception as e:
-                errors.append(f"Dòng {index + 2}: {str(e)}")
+        result = import_employees(itertools.chain([first_frame], frames), supabase)
+        created_users = result["created_users"]
 
         return {
             "message": f"Upload hoàn thành. Tạo thành công {len(created_users)} nhân viên.",
             "created_count": len(created_users),
             "created_users": created_users,
-            "errors": errors
+            "errors": result["errors"]
         }
 
     except HTTPException:
@@ -0,0 +1,40 @@
+"""
+Tiện ích dùng chung cho các truy vấn Supabase.
+
+PostgREST mặc định chỉ trả về tối đa 1000 dòng mỗi request, nên mọi lần đọc "toàn bộ"
+phải đi theo trang .range(offset, ...); iter_pages / fetch_all là vòng lặp đó. Query
+builder của supabase-py không dùng lại được sau khi đã gắn range, nên hàm nhận
+query_factory tạo query mới (đã lọc và order theo một khóa duy nhất) cho mỗi trang.
+
+get_client trả về client được truyền vào (test, script) hoặc client dùng chung của
+supabase_client; import muộn để module dùng nó vẫn import được khi chưa cấu hình
+SUPABASE_URL.
+"""
+from typing import Any, Callable, Dict, Iterator, List
+
+# Số dòng tối đa PostgREST trả về cho một request
+PAGE_SIZE = 1000
+
+def get_client(client=None):
+    if client is not None:
+        return client
+    from supabase_client import supabase
+    return supabase
+
+def iter_pages(query_factory: Callable[[], Any], page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Từng trang (không rỗng) của query; dừng khi một trang có ít hơn page_size dòng"""
+    offset = 0
+    while True:
+        rows = query_factory().range(offset, offset + page_size - 1).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+def fetch_all(query_factory: Callable[[], Any], page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Mọi dòng của query, đọc theo trang"""
+    rows: List[Dict[str, Any]] = []
+    for page in iter_pages(query_factory, page_size):
+        rows.extend(page)
+    return rows
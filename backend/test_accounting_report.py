@@ -0,0 +1,48 @@
+import accounting_report
+
+
+def _seed(fake_supabase):
+    fake_supabase.tables.update({
+        'invoices_reality': [{'id': i, 'invoice_date': '2025-09-10', 'total_amount': 100} for i in range(1, 251)],
+        'quanly_chiphi': [
+            {'id': 1, 'id_lcp': 1, 'parent_id': None, 'giathanh': 300, 'created_at': '2025-09-02T08:00:00'},
+            {'id': 2, 'id_lcp': 1, 'parent_id': 1, 'giathanh': 300, 'created_at': '2025-09-02T09:00:00'},
+            {'id': 3, 'id_lcp': None, 'parent_id': None, 'giathanh': 50, 'created_at': '2025-09-03T09:00:00'},
+            {'id': 4, 'id_lcp': 1, 'parent_id': None, 'giathanh': 999, 'created_at': '2025-10-01T09:00:00'},
+        ],
+        'phieu_luong': [{'id': 1, 'ky_tinh_luong': '2025-09', 'luong_thuc_nhan': 500}],
+    })
+
+
+def test_report_totals_fallback_matches_row_semantics(fake_supabase):
+    _seed(fake_supabase)
+
+    totals = accounting_report.report_totals('2025-09', client=fake_supabase)
+
+    assert totals == {
+        'total_revenue': 25000, 'revenue_count': 250,
+        'total_expenses': 350, 'expense_count': 3,
+        'total_payroll_expenses': 500, 'payroll_count': 1,
+    }
+    assert accounting_report.expense_totals_by_lcp('2025-09', client=fake_supabase) == {1: 300, None: 50}
+
+
+def test_report_totals_prefers_aggregate_function(fake_supabase):
+    _seed(fake_supabase)
+    fake_supabase.rpc_functions['accounting_report_totals'] = lambda db, params: [
+        {'total_revenue': '25000', 'revenue_count': 250, 'total_expenses': '350', 'expense_count': 3,
+         'total_payroll_expenses': 500, 'payroll_count': 1}
+    ]
+
+    totals = accounting_report.report_totals('2025-09', client=fake_supabase)
+
+    assert totals['total_revenue'] == 25000.0
+    assert fake_supabase.calls == [('accounting_report_totals', 'rpc')]
+
+
+def test_fetch_page_is_bounded(fake_supabase):
+    _seed(fake_supabase)
+
+    rows = accounting_report.fetch_page('invoices_reality', 'invoice_date', '2025-09', page=3, page_size=100, client=fake_supabase)
+    assert [row['id'] for row in rows] == list(range(201, 251))
+    assert accounting_report.normalize_page(0, 50000) == (1, accounting_report.MAX_PAGE_SIZE)
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import jwt as pyjwt
+import pytest
+
+import auth_tokens
+from auth_tokens import RoleCache, TokenUser, TokenVerifier, invalidate_employees
+
+SECRET = 'test-jwt-secret-with-enough-length-for-hs256'
+NOW = int(time.time())
+
+
+def _token(sub='user-1', email='a@example.com', iat=NOW - 10, exp=NOW + 3600, aud='authenticated', key=SECRET, **headers):
+    claims = {'sub': sub, 'email': email, 'role': 'authenticated', 'aud': aud, 'iat': iat, 'exp': exp}
+    return pyjwt.encode(claims, key, algorithm=headers.pop('algorithm', 'HS256'), headers=headers or None)
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _verifier(**options):
+    options.setdefault('clock', Clock())
+    return TokenVerifier(jwt_secret=SECRET, **options)
+
+
+def test_tokens_are_verified_locally_and_cached():
+    verifier = _verifier(remote_verify=lambda token: pytest.fail('auth server should not be called'))
+    decodes = []
+    original = verifier._decode
+    verifier._decode = lambda token: decodes.append(token) or original(token)
+    token = _token()
+
+    users = [verifier.verify(token) for _ in range(5)]
+
+    assert users[0] == TokenUser(id='user-1', email='a@example.com', role='authenticated', issued_at=NOW - 10, expires_at=NOW + 3600)
+    assert users[0].get('id') == 'user-1'
+    assert len(decodes) == 1
+
+
+@pytest.mark.parametrize('token', [
+    _token(iat=NOW - 120, exp=NOW - 60),
+    _token(aud='anon'),
+    _token(key='another-secret-with-enough-length-for-hs256'),
+])
+def test_invalid_tokens_are_rejected(token):
+    with pytest.raises(pyjwt.InvalidTokenError):
+        _verifier().verify(token)
+
+
+def test_cached_entries_expire_after_ttl_and_lru_is_bounded():
+    clock = Clock()
+    verifier = _verifier(ttl_seconds=30, max_entries=2, clock=clock)
+    decodes = []
+    original = verifier._decode
+    verifier._decode = lambda token: decodes.append(token) or original(token)
+    first, second, third = _token(sub='u1'), _token(sub='u2'), _token(sub='u3')
+
+    for token in (first, second, first, third, first):
+        verifier.verify(token)
+    # second bị đẩy khỏi LRU khi thêm third
+    verifier.verify(second)
+    assert decodes == [first, second, third, second]
+
+    clock.now += 31
+    verifier.verify(first)
+    assert decodes[-1] == first
+
+
+def test_revoked_users_are_rejected_until_they_get_a_new_token():
+    verifier = _verifier(clock=Clock(NOW - 30))
+    old_token = _token(email='b@example.com', iat=NOW - 60)
+    verifier.verify(old_token)
+
+    verifier.revoke_user(email='b@example.com')
+
+    with pytest.raises(pyjwt.InvalidTokenError):
+        verifier.verify(old_token)
+    assert verifier.verify(_token(email='b@example.com', iat=NOW - 10)).email == 'b@example.com'
+
+
+def test_unconfigured_algorithms_fall_back_to_the_auth_server_once():
+    calls = []
+    verifier = TokenVerifier(remote_verify=lambda token: calls.append(token) or TokenUser(id='user-9', email='r@example.com'),
+                             clock=Clock())
+    token = _token(sub='user-9')
+
+    assert verifier.verify(token).email == 'r@example.com'
+    assert verifier.verify(token).email == 'r@example.com'
+    assert len(calls) == 1
+
+
+def test_asymmetric_tokens_use_cached_jwks():
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = json.loads(pyjwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': 'key-1', 'alg': 'ES256', 'use': 'sig'})
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            requests.append(self.path)
+            payload = json.dumps({'keys': [jwk]}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    try:
+        verifier = TokenVerifier(jwks_url=f'http://127.0.0.1:{server.server_address[1]}/auth/v1/.well-known/jwks.json', clock=Clock())
+        for sub in ('u1', 'u2', 'u3'):
+            token = _token(sub=sub, key=private_key, algorithm='ES256', kid='key-1')
+            assert verifier.verify(token).id == sub
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(requests) == 1
+
+
+def test_role_cache_reads_employees_once_per_email(fake_supabase):
+    fake_supabase.tables['employees'] = [{'id': 1, 'email': 'admin@example.vn', 'role_id': 1}]
+    clock = Clock()
+    roles = RoleCache(ttl_seconds=60, clock=clock)
+
+    assert [roles.get_role_id('admin@example.vn', fake_supabase) for _ in range(3)] == [1, 1, 1]
+    assert roles.get_role_id('khach@example.vn', fake_supabase) is None
+    assert roles.get_role_id('khach@example.vn', fake_supabase) is None
+    assert len(fake_supabase.calls) == 2
+
+    fake_supabase.tables['employees'][0]['role_id'] = 2
+    roles.forget('admin@example.vn')
+    assert roles.get_role_id('admin@example.vn', fake_supabase) == 2
+    assert len(fake_supabase.calls) == 3
+
+
+def test_employee_writes_drop_cached_roles_and_revoke_tokens(fake_supabase, monkeypatch):
+    fake_supabase.tables['employees'] = [
+        {'id': 1, 'email': 'a@example.com', 'role_id': 1},
+        {'id': 2, 'email': 'b@example.com', 'role_id': 1},
+    ]
+    verifier = _verifier(clock=Clock(NOW - 30))
+    roles = RoleCache(ttl_seconds=60, clock=Clock())
+    monkeypatch.setattr(auth_tokens, 'token_verifier', verifier)
+    monkeypatch.setattr(auth_tokens, 'role_cache', roles)
+    old_token = _token(email='b@example.com', iat=NOW - 60)
+    verifier.verify(old_token)
+    assert [roles.get_role_id(email, fake_supabase) for email in ('a@example.com', 'b@example.com')] == [1, 1]
+
+    # Đổi quyền nhân viên a, xóa nhân viên b
+    fake_supabase.tables['employees'] = [{'id': 1, 'email': 'a@example.com', 'role_id': 2}]
+    invalidate_employees(['a@example.com', None])
+    invalidate_employees(['b@example.com'], revoke=True)
+
+    assert [roles.get_role_id(email, fake_supabase) for email in ('a@example.com', 'b@example.com')] == [2, None]
+    with pytest.raises(pyjwt.InvalidTokenError):
+        verifier.verify(old_token)
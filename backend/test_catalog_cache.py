@@ -0,0 +1,47 @@
+from catalog_cache import CatalogCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _make_cache(fake_supabase, clock):
+    fake_supabase.tables.update({
+        'loainhom': [{'id': 'NHK', 'tenloai': 'Nhôm Hệ K'}, {'id': 'NXF', 'tenloai': 'Nhôm Xingfa'}],
+        'sanpham': [{'id': 5, 'tensp': 'Tủ bếp trên'}],
+    })
+    return CatalogCache(ttls={'loainhom': 60, 'sanpham': 30}, client=fake_supabase, clock=clock)
+
+
+def test_catalog_cache_hits_until_ttl_expires(fake_supabase):
+    clock = FakeClock()
+    cache = _make_cache(fake_supabase, clock)
+
+    assert cache.get_name('loainhom', 'NHK') == 'Nhôm Hệ K'
+    assert cache.get_name_map('loainhom') == {'NHK': 'Nhôm Hệ K', 'NXF': 'Nhôm Xingfa'}
+    assert cache.get('sanpham', '5')['tensp'] == 'Tủ bếp trên'
+    assert len(fake_supabase.calls) == 2
+
+    clock.now = 61
+    cache.get_rows('loainhom')
+    assert len(fake_supabase.calls_to('loainhom')) == 2
+
+    stats = cache.stats()
+    assert stats['tables']['loainhom'] == {'hits': 1, 'misses': 2, 'invalidations': 0, 'cached_rows': 2, 'ttl_remaining': 60}
+    assert stats['hits'] == 1
+    assert stats['misses'] == 3
+
+
+def test_catalog_cache_invalidate_reloads_table(fake_supabase):
+    cache = _make_cache(fake_supabase, FakeClock())
+    assert cache.get_name('loainhom', 'NEW') is None
+
+    fake_supabase.tables['loainhom'].append({'id': 'NEW', 'tenloai': 'Nhôm mới'})
+    cache.invalidate('loainhom')
+
+    assert cache.get_name('loainhom', 'NEW') == 'Nhôm mới'
+    assert cache.stats()['tables']['loainhom']['invalidations'] == 1
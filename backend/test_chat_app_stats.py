@@ -0,0 +1,32 @@
+from chat_app_stats import app_conversation_counts
+
+
+def test_reads_one_row_per_app_from_the_counter_table(fake_supabase):
+    fake_supabase.tables['app_conversation_stats'] = [
+        {'name_app': 'Bao gia', 'conversation_count': 12},
+        {'name_app': 'Ke toan', 'conversation_count': 3},
+        {'name_app': 'Cu', 'conversation_count': 0},
+    ]
+
+    apps = app_conversation_counts(client=fake_supabase)
+
+    assert apps == [{'name': 'Bao gia', 'chat_count': 12}, {'name': 'Ke toan', 'chat_count': 3}]
+    assert fake_supabase.calls == [('app_conversation_stats', 'select')]
+
+
+def test_falls_back_to_paged_distinct_scan(fake_supabase):
+    class MissingStatsTable(type(fake_supabase)):
+        def table(self, name):
+            if name == 'app_conversation_stats':
+                raise Exception('relation "app_conversation_stats" does not exist')
+            return super().table(name)
+
+    client = MissingStatsTable({'chat_history': [
+        {'log_id': log_id, 'name_app': 'Bao gia' if log_id % 2 else 'Ke toan', 'conversation_id': f'c{log_id % 700}'}
+        for log_id in range(2400)
+    ]})
+
+    apps = app_conversation_counts(client=client)
+
+    assert apps == [{'name': 'Bao gia', 'chat_count': 350}, {'name': 'Ke toan', 'chat_count': 350}]
+    assert client.calls == [('chat_history', 'select')] * 3
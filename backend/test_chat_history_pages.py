@@ -0,0 +1,86 @@
+import base64
+import json
+
+import pytest
+
+from chat_history_pages import count_chat_messages, decode_cursor, encode_cursor, fetch_chat_page
+
+
+def _history(count):
+    # Nhiều dòng cùng created_at để kiểm tra khóa phụ log_id
+    return [{'log_id': log_id, 'created_at': f'2025-09-{log_id // 10 + 1:02d}T08:00:00+00:00',
+             'name_app': 'Bao gia' if log_id % 2 else 'Ke toan', 'conversation_id': f'c{log_id % 7}'}
+            for log_id in range(1, count + 1)]
+
+
+def _walk(client, **filters):
+    pages, cursor = [], None
+    while True:
+        records, cursor = fetch_chat_page('*', cursor, 4, client=client, **filters)
+        pages.append(records)
+        if not cursor:
+            return pages
+
+
+def test_cursor_pages_cover_every_row_once_newest_first(fake_supabase):
+    fake_supabase.tables['chat_history'] = _history(45)
+
+    pages = _walk(fake_supabase)
+
+    log_ids = [record['log_id'] for page in pages for record in page]
+    assert log_ids == list(range(45, 0, -1))
+    assert all(len(page) == 4 for page in pages[:-1])
+    # Mỗi trang là đúng một query, không đọc lại các trang trước
+    assert len(fake_supabase.calls) == len(pages)
+
+
+def test_allow_list_and_app_filter_are_applied_in_the_query(fake_supabase):
+    fake_supabase.tables['chat_history'] = _history(45)
+
+    pages = _walk(fake_supabase, name_app='Bao gia', conversation_ids=['c1', 'c3'])
+
+    records = [record for page in pages for record in page]
+    assert records and all(record['name_app'] == 'Bao gia' and record['conversation_id'] in ('c1', 'c3') for record in records)
+    assert len(records) == sum(1 for row in _history(45) if row['name_app'] == 'Bao gia' and row['conversation_id'] in ('c1', 'c3'))
+
+
+def test_totals_are_counted_across_all_pages_in_one_request(fake_supabase):
+    fake_supabase.tables['chat_history'] = _history(45)
+    expected = sum(1 for row in _history(45) if row['name_app'] == 'Bao gia' and row['conversation_id'] in ('c1', 'c3'))
+
+    records, _ = fetch_chat_page('*', None, 4, name_app='Bao gia', conversation_ids=['c1', 'c3'], client=fake_supabase)
+    total = count_chat_messages(name_app='Bao gia', conversation_ids=['c1', 'c3'], client=fake_supabase)
+
+    assert len(records) == 4
+    assert total == expected > 4
+    assert fake_supabase.calls == [('chat_history', 'select')] * 2
+
+
+def test_empty_allow_list_skips_the_query(fake_supabase):
+    assert fetch_chat_page(conversation_ids=[], client=fake_supabase) == ([], None)
+    assert count_chat_messages(conversation_ids=[], client=fake_supabase) == 0
+    assert fake_supabase.calls == []
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+
+@pytest.mark.parametrize('payload', [
+    ['2025-09-01T08:00:00+00:00', '1),log_id.gt.(0'],
+    ['2025-09-01",name_app.neq."x', 5],
+    ['2025-09-01T08:00:00+00:00', True],
+    ['2025-09-01T08:00:00+00:00', 1.5],
+])
+def test_cursor_values_must_be_a_timestamp_and_an_integer(payload):
+    cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_cursor_round_trips_to_typed_values():
+    cursor = encode_cursor({'created_at': '2025-09-01T08:00:00+00:00', 'log_id': 42})
+
+    assert decode_cursor(cursor) == ('2025-09-01T08:00:00+00:00', 42)
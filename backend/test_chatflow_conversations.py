@@ -0,0 +1,65 @@
+import asyncio
+
+from chatflow_conversations import resolve_conversation_ids
+
+
+class FakeDify:
+    """Ghi lại số lần hỏi conversation gần nhất của user"""
+
+    def __init__(self, failing_users=()):
+        self.failing_users = set(failing_users)
+        self.requests = 0
+
+    async def get_user_conversations(self, user, limit=20):
+        self.requests += 1
+        if user in self.failing_users:
+            raise RuntimeError('Dify unavailable')
+        return {'data': [{'id': f'dify-{user}-{self.requests}'}], 'has_more': False}
+
+
+def _setup(fake_supabase, chatflow_count=8):
+    fake_supabase.tables['user_chat_sessions'] = [
+        {'id': 1, 'user_id': 5, 'chatflow_id': 1, 'conversation_id': 'conv-existing-1'},
+        {'id': 2, 'user_id': 5, 'chatflow_id': 2, 'conversation_id': 'conv-existing-2'},
+        {'id': 3, 'user_id': 6, 'chatflow_id': 3, 'conversation_id': 'conv-other-user'},
+    ]
+    return [{'id': chatflow_id, 'name': f'Chatflow {chatflow_id}'} for chatflow_id in range(1, chatflow_count + 1)]
+
+
+def test_missing_chatflows_share_one_dify_lookup_and_are_saved_once(fake_supabase):
+    chatflows = _setup(fake_supabase)
+    dify = FakeDify()
+
+    conversation_ids = asyncio.run(resolve_conversation_ids({'id': 5, 'username': 'nv05'}, chatflows,
+                                                            client=fake_supabase, dify=dify))
+
+    assert conversation_ids['1'] == 'conv-existing-1'
+    assert conversation_ids['2'] == 'conv-existing-2'
+    # 6 chatflow thiếu: một request Dify, kết quả dùng cho cả 6
+    assert dify.requests == 1
+    assert {conversation_ids[str(chatflow_id)] for chatflow_id in range(3, 9)} == {'dify-nv05-1'}
+    assert fake_supabase.calls == [('user_chat_sessions', 'select'), ('user_chat_sessions', 'upsert')]
+    saved = {row['chatflow_id']: row for row in fake_supabase.tables['user_chat_sessions'] if row['user_id'] == 5}
+    assert {chatflow_id: row['conversation_id'] for chatflow_id, row in saved.items()} == {int(k): v for k, v in conversation_ids.items()}
+    assert saved[4]['session_data']['login_sync'] is True
+
+
+def test_no_dify_request_when_every_chatflow_has_a_session(fake_supabase):
+    chatflows = _setup(fake_supabase, chatflow_count=2)
+    dify = FakeDify()
+
+    conversation_ids = asyncio.run(resolve_conversation_ids({'id': 5, 'username': 'nv05'}, chatflows,
+                                                            client=fake_supabase, dify=dify, save=False))
+
+    assert conversation_ids == {'1': 'conv-existing-1', '2': 'conv-existing-2'}
+    assert dify.requests == 0
+
+
+def test_failed_lookups_are_skipped(fake_supabase):
+    chatflows = _setup(fake_supabase, chatflow_count=4)
+
+    conversation_ids = asyncio.run(resolve_conversation_ids({'id': 5, 'username': 'nv05'}, chatflows, client=fake_supabase,
+                                                            dify=FakeDify(failing_users={'nv05'}), save=False))
+
+    assert conversation_ids == {'1': 'conv-existing-1', '2': 'conv-existing-2'}
+    assert fake_supabase.calls == [('user_chat_sessions', 'select')]
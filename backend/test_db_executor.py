@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from db_executor import offload_db, get_db_executor_stats
+
+
+def _make_app():
+    app = FastAPI()
+
+    @app.get("/slow/")
+    @offload_db
+    def slow_report(delay: float = 0.2):
+        # Mô phỏng một truy vấn Supabase đồng bộ chậm
+        time.sleep(delay)
+        return {"delay": delay}
+
+    @app.get("/missing/")
+    @offload_db
+    def missing():
+        raise HTTPException(status_code=404, detail="Không tìm thấy")
+
+    return app
+
+
+async def _fire(app, count, delay):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(client.get("/slow/", params={"delay": delay}) for _ in range(count)))
+        return time.perf_counter() - started, responses
+
+
+def test_offloaded_handlers_do_not_serialize():
+    # 8 request x 0.2s: nếu chặn event loop sẽ mất >= 1.6s
+    elapsed, responses = asyncio.run(_fire(_make_app(), count=8, delay=0.2))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert responses[0].json() == {"delay": 0.2}
+    assert elapsed < 0.8
+    assert get_db_executor_stats()['max_in_flight'] >= 2
+
+
+def test_offloaded_handler_keeps_http_exceptions():
+    async def call():
+        transport = httpx.ASGITransport(app=_make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/missing/")
+
+    response = asyncio.run(call())
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Không tìm thấy"}
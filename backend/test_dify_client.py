@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from dify_client import AsyncDifyClient, CircuitBreaker, DifyAPIError, DifyCircuitOpenError
+
+
+class MockDify:
+    """Dify giả: 45 message trong conv-1, 25 conversation; có thể trả 503 hoặc trả chậm"""
+
+    def __init__(self):
+        self.messages = [{'id': f'm{index:03d}', 'query': f'q{index}', 'answer': f'a{index}', 'created_at': 1700000000 + index}
+                         for index in range(45)]
+        self.conversations = [{'id': f'c{index:03d}', 'name': f'conv {index}'} for index in reversed(range(25))]
+        self.requests = []
+        self.client_ports = set()
+        self.fail_next = 0
+        self.delay = 0
+
+    def messages_page(self, params):
+        limit = int(params['limit'])
+        end = len(self.messages)
+        if 'first_id' in params:
+            end = next(index for index, message in enumerate(self.messages) if message['id'] == params['first_id'])
+        start = max(0, end - limit)
+        return {'limit': limit, 'has_more': start > 0, 'data': self.messages[start:end]}
+
+    def conversations_page(self, params):
+        limit = int(params['limit'])
+        start = 0
+        if 'last_id' in params:
+            start = next(index for index, conversation in enumerate(self.conversations) if conversation['id'] == params['last_id']) + 1
+        return {'limit': limit, 'has_more': start + limit < len(self.conversations), 'data': self.conversations[start:start + limit]}
+
+
+@pytest.fixture
+def dify():
+    state = MockDify()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            state.requests.append((url.path, params))
+            state.client_ports.add(self.client_address[1])
+            if state.delay:
+                time.sleep(state.delay)
+            if self.headers.get('Authorization') != 'Bearer test-key':
+                return self._send(401, {'code': 'unauthorized'})
+            if state.fail_next:
+                state.fail_next -= 1
+                return self._send(503, {'code': 'unavailable'})
+            if url.path == '/v1/messages':
+                return self._send(200, state.messages_page(params))
+            if url.path == '/v1/conversations':
+                return self._send(200, state.conversations_page(params))
+            self._send(404, {'code': 'not_found'})
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass  # Client đã ngắt kết nối (timeout)
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    state.base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def _client(dify, **options):
+    return AsyncDifyClient(api_base_url=dify.base_url, api_key='test-key', backoff_seconds=0, **options)
+
+
+def test_messages_are_streamed_across_pages_on_one_connection(dify):
+    async def run():
+        client = _client(dify)
+        try:
+            pages = [page async for page in client.iter_message_pages('conv-1', 'nv01', page_size=20)]
+            conversations = [conversation async for conversation in client.iter_user_conversations('nv01', page_size=10)]
+        finally:
+            await client.aclose()
+        return pages, conversations
+
+    pages, conversations = asyncio.run(run())
+
+    assert [len(page) for page in pages] == [20, 20, 5]
+    assert sorted(message['id'] for page in pages for message in page) == [message['id'] for message in dify.messages]
+    assert [params.get('first_id') for path, params in dify.requests if path == '/v1/messages'] == [None, 'm025', 'm005']
+    assert [conversation['id'] for conversation in conversations] == [conversation['id'] for conversation in dify.conversations]
+    # Cả 6 request dùng chung một kết nối keep-alive
+    assert len(dify.requests) == 6
+    assert len(dify.client_ports) == 1
+
+
+def test_transient_errors_are_retried(dify):
+    dify.fail_next = 2
+
+    async def run():
+        client = _client(dify, max_attempts=3)
+        try:
+            return await client.get_conversation_messages('conv-1', 'nv01')
+        finally:
+            await client.aclose()
+
+    page = asyncio.run(run())
+
+    assert len(page['data']) == 20
+    assert len(dify.requests) == 3
+
+
+def test_client_errors_are_not_retried(dify):
+    async def run():
+        client = AsyncDifyClient(api_base_url=dify.base_url, api_key='wrong', backoff_seconds=0, max_attempts=3)
+        try:
+            await client.get_user_conversations('nv01')
+        finally:
+            await client.aclose()
+
+    with pytest.raises(DifyAPIError) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 401
+    assert len(dify.requests) == 1
+
+
+def test_circuit_opens_after_repeated_failures_and_recovers(dify):
+    dify.fail_next = 100
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+
+    async def run():
+        client = _client(dify, max_attempts=2, breaker=breaker)
+        try:
+            with pytest.raises(DifyAPIError):
+                await client.get_user_conversations('nv01')
+            with pytest.raises(DifyCircuitOpenError):
+                await client.get_user_conversations('nv01')
+            calls_while_open = len(dify.requests)
+            dify.fail_next = 0
+            await asyncio.sleep(0.25)
+            page = await client.get_user_conversations('nv01')
+        finally:
+            await client.aclose()
+        return calls_while_open, page
+
+    calls_while_open, page = asyncio.run(run())
+
+    assert calls_while_open == 2
+    assert breaker.state == 'closed'
+    assert len(page['data']) == 20
+
+
+def test_slow_responses_time_out(dify):
+    dify.delay = 0.5
+
+    async def run():
+        client = _client(dify, timeout=0.1, max_attempts=1)
+        try:
+            await client.get_user_conversations('nv01')
+        finally:
+            await client.aclose()
+
+    started = time.monotonic()
+    with pytest.raises(DifyAPIError):
+        asyncio.run(run())
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,81 @@
+import asyncio
+
+from dify_api_service import DifyAPIService
+from dify_message_sync import sync_conversation_messages
+
+
+def _messages(count):
+    return [{'id': f'msg-{index:04d}', 'query': f'hoi {index}', 'answer': f'tra loi {index}', 'created_at': 1700000000 + index}
+            for index in range(count)]
+
+
+class PagedDify:
+    """Trả message theo trang giống Dify: trang mới nhất trước, first_id = message cũ nhất của trang trước"""
+
+    def __init__(self, messages, page_size=100):
+        self.messages = messages
+        self.page_size = page_size
+        self.requests = 0
+
+    def page(self, first_id=None):
+        self.requests += 1
+        end = len(self.messages)
+        if first_id:
+            end = next(index for index, message in enumerate(self.messages) if message['id'] == first_id)
+        start = max(0, end - self.page_size)
+        return {'data': self.messages[start:end], 'has_more': start > 0}
+
+    async def iter_message_pages(self, conversation_id, user):
+        first_id = None
+        while True:
+            page = self.page(first_id)
+            yield page['data']
+            if not page['has_more']:
+                return
+            first_id = page['data'][0]['id']
+
+
+def _service(dify):
+    service = DifyAPIService()
+    service.get_conversation_messages = lambda conversation_id, user, first_id=None, limit=20: dify.page(first_id)
+    return service
+
+
+def test_each_page_is_written_with_one_upsert(fake_supabase):
+    fake_supabase.tables['employees'] = [{'id': 7, 'username': 'nv07'}]
+    dify = PagedDify(_messages(2000))
+
+    stats = _service(dify).sync_messages_to_database('conv-1', 7, 'Bao gia', client=fake_supabase)
+
+    assert stats == {'inserted': 2000, 'skipped': 0, 'pages': 20}
+    assert fake_supabase.calls_to('chat_history') == [('chat_history', 'upsert')] * 20
+    row = next(row for row in fake_supabase.tables['chat_history'] if row['dify_message_id'] == 'msg-0005')
+    assert (row['input_text'], row['output_text'], row['user_id'], row['name_app']) == ('hoi 5', 'tra loi 5', 7, 'Bao gia')
+
+
+def test_resync_only_inserts_new_messages(fake_supabase):
+    fake_supabase.tables['employees'] = [{'id': 7, 'username': 'nv07'}]
+    dify = PagedDify(_messages(150))
+    service = _service(dify)
+    service.sync_messages_to_database('conv-1', 7, 'Bao gia', client=fake_supabase)
+
+    dify.messages.extend(_messages(160)[150:])
+    stats = service.sync_messages_to_database('conv-1', 7, 'Bao gia', client=fake_supabase)
+
+    assert stats == {'inserted': 10, 'skipped': 150, 'pages': 2}
+    assert len(fake_supabase.tables['chat_history']) == 160
+
+
+def test_concurrent_async_syncs_do_not_duplicate(fake_supabase):
+    async def run():
+        return await asyncio.gather(*[
+            sync_conversation_messages(PagedDify(_messages(250)), 'conv-1', 'nv07', 7, 'Bao gia', client=fake_supabase)
+            for _ in range(3)
+        ])
+
+    results = asyncio.run(run())
+
+    assert sum(result['inserted'] for result in results) == 250
+    assert sum(result['skipped'] for result in results) == 500
+    assert len({row['dify_message_id'] for row in fake_supabase.tables['chat_history']}) == 250
+    assert len(fake_supabase.tables['chat_history']) == 250
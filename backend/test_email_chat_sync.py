@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from email_chat_sync import EmailChatSyncService, NOTIFY_CHANNEL, get_high_water_mark, reconcile_pending, sync_new_records
+
+
+def _chat(log_id, email=None, conversation_id=None, **extra):
+    return {'log_id': log_id, 'email': email, 'input_text': 'xin chao', 'name_app': 'Bao gia',
+            'conversation_id': conversation_id or f'conv-{log_id}', 'user_id': None, **extra}
+
+
+@pytest.fixture
+def chat_db(fake_supabase):
+    fake_supabase.tables['employees'] = [{'id': 10, 'email': 'a@example.com'}, {'id': 11, 'email': 'b@example.com'}]
+    fake_supabase.tables['user_chat'] = [{'id': 1, 'email': 'a@example.com', 'conversation_id': 'conv-old'}]
+    return fake_supabase
+
+
+def test_only_rows_after_the_high_water_mark_are_processed(chat_db):
+    chat_db.tables['sync_state'] = [{'name': 'email_user_chat', 'last_log_id': 2}]
+    chat_db.tables['chat_history'] = [
+        _chat(1, 'a@example.com', user_id=10), _chat(2, 'b@example.com', user_id=11),
+        _chat(3, 'a@example.com', 'conv-old'),
+        _chat(4, 'a@example.com', 'conv-x'), _chat(5, 'a@example.com', 'conv-x'),
+        _chat(6, None, 'conv-y', input_text=json.dumps({'Email': 'b@example.com'})),
+        _chat(7, 'khach@example.com'),
+        _chat(8),
+    ]
+
+    stats = sync_new_records(chat_db)
+
+    assert stats['records'] == 6
+    assert stats['user_chat_created'] == 2
+    assert stats['unmatched_emails'] == 1
+    assert stats['last_log_id'] == 8
+    pairs = {(row['email'], row['conversation_id']) for row in chat_db.tables['user_chat']}
+    assert pairs == {('a@example.com', 'conv-old'), ('a@example.com', 'conv-x'), ('b@example.com', 'conv-y')}
+    assert [row['user_id'] for row in chat_db.tables['chat_history'][2:6]] == [10, 10, 10, 11]
+    assert get_high_water_mark(chat_db) == 8
+    assert chat_db.calls_to('employees') == [('employees', 'select')]
+    assert chat_db.calls_to('user_chat') == [('user_chat', 'select'), ('user_chat', 'insert')]
+
+
+def test_rows_committed_behind_the_high_water_mark_are_picked_up(chat_db):
+    now = datetime(2025, 9, 10, 8, 0, 0)
+    recent = (now - timedelta(seconds=30)).isoformat()
+    chat_db.tables['sync_state'] = [{'name': 'email_user_chat', 'last_log_id': 700}]
+    chat_db.tables['chat_history'] = [
+        _chat(1, 'a@example.com', created_at=recent),
+        # log_id 600 được cấp trước 650 nhưng commit sau lần sync trước
+        _chat(600, 'b@example.com', created_at=recent), _chat(650, 'a@example.com', user_id=10, created_at=recent),
+        # Email không khớp nhân viên nào: chỉ được đọc lại khi dòng còn mới
+        _chat(660, 'khach@example.com', created_at=(now - timedelta(hours=1)).isoformat()),
+        _chat(701, 'a@example.com', created_at=recent),
+    ]
+
+    stats = sync_new_records(chat_db, now=now)
+
+    assert stats['records'] == 2
+    assert stats['unmatched_emails'] == 0
+    assert stats['last_log_id'] == 701
+    assert [row['user_id'] for row in chat_db.tables['chat_history']] == [None, 11, 10, None, 10]
+
+
+def test_idle_run_costs_three_indexed_reads(chat_db):
+    chat_db.tables['chat_history'] = [_chat(1, 'a@example.com')]
+    sync_new_records(chat_db)
+    chat_db.calls.clear()
+
+    stats = sync_new_records(chat_db)
+
+    assert stats == {'last_log_id': 1}
+    assert chat_db.calls == [('sync_state', 'select'), ('chat_history', 'select'), ('chat_history', 'select')]
+
+
+def test_backlog_is_consumed_in_batches(chat_db):
+    chat_db.tables['chat_history'] = [_chat(log_id, 'a@example.com') for log_id in range(1, 1201)]
+
+    stats = sync_new_records(chat_db, batch_size=500)
+
+    assert stats['records'] == 1200
+    assert stats['user_chat_created'] == 1200
+    assert chat_db.calls_to('chat_history').count(('chat_history', 'select')) == 3
+
+
+def test_service_polls_when_listen_is_unavailable(chat_db):
+    chat_db.tables['chat_history'] = [_chat(1, 'a@example.com')]
+    service = EmailChatSyncService(client=chat_db, poll_interval=0.05, connect_listener=lambda: None)
+    synced = threading.Event()
+    original = service.run_once
+
+    def run_once():
+        stats = original()
+        if stats.get('last_log_id') == 2:
+            synced.set()
+        return stats
+
+    service.run_once = run_once
+    service.start()
+    chat_db.tables['chat_history'].append(_chat(2, 'b@example.com'))
+    try:
+        assert synced.wait(2)
+    finally:
+        service.stop()
+    assert len(chat_db.tables['user_chat']) == 3
+
+
+def test_service_sweeps_pending_rows_periodically(chat_db):
+    chat_db.tables['sync_state'] = [{'name': 'email_user_chat', 'last_log_id': 5000}]
+    chat_db.tables['chat_history'] = [_chat(1, 'moi@example.com')]
+    clock = [0.0]
+    service = EmailChatSyncService(client=chat_db, pending_interval=3600, connect_listener=lambda: None, clock=lambda: clock[0])
+
+    service.run_once()
+    # Nhân viên được tạo sau khi dòng chat đã qua high-water mark
+    chat_db.tables['employees'].append({'id': 12, 'email': 'moi@example.com'})
+    clock[0] = 60
+    service.run_once()
+    assert chat_db.tables['chat_history'][0]['user_id'] is None
+
+    clock[0] = 3600
+    service.run_once()
+    assert chat_db.tables['chat_history'][0]['user_id'] == 12
+    assert service.last_pending_stats['user_chat_created'] == 1
+
+
+@pytest.mark.skipif(not os.environ.get('TEST_DATABASE_URL'), reason='cần Postgres cục bộ (TEST_DATABASE_URL)')
+def test_notify_wakes_the_service_against_local_postgres(chat_db):
+    psycopg2 = pytest.importorskip('psycopg2')
+
+    def connect_listener():
+        connection = psycopg2.connect(os.environ['TEST_DATABASE_URL'])
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+        return connection
+
+    service = EmailChatSyncService(client=chat_db, listen_timeout=30, connect_listener=connect_listener)
+    runs = []
+    second_run = threading.Event()
+    original = service.run_once
+
+    def run_once():
+        runs.append(original())
+        if len(runs) == 2:
+            second_run.set()
+        return runs[-1]
+
+    service.run_once = run_once
+    service.start()
+    try:
+        chat_db.tables['chat_history'] = [_chat(1, 'a@example.com')]
+        notifier = psycopg2.connect(os.environ['TEST_DATABASE_URL'])
+        notifier.autocommit = True
+        # Chờ service vào trạng thái LISTEN rồi gửi NOTIFY như trigger trên chat_history
+        while not runs:
+            threading.Event().wait(0.01)
+        with notifier.cursor() as cursor:
+            cursor.execute(f"NOTIFY {NOTIFY_CHANNEL}, '1';")
+        notifier.close()
+        assert second_run.wait(5)
+    finally:
+        service.stop()
+    assert runs[1]['user_chat_created'] == 1
+
+
+def test_pending_backfill_is_reconciled_with_bulk_queries(chat_db):
+    chat_db.tables['employees'] = [{'id': 100 + index, 'email': f'nv{index}@example.com'} for index in range(40)]
+    chat_db.tables['chat_history'] = [
+        _chat(log_id, f'nv{log_id % 50}@example.com', f'conv-{log_id % 300}', created_at='2025-09-10T08:00:00')
+        for log_id in range(1, 3001)
+    ] + [_chat(3001, 'nv1@example.com', user_id=101), _chat(3002, None)]
+
+    stats = reconcile_pending(client=chat_db)
+
+    assert stats['records'] == 3000
+    assert stats['matched'] == 2400
+    assert stats['unmatched_emails'] == 10
+    assert stats['user_chat_created'] == len({(log_id % 50, log_id % 300) for log_id in range(1, 3001) if log_id % 50 < 40})
+    assert set(stats['timings']) == {'fetch_seconds', 'reconcile_seconds', 'total_seconds'}
+    assert stats['timings']['total_seconds'] < 5
+    assert chat_db.calls_to('employees') == [('employees', 'select')]
+    assert chat_db.calls_to('user_chat') == [('user_chat', 'select')] * 2 + [('user_chat', 'insert')]
+    # Một lệnh update cho mỗi nhân viên khớp email
+    assert chat_db.calls_to('chat_history').count(('chat_history', 'update')) == 40
@@ -0,0 +1,101 @@
+import socket
+
+import pytest
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller
+
+from email_delivery import EmailDeliveryQueue, SMTPConnectionPool
+
+
+class SinkHandler:
+    """SMTP sink: ghi lại mỗi envelope, từ chối/tạm hoãn theo cấu hình"""
+
+    def __init__(self, rejected=(), deferred_once=()):
+        self.envelopes = []
+        self.rejected = set(rejected)
+        self.deferred = set(deferred_once)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.rejected:
+            return '550 Mailbox unavailable'
+        if address in self.deferred:
+            self.deferred.discard(address)
+            return '451 Try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append((session.peer, list(envelope.rcpt_tos), envelope.content))
+        return '250 Message accepted'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_sink():
+    handlers = []
+
+    def start(**options):
+        handler = SinkHandler(**options)
+        port = _free_port()
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        handlers.append(controller)
+        return handler, port
+
+    yield start
+    for controller in handlers:
+        controller.stop()
+
+
+def _queue(port, size=3):
+    pool = SMTPConnectionPool('127.0.0.1', port, starttls=False, size=size)
+    return EmailDeliveryQueue(pool, sender='noreply@example.com', max_attempts=3, backoff_seconds=0.01)
+
+
+def test_each_recipient_gets_its_own_envelope_over_pooled_connections(smtp_sink):
+    handler, port = smtp_sink()
+    delivery = _queue(port)
+    recipients = [f'nv{index}@example.com' for index in range(12)]
+
+    results = delivery.deliver(recipients + ['nv0@example.com'], 'Thong bao', 'Noi dung\ndong 2', {'X-Priority': '1'})
+    delivery.shutdown()
+
+    assert [result.recipient_email for result in results] == recipients
+    assert all(result.status == 'sent' and result.attempts == 1 for result in results)
+    assert sorted(rcpt for _, rcpts, _ in handler.envelopes for rcpt in rcpts) == sorted(recipients)
+    assert all(len(rcpts) == 1 for _, rcpts, _ in handler.envelopes)
+    # Mỗi worker dùng lại một kết nối cho cả phần danh sách của mình
+    assert len({peer for peer, _, _ in handler.envelopes}) <= 3
+    assert b'X-Priority: 1' in handler.envelopes[0][2]
+
+
+def test_rejected_recipient_fails_alone_and_transient_errors_retry(smtp_sink):
+    handler, port = smtp_sink(rejected={'sai@example.com'}, deferred_once={'cham@example.com'})
+    delivery = _queue(port, size=1)
+
+    results = {result.recipient_email: result for result in
+               delivery.deliver(['a@example.com', 'sai@example.com', 'cham@example.com'], 'Tieu de', 'Noi dung')}
+    delivery.shutdown()
+
+    assert results['a@example.com'].status == 'sent'
+    assert results['sai@example.com'].status == 'failed'
+    assert results['sai@example.com'].attempts == 1
+    assert '550' in results['sai@example.com'].error_message
+    assert results['cham@example.com'].status == 'sent'
+    assert results['cham@example.com'].attempts == 2
+
+
+def test_unreachable_server_reports_every_recipient():
+    delivery = _queue(_free_port(), size=2)
+
+    results = delivery.deliver(['a@example.com', 'b@example.com'], 'Tieu de', 'Noi dung')
+    delivery.shutdown()
+
+    assert [result.status for result in results] == ['failed', 'failed']
+    assert all(result.attempts == 3 for result in results)
@@ -0,0 +1,89 @@
+import pytest
+
+from employee_directory import list_employees
+
+
+@pytest.fixture
+def directory(fake_supabase):
+    fake_supabase.tables['departments'] = [
+        {'id': 1, 'name': 'Kế toán', 'description': 'KT'},
+        {'id': 2, 'name': 'Kinh doanh', 'description': 'KD'},
+    ]
+    fake_supabase.tables['employees'] = [
+        {'id': index, 'ma_nv': f'{1000 + index}', 'full_name': f'Nhân Viên {index}', 'email': f'nv{index}@congty.vn',
+         'department_id': 1 + index % 2 if index % 5 else None}
+        for index in range(1, 2501)
+    ] + [
+        {'id': 3001, 'ma_nv': '9001', 'full_name': 'Trần Thị Hoa', 'email': 'hoa.tran@congty.vn', 'department_id': 2},
+        {'id': 3002, 'ma_nv': '9002', 'full_name': 'Lê Văn, Nam (KD)', 'email': 'nam@congty.vn', 'department_id': 1},
+    ]
+    # Hai quan hệ như trên database: employees.department_id -> departments.id và departments.manager_id -> employees.id
+    fake_supabase.foreign_keys[('employees', 'departments')] = [
+        ('department_id', 'id', 'fk_employees_department'),
+        ('id', 'manager_id', 'departments_manager_id_fkey'),
+    ]
+    return fake_supabase
+
+
+def test_search_runs_in_one_query_with_embedded_departments(directory):
+    users, next_offset = list_employees(search='  HOA ', client=directory)
+
+    assert [(user['ma_nv'], user['departments']['name']) for user in users] == [('9001', 'Kinh doanh')]
+    assert next_offset is None
+    assert directory.calls == [('employees', 'select')]
+
+
+def test_embed_names_the_department_relationship_so_it_never_falls_back(directory, capsys):
+    users, _ = list_employees(department_id=1, limit=5, client=directory)
+
+    assert [user['departments']['name'] for user in users] == ['Kế toán'] * 5
+    assert directory.calls == [('employees', 'select')]
+    assert 'Embedded departments select unavailable' not in capsys.readouterr().out
+
+
+def test_search_terms_with_postgrest_syntax_are_quoted(directory):
+    users, _ = list_employees(search='Nam (KD', client=directory)
+
+    assert [user['ma_nv'] for user in users] == ['9002']
+
+
+@pytest.mark.parametrize('search, expected', [('a_b', ['9003']), ('100%', ['9005']), ('c\\d', ['9007'])])
+def test_like_wildcards_in_search_terms_match_literally(directory, search, expected):
+    directory.tables['employees'] += [
+        {'id': 3000 + index, 'ma_nv': f'{9000 + index}', 'full_name': name, 'email': f'x{index}@congty.vn', 'department_id': None}
+        for index, name in ((3, 'a_b'), (4, 'aXb'), (5, 'Đạt 100%'), (6, 'Đạt 1000'), (7, 'c\\d'), (8, 'cd'))
+    ]
+
+    users, _ = list_employees(search=search, client=directory)
+
+    assert [user['ma_nv'] for user in users] == expected
+
+
+def test_pages_are_sliced_in_the_database(directory):
+    first, next_offset = list_employees(department_id=2, limit=100, client=directory)
+    second, _ = list_employees(department_id=2, limit=100, offset=next_offset, client=directory)
+
+    assert next_offset == 100
+    assert len(first) == len(second) == 100
+    assert first[-1]['ma_nv'] < second[0]['ma_nv']
+    assert all(user['departments'] == {'id': 2, 'name': 'Kinh doanh', 'description': 'KD'} for user in first + second)
+    assert directory.calls == [('employees', 'select')] * 2
+
+
+def test_unpaged_listing_reads_past_the_postgrest_row_cap(directory):
+    users, next_offset = list_employees(client=directory)
+
+    assert len(users) == 2502
+    assert next_offset is None
+    assert users[4]['departments'] is None
+    assert directory.calls == [('employees', 'select')] * 3
+
+
+def test_departments_are_batched_when_embedding_is_unavailable(directory):
+    directory.foreign_keys.clear()
+
+    users, next_offset = list_employees(search='congty', limit=3, client=directory)
+
+    assert [user['departments']['name'] for user in users] == ['Kinh doanh', 'Kế toán', 'Kinh doanh']
+    assert next_offset == 3
+    assert directory.calls == [('employees', 'select'), ('employees', 'select'), ('departments', 'select')]
@@ -0,0 +1,115 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import pandas as pd
+
+import employee_import
+from employee_import import import_employees, read_frames
+
+HEADER = 'ma_nv,email,password,full_name,luong_hop_dong,muc_luong_dong_bhxh,so_nguoi_phu_thuoc,dien_thoai\n'
+
+
+def _csv(rows):
+    return io.StringIO(HEADER + ''.join(','.join(str(value) for value in row) + '\n' for row in rows))
+
+
+def _employees(fake_supabase):
+    fake_supabase.tables['employees'] = [
+        {'id': 1, 'ma_nv': '1500', 'email': 'cu@example.com'},
+        {'id': 2, 'ma_nv': 'NV-A', 'email': 'khac@example.com'},
+    ]
+
+
+def test_large_csv_is_imported_in_bulk(fake_supabase):
+    _employees(fake_supabase)
+    rows = [('', f'nv{index}@example.com', f'matkhau{index}', f'Nhan Vien {index}', 10000000, 5000000, index % 3, f'0900{index:06d}')
+            for index in range(5000)]
+    rows[10] = ('', '', 'x', 'Thieu Email', 1, 1, '', '')
+    rows[20] = ('', 'nv20@example.com', 'x', 'Sai Luong', 'abc', 1, '', '')
+    rows[30] = ('', 'NV0@example.com', 'x', 'Trung Email', 1, 1, '', '')
+    rows[40] = ('', 'cu@example.com', 'x', 'Da Ton Tai', 1, 1, '', '')
+    rows[50] = ('2000', 'nv50@example.com', 'x', 'Co Ma', 1, 1, '', '')
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(4) as executor:
+        result = import_employees(read_frames(_csv(rows), 'nhan_vien.csv', chunk_size=2000), fake_supabase,
+                                  executor=executor, rounds=4)
+    elapsed = time.monotonic() - started
+
+    assert len(result['created_users']) == 4996
+    assert result['errors'] == [
+        'Dòng 12: Thiếu email',
+        'Dòng 22: luong_hop_dong không phải số',
+        'Dòng 32: Email bị trùng trong file',
+        'Dòng 42: Email cu@example.com đã tồn tại',
+    ]
+    assert elapsed < 30
+    by_email = {row['email']: row for row in fake_supabase.tables['employees']}
+    # ma_nv có sẵn trong file được giữ, các dòng còn lại được cấp tiếp sau số lớn nhất
+    assert by_email['nv50@example.com']['ma_nv'] == '2000'
+    assert by_email['nv0@example.com']['ma_nv'] == '2001'
+    assert len({row['ma_nv'] for row in fake_supabase.tables['employees']}) == 4998
+    assert by_email['nv7@example.com']['dien_thoai'] == '0900000007'
+    assert by_email['nv7@example.com']['so_nguoi_phu_thuoc'] == 1
+    assert bcrypt.checkpw(b'matkhau7', by_email['nv7@example.com']['hashed_password'].encode('utf-8'))
+    calls = fake_supabase.calls_to('employees')
+    assert calls.count(('employees', 'insert')) == 10
+    assert calls.count(('employees', 'select')) == 26
+
+
+class RejectingBatches:
+    """Database từ chối insert nhiều dòng; một email cụ thể bị từ chối cả khi insert lẻ"""
+
+    def __init__(self, db, bad_email):
+        self.db = db
+        self.bad_email = bad_email
+
+    def table(self, name):
+        query = self.db.table(name)
+        insert = query.insert
+
+        def checked_insert(payload):
+            if isinstance(payload, list) or payload.get('email') == self.bad_email:
+                raise Exception('duplicate key value violates unique constraint "employees_ma_nv_key"')
+            return insert(payload)
+
+        query.insert = checked_insert
+        return query
+
+
+def test_rejected_batch_is_retried_row_by_row(fake_supabase):
+    _employees(fake_supabase)
+    frame = pd.DataFrame({
+        'email': ['a@example.com', 'b@example.com', 'c@example.com'],
+        'password': ['1', '2', '3'],
+        'full_name': ['A', 'B', 'C'],
+        'luong_hop_dong': [1, 2, 3],
+        'muc_luong_dong_bhxh': [1, 2, 3],
+    })
+
+    with ThreadPoolExecutor(2) as executor:
+        result = import_employees([frame], RejectingBatches(fake_supabase, 'b@example.com'), executor=executor, rounds=4)
+
+    assert [user['email'] for user in result['created_users']] == ['a@example.com', 'c@example.com']
+    assert result['errors'] == ['Dòng 3: duplicate key value violates unique constraint "employees_ma_nv_key"']
+
+
+def test_passwords_are_hashed_in_the_shared_pool(fake_supabase):
+    frame = pd.DataFrame({
+        'email': ['p@example.com'], 'password': ['bi-mat'], 'full_name': ['P'],
+        'luong_hop_dong': [1], 'muc_luong_dong_bhxh': [1],
+    })
+
+    result = import_employees([frame], fake_supabase, rounds=4)
+    pool = employee_import.get_hash_executor()
+    import_employees([frame.assign(email='q@example.com')], fake_supabase, rounds=4)
+
+    assert result == {'created_users': [{'email': 'p@example.com', 'ma_nv': '1000'}], 'errors': []}
+    assert bcrypt.checkpw(b'bi-mat', fake_supabase.tables['employees'][0]['hashed_password'].encode('utf-8'))
+    # Mọi request dùng chung một pool cho tới khi app tắt
+    assert employee_import.get_hash_executor() is pool
+    employee_import.shutdown_hash_executor()
+    assert employee_import.get_hash_executor() is not pool
+    employee_import.shutdown_hash_executor()
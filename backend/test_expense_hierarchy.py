@@ -0,0 +1,165 @@
+import json
+
+from expense_hierarchy import ExpenseHierarchyCache, hierarchy_response
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _expenses():
+    return [
+        {'id': 1, 'parent_id': None, 'giathanh': 0, 'created_at': '2025-09-01T08:00:00', 'id_lcp': 1, 'ti_le': None},
+        {'id': 2, 'parent_id': 1, 'giathanh': 0, 'created_at': '2025-09-02T08:00:00', 'id_lcp': 2, 'ti_le': None},
+        {'id': 3, 'parent_id': 2, 'giathanh': 100, 'created_at': '2025-09-03T08:00:00', 'id_lcp': 2, 'ti_le': None},
+        {'id': 4, 'parent_id': 2, 'giathanh': 50, 'created_at': '2025-09-04T08:00:00', 'id_lcp': None, 'ti_le': None},
+        {'id': 5, 'parent_id': 1, 'giathanh': 30, 'created_at': '2025-09-05T08:00:00', 'id_lcp': 1, 'ti_le': None},
+        # Chi phí con khác tháng: có trong total_amount của cây mọi tháng nhưng không cộng vào giathanh cha
+        {'id': 6, 'parent_id': 1, 'giathanh': 999, 'created_at': '2025-10-01T08:00:00', 'id_lcp': 1, 'ti_le': None},
+        {'id': 7, 'parent_id': None, 'giathanh': 10, 'created_at': '2025-10-02T08:00:00', 'id_lcp': 1, 'ti_le': None},
+    ]
+
+
+def _cache(fake_supabase, clock=None):
+    fake_supabase.tables['quanly_chiphi'] = _expenses()
+    fake_supabase.tables['loaichiphi'] = [
+        {'id': 1, 'tenchiphi': 'Điện', 'loaichiphi': 'định phí', 'giathanh': None},
+        {'id': 2, 'tenchiphi': 'Nhân công', 'loaichiphi': 'biến phí', 'giathanh': 5},
+        {'id': 3, 'tenchiphi': 'Không dùng', 'loaichiphi': 'biến phí', 'giathanh': None},
+    ]
+    return ExpenseHierarchyCache(client=fake_supabase, clock=clock or FakeClock())
+
+
+def _tree(cache, month=None):
+    return json.loads(cache.get(month)[0])['hierarchy']
+
+
+def _summary(nodes):
+    return [(node['id'], node['giathanh'], node['total_amount'], _summary(node['children'])) for node in nodes]
+
+
+def test_month_tree_is_built_once_and_served_from_cache(fake_supabase):
+    cache = _cache(fake_supabase)
+
+    tree = _tree(cache, '2025-09')
+
+    assert _summary(tree) == [(1, 180, 510, [(5, 30, 30, []), (2, 150, 300, [(4, 50, 50, []), (3, 100, 100, [])])])]
+    assert tree[0]['loaichiphi'] == {'id': 1, 'tenchiphi': 'Điện', 'loaichiphi': 'định phí', 'giathanh': None}
+    assert tree[0]['children'][1]['children'][0]['loaichiphi'] is None
+    assert fake_supabase.calls == [('quanly_chiphi', 'select'), ('loaichiphi', 'select')]
+
+    body, etag = cache.get('2025-09')
+    assert json.loads(body)['hierarchy'] == tree
+    assert cache.get('2025-09')[1] == etag
+    assert len(fake_supabase.calls) == 2
+    assert cache.stats()['hits'] == 2
+
+
+def test_all_months_tree_keeps_cross_month_children_out_of_parent_giathanh(fake_supabase):
+    cache = _cache(fake_supabase)
+
+    assert [(node['id'], node['giathanh'], node['total_amount']) for node in _tree(cache)] == [(7, 10, 10), (1, 180, 1509)]
+
+
+def test_deep_chains_are_built_and_serialized_without_recursion(fake_supabase):
+    cache = _cache(fake_supabase)
+    fake_supabase.tables['quanly_chiphi'] = [
+        {'id': index, 'parent_id': index - 1 if index > 1 else None, 'giathanh': 1, 'created_at': '2025-09-01', 'id_lcp': None}
+        for index in range(1, 5001)
+    ]
+
+    body, _ = cache.get('2025-09')
+
+    # json.loads của Python tự giới hạn độ sâu nên chỉ kiểm tra cấu trúc chuỗi JSON
+    assert body.startswith(b'{"hierarchy":[{"id":1,"parent_id":null,"giathanh":1,')
+    assert b'"total_amount":5000,' in body
+    assert body.count(b'"children":[') == 5000
+    assert body.endswith(b'"children":[' + b']}' * 5000 + b']}')
+
+
+def test_writes_patch_the_cached_trees_without_reloading(fake_supabase):
+    cache = _cache(fake_supabase)
+    _tree(cache, '2025-09')
+    _tree(cache)
+    _, old_etag = cache.get('2025-09')
+    fake_supabase.calls.clear()
+
+    changes = [
+        {**_expenses()[2], 'giathanh': 400},
+        {'id': 8, 'parent_id': 5, 'giathanh': 20, 'created_at': '2025-09-20T08:00:00', 'id_lcp': 3, 'ti_le': None},
+        # Đổi cha và đổi tháng
+        {**_expenses()[3], 'parent_id': 7},
+        {**_expenses()[6], 'created_at': '2025-09-30T08:00:00'},
+    ]
+    rows = {row['id']: row for row in fake_supabase.tables['quanly_chiphi']}
+    for change in changes:
+        rows[change['id']] = change
+        cache.apply_upsert(change)
+    del rows[2], rows[3]
+    cache.apply_delete([3, 2])
+    fake_supabase.tables['quanly_chiphi'] = list(rows.values())
+
+    # Chỉ loaichiphi mới (id 3) được đọc thêm
+    assert fake_supabase.calls == [('loaichiphi', 'select')]
+    assert cache.get('2025-09')[1] != old_etag
+    fresh = ExpenseHierarchyCache(client=fake_supabase)
+    assert _tree(cache, '2025-09') == _tree(fresh, '2025-09')
+    assert _tree(cache) == _tree(fresh)
+    assert _summary(_tree(cache, '2025-09')) == [
+        (7, 50, 100, [(4, 50, 50, [])]),
+        (1, 20, 60, [(5, 20, 40, [(8, 20, 20, [])])]),
+    ]
+
+
+def test_ratio_refresh_only_reads_the_ratio_column(fake_supabase):
+    cache = _cache(fake_supabase)
+    _tree(cache, '2025-09')
+    for row in fake_supabase.tables['quanly_chiphi']:
+        row['ti_le'] = 12.5
+    fake_supabase.calls.clear()
+
+    cache.refresh_ratios('2025-09')
+
+    assert fake_supabase.calls == [('quanly_chiphi', 'select')]
+    assert _tree(cache, '2025-09')[0]['ti_le'] == 12.5
+
+
+def test_snapshots_expire_and_invalidate(fake_supabase):
+    clock = FakeClock()
+    cache = _cache(fake_supabase, clock)
+    cache.ttl = 60
+    _tree(cache, '2025-09')
+
+    clock.now = 61
+    _tree(cache, '2025-09')
+    cache.invalidate('2025-09')
+    _tree(cache, '2025-09')
+
+    assert fake_supabase.calls.count(('quanly_chiphi', 'select')) == 3
+    assert cache.stats()['misses'] == 3
+
+
+def test_response_carries_etag_and_honours_if_none_match(fake_supabase):
+    cache = _cache(fake_supabase)
+
+    response = hierarchy_response('2025-09', cache=cache)
+    etag = response.headers['etag']
+    cached = hierarchy_response('2025-09', f'W/"other", {etag}', cache=cache)
+
+    assert response.status_code == 200
+    assert json.loads(response.body)['hierarchy'][0]['id'] == 1
+    assert (cached.status_code, cached.body, cached.headers['etag']) == (304, b'', etag)
+
+
+def test_parent_losing_its_last_child_drops_to_zero(fake_supabase):
+    cache = _cache(fake_supabase)
+    _tree(cache, '2025-09')
+
+    cache.apply_delete([4, 3])
+    cache.apply_upsert({**_expenses()[4], 'parent_id': 7})
+
+    assert _summary(_tree(cache, '2025-09')) == [(5, 30, 30, []), (1, 0, 0, [(2, 0, 0, [])])]
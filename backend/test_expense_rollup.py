@@ -0,0 +1,116 @@
+from expense_rollup import compute_parent_totals, rollup_expenses, rollup_parent_month
+
+
+def _expenses():
+    return [
+        {'id': 1, 'parent_id': None, 'giathanh': 0, 'created_at': '2025-09-01T08:00:00', 'id_lcp': 1},
+        {'id': 2, 'parent_id': 1, 'giathanh': 0, 'created_at': '2025-09-02T08:00:00', 'id_lcp': 1},
+        {'id': 3, 'parent_id': 2, 'giathanh': 100, 'created_at': '2025-09-03T08:00:00', 'id_lcp': 1},
+        {'id': 4, 'parent_id': 2, 'giathanh': 50, 'created_at': '2025-09-04T08:00:00', 'id_lcp': 1},
+        {'id': 5, 'parent_id': 1, 'giathanh': 30, 'created_at': '2025-09-05T08:00:00', 'id_lcp': 1},
+        # Chi phí con khác tháng không được cộng vào cha
+        {'id': 6, 'parent_id': 1, 'giathanh': 999, 'created_at': '2025-10-01T08:00:00', 'id_lcp': 1},
+    ]
+
+
+def test_compute_parent_totals_uses_same_month_children_bottom_up():
+    assert compute_parent_totals(_expenses()) == {1: 180, 2: 150}
+
+
+def test_compute_parent_totals_handles_deep_trees_and_cycles():
+    chain = [{'id': i, 'parent_id': i - 1 if i > 1 else None, 'giathanh': 1, 'created_at': '2025-09-01'} for i in range(1, 5001)]
+    totals = compute_parent_totals(chain)
+    assert totals[1] == 1
+
+    cycle = [
+        {'id': 1, 'parent_id': 2, 'giathanh': 5, 'created_at': '2025-09-01'},
+        {'id': 2, 'parent_id': 1, 'giathanh': 7, 'created_at': '2025-09-01'},
+    ]
+    assert set(compute_parent_totals(cycle)) == {1, 2}
+
+
+def _set_expense_giathanh(db, params):
+    rows = {row['id']: row for row in db.tables['quanly_chiphi']}
+    for update in params['p_updates']:
+        rows[update['id']]['giathanh'] = update['giathanh']
+    return len(params['p_updates'])
+
+
+def test_rollup_expenses_writes_only_giathanh_in_one_call(fake_supabase):
+    fake_supabase.tables['quanly_chiphi'] = [{**row, 'mo_ta': 'cũ'} for row in _expenses()]
+
+    def concurrent_edit_then_write(db, params):
+        # Request khác sửa chi phí cha sau khi rollup đã đọc dữ liệu
+        db.tables['quanly_chiphi'][0].update({'mo_ta': 'mới', 'ti_le': 12.5})
+        return _set_expense_giathanh(db, params)
+    fake_supabase.rpc_functions['set_expense_giathanh'] = concurrent_edit_then_write
+
+    result = rollup_expenses('2025-09', client=fake_supabase)
+
+    assert result['updated_count'] == 2
+    assert fake_supabase.calls == [('quanly_chiphi', 'select'), ('set_expense_giathanh', 'rpc')]
+    rows = {row['id']: row for row in fake_supabase.tables['quanly_chiphi']}
+    assert (rows[1]['giathanh'], rows[2]['giathanh']) == (180, 150)
+    assert (rows[1]['mo_ta'], rows[1]['ti_le'], rows[1]['id_lcp']) == ('mới', 12.5, 1)
+
+    # Chạy lại không còn gì để ghi
+    fake_supabase.calls.clear()
+    assert rollup_expenses('2025-09', client=fake_supabase)['updated_count'] == 0
+    assert fake_supabase.calls == [('quanly_chiphi', 'select')]
+
+
+def test_rollup_expenses_falls_back_to_updates_grouped_by_value(fake_supabase):
+    fake_supabase.tables['quanly_chiphi'] = _expenses() + [
+        {'id': 7, 'parent_id': None, 'giathanh': 0, 'created_at': '2025-09-06T08:00:00', 'id_lcp': 1},
+        {'id': 8, 'parent_id': 7, 'giathanh': 180, 'created_at': '2025-09-07T08:00:00', 'id_lcp': 1},
+    ]
+
+    rollup_expenses('2025-09', client=fake_supabase)
+
+    # Chi phí 1 và 7 cùng giá trị 180: một lệnh update cho cả hai
+    assert fake_supabase.calls == [('quanly_chiphi', 'select')] + [('quanly_chiphi', 'update')] * 2
+    rows = {row['id']: row for row in fake_supabase.tables['quanly_chiphi']}
+    assert [rows[expense_id]['giathanh'] for expense_id in (1, 2, 7)] == [180, 150, 180]
+
+
+def test_rollup_parent_month_uses_parent_month(fake_supabase):
+    fake_supabase.tables['quanly_chiphi'] = _expenses()
+    fake_supabase.rpc_functions['set_expense_giathanh'] = _set_expense_giathanh
+
+    result = rollup_parent_month(2, client=fake_supabase)
+
+    assert result['month'] == '2025-09'
+    assert len(fake_supabase.calls) == 3
+
+
+def test_parent_left_without_children_is_reset_to_zero(fake_supabase):
+    fake_supabase.tables['quanly_chiphi'] = [
+        {'id': 1, 'parent_id': None, 'giathanh': 130, 'created_at': '2025-09-01T08:00:00'},
+        {'id': 2, 'parent_id': 1, 'giathanh': 100, 'created_at': '2025-09-02T08:00:00'},
+        {'id': 3, 'parent_id': 2, 'giathanh': 100, 'created_at': '2025-09-03T08:00:00'},
+        {'id': 4, 'parent_id': 1, 'giathanh': 30, 'created_at': '2025-09-04T08:00:00'},
+    ]
+    # Xóa con cuối cùng của chi phí 2
+    fake_supabase.tables['quanly_chiphi'] = [row for row in fake_supabase.tables['quanly_chiphi'] if row['id'] != 3]
+
+    result = rollup_parent_month(2, client=fake_supabase)
+
+    rows = {row['id']: row for row in fake_supabase.tables['quanly_chiphi']}
+    assert result['updated_count'] == 2
+    assert (rows[2]['giathanh'], rows[1]['giathanh']) == (0, 30)
+
+
+def test_reparented_last_child_resets_old_parent(fake_supabase):
+    fake_supabase.tables['quanly_chiphi'] = [
+        {'id': 1, 'parent_id': None, 'giathanh': 100, 'created_at': '2025-09-01T08:00:00'},
+        {'id': 2, 'parent_id': None, 'giathanh': 0, 'created_at': '2025-09-02T08:00:00'},
+        # Trước đây là con của 1
+        {'id': 3, 'parent_id': 2, 'giathanh': 100, 'created_at': '2025-09-03T08:00:00'},
+    ]
+
+    rollup_parent_month(2, client=fake_supabase)
+    result = rollup_parent_month(1, client=fake_supabase)
+
+    rows = {row['id']: row for row in fake_supabase.tables['quanly_chiphi']}
+    assert result['changes'] == [{'id': 1, 'old': 100, 'new': 0}]
+    assert (rows[1]['giathanh'], rows[2]['giathanh']) == (0, 100)
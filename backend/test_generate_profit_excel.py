@@ -0,0 +1,61 @@
+import io
+
+from openpyxl import load_workbook
+
+import generate_profit_excel
+from catalog_cache import CatalogCache
+
+
+def test_write_profit_excel_streams_write_only_workbook(fake_supabase, monkeypatch):
+    monkeypatch.setattr(generate_profit_excel, 'catalog_cache', CatalogCache(client=fake_supabase))
+    fake_supabase.tables.update({
+        'loainhom': [{'id': 1, 'tenloai': 'Nhôm Hệ K'}],
+        'loaikinh': [], 'loaitaynam': [], 'bophan': [], 'sanpham': [],
+        'invoices_reality': [{'id': 1, 'invoice_date': '2025-09-10', 'customer_name': 'Anh A', 'total_amount': 2000}],
+        'invoice_items_reality': [{'id': 1, 'invoice_id': 1, 'id_nhom': 1, 'so_luong': 2, 'don_gia': 1000, 'thanh_tien': 2000}],
+        'quanly_chiphi': [{'id': 1, 'id_lcp': 1, 'giathanh': 300, 'created_at': '2025-09-02T08:00:00'}],
+        'loaichiphi': [{'id': 1, 'tenchiphi': 'Vận chuyển'}],
+        'phieu_luong': [{'id': 1, 'ma_nv': 'NV01', 'ky_tinh_luong': '2025-09', 'luong_thuc_nhan': 500}],
+        'employees': [{'id': 1, 'ma_nv': 'NV01', 'ho_ten': 'Nguyễn Văn B'}],
+    })
+
+    output, filename = generate_profit_excel.write_profit_excel('2025-09', client=fake_supabase)
+    content = b''.join(generate_profit_excel.iter_file_chunks(output, chunk_size=1024))
+
+    assert filename.startswith('bao_cao_loi_nhuan_202509_')
+    assert output.closed
+    wb = load_workbook(io.BytesIO(content))
+    assert wb.sheetnames == ["Tong loi nhuan", "Doanh thu chi tiet", "Chi phi chi tiet", "Chi phi nhan su"]
+    summary = wb["Tong loi nhuan"]
+    assert summary['A5'].value == 'Tong doanh thu'
+    assert summary['B9'].value == 1200
+    revenue = wb["Doanh thu chi tiet"]
+    assert revenue['E5'].value == 'Nhôm Hệ K'
+    assert revenue['L7'].value == 2000
+    assert wb["Chi phi chi tiet"]['C5'].value == 'Vận chuyển'
+    assert wb["Chi phi nhan su"]['C5'].value == 'Nguyễn Văn B'
+
+
+def test_export_reads_and_writes_one_page_at_a_time(fake_supabase, monkeypatch):
+    monkeypatch.setattr(generate_profit_excel, 'catalog_cache', CatalogCache(client=fake_supabase))
+    fake_supabase.tables.update({
+        'loainhom': [], 'loaikinh': [], 'loaitaynam': [], 'bophan': [], 'sanpham': [],
+        'invoices_reality': [{'id': index, 'invoice_date': '2025-09-10', 'total_amount': 10} for index in range(1, 2501)],
+        'invoice_items_reality': [{'id': index, 'invoice_id': index, 'so_luong': 1, 'thanh_tien': 10} for index in range(1, 2501)],
+        'quanly_chiphi': [], 'loaichiphi': [],
+        'phieu_luong': [{'id': index, 'ma_nv': f'NV{index}', 'ky_tinh_luong': '2025-09', 'luong_thuc_nhan': index}
+                        for index in range(1, 4)],
+        'employees': [],
+    })
+
+    output, _ = generate_profit_excel.write_profit_excel('2025-09', client=fake_supabase)
+    wb = load_workbook(io.BytesIO(b''.join(generate_profit_excel.iter_file_chunks(output))))
+
+    # Trang hóa đơn tiếp theo chỉ được đọc sau khi item của trang trước đã được ghi
+    tables = [table for table, _ in fake_supabase.calls if table in ('invoices_reality', 'invoice_items_reality')]
+    assert tables == (['invoices_reality'] + ['invoice_items_reality'] * 5) * 2 + ['invoices_reality'] + ['invoice_items_reality'] * 3
+    summary = wb["Tong loi nhuan"]
+    assert (summary['B5'].value, summary['B11'].value, summary['B13'].value) == (25000, 2500, 3)
+    assert wb["Doanh thu chi tiet"].max_row == 2500 + 6
+    payroll = wb["Chi phi nhan su"]
+    assert [payroll.cell(row, 2).value for row in range(12, 16)] == [3, 2, 3, 1]
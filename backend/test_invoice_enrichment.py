@@ -0,0 +1,71 @@
+import os
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_SERVICE_KEY', 'test-service-key')
+
+import invoice_enrichment
+from catalog_cache import CatalogCache
+
+
+def _seed(fake_supabase, invoice_count, items_per_invoice):
+    fake_supabase.tables.update({
+        'loainhom': [{'id': 'NHK', 'tenloai': 'Nhôm Hệ K'}],
+        'loaikinh': [{'id': '5LC', 'tenloai': 'Kính 5 ly cường lực'}],
+        'loaitaynam': [{'id': 'TNA', 'tenloai': 'Tay nắm âm'}],
+        'bophan': [{'id': 'TL', 'tenloai': 'Tủ lạnh'}],
+        'sanpham': [{'id': 'NHKTNA5LCTL', 'tensp': 'Tủ bếp', 'id_nhom': 'NHK', 'id_kinh': '5LC', 'id_taynam': 'TNA', 'id_bophan': 'TL'}],
+        'loaiphukienbep': [{'id': 1, 'tenloai': 'Bếp từ'}],
+        'phukienbep': [{'id': 7, 'id_loaiphukien': 1, 'tenphukien': 'Bếp từ đôi'}],
+        'cong_trinh': [{'id': 3, 'name_congtrinh': 'Nhà anh A'}],
+        'invoice_items_reality': [],
+    })
+    invoices = []
+    for invoice_id in range(1, invoice_count + 1):
+        invoices.append({'id': invoice_id, 'id_congtrinh': 3 if invoice_id % 2 else None})
+        for _ in range(items_per_invoice):
+            fake_supabase.tables['invoice_items_reality'].extend([
+                {'id': len(fake_supabase.tables['invoice_items_reality']) + 1, 'invoice_id': invoice_id,
+                 'loai_san_pham': 'tu_bep', 'sanpham_id': 'NHKTNA5LCTL', 'id_nhom': 'NHK'},
+            ])
+        fake_supabase.tables['invoice_items_reality'].extend([
+            {'id': len(fake_supabase.tables['invoice_items_reality']) + 1, 'invoice_id': invoice_id,
+             'loai_san_pham': 'phu_kien_bep', 'id_phukien': 7},
+            {'id': len(fake_supabase.tables['invoice_items_reality']) + 2, 'invoice_id': invoice_id,
+             'loai_san_pham': 'tu_bep', 'sanpham_id': 'MISSING', 'id_nhom': 'NHK', 'id_bophan': 'TL'},
+        ])
+    return invoices
+
+
+def test_enrich_invoices_keeps_response_shape(fake_supabase, monkeypatch):
+    monkeypatch.setattr(invoice_enrichment, 'supabase', fake_supabase)
+    monkeypatch.setattr(invoice_enrichment, 'catalog_cache', CatalogCache(client=fake_supabase))
+    invoices = _seed(fake_supabase, invoice_count=2, items_per_invoice=1)
+
+    result = invoice_enrichment.enrich_invoices(invoices, 'invoice_items_reality', include_cong_trinh=True)
+
+    assert [invoice['id'] for invoice in result] == [1, 2]
+    assert result[0]['cong_trinh']['name_congtrinh'] == 'Nhà anh A'
+    assert result[1]['cong_trinh'] is None
+
+    product_item, phukien_item, fallback_item = result[0]['items']
+    assert product_item['sanpham']['ten_nhom'] == 'Nhôm Hệ K'
+    assert product_item['sanpham']['ten_bophan'] == 'Tủ lạnh'
+    assert 'ten_nhom' not in product_item
+    assert phukien_item['phukien']['ten_loai_phukien'] == 'Bếp từ'
+    assert 'sanpham' not in fallback_item
+    assert fallback_item['ten_nhom'] == 'Nhôm Hệ K'
+    assert fallback_item['ten_bophan'] == 'Tủ lạnh'
+
+
+def test_enrich_invoices_round_trips_do_not_grow_with_items(fake_supabase, monkeypatch):
+    monkeypatch.setattr(invoice_enrichment, 'supabase', fake_supabase)
+    monkeypatch.setattr(invoice_enrichment, 'catalog_cache', CatalogCache(client=fake_supabase))
+    invoices = _seed(fake_supabase, invoice_count=150, items_per_invoice=4)
+
+    invoice_enrichment.enrich_invoices(invoices, 'invoice_items_reality', include_cong_trinh=True)
+    # 900 item trên 1 trang 1000 dòng: 1 truy vấn items + 7 bảng danh mục + 1 công trình
+    assert len(fake_supabase.calls) == 9
+
+    # Lần gọi sau, danh mục đã có trong cache: chỉ còn items và công trình
+    fake_supabase.calls.clear()
+    invoice_enrichment.enrich_invoices(invoices, 'invoice_items_reality', include_cong_trinh=True)
+    assert len(fake_supabase.calls) == 2
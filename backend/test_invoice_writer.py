@@ -0,0 +1,39 @@
+import pytest
+
+from invoice_writer import create_invoice_with_items
+
+
+def _items(count):
+    items = [{'loai_san_pham': 'phu_kien_bep', 'id_phukien': 7, 'don_gia': 100, 'thanh_tien': 100}]
+    items += [
+        {'id_nhom': 'NHK', 'id_kinh': '5LC', 'id_taynam': 'TNA', 'id_bophan': 'TL', 'sanpham_id': 'NHKTNA5LCTL',
+         'ngang': 600, 'cao': 720, 'sau': 560, 'so_luong': 1, 'don_gia': 1000, 'thanh_tien': 1000}
+        for _ in range(count - 1)
+    ]
+    return items
+
+
+def test_fallback_writes_all_items_in_one_insert(fake_supabase):
+    invoice_id = create_invoice_with_items('quote', {'invoice_date': '2025-09-10', 'total_amount': 40000}, _items(40), client=fake_supabase)
+
+    assert fake_supabase.calls == [('invoices_quote', 'insert'), ('invoice_items_quote', 'insert')]
+    rows = fake_supabase.tables['invoice_items_quote']
+    assert len(rows) == 40
+    assert all(row['invoice_id'] == invoice_id for row in rows)
+    assert rows[0]['loai_san_pham'] == 'phu_kien_bep'
+    assert rows[1]['loai_san_pham'] == 'tu_bep'
+
+
+def test_uses_transactional_function_when_available(fake_supabase):
+    fake_supabase.rpc_functions['create_invoice_with_items'] = lambda db, params: 42
+
+    invoice_id = create_invoice_with_items('reality', {'customer_name': 'Anh A'}, _items(3), client=fake_supabase)
+
+    assert invoice_id == 42
+    assert fake_supabase.calls == [('create_invoice_with_items', 'rpc')]
+
+
+def test_invalid_items_are_rejected_before_any_write(fake_supabase):
+    with pytest.raises(KeyError):
+        create_invoice_with_items('quote', {'invoice_date': '2025-09-10'}, [{'loai_san_pham': 'tu_bep'}], client=fake_supabase)
+    assert fake_supabase.calls == []
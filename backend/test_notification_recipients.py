@@ -0,0 +1,73 @@
+from notification_recipients import RecipientCache, resolve_recipient_emails
+
+
+def _employees(count):
+    return [{'id': emp_id, 'email': f'nv{emp_id}@example.com', 'department_id': emp_id % 5, 'role_id': emp_id % 3}
+            for emp_id in range(1, count + 1)]
+
+
+def test_ids_departments_and_roles_resolve_in_one_query(fake_supabase):
+    fake_supabase.tables['employees'] = _employees(600)
+    notification = {
+        'id': 1,
+        'recipient_emails': ['sep@example.com', 'nv1@example.com'],
+        'recipient_employees': list(range(1, 501)),
+        'recipient_departments': [0],
+        'recipient_roles': [1],
+    }
+
+    emails = resolve_recipient_emails(notification, client=fake_supabase)
+
+    assert fake_supabase.calls == [('employees', 'select')]
+    expected = {f'nv{emp["id"]}@example.com' for emp in _employees(600)
+                if emp['id'] <= 500 or emp['department_id'] == 0 or emp['role_id'] == 1}
+    assert set(emails) == expected | {'sep@example.com'}
+    assert len(emails) == len(set(emails))
+
+
+def test_string_ids_are_cast_and_filter_syntax_is_rejected(fake_supabase):
+    fake_supabase.tables['employees'] = _employees(10)
+
+    emails = resolve_recipient_emails({'recipient_employees': ['3', 4.0]}, client=fake_supabase)
+    assert sorted(emails) == ['nv3@example.com', 'nv4@example.com']
+
+    fake_supabase.calls.clear()
+    for bad_id in ('1),id.gt.(0', '2,3', True, 1.5):
+        notification = {'recipient_emails': ['sep@example.com'], 'recipient_employees': [1, bad_id]}
+        assert resolve_recipient_emails(notification, client=fake_supabase) == ['sep@example.com']
+    assert fake_supabase.calls == []
+
+
+def test_direct_emails_only_skip_the_database(fake_supabase):
+    emails = resolve_recipient_emails({'recipient_emails': ['a@example.com', 'a@example.com']}, client=fake_supabase)
+
+    assert emails == ['a@example.com']
+    assert fake_supabase.calls == []
+
+
+def test_send_to_all_pages_through_employees(fake_supabase):
+    fake_supabase.tables['employees'] = _employees(2500) + [{'id': 9999, 'email': None}]
+
+    emails = resolve_recipient_emails({'send_to_all': True}, client=fake_supabase)
+
+    assert len(emails) == 2500
+    assert fake_supabase.calls == [('employees', 'select')] * 3
+
+
+def test_cache_reuses_audience_until_recipients_change(fake_supabase):
+    fake_supabase.tables['employees'] = _employees(10)
+    cache = RecipientCache()
+    notification = {'id': 7, 'recipient_departments': [1]}
+
+    first = cache.get_recipient_emails(notification, client=fake_supabase)
+    second = cache.get_recipient_emails(dict(notification), client=fake_supabase)
+    assert first == second
+    assert len(fake_supabase.calls) == 1
+
+    changed = cache.get_recipient_emails({'id': 7, 'recipient_departments': [2]}, client=fake_supabase)
+    assert changed != first
+    assert len(fake_supabase.calls) == 2
+
+    cache.forget(7)
+    cache.get_recipient_emails({'id': 7, 'recipient_departments': [2]}, client=fake_supabase)
+    assert len(fake_supabase.calls) == 3
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# notification_scheduler khởi tạo Supabase client khi import; test dùng client giả
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_SERVICE_KEY', 'test-key')
+
+import notification_scheduler as scheduler_module
+from notification_scheduler import NotificationScheduler
+
+
+def _at(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+@pytest.fixture
+def scheduler(fake_supabase, monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'supabase', fake_supabase)
+    instance = NotificationScheduler()
+    sent = []
+    fired = threading.Event()
+
+    def record(notification_id):
+        sent.append((notification_id, time.monotonic()))
+        fired.set()
+
+    monkeypatch.setattr(instance, '_send_scheduled_notification', record)
+    instance.sent, instance.fired = sent, fired
+    yield instance
+    instance.stop_scheduler()
+
+
+def test_loads_once_and_fires_at_the_due_time(scheduler, fake_supabase):
+    fake_supabase.tables['notifications'] = [
+        {'id': 1, 'status': 'published', 'scheduled_send_at': _at(0.3)},
+        {'id': 2, 'status': 'draft', 'scheduled_send_at': _at(0.1)},
+    ]
+    started = time.monotonic()
+    scheduler.start_scheduler()
+
+    assert scheduler.fired.wait(2)
+    assert scheduler.sent[0][0] == 1
+    assert 0.2 <= scheduler.sent[0][1] - started < 1
+    # Không truy vấn lại khi rảnh
+    time.sleep(0.2)
+    assert fake_supabase.calls == [('notifications', 'select')]
+
+
+def test_enqueue_wakes_the_sleeping_loop_and_reschedules(scheduler):
+    scheduler.start_scheduler()
+    scheduler.enqueue({'id': 5, 'status': 'published', 'scheduled_send_at': _at(60)})
+    scheduler.enqueue({'id': 5, 'status': 'published', 'scheduled_send_at': _at(0.1)})
+
+    assert scheduler.fired.wait(2)
+    assert [notification_id for notification_id, _ in scheduler.sent] == [5]
+    assert scheduler.pending_count() == 0
+
+
+def test_cancelled_and_unpublished_notifications_never_fire(scheduler):
+    scheduler.start_scheduler()
+    scheduler.enqueue({'id': 7, 'status': 'published', 'scheduled_send_at': _at(0.1)})
+    scheduler.enqueue({'id': 8, 'status': 'published', 'scheduled_send_at': _at(0.1)})
+    scheduler.cancel(7)
+    scheduler.enqueue({'id': 8, 'status': 'cancelled', 'scheduled_send_at': _at(0.1)})
+
+    assert not scheduler.fired.wait(0.4)
+    assert scheduler.sent == []
@@ -0,0 +1,52 @@
+import json
+
+from payroll_batch import tinh_luong_ky
+
+
+def _employee(ma_nv):
+    return {'ma_nv': ma_nv, 'ho_ten': f'Nhan vien {ma_nv}', 'chuc_vu': 'Tho', 'phong_ban': 'San xuat',
+            'luong_hop_dong': 10000000, 'muc_luong_dong_bhxh': 5000000, 'so_nguoi_phu_thuoc': 0}
+
+
+def _cham_cong(ma_nv, ky='2025-09'):
+    return {'ma_nv': ma_nv, 'ky_tinh_luong': ky, 'ngay_cong_chuan': 26, 'ngay_cong_thuc_te': 26,
+            'gio_ot_ngay_thuong': 2, 'gio_ot_cuoi_tuan': 0, 'gio_ot_le_tet': 0}
+
+
+def _tables(count):
+    return {
+        'employees': [_employee(ma_nv) for ma_nv in range(1, count + 1)],
+        'bang_cham_cong': [{'id': ma_nv, **_cham_cong(ma_nv)} for ma_nv in range(1, count + 1)] + [{'id': 999, **_cham_cong(1, '2025-08')}],
+        'luong_san_pham': [{'id': 1, 'ma_nv': 1, 'ky_tinh_luong': '2025-09', 'san_pham_id': 'SP1', 'so_luong': 10, 'don_gia': 50000, 'ty_le': 1}],
+    }
+
+
+def test_whole_period_uses_three_reads_and_one_upsert(fake_supabase):
+    fake_supabase.tables.update(_tables(50))
+
+    result = tinh_luong_ky('2025-09', thuong_kpi={'2': 300000}, client=fake_supabase)
+
+    assert result['errors'] == []
+    assert len(result['payslips']) == 50
+    assert fake_supabase.calls == [('bang_cham_cong', 'select'), ('luong_san_pham', 'select'),
+                                   ('employees', 'select'), ('phieu_luong', 'upsert')]
+    saved = {row['ma_nv']: row for row in fake_supabase.tables['phieu_luong']}
+    assert len(saved) == 50
+    assert json.loads(saved[1]['chi_tiet_thu_nhap'])['luong_san_pham'] > 0
+    assert saved[2]['tong_thu_nhap'] == saved[3]['tong_thu_nhap'] + 300000
+    phieu_luong, saved_row = result['payslips'][0]
+    assert saved_row['id'] and saved_row['ma_nv'] == phieu_luong.ma_nv
+
+
+def test_per_employee_errors_do_not_block_the_period(fake_supabase):
+    fake_supabase.tables.update(_tables(2))
+    fake_supabase.tables['bang_cham_cong'].append({'id': 3, **_cham_cong(77)})
+
+    result = tinh_luong_ky('2025-09', ma_nv_list=['1', 77, '88'], client=fake_supabase)
+
+    assert [phieu_luong.ma_nv for phieu_luong, _ in result['payslips']] == [1]
+    assert result['errors'] == [
+        {'ma_nv': '77', 'error': 'Nhân viên không tồn tại'},
+        {'ma_nv': '88', 'error': 'Nhân viên không tồn tại'},
+    ]
+    assert len(fake_supabase.tables['phieu_luong']) == 1
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from pg_pool import PoolTimeout, PostgresPool
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.alive = True
+        self.rollbacks = 0
+        self.health_checks = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def execute(self, sql):
+                connection.health_checks += 1
+                if not connection.alive:
+                    raise Exception('server closed the connection unexpectedly')
+
+        return Cursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class Connector:
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self):
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+
+def test_connections_are_reused_across_requests():
+    connector = Connector()
+    pool = PostgresPool(connect=connector, size=3)
+
+    for _ in range(20):
+        with pool.connection() as connection:
+            assert connection.number == 0
+
+    stats = pool.stats()
+    assert len(connector.connections) == 1
+    assert (stats['acquired'], stats['created'], stats['in_use'], stats['idle']) == (20, 1, 0, 1)
+    assert sum(stats['wait_ms_histogram'].values()) == 20
+
+
+def test_pool_size_is_capped_and_waiters_time_out():
+    connector = Connector()
+    pool = PostgresPool(connect=connector, size=2, acquire_timeout=0.05)
+    first, second = pool.acquire(), pool.acquire()
+
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    # Người chờ nhận được kết nối ngay khi có kết nối được trả về
+    threading.Timer(0.1, pool.release, args=(first,)).start()
+    started = time.perf_counter()
+    third = pool.acquire(timeout=2)
+    assert third is first
+    assert time.perf_counter() - started >= 0.09
+    pool.release(second)
+    pool.release(third)
+
+    stats = pool.stats()
+    assert len(connector.connections) == 2
+    assert stats['timeouts'] == 1
+    assert stats['max_wait_ms'] >= 90
+
+
+def test_dead_or_stale_connections_are_replaced():
+    connector = Connector()
+    pool = PostgresPool(connect=connector, size=2, health_check_seconds=0)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    connection.alive = False
+    replacement = pool.acquire()
+
+    assert replacement is not connection
+    assert connection.closed
+    assert connection.health_checks == 1
+    pool.release(replacement)
+    assert pool.stats()['discarded'] == 1
+
+
+def test_fresh_idle_connections_skip_the_health_check():
+    pool = PostgresPool(connect=Connector(), size=1, health_check_seconds=60)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    assert pool.acquire() is connection
+    assert connection.health_checks == 0
+
+
+def test_closed_connection_is_dropped_on_release():
+    connector = Connector()
+    pool = PostgresPool(connect=connector, size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as connection:
+            connection.close()
+            raise RuntimeError('query failed')
+
+    with pool.connection() as connection:
+        assert connection.number == 1
+    assert pool.stats()['discarded'] == 1
@@ -0,0 +1,61 @@
+import catalog_cache
+import profit_sync
+from catalog_cache import CatalogCache
+
+
+def _seed(fake_supabase):
+    fake_supabase.tables.update({
+        'invoices_reality': [
+            {'id': 1, 'invoice_date': '2025-08-15', 'total_amount': 1000},
+            {'id': 2, 'invoice_date': '2025-09-10', 'total_amount': 2000},
+        ],
+        'quanly_chiphi': [
+            {'id': 1, 'parent_id': None, 'giathanh': 300, 'created_at': '2025-09-02T08:00:00'},
+            {'id': 2, 'parent_id': 1, 'giathanh': 300, 'created_at': '2025-09-02T09:00:00'},
+        ],
+        'phieu_luong': [{'id': 1, 'ky_tinh_luong': '2025-09', 'luong_thuc_nhan': 500}],
+        'sanpham': [{'id': 'SP1', 'tensp': 'Tủ bếp'}],
+        'profits': [{'id': 1, 'report_month': '2025-08', 'total_revenue': 1000}],
+        'profit_dirty_months': [],
+    })
+
+
+def test_sync_dirty_months_only_touches_marked_months(fake_supabase, monkeypatch):
+    monkeypatch.setattr(catalog_cache, 'catalog_cache', CatalogCache(client=fake_supabase))
+    _seed(fake_supabase)
+    profit_sync.mark_months_dirty('2025-09-10', '2025-09', None, client=fake_supabase)
+    fake_supabase.calls.clear()
+
+    result = profit_sync.sync_dirty_months(client=fake_supabase)
+
+    assert result['synced_months'] == ['2025-09']
+    # Một truy vấn mỗi bảng cho tháng bẩn, không quét toàn bộ lịch sử
+    assert fake_supabase.calls_to('invoices_reality') == [('invoices_reality', 'select')]
+    rows = {row['report_month']: row for row in fake_supabase.tables['profits']}
+    assert rows['2025-08']['total_revenue'] == 1000
+    september = rows['2025-09']
+    assert september['total_revenue'] == 2000
+    # Chỉ tính chi phí gốc + lương
+    assert september['total_expenses'] == 800
+    assert september['expense_count'] == 1
+    assert september['total_profit'] == 1200
+    assert september['product_count'] == 1
+    assert fake_supabase.tables['profit_dirty_months'] == []
+
+    fake_supabase.calls.clear()
+    assert profit_sync.sync_dirty_months(client=fake_supabase)['synced_months'] == []
+    assert fake_supabase.calls == [('profit_dirty_months', 'select')]
+
+
+def test_compute_month_totals_uses_aggregate_function_when_available(fake_supabase):
+    _seed(fake_supabase)
+    fake_supabase.rpc_functions['profit_month_totals'] = lambda db, params: [
+        {'report_month': month, 'total_revenue': 1, 'invoice_count': 1, 'total_expenses': 0,
+         'expense_count': 0, 'total_payroll_expenses': 0, 'payroll_count': 0}
+        for month in params['p_months']
+    ]
+
+    totals = profit_sync.compute_month_totals(['2025-08', '2025-09'], client=fake_supabase)
+
+    assert set(totals) == {'2025-08', '2025-09'}
+    assert fake_supabase.calls == [('profit_month_totals', 'rpc')]
@@ -0,0 +1,68 @@
+import os
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_SERVICE_KEY', 'test-service-key')
+
+import io
+
+from openpyxl import Workbook
+from openpyxl.styles import Border, Font, PatternFill
+
+from benchmark_profit_report import make_expense_fixture, make_report_fixture
+from generate_profit_excel import create_revenue_detail_sheet
+from update_expense_ratios import get_root_total
+
+
+class CountingDict(dict):
+    """dict đếm số lần đọc qua .get() vào counter dùng chung"""
+
+    def __init__(self, values, counter):
+        super().__init__(values)
+        self.counter = counter
+
+    def get(self, key, default=None):
+        self.counter[0] += 1
+        return super().get(key, default)
+
+
+def _revenue_sheet_reads(invoice_count):
+    data = make_report_fixture(invoice_count=invoice_count, items_per_invoice=5)
+    counter = [0]
+    data['revenue'] = [CountingDict(invoice, counter) for invoice in data['revenue']]
+    data['invoice_items'] = [CountingDict(item, counter) for item in data['invoice_items']]
+
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet("Doanh thu chi tiet")
+    totals = create_revenue_detail_sheet(sheet, data, Font(bold=True), PatternFill(fill_type="solid"), Border())
+    wb.save(io.BytesIO())
+
+    assert totals == {'total_revenue': invoice_count * 1000, 'invoice_count': invoice_count}
+    return counter[0]
+
+
+def _root_total_lookups(expense_count):
+    counter = [0]
+    expenses = make_expense_fixture(expense_count=expense_count, depth=5)
+    expenses_by_id = CountingDict({expense['id']: expense for expense in expenses}, counter)
+    for expense in expenses:
+        get_root_total(expense, expenses_by_id)
+    return counter[0]
+
+
+def test_revenue_sheet_reads_scale_linearly_with_rows():
+    # Gom items theo hóa đơn một lần: gấp đôi dữ liệu thì gấp đôi số lần đọc (cách cũ quét lại mọi item cho từng hóa đơn: gấp bốn)
+    assert _revenue_sheet_reads(400) == 2 * _revenue_sheet_reads(200)
+
+
+def test_get_root_total_uses_id_index_and_stops_on_cycles():
+    expenses = make_expense_fixture(expense_count=10, depth=5)
+    expenses[0]['giathanh'] = 500
+    expenses_by_id = {expense['id']: expense for expense in expenses}
+
+    assert get_root_total(expenses_by_id[5], expenses_by_id) == 500
+    assert get_root_total(expenses_by_id[6], expenses_by_id) == 100
+    # Mỗi chi phí chỉ tra chỉ mục theo id tối đa depth - 1 lần
+    assert _root_total_lookups(2000) == 2 * _root_total_lookups(1000)
+
+    cycle = {1: {'id': 1, 'parent_id': 2, 'giathanh': 10}, 2: {'id': 2, 'parent_id': 1, 'giathanh': 20}}
+    # 1 -> 2 -> 1 đã duyệt: dừng tại chi phí 1
+    assert get_root_total(cycle[1], cycle) == 10
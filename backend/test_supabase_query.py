@@ -0,0 +1,28 @@
+from supabase_query import fetch_all, get_client, iter_pages
+
+
+def _rows(count):
+    return [{'id': row_id, 'value': row_id % 7} for row_id in range(1, count + 1)]
+
+
+def test_fetch_all_reads_past_the_postgrest_row_cap(fake_supabase):
+    fake_supabase.tables['items'] = _rows(2500)
+
+    rows = fetch_all(lambda: fake_supabase.table('items').select('id, value').gte('value', 1).order('id'))
+
+    assert [row['id'] for row in rows] == [row['id'] for row in _rows(2500) if row['value'] >= 1]
+    assert fake_supabase.calls == [('items', 'select')] * 3
+
+
+def test_iter_pages_stops_after_short_page(fake_supabase):
+    fake_supabase.tables['items'] = _rows(2000)
+
+    pages = list(iter_pages(lambda: fake_supabase.table('items').select('id').order('id'), page_size=1000))
+
+    # Trang thứ ba rỗng chỉ để biết đã hết dữ liệu, không được trả về
+    assert [len(page) for page in pages] == [1000, 1000]
+    assert fake_supabase.calls == [('items', 'select')] * 3
+
+
+def test_get_client_prefers_given_client(fake_supabase):
+    assert get_client(fake_supabase) is fake_supabase
@@ -76,6 +76,7 @@ def update_expense_ratios(month=None):
             # Group expenses by parent_id to handle hierarchical ratios
             expenses_by_parent = defaultdict(list)
             parent_expenses = {}
+            expenses_by_id = {expense['id']: expense for expense in month_expenses}
 
             for expense in month_expenses:
                 parent_id = expense.get('parent_id')
@@ -87,7 +88,7 @@ def update_expense_ratios(month=None):
             # Update ratio for each expense (relative to root parent)
             def update_all_ratios_recursive(expense_id, root_total, indent_level=1):
                 nonlocal updated_count
-                expense = next((e for e in month_expenses if e['id'] == expense_id), None)
+                expense = expenses_by_id.get(expense_id)
                 if expense:
                     expense_amount = expense['giathanh'] or 0
                     ratio = (expense_amount / root_total) * 100 if root_total > 0 else 0
@@ -122,11 +123,16 @@ def update_expense_ratios(month=None):
         print(f"Error updating ratios: {e}")
         return {"success": False, "error": str(e)}
 
-def get_root_total(expense, all_expenses):
-    """Get the total amount of the root parent for an expense"""
+def get_root_total(expense, expenses_by_id):
+    """Get the total amount of the root parent for an expense
+
+    expenses_by_id: dict id -> expense, built once per month by the caller
+    """
     current = expense
-    while current.get('parent_id'):
-        parent = next((e for e in all_expenses if e['id'] == current['parent_id']), None)
+    visited = set()
+    while current.get('parent_id') and current['id'] not in visited:
+        visited.add(current['id'])
+        parent = expenses_by_id.get(current['parent_id'])
         if not parent:
             break
         current = parent
@@ -183,21 +189,12 @@ def verify_expense_ratios(month=None):
             if total_month_expenses == 0:
                 continue
 
-            # Group expenses by parent
-            expenses_by_parent = defaultdict(list)
-            parent_expenses = {}
-
-            for expense in month_expenses:
-                parent_id = expense.get('parent_id')
-                if parent_id:
-                    expenses_by_parent[parent_id].append(expense)
-                else:
-                    parent_expenses[expense['id']] = expense
+            expenses_by_id = {expense['id']: expense for expense in month_expenses}
 
             # Check that all expenses have correct ratios relative to their root parent
             for expense in month_expenses:
                 # Find root parent for this expense
-                root_total = get_root_total(expense, month_expenses)
+                root_total = get_root_total(expense, expenses_by_id)
                 expense_amount = expense['giathanh'] or 0
                 expected_ratio = (expense_amount / root_total) * 100 if root_total > 0 else 0
                 actual_ratio = expense.get('ti_le') or 0
@@ -1957,12 +1957,21 @@ function ChatHistoryManagement() {
     setLoadingHistory(true);
     try {
       console.log('Fetching chat history for app:', appName);
-      const response = await fetch(`http://localhost:8003/api/v1/chat-history/app/${encodeURIComponent(appName)}`);
+      // API trả về từng trang (tối đa 1000 dòng); đi theo header X-Next-Cursor để lấy đủ lịch sử
+      const baseUrl = `http://localhost:8003/api/v1/chat-history/app/${encodeURIComponent(appName)}?limit=1000`;
+      let response = await fetch(baseUrl);
       console.log('Response status:', response.status);
       console.log('Response ok:', response.ok);
 
       if (response.ok) {
         const data = await response.json();
+        let nextCursor = response.headers.get('X-Next-Cursor');
+        while (nextCursor) {
+          response = await fetch(`${baseUrl}&cursor=${encodeURIComponent(nextCursor)}`);
+          if (!response.ok) break;
+          data.push(...(await response.json()));
+          nextCursor = response.headers.get('X-Next-Cursor');
+        }
         console.log('Raw data received:', data);
         console.log('Data type:', typeof data);
         console.log('Data length:', Array.isArray(data) ? data.length : 'Not an array');
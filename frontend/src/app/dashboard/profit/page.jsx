@@ -114,7 +114,7 @@ export default function ProfitPage() {
   const loadDetailedData = async () => {
     try {
       // Load profit report data from single endpoint
-      const profitResponse = await fetch(`http://localhost:8001/api/v1/accounting/profit/?month=${selectedPeriod}`, {
+      const profitResponse = await fetch(`http://localhost:8001/api/v1/accounting/profit/?month=${selectedPeriod}&include_rows=true&page_size=1000`, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json'
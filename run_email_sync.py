@@ -35,7 +35,7 @@ def main():
 
         print("\n✅ Email Sync Service đang chạy...")
         print("📊 Service sẽ tự động sync email từ chat_history sang user_chat")
-        print("🔄 Kiểm tra mỗi 1 giây")
+        print("🔄 Sync ngay khi có chat_history mới (LISTEN/NOTIFY), hoặc kiểm tra mỗi 5 giây")
         print("🛑 Nhấn Ctrl+C để dừng service")
 
         # Giữ service chạy